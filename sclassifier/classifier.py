@@ -28,9 +28,8 @@ import pickle
 from sclassifier import logger
 
 ## SCI MODULES
-from skimage.metrics import mean_squared_error
-from skimage.metrics import structural_similarity
-from scipy.stats import kurtosis, skew
+#  NB: plotting & optional backends are imported at first use (see lazy_import)
+from .lazy_import import lazy_import, set_agg_backend
 from sklearn.model_selection import cross_val_score
 from sklearn.model_selection import RepeatedStratifiedKFold, StratifiedKFold, StratifiedShuffleSplit
 from sklearn.tree import DecisionTreeClassifier
@@ -51,16 +50,13 @@ from lightgbm import LGBMClassifier
 from lightgbm import early_stopping, log_evaluation, record_evaluation
 from lightgbm import plot_tree, plot_importance
 
-import pandas as pd
+pd= lazy_import("pandas")
 
 ## OPTUNA
-import optuna
-from optuna.integration import LightGBMPruningCallback
+optuna= lazy_import("optuna")
 
 ## GRAPHICS MODULES
-import matplotlib
-import matplotlib.pyplot as plt
-matplotlib.use('Agg')
+plt= lazy_import("matplotlib.pyplot", on_load=set_agg_backend)
 
 ## PACKAGE MODULES
 from .utils import Utils
@@ -646,44 +642,55 @@ class SClassifier(object):
 	def set_data_from_file(self, filename):
 		""" Set data from input file. Expected format: sname, N features, classid """
 
-		# - Read table
-		row_start= 0
-		try:
-			table= ascii.read(filename, data_start=row_start)
-		except:
-			logger.error("Failed to read feature file %s!" % filename)
-			return -1
+		# - Read binary table? (selected by file extension)
+		if Utils.is_binary_table_file(filename):
+			ret= Utils.read_binary_feature_data(filename)
+			if not ret:
+				logger.error("Failed to read feature file %s!" % filename)
+				return -1
+			self.data, self.source_names, self.data_classids, colnames= ret
+			self.data_labels= [self.classid_label_map[obj_id] for obj_id in self.data_classids]
+			self.data_targets= [self.classid_remap[obj_id] for obj_id in self.data_classids] # remap obj id in class id
+		else:
+			# - Read table
+			row_start= 0
+			try:
+				table= ascii.read(filename, data_start=row_start)
+			except:
+				logger.error("Failed to read feature file %s!" % filename)
+				return -1
 	
-		print(table.colnames)
-		print(table)
-
-		ncols= len(table.colnames)
-		nfeat= ncols-2
-
-		# - Set data vectors
-		rowIndex= 0
-		self.data_labels= []
-		self.data_classids= []
-		self.data_targets= []
-		self.source_names= []
-		featdata= []
-
-		for data in table:
-			sname= data[0]
-			obj_id= data[ncols-1]
-			label= self.classid_label_map[classid]
-			targetid= self.classid_remap[obj_id] # remap obj id in class id
+			print(table.colnames)
+			print(table)
+
+			ncols= len(table.colnames)
+			nfeat= ncols-2
+
+			# - Set data vectors
+			rowIndex= 0
+			self.data_labels= []
+			self.data_classids= []
+			self.data_targets= []
+			self.source_names= []
+			featdata= []
+
+			for data in table:
+				sname= data[0]
+				obj_id= data[ncols-1]
+				label= self.classid_label_map[obj_id]
+				targetid= self.classid_remap[obj_id] # remap obj id in class id
+
+				self.source_names.append(sname)
+				self.data_labels.append(label)
+				self.data_classids.append(obj_id)
+				self.data_targets.append(targetid)
+				featdata_curr= []
+				for k in range(nfeat):
+					featdata_curr.append(data[k+1])
+				featdata.append(featdata_curr)
 
-			self.source_names.append(sname)
-			self.data_labels.append(label)
-			self.data_classids.append(obj_id)
-			self.data_targets.append(targetid)
-			featdata_curr= []
-			for k in range(nfeat):
-				featdata_curr.append(data[k+1])
-			featdata.append(featdata_curr)
+			self.data= np.array(featdata)
 
-		self.data= np.array(featdata)
 		if self.data.size==0:
 			logger.error("Empty feature data vector read!")
 			return -1
@@ -714,45 +721,56 @@ class SClassifier(object):
 	def set_val_data_from_file(self, filename):
 		""" Set validation data from input file. Expected format: sname, N features, classid """
 
-		# - Read table
-		row_start= 0
-		try:
-			table= ascii.read(filename, data_start=row_start)
-		except:
-			logger.error("Failed to read feature file %s!" % filename)
-			return -1
+		# - Read binary table? (selected by file extension)
+		if Utils.is_binary_table_file(filename):
+			ret= Utils.read_binary_feature_data(filename)
+			if not ret:
+				logger.error("Failed to read feature file %s!" % filename)
+				return -1
+			self.data_cv, self.source_names_cv, self.data_classids_cv, colnames= ret
+			self.data_labels_cv= [self.classid_label_map[obj_id] for obj_id in self.data_classids_cv]
+			self.data_targets_cv= [self.classid_remap[obj_id] for obj_id in self.data_classids_cv] # remap obj id in class id
+		else:
+			# - Read table
+			row_start= 0
+			try:
+				table= ascii.read(filename, data_start=row_start)
+			except:
+				logger.error("Failed to read feature file %s!" % filename)
+				return -1
 	
-		print(table.colnames)
-		print(table)
-
-		ncols= len(table.colnames)
-		nfeat= ncols-2
-
-		# - Set data vectors
-		rowIndex= 0
-		self.data_labels_cv= []
-		self.data_classids_cv= []
-		self.data_targets_cv= []
-		self.source_names_cv= []
-		featdata= []
-
-		for data in table:
-			sname= data[0]
-			obj_id= data[ncols-1]
-			label= self.classid_label_map[classid]
-			targetid= self.classid_remap[obj_id] # remap obj id in class id
+			print(table.colnames)
+			print(table)
+
+			ncols= len(table.colnames)
+			nfeat= ncols-2
+
+			# - Set data vectors
+			rowIndex= 0
+			self.data_labels_cv= []
+			self.data_classids_cv= []
+			self.data_targets_cv= []
+			self.source_names_cv= []
+			featdata= []
+
+			for data in table:
+				sname= data[0]
+				obj_id= data[ncols-1]
+				label= self.classid_label_map[obj_id]
+				targetid= self.classid_remap[obj_id] # remap obj id in class id
+
+				self.source_names_cv.append(sname)
+				self.data_labels_cv.append(label)
+				self.data_classids_cv.append(obj_id)
+				self.data_targets_cv.append(targetid)
+				featdata_curr= []
+				for k in range(nfeat):
+					featdata_curr.append(data[k+1])
+				featdata.append(featdata_curr)
 
-			self.source_names_cv.append(sname)
-			self.data_labels_cv.append(label)
-			self.data_classids_cv.append(obj_id)
-			self.data_targets_cv.append(targetid)
-			featdata_curr= []
-			for k in range(nfeat):
-				featdata_curr.append(data[k+1])
-			featdata.append(featdata_curr)
+			self.data_cv= np.array(featdata)
 
-		self.data_cv= np.array(featdata)
-		if self.data.size_cv==0:
+		if self.data_cv.size==0:
 			logger.error("Empty feature data vector read!")
 			return -1
 
@@ -2018,6 +2036,68 @@ class SClassifier(object):
 
 		return 0
 
+	#####################################
+	##     PREDICT IN MEMORY
+	#####################################
+	def load_model(self, modelfile, scalerfile=""):
+		""" Load model (and data scaler if given) from file, to be used with predict_data """
+
+		if scalerfile!="":
+			logger.info("Loading data scaler from file %s ..." % (scalerfile))
+			try:
+				self.data_scaler= pickle.load(open(scalerfile, 'rb'))
+			except Exception as e:
+				logger.error("Failed to load data scaler from file %s (err=%s)!" % (scalerfile, str(e)))
+				return -1
+
+		logger.info("Loading the model from file %s ..." % modelfile)
+		try:
+			self.model= pickle.load((open(modelfile, 'rb')))
+		except Exception as e:
+			logger.error("Failed to load model from file %s (err=%s)!" % (modelfile, str(e)))
+			return -1
+
+		self.classifier= self.model.__class__.__name__
+		logger.info("Loaded model classifier is: %s" % (self.classifier))
+
+		return 0
+
+	def predict_data(self, data):
+		""" Predict class ids, labels and probabilities of input feature data with loaded model, without setting data or saving outputs.
+				Data are transformed with the loaded scaler if normalize is enabled. Returns (classids, labels, probs) or None on failure.
+		"""
+
+		if self.model is None:
+			logger.error("Model is not set!")
+			return None
+
+		if self.normalize:
+			if self.data_scaler is None:
+				logger.error("Normalization enabled but no data scaler loaded!")
+				return None
+			data= self.data_scaler.transform(data)
+
+		try:
+			targets_pred= self.model.predict(data)
+		except Exception as e:
+			logger.error("Failed to predict model on data (err=%s)!" % (str(e)))
+			return None
+
+		try:
+			probs_pred= list(np.max(self.model.predict_proba(data), axis=1))
+		except Exception as e:
+			logger.debug("Failed to get model prob on data (err=%s), setting them to -1 ..." % (str(e)))
+			probs_pred= [-1]*data.shape[0]
+
+		if self.multiclass:
+			classids_pred= [self.classid_remap_inv[item] for item in targets_pred]
+			labels_pred= [self.classid_label_map[item] for item in classids_pred]
+		else:
+			classids_pred= list(targets_pred)
+			labels_pred= [self.target_label_map[item] for item in classids_pred]
+
+		return classids_pred, labels_pred, probs_pred
+
 	#####################################
 	##     FIND OUTLIERS
 	#####################################
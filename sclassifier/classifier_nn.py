@@ -113,7 +113,10 @@ from .utils import Utils
 from .data_loader import DataLoader
 from .data_loader import SourceData
 from .data_generator import DataGenerator
+from .tf_dataset import TFDatasetBuilder
 from .tf_utils import ChanMinMaxNorm, ChanMaxScale, ChanMeanRatio, ChanMaxRatio, ChanPosDef
+from .tf_utils import predict_in_batches, get_compile_options
+from .tf_distribute import get_num_workers, is_chief, distribute_data
 from .models import resnet18, resnet34
 
 ##################################
@@ -231,6 +234,11 @@ class SClassifierNN(object):
 		self.validation_steps= 10
 		self.use_multiprocessing= True
 		self.nworkers= 0
+		self.use_tf_data= False
+		self.tf_data_cache= False
+		self.tf_data_cachefile= ""
+		self.predict_batch_size= 32
+		self.pred_data_indexes= []
 
 		# *****************************
 		# ** Model
@@ -319,6 +327,8 @@ class SClassifierNN(object):
 		self.freeze_backbone= False
 		
 		self.skip_first_class= False # to skip first class (e.g. NONE, BACKGROUND) in multilabel
+		self.use_xla= False # compile train & predict steps with XLA (graph mode)
+		self.strategy= None # tf.distribute strategy for multi-worker training (models & optimizer must be created in its scope)
 
 		# *****************************
 		# ** Output
@@ -588,7 +598,9 @@ class SClassifierNN(object):
 		
 		# - Create data generators
 		logger.info("Creating data generators ...")
-		self.__set_data_generators()
+		if self.__set_data_generators()<0:
+			logger.error("Failed to create data generators!")
+			return -1
 
 		return 0
 	
@@ -665,24 +677,47 @@ class SClassifierNN(object):
 		
 		# - Create data generators
 		logger.info("Creating data generators ...")
-		self.__set_data_generators()
+		if self.__set_data_generators()<0:
+			logger.error("Failed to create data generators!")
+			return -1
 		
 		return 0
 
 	#####################################
 	##     SET DATA GENERATOR
 	#####################################
+	def __create_tf_dataset_builder(self, dg, cachefile_suffix=""):
+		""" Create tf.data dataset builder for given data generator """
+		ds_builder= TFDatasetBuilder(dg)
+		ds_builder.cache= self.tf_data_cache
+		if self.tf_data_cachefile!="":
+			ds_builder.cachefile= self.tf_data_cachefile + cachefile_suffix
+		return ds_builder
+
 	def __set_data_generators(self):
 		""" Create data generators """
 
 		# - Create train data generator
-		self.train_data_generator= self.dg.generate_cnn_data(
-			batch_size=self.batch_size, 
-			shuffle=self.shuffle_train_data,
-			classtarget_map=self.classid_remap, nclasses=self.nclasses,
-			balance_classes=self.balance_classes, class_probs=self.class_probs,
-			skip_first_class=self.skip_first_class
-		)
+		if self.use_tf_data:
+			logger.info("Creating train tf.data dataset ...")
+			self.train_data_generator= self.__create_tf_dataset_builder(self.dg).build_cnn_dataset(
+				batch_size=self.batch_size, 
+				shuffle=self.shuffle_train_data,
+				classtarget_map=self.classid_remap, nclasses=self.nclasses,
+				balance_classes=self.balance_classes, class_probs=self.class_probs,
+				skip_first_class=self.skip_first_class
+			)
+			if self.train_data_generator is None:
+				logger.error("Failed to create train tf.data dataset!")
+				return -1
+		else:
+			self.train_data_generator= self.dg.generate_cnn_data(
+				batch_size=self.batch_size, 
+				shuffle=self.shuffle_train_data,
+				classtarget_map=self.classid_remap, nclasses=self.nclasses,
+				balance_classes=self.balance_classes, class_probs=self.class_probs,
+				skip_first_class=self.skip_first_class
+			)
 		
 		# - Create cross validation data generator
 		if self.dg_cv is None:
@@ -707,12 +742,23 @@ class SClassifierNN(object):
 
 			logger.info("Loading cv data in batches? %d (batch_size_cv=%d)" % (self.load_cv_data_in_batches, batch_size_cv))
 
-			self.crossval_data_generator= self.dg_cv.generate_cnn_data(
-				batch_size=batch_size_cv, 
-				shuffle=False,
-				classtarget_map=self.classid_remap, nclasses=self.nclasses,
-				skip_first_class=self.skip_first_class
-			)
+			if self.use_tf_data:
+				self.crossval_data_generator= self.__create_tf_dataset_builder(self.dg_cv, cachefile_suffix="_cv").build_cnn_dataset(
+					batch_size=batch_size_cv, 
+					shuffle=False,
+					classtarget_map=self.classid_remap, nclasses=self.nclasses,
+					skip_first_class=self.skip_first_class
+				)
+				if self.crossval_data_generator is None:
+					logger.error("Failed to create validation tf.data dataset!")
+					return -1
+			else:
+				self.crossval_data_generator= self.dg_cv.generate_cnn_data(
+					batch_size=batch_size_cv, 
+					shuffle=False,
+					classtarget_map=self.classid_remap, nclasses=self.nclasses,
+					skip_first_class=self.skip_first_class
+				)
 
 		
 		# - Create test data generator
@@ -721,13 +767,9 @@ class SClassifierNN(object):
 		logger.info("Disabling data augmentation in test data generator ...")
 		self.dg_test.disable_augmentation()
 
-		self.test_data_generator= self.dg_test.generate_cnn_data(
-			#batch_size=self.nsamples,
-			batch_size=1,
-			shuffle=False,
-			classtarget_map=self.classid_remap, nclasses=self.nclasses,
-			skip_first_class=self.skip_first_class
-		)
+		# - NB: test data are read in batches by generate_inference_data when predicting model outputs
+
+		return 0
 
 
 	#####################################
@@ -780,8 +822,9 @@ class SClassifierNN(object):
 		#===========================
 		#==   PLOT RESULTS
 		#===========================
-		logger.info("Plotting results ...")
-		self.__plot_results()
+		if is_chief(self.strategy):
+			logger.info("Plotting results ...")
+			self.__plot_results()
 
 		return 0
 	
@@ -821,14 +864,11 @@ class SClassifierNN(object):
 		#==   PREDICT
 		#===========================
 		# - Get predicted output data
-		logger.info("Predicting model output data ...")
-		predout= self.model.predict(
-			x=self.test_data_generator,
-			steps=self.nsamples,
-    	verbose=2,
-    	workers=self.nworkers,
-    	use_multiprocessing=self.use_multiprocessing
-		)
+		logger.info("Predicting model output data (batch_size=%d) ..." % (self.predict_batch_size))
+		predout= self.__predict()
+		if predout is None:
+			logger.error("No model output data predicted!")
+			return -1
 
 		# - Save prediction data to file
 		logger.info("Saving predicted data to file ...")
@@ -885,8 +925,8 @@ class SClassifierNN(object):
 		# - Save predicted data to file
 		logger.info("Saving prediction data to file %s ..." % (self.outfile))
 		N= predout.shape[0]
-		snames= np.array(self.source_names).reshape(N,1)
-		objids= np.array(self.source_ids).reshape(N,1)
+		snames= np.array([self.source_names[index] for index in self.pred_data_indexes]).reshape(N,1)
+		objids= np.array([self.source_ids[index] for index in self.pred_data_indexes]).reshape(N,1)
 		objids_pred= np.array(self.classids_pred).reshape(N,1)
 		probs_pred= np.array(self.probs_pred).reshape(N,1)
 
@@ -960,7 +1000,8 @@ class SClassifierNN(object):
 
 		# - Get original labels from target ids
 		##labels= [[self.target_label_map[target_id] for target_id in item] for item in self.target_ids_all]
-		labels= [[self.target_label_map[target_id] if target_id in self.target_label_map else 'UNKNOWN' for target_id in item] for item in self.target_ids_all]
+		target_ids_all= [self.target_ids_all[index] for index in self.pred_data_indexes]
+		labels= [[self.target_label_map[target_id] if target_id in self.target_label_map else 'UNKNOWN' for target_id in item] for item in target_ids_all]
 		
 		#print("labels")
 		#print(labels)
@@ -977,10 +1018,11 @@ class SClassifierNN(object):
 		ddlist= []
 		N= predout.shape[0]
 		for i in range(N):
+			index= self.pred_data_indexes[i]
 			dd= {
-				"sname": self.source_names[i],
-				"id": self.source_ids[i],
-				"target_id": [int(item) for item in self.target_ids_all[i]],
+				"sname": self.source_names[index],
+				"id": self.source_ids[index],
+				"target_id": [int(item) for item in target_ids_all[i]],
 				"label": labels[i],
 				"id_pred": self.classids_pred[i],
 				"target_id_pred": [int(item) for item in self.targets_pred[i]],
@@ -1007,8 +1049,8 @@ class SClassifierNN(object):
 		# - Compute target/pred vectors (must have a class label set)
 		y_true= []
 		y_pred= []
-		for i in range(len(self.target_ids_all)):
-			target_id= self.target_ids_all[i]
+		for i in range(len(self.targets_pred)):
+			target_id= self.target_ids_all[self.pred_data_indexes[i]]
 			pred_id= self.targets_pred[i]
 			if target_id<0:
 				continue
@@ -1124,8 +1166,8 @@ class SClassifierNN(object):
 		# - Compute target/pred vectors (must have a class label set)
 		target_ids_true= []
 		target_ids_pred= []
-		for i in range(len(self.target_ids_all)):
-			target_ids= self.target_ids_all[i]
+		for i in range(len(self.targets_pred)):
+			target_ids= self.target_ids_all[self.pred_data_indexes[i]]
 			pred_ids= self.targets_pred[i]
 			#print("target_ids")
 			#print(target_ids)
@@ -1474,13 +1516,13 @@ class SClassifierNN(object):
 		#   NB: see https://glassboxmedicine.com/2019/05/26/classification-sigmoid-vs-softmax/
 		if self.multilabel:
 			if self.skip_first_class:
-				self.outputs = layers.Dense(self.nclasses-1, name='outputs', activation='sigmoid')(x)
+				self.outputs = layers.Dense(self.nclasses-1, name='outputs', activation='sigmoid', dtype='float32')(x)
 				print("self.outputs.shape")
 				print(K.int_shape(self.outputs))
 			else:
-				self.outputs = layers.Dense(self.nclasses, name='outputs', activation='sigmoid')(x)
+				self.outputs = layers.Dense(self.nclasses, name='outputs', activation='sigmoid', dtype='float32')(x)
 		else:
-			self.outputs = layers.Dense(self.nclasses, name='outputs', activation='softmax')(x)
+			self.outputs = layers.Dense(self.nclasses, name='outputs', activation='softmax', dtype='float32')(x)
 
 		#===========================
 		#==   BUILD MODEL
@@ -1494,7 +1536,7 @@ class SClassifierNN(object):
 				optimizer=self.optimizer, 
 				loss=self.__multilabel_loss, 
 				#metrics=['accuracy', f1score_metric, precision_metric, recall_metric], 
-				run_eagerly=True
+				**get_compile_options(self.use_xla)
 			)
 		
 		else:
@@ -1502,7 +1544,7 @@ class SClassifierNN(object):
 				optimizer=self.optimizer, 
 				loss=self.loss_type, 
 				metrics=['accuracy', f1score_metric, precision_metric, recall_metric], 
-				run_eagerly=True
+				**get_compile_options(self.use_xla)
 		)
 		
 		# - Print model summary
@@ -1675,12 +1717,12 @@ class SClassifierNN(object):
 		# - Output layer
 		if self.multilabel:
 			if self.skip_first_class:
-				self.outputs = layers.Dense(self.nclasses-1, name='outputs', activation='sigmoid')
+				self.outputs = layers.Dense(self.nclasses-1, name='outputs', activation='sigmoid', dtype='float32')
 			else:
-				self.outputs = layers.Dense(self.nclasses, name='outputs', activation='sigmoid')
+				self.outputs = layers.Dense(self.nclasses, name='outputs', activation='sigmoid', dtype='float32')
 				
 		else:
-			self.outputs = layers.Dense(self.nclasses, name='outputs', activation='softmax')
+			self.outputs = layers.Dense(self.nclasses, name='outputs', activation='softmax', dtype='float32')
 		
 		self.model.add(self.outputs)
 		
@@ -1697,14 +1739,14 @@ class SClassifierNN(object):
 				optimizer=self.optimizer, 
 				loss=self.__multilabel_loss,
 				#metrics=['accuracy', f1score_metric, precision_metric, recall_metric], 
-				run_eagerly=True
+				**get_compile_options(self.use_xla)
 			)
 		else:
 			self.model.compile(
 				optimizer=self.optimizer, 
 				loss=self.loss_type, 
 				metrics=['accuracy', f1score_metric, precision_metric, recall_metric], 
-				run_eagerly=True
+				**get_compile_options(self.use_xla)
 			)
 		
 		# - Print model summary
@@ -1825,11 +1867,11 @@ class SClassifierNN(object):
 		# - Output layer
 		if self.multilabel:
 			if self.skip_first_class:
-				self.outputs = layers.Dense(self.nclasses-1, name='outputs', activation='sigmoid')(x)
+				self.outputs = layers.Dense(self.nclasses-1, name='outputs', activation='sigmoid', dtype='float32')(x)
 			else:
-				self.outputs = layers.Dense(self.nclasses, name='outputs', activation='sigmoid')(x)
+				self.outputs = layers.Dense(self.nclasses, name='outputs', activation='sigmoid', dtype='float32')(x)
 		else:
-			self.outputs = layers.Dense(self.nclasses, name='outputs', activation='softmax')(x)
+			self.outputs = layers.Dense(self.nclasses, name='outputs', activation='softmax', dtype='float32')(x)
 		
 		#print("outputs shape")
 		#print(K.int_shape(self.outputs))
@@ -1845,14 +1887,14 @@ class SClassifierNN(object):
 				optimizer=self.optimizer, 
 				loss=self.__multilabel_loss,
 				#metrics=['accuracy', f1score_metric, precision_metric, recall_metric], 
-				run_eagerly=True
+				**get_compile_options(self.use_xla)
 			)
 		else:
 			self.model.compile(
 				optimizer=self.optimizer, 
 				loss=self.loss_type, 
 				metrics=['accuracy', f1score_metric, precision_metric, recall_metric], 
-				run_eagerly=True
+				**get_compile_options(self.use_xla)
 			)
 		
 		# - Print model summary
@@ -1874,13 +1916,15 @@ class SClassifierNN(object):
 		scale= 1
 		if self.augmentation:
 			scale= self.augment_scale_factor
-		steps_per_epoch= scale*self.nsamples // self.batch_size
+		# - NB: with multi-worker training each worker reads a data shard
+		num_workers= get_num_workers(self.strategy)
+		steps_per_epoch= scale*self.nsamples // (self.batch_size*num_workers)
 
 		# - Set validation steps
 		val_steps_per_epoch= self.validation_steps
 		if self.has_cvdata:
 			if self.load_cv_data_in_batches:
-				val_steps_per_epoch= self.nsamples_cv // self.batch_size
+				val_steps_per_epoch= self.nsamples_cv // (self.batch_size*num_workers)
 			else:
 				val_steps_per_epoch= 1
 
@@ -1893,16 +1937,21 @@ class SClassifierNN(object):
 		logger.info("Start model training (dataset_size=%d, batch_size=%d, steps_per_epoch=%d, val_steps_per_epoch=%d) ..." % (self.nsamples, self.batch_size, steps_per_epoch, val_steps_per_epoch))
 
 		self.fitout= self.model.fit(
-			x=self.train_data_generator,
+			x=distribute_data(self.strategy, self.train_data_generator),
 			epochs=self.nepochs,
 			steps_per_epoch=steps_per_epoch,
-			validation_data=self.crossval_data_generator,
+			validation_data=distribute_data(self.strategy, self.crossval_data_generator),
 			validation_steps=val_steps_per_epoch,
 			#callbacks=[cb],
 			use_multiprocessing=self.use_multiprocessing,
 			workers=self.nworkers,
 			verbose=2
 		)
+
+		# - Only chief worker writes outputs
+		if not is_chief(self.strategy):
+			logger.info("Not chief worker, skip saving model & outputs ...")
+			return 0
 		
 		#===========================
 		#==   SAVE NN
@@ -1976,16 +2025,21 @@ class SClassifierNN(object):
 
 
 
+	def __predict(self):
+		""" Run model prediction on test data in batches. Data indexes of predicted rows are stored in pred_data_indexes. """
+
+		data_generator= self.dg_test.generate_inference_data(batch_size=self.predict_batch_size)
+		predout, self.pred_data_indexes= predict_in_batches(self.model, data_generator, use_xla=self.use_xla)
+
+		return predout
+
 	def __save_model_output_data(self):
 		""" Save model output data to file """
 	
-		self.output_data= self.model.predict(
-			x=self.test_data_generator,	
-			steps=self.nsamples,
-    	verbose=2,
-    	workers=self.nworkers,
-    	use_multiprocessing=self.use_multiprocessing
-		)
+		self.output_data= self.__predict()
+		if self.output_data is None:
+			logger.error("No model output data predicted!")
+			return -1
 
 		print("output_data shape")
 		print(self.output_data.shape)	
@@ -1995,8 +2049,8 @@ class SClassifierNN(object):
 		
 		
 		# - Merge output data
-		obj_names= np.array(self.source_names).reshape(N,1)
-		obj_ids= np.array(self.source_ids).reshape(N,1)
+		obj_names= np.array([self.source_names[index] for index in self.pred_data_indexes]).reshape(N,1)
+		obj_ids= np.array([self.source_ids[index] for index in self.pred_data_indexes]).reshape(N,1)
 		out_data= np.concatenate(
 			(obj_names, self.output_data, obj_ids),
 			axis=1
@@ -2012,13 +2066,10 @@ class SClassifierNN(object):
 	def __save_model_output_data_multilabel(self):
 		""" Save model output data to file """
 
-		self.output_data= self.model.predict(
-			x=self.test_data_generator,	
-			steps=self.nsamples,
-    	verbose=2,
-    	workers=self.nworkers,
-    	use_multiprocessing=self.use_multiprocessing
-		)
+		self.output_data= self.__predict()
+		if self.output_data is None:
+			logger.error("No model output data predicted!")
+			return -1
 
 		print("output_data shape")
 		print(self.output_data.shape)	
@@ -2031,9 +2082,10 @@ class SClassifierNN(object):
 		dd_list= []
 		
 		for i in range(N):
+			index= self.pred_data_indexes[i]
 			dd= {
-				"sname": self.source_names[i],
-				"id": self.source_ids[i],
+				"sname": self.source_names[index],
+				"id": self.source_ids[index],
 				"probs": self.output_data[i].tolist()
 			}
 			dd_list.append(dd)
@@ -2103,14 +2155,14 @@ class SClassifierNN(object):
 				optimizer=self.optimizer, 
 				loss=self.__multilabel_loss,
 				#metrics=['accuracy', f1score_metric, precision_metric, recall_metric], 
-				run_eagerly=True
+				**get_compile_options(self.use_xla)
 			)
 		else:
 			self.model.compile(
 				optimizer=self.optimizer, 
 				loss=self.loss_type, 
 				metrics=['accuracy', f1score_metric, precision_metric, recall_metric], 
-				run_eagerly=True
+				**get_compile_options(self.use_xla)
 			)
 		
 		return 0
@@ -372,42 +372,54 @@ class Clusterer(object):
 	def set_data_from_file(self, filename):
 		""" Set data from input file. Expected format: sname, N features, classid """
 
-		# - Read table
-		row_start= 0
-		try:
-			table= ascii.read(filename, data_start=row_start)
-		except:
-			logger.error("Failed to read feature file %s!" % filename)
-			return -1
-	
-		print(table.colnames)
-		print(table)
-
-		ncols= len(table.colnames)
-		nfeat= ncols-2
-
-		# - Set data vectors
-		rowIndex= 0
-		self.data_labels= []
-		self.data_classids= []
-		self.source_names= []
-		featdata= []
-
-		for data in table:
-			sname= data[0]
-			classid= data[ncols-1]
+		# - Read binary table? (selected by file extension)
+		if Utils.is_binary_table_file(filename):
+			ret= Utils.read_binary_feature_data(filename)
+			if not ret:
+				logger.error("Failed to read feature file %s!" % filename)
+				return -1
+			featdata, self.source_names, self.data_classids, colnames= ret
 			if self.classid_label_map:
-				label= self.classid_label_map[classid]
+				self.data_labels= [self.classid_label_map[classid] for classid in self.data_classids]
 			else:
-				label= str(classid)
+				self.data_labels= [str(classid) for classid in self.data_classids]
+		else:
+			# - Read table
+			row_start= 0
+			try:
+				table= ascii.read(filename, data_start=row_start)
+			except:
+				logger.error("Failed to read feature file %s!" % filename)
+				return -1
+	
+			print(table.colnames)
+			print(table)
+
+			ncols= len(table.colnames)
+			nfeat= ncols-2
+
+			# - Set data vectors
+			rowIndex= 0
+			self.data_labels= []
+			self.data_classids= []
+			self.source_names= []
+			featdata= []
+
+			for data in table:
+				sname= data[0]
+				classid= data[ncols-1]
+				if self.classid_label_map:
+					label= self.classid_label_map[classid]
+				else:
+					label= str(classid)
 
-			self.source_names.append(sname)
-			self.data_labels.append(label)
-			self.data_classids.append(classid)
-			featdata_curr= []
-			for k in range(nfeat):
-				featdata_curr.append(data[k+1])
-			featdata.append(featdata_curr)
+				self.source_names.append(sname)
+				self.data_labels.append(label)
+				self.data_classids.append(classid)
+				featdata_curr= []
+				for k in range(nfeat):
+					featdata_curr.append(data[k+1])
+				featdata.append(featdata_curr)
 
 		self.data= np.array(featdata)
 		if self.data.size==0:
@@ -1163,67 +1175,30 @@ class Clusterer(object):
 			objids= np.array(data_classids).reshape(N,1)
 			objlabels= np.array(data_labels).reshape(N,1)
 			
+		# - Set columns to be saved
+		columns= [snames]
+		colnames= ["sname"]
 		if self.save_features:
-			znames_counter= list(range(1, Nfeat+1))
-			znames= '{}{}'.format('z',' z'.join(str(item) for item in znames_counter))
-		
-			if self.save_labels_in_ascii:
-				if clust_outlier_scores is None:
-					clustered_data= np.concatenate(
-						(snames, data, objlabels, clust_labels, clust_probs),
-						axis=1
-					)
-					head= '{} {} {}'.format("# sname",znames,"label clust_id clust_prob")
-				else:
-					clustered_data= np.concatenate(
-						(snames, data, objlabels, clust_labels, clust_probs, clust_outlier_scores),
-						axis=1
-					)
-					head= '{} {} {}'.format("# sname",znames,"label clust_id clust_prob clust_outlier_score")
-			else:
-				if clust_outlier_scores is None:
-					clustered_data= np.concatenate(
-						(snames, data, objids, clust_labels, clust_probs),
-						axis=1
-					)
-					head= '{} {} {}'.format("# sname",znames,"id clust_id clust_prob")
-				else:
-					clustered_data= np.concatenate(
-						(snames, data, objids, clust_labels, clust_probs, clust_outlier_scores),
-						axis=1
-					)
-					head= '{} {} {}'.format("# sname",znames,"id clust_id clust_prob clust_outlier_score")
+			columns.append(data)
+			colnames.extend(["z" + str(i+1) for i in range(Nfeat)])
+
+		if self.save_labels_in_ascii:
+			columns.append(objlabels)
+			colnames.append("label")
 		else:
-			if self.save_labels_in_ascii:
-				if clust_outlier_scores is None:
-					clustered_data= np.concatenate(
-						(snames, objlabels, clust_labels, clust_probs),
-						axis=1
-					)
-					head= "# sname label clust_id clust_prob"
-				else:
-					clustered_data= np.concatenate(
-						(snames, objlabels, clust_labels, clust_probs, clust_outlier_scores),
-						axis=1
-					)
-					head= "# sname label clust_id clust_prob clust_outlier_score"
-			else:
-				if clust_outlier_scores is None:
-					clustered_data= np.concatenate(
-						(snames, objids, clust_labels, clust_probs),
-						axis=1
-					)
-					head= "# sname id clust_id clust_prob"
-				else:
-					clustered_data= np.concatenate(
-						(snames, objids, clust_labels, clust_probs, clust_outlier_scores),
-						axis=1
-					)
-					head= "# sname id clust_id clust_prob clust_outlier_score"
+			columns.append(objids)
+			colnames.append("id")
+
+		columns.extend([clust_labels, clust_probs])
+		colnames.extend(["clust_id", "clust_prob"])
+		if clust_outlier_scores is not None:
+			columns.append(clust_outlier_scores)
+			colnames.append("clust_outlier_score")
 				
 		# - Save clustering data 
+		#   NB: binary columnar format if file has .npz extension, ascii otherwise
 		logger.info("Saving clustering output data to file %s ..." % (self.outfile))
-		Utils.write_ascii(clustered_data, self.outfile, head)	
+		Utils.write_table(self.outfile, columns, colnames)
 
 		return 0
 
@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+##################################################
+###          MODULE IMPORT
+##################################################
+## STANDARD MODULES
+import os
+import sys
+import time
+import datetime
+import numpy as np
+import random
+import math
+import logging
+import json
+
+## MODULES
+from sclassifier.data_loader import SourceData
+from sclassifier.utils import Utils
+
+##############################
+##     GLOBAL VARS
+##############################
+from sclassifier import logger
+
+
+##############################
+##     CUTOUT STORE
+##############################
+class CutoutStore(object):
+	""" Packed cutout store: a single memory-mapped tensor of shape (N, ny, nx, nchannels) with a metadata index.
+
+			The store is a directory containing:
+				- data.npy: float32 tensor with all cutouts resampled to the same size
+				- index.json: metadata index in datalist format ({"data": [{"filepaths", "sname", "label", "id", ...}]}), row i in data.npy corresponds to entry i
+
+	"""
+
+	data_filename= "data.npy"
+	index_filename= "index.json"
+
+	def __init__(self, path):
+		""" Return a CutoutStore object """
+
+		self.path= path
+		self.datafile= os.path.join(path, self.data_filename)
+		self.indexfile= os.path.join(path, self.index_filename)
+		self.datalist= {}
+		self.datasize= 0
+		self.nx= 0
+		self.ny= 0
+		self.nchannels= 0
+		self.data= None
+
+	def __getstate__(self):
+		""" Do not pickle/copy the memory-mapped array, re-open it on demand """
+		state= self.__dict__.copy()
+		state["data"]= None
+		return state
+
+	#############################
+	##     CHECK STORE
+	#############################
+	@classmethod
+	def is_store(cls, path):
+		""" Check if given path is a cutout store directory """
+		if not path or not os.path.isdir(path):
+			return False
+		return os.path.isfile(os.path.join(path, cls.data_filename)) and os.path.isfile(os.path.join(path, cls.index_filename))
+
+	#############################
+	##     OPEN STORE
+	#############################
+	def open(self):
+		""" Read store metadata index and memory-map data tensor """
+
+		# - Read index
+		try:
+			with open(self.indexfile, 'r') as fp:
+				self.datalist= json.load(fp)
+		except Exception as e:
+			logger.error("Failed to read store index file %s (err=%s)!" % (self.indexfile, str(e)))
+			return -1
+
+		# - Memory-map data
+		if self.__map_data()<0:
+			return -1
+
+		# - Check consistency between index and data
+		self.datasize= len(self.datalist["data"])
+		if self.data.ndim!=4 or self.data.shape[0]!=self.datasize:
+			logger.error("Store data shape %s is not consistent with index size (%d)!" % (str(self.data.shape), self.datasize))
+			return -1
+
+		self.ny= self.data.shape[1]
+		self.nx= self.data.shape[2]
+		self.nchannels= self.data.shape[3]
+
+		logger.info("Opened cutout store %s (#%d cutouts of size (%d,%d,%d)) ..." % (self.path, self.datasize, self.ny, self.nx, self.nchannels))
+
+		return 0
+
+	def __map_data(self):
+		""" Memory-map data tensor in read-only mode """
+		try:
+			self.data= np.load(self.datafile, mmap_mode='r')
+		except Exception as e:
+			logger.error("Failed to memory-map store data file %s (err=%s)!" % (self.datafile, str(e)))
+			return -1
+		return 0
+
+	#############################
+	##     READ DATA
+	#############################
+	def get_data(self, index, crop_range=None):
+		""" Return a view (no copy) of cutout data at given index, optionally restricted to crop_range=(ixmin,ixmax,iymin,iymax) (max excluded) """
+
+		# - Re-open data map if needed (e.g. after pickling in a worker process)
+		if self.data is None:
+			if self.__map_data()<0:
+				return None
+
+		# - Check index
+		if index<0 or index>=self.datasize:
+			logger.error("Invalid index %d given!" % (index))
+			return None
+
+		if crop_range is None:
+			return self.data[index]
+
+		ixmin, ixmax, iymin, iymax= crop_range
+		if ixmin<0 or iymin<0 or ixmax>self.nx or iymax>self.ny or ixmin>=ixmax or iymin>=iymax:
+			logger.error("Invalid crop range (%d,%d,%d,%d) given for store cutouts of size (%d,%d)!" % (ixmin, ixmax, iymin, iymax, self.nx, self.ny))
+			return None
+
+		return self.data[index, iymin:iymax, ixmin:ixmax, :]
+
+	def get_random_crop_range(self, crop_size):
+		""" Return a random crop range (ixmin,ixmax,iymin,iymax) of given size """
+
+		if crop_size>self.nx or crop_size>self.ny:
+			logger.error("Crop size (%d) exceeds store cutout size (%d,%d)!" % (crop_size, self.nx, self.ny))
+			return None
+
+		ixmin= random.randint(0, self.nx-crop_size)
+		iymin= random.randint(0, self.ny-crop_size)
+
+		return (ixmin, ixmin + crop_size, iymin, iymin + crop_size)
+
+	def read_source_data(self, index, sdata, read_crop=False, crop_size=32, crop_range=None):
+		""" Fill source data image cube with store data at given index """
+
+		# - Set crop range
+		if read_crop and crop_range is None:
+			crop_range= self.get_random_crop_range(crop_size)
+			if crop_range is None:
+				return -1
+
+		# - Get data view
+		data= self.get_data(index, crop_range if read_crop else None)
+		if data is None:
+			logger.error("Failed to get store data at index %d!" % (index))
+			return -1
+
+		# - Set source data cube
+		#   NB: copy the (small) cutout as pre-processing stages may modify the cube in place
+		sdata.img_cube= np.array(data, dtype=np.float32)
+		sdata.img_cube_mask= np.logical_and(sdata.img_cube!=0, np.isfinite(sdata.img_cube)).astype(np.uint8)
+		sdata.img_data= [sdata.img_cube[:,:,i] for i in range(sdata.img_cube.shape[-1])]
+		sdata.img_data_mask= [sdata.img_cube_mask[:,:,i] for i in range(sdata.img_cube_mask.shape[-1])]
+		sdata.nx= sdata.img_cube.shape[1]
+		sdata.ny= sdata.img_cube.shape[0]
+		sdata.nchannels= sdata.img_cube.shape[-1]
+		if read_crop:
+			sdata.ixmin, sdata.ixmax, sdata.iymin, sdata.iymax= crop_range
+
+		return 0
+
+	#############################
+	##     CREATE STORE
+	#############################
+	@classmethod
+	def create_from_datalist(cls, filename, path, nx=64, ny=64, badpix_fract_thr=0.3, overwrite=False):
+		""" Read all cutouts in json datalist, resample them to size (nx,ny) and pack them in a store at given path """
+
+		# - Read datalist
+		try:
+			with open(filename, 'r') as fp:
+				datalist= json.load(fp)
+		except Exception as e:
+			logger.error("Failed to read data filelist %s (err=%s)!" % (filename, str(e)))
+			return None
+
+		data_entries= datalist["data"]
+		nentries= len(data_entries)
+		if nentries<=0:
+			logger.error("Empty datalist read from file %s!" % (filename))
+			return None
+
+		nchannels_set= set([len(item["filepaths"]) for item in data_entries])
+		if len(nchannels_set)!=1:
+			logger.error("Number of channels in each object instance is different (len(nchannels_set)=%d!=1)!" % (len(nchannels_set)))
+			return None
+		nchannels= list(nchannels_set)[0]
+
+		# - Create store directory
+		if cls.is_store(path) and not overwrite:
+			logger.error("Store %s already exists (enable overwrite to replace it)!" % (path))
+			return None
+
+		try:
+			if not os.path.isdir(path):
+				os.makedirs(path)
+		except Exception as e:
+			logger.error("Failed to create store directory %s (err=%s)!" % (path, str(e)))
+			return None
+
+		# - Create data tensor on disk
+		#   NB: allocate for all entries and truncate index at the end, failed entries are skipped
+		datafile= os.path.join(path, cls.data_filename)
+		datafile_tmp= datafile + ".tmp"
+		try:
+			data= np.lib.format.open_memmap(datafile_tmp, mode='w+', dtype=np.float32, shape=(nentries, ny, nx, nchannels))
+		except Exception as e:
+			logger.error("Failed to create store data file %s (err=%s)!" % (datafile_tmp, str(e)))
+			return None
+
+		# - Read, resample and pack cutouts
+		index_entries= []
+		nfailed= 0
+		for i in range(nentries):
+			if i%1000==0:
+				logger.info("Packing cutout no. %d/%d ..." % (i+1, nentries))
+
+			d= data_entries[i]
+			sdata= SourceData()
+			if sdata.set_from_dict(d)<0 or sdata.read_imgs(badpix_fract_thr=badpix_fract_thr)<0:
+				logger.warn("Failed to read cutout at index %d (sname=%s), skip it ..." % (i, str(d.get("sname", ""))))
+				nfailed+= 1
+				continue
+
+			if sdata.resize_imgs(nx, ny, preserve_range=True)<0:
+				logger.warn("Failed to resize cutout at index %d (sname=%s) to size (%d,%d), skip it ..." % (i, sdata.sname, nx, ny))
+				nfailed+= 1
+				continue
+
+			data[len(index_entries)]= sdata.img_cube
+			index_entries.append(d)
+
+		nstored= len(index_entries)
+		logger.info("#%d/%d cutouts packed (#%d failed) ..." % (nstored, nentries, nfailed))
+
+		if nstored<=0:
+			logger.error("No cutouts packed in store!")
+			del data
+			os.remove(datafile_tmp)
+			return None
+
+		# - Truncate data tensor if some entries failed
+		data.flush()
+		if nstored<nentries:
+			data_sel= np.lib.format.open_memmap(datafile_tmp + ".sel", mode='w+', dtype=np.float32, shape=(nstored, ny, nx, nchannels))
+			for i in range(0, nstored, 1000):
+				data_sel[i:i+1000]= data[i:i+1000]
+			data_sel.flush()
+			del data_sel
+			del data
+			os.replace(datafile_tmp + ".sel", datafile_tmp)
+		else:
+			del data
+
+		os.replace(datafile_tmp, datafile)
+
+		# - Write metadata index
+		indexfile= os.path.join(path, cls.index_filename)
+		index= {
+			"data": index_entries,
+			"source": os.path.abspath(filename),
+			"nx": nx,
+			"ny": ny,
+			"nchannels": nchannels,
+		}
+		try:
+			with open(indexfile, 'w') as fp:
+				json.dump(index, fp)
+		except Exception as e:
+			logger.error("Failed to write store index file %s (err=%s)!" % (indexfile, str(e)))
+			return None
+
+		# - Open and return store
+		store= CutoutStore(path)
+		if store.open()<0:
+			logger.error("Failed to open created store %s!" % (path))
+			return None
+
+		return store
@@ -19,8 +19,18 @@ import random
 import math
 import logging
 from collections import Counter
+from collections import deque
 from itertools import chain
 import json
+import copy
+import functools
+import threading
+try:
+	import queue
+except ImportError:
+	import Queue as queue
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import imgaug
 
 ## KERAS MODULES
 from tensorflow.keras.utils import to_categorical
@@ -33,12 +43,111 @@ from astropy.io import ascii
 from astropy.stats import sigma_clipped_stats
 
 from sclassifier.data_loader import SourceData
+from sclassifier.cutout_store import CutoutStore
+from sclassifier.data_sampler import DataSampler
 
 ##############################
 ##     GLOBAL VARS
 ##############################
 from sclassifier import logger
 
+# - Data generator instance used by reader worker processes
+_worker_dg= None
+
+
+##############################
+##     PARALLEL READING
+##############################
+def _init_reader_worker(dg):
+	""" Set data generator used by reader worker process """
+	global _worker_dg
+	_worker_dg= dg
+
+def _read_data_views_task(indexes, read_crop, crop_size, nviews, seed):
+	""" Read data views at given indexes in a reader worker process """
+
+	# - Re-seed random generators with the task seed, so that augmentations
+	#   do not depend on which worker process runs the task
+	random.seed(seed)
+	np.random.seed(seed)
+	imgaug.seed(seed)
+
+	# - Read data views
+	sdata_views_list= _worker_dg.read_data_views_chunk(indexes, read_crop, crop_size, nviews)
+
+	# - Strip data not needed by generators to reduce transfer to main process
+	for sdata_views in sdata_views_list:
+		for sdata in sdata_views:
+			if sdata is None:
+				continue
+			sdata.img_data= []
+			sdata.img_data_mask= []
+			sdata.img_heads= []
+
+	return sdata_views_list
+
+
+class _PrefetchError(object):
+	""" Wrap exception raised in prefetch thread """
+	def __init__(self, exc):
+		self.exc= exc
+
+_PREFETCH_END= object()
+
+def prefetch_batches(generator, prefetch_size=4):
+	""" Run generator in a background thread keeping up to prefetch_size batches in a bounded queue """
+
+	q= queue.Queue(maxsize=prefetch_size)
+	stop_event= threading.Event()
+
+	def put(item):
+		while not stop_event.is_set():
+			try:
+				q.put(item, timeout=0.1)
+				return True
+			except queue.Full:
+				continue
+		return False
+
+	def producer():
+		try:
+			for item in generator:
+				if not put(item):
+					break
+			put(_PREFETCH_END)
+		except Exception as e:
+			put(_PrefetchError(e))
+		finally:
+			generator.close()
+
+	thread= threading.Thread(target=producer)
+	thread.daemon= True
+	thread.start()
+
+	try:
+		while True:
+			item= q.get()
+			if item is _PREFETCH_END:
+				return
+			if isinstance(item, _PrefetchError):
+				raise item.exc
+			yield item
+	finally:
+		stop_event.set()
+		
+		
+def prefetched(generator_fcn):
+	""" Decorator running DataGenerator generators in a background producer thread when parallel reading is enabled """
+
+	@functools.wraps(generator_fcn)
+	def wrapper(self, *args, **kwargs):
+		gen= generator_fcn(self, *args, **kwargs)
+		if self.nworkers<=0 or self.prefetch_size<=0:
+			return gen
+		return prefetch_batches(gen, self.prefetch_size)
+
+	return wrapper
+
 
 ##############################
 ##     DATA GENERATOR
@@ -48,7 +157,7 @@ class DataGenerator(object):
 	""" Read data from disk and provide it to the network
 
 			Arguments:
-				- datalist: Filelist (json) with input data
+				- datalist: Filelist (json) with input data or packed cutout store directory (see CutoutStore)
 				
 	"""
 	
@@ -57,6 +166,7 @@ class DataGenerator(object):
 
 		# - Input data
 		self.datalistfile= filename
+		self.store= None
 		self.datalist= {}
 		self.datasize= 0
 		self.classids= []
@@ -68,6 +178,36 @@ class DataGenerator(object):
 		# - Pre-processor
 		self.preprocessor= preprocessor
 
+		# - Cache of deterministic pre-processing outputs (PreprocessingCache, disabled if None)
+		#   NB: not used when reading random crops
+		self.preproc_cache= None
+
+		# - Parallel reading options
+		#   NB: nworkers=0 reads and pre-processes data in the generator thread
+		self.nworkers= 0
+		self.worker_type= "process" # {"process","thread"}
+		self.prefetch_size= 4 # max number of batches kept in the prefetch queue
+		# - Seed used to generate reader task seeds (data index order is seeded for both worker types)
+		#   NB: only process workers re-seed random/numpy/imgaug generators per task, so augmentations are reproducible 
+		#       only with worker_type=process. Thread workers share the global generator state, concurrently drawn 
+		#       by all threads, so their augmentations are not reproducible.
+		self.seed= None
+
+		# - Batch pre-processing options
+		#   NB: if preproc_batch_size>1, data are read and pre-processed in chunks of this size 
+		#       using DataPreprocessor batch mode (not used together with preproc_cache)
+		self.preproc_batch_size= 0
+
+		# - Class rebalancing options
+		#   NB: data indexes are drawn with DataSampler before reading when balance_classes is enabled
+		self.sampling= "weighted" # {"weighted","stratified"}
+
+		# - Shard options (e.g. for multi-worker training)
+		#   NB: training generators return only data indexes of this shard (index % num_shards == shard_index, or one every 
+		#       num_shards indexes drawn from class rebalancing sampler, that requires the same seed on all shards)
+		self.num_shards= 1
+		self.shard_index= 0
+
 
 	#############################
 	##     DISABLE AUGMENTATION
@@ -90,13 +230,24 @@ class DataGenerator(object):
 		""" Read json filelist """
 
 		# - Read data list
+		#   NB: if a packed cutout store is given, read the datalist from the store index
 		self.datalist= {}
-		try:
-			with open(self.datalistfile) as fp:
-				self.datalist= json.load(fp)
-		except Exception as e:
-			logger.error("Failed to read data filelist %s!" % self.datalistfile)
-			return -1
+		self.store= None
+		if CutoutStore.is_store(self.datalistfile):
+			logger.info("Opening packed cutout store %s ..." % (self.datalistfile))
+			store= CutoutStore(self.datalistfile)
+			if store.open()<0:
+				logger.error("Failed to open cutout store %s!" % self.datalistfile)
+				return -1
+			self.store= store
+			self.datalist= store.datalist
+		else:
+			try:
+				with open(self.datalistfile) as fp:
+					self.datalist= json.load(fp)
+			except Exception as e:
+				logger.error("Failed to read data filelist %s!" % self.datalistfile)
+				return -1
 
 		# - Check number of channels per image
 		nchannels_set= set([len(item["filepaths"]) for item in self.datalist["data"]])
@@ -132,6 +283,21 @@ class DataGenerator(object):
 	def read_data(self, index, read_crop=False, crop_size=32, crop_range=None):	
 		""" Read data at given index """
 
+		# - Read deterministic pre-processing output from cache?
+		if self.preproc_cache is not None and self.preprocessor is not None and not read_crop:
+			return self.read_cached_data(index)
+
+		# - Read source image data
+		sdata= self.read_raw_data(index, read_crop, crop_size, crop_range)
+		if sdata is None:
+			return None
+
+		# - Apply pre-processing
+		return self.preprocess_data(index, sdata)
+
+	def read_raw_data(self, index, read_crop=False, crop_size=32, crop_range=None):	
+		""" Read data at given index without applying pre-processing """
+
 		# - Check index
 		if index<0 or index>=self.datasize:
 			logger.error("Invalid index %d given!" % (index))
@@ -151,7 +317,9 @@ class DataGenerator(object):
 
 		# - Read source image data
 		status= 0
-		if read_crop:
+		if self.store is not None:
+			status= self.store.read_source_data(index, sdata, read_crop, crop_size, crop_range)
+		elif read_crop:
 			if crop_range is None:
 				status= sdata.read_random_img_crops(crop_size)
 			else:
@@ -170,7 +338,83 @@ class DataGenerator(object):
 		if sdata.img_cube is None:
 			logger.error("Source image data cube at index %d (sname=%s, label=%s, classid=%s) is None!" % (index, sname, str(label), str(classid)))
 			return None
-			
+
+		return sdata
+
+	def read_cached_data(self, index):
+		""" Read data at given index taking the output of deterministic pre-processing stages from cache (if present) or storing it in cache. 
+				Remaining stages (e.g. augmenters) are applied to cached data. 
+		"""
+
+		sdata, nstages_det= self.read_deterministic_data(index)
+		if sdata is None:
+			return None
+
+		# - Apply remaining pre-processing stages
+		return self.preprocess_data(index, sdata, first_stage=nstages_det)
+
+	def read_deterministic_data(self, index, read_crop=False, crop_size=32, crop_range=None):
+		""" Read data at given index and apply the deterministic pre-processing stages (e.g. stages before the first augmenter), 
+				taking their output from cache if enabled (and not reading crops). 
+				Returns the source data and the number of stages applied (None, 0 on failure).
+		"""
+
+		# - Check index
+		if index<0 or index>=self.datasize:
+			logger.error("Invalid index %d given!" % (index))
+			return None, 0
+
+		# - Read raw data if no pre-processing is to be applied
+		if self.preprocessor is None:
+			return self.read_raw_data(index, read_crop, crop_size, crop_range), 0
+
+		d= self.datalist["data"][index]
+		nstages_det= self.preprocessor.get_deterministic_stage_count()
+		use_cache= self.preproc_cache is not None and not read_crop and nstages_det>0
+
+		# - Read from cache (only if there are deterministic stages to be cached)
+		#   NB: if reading from a cutout store, the store data file identifies the input
+		if use_cache:
+			config_hash= self.preprocessor.get_config_hash(nstages_det)
+			if self.store is not None:
+				key= self.preproc_cache.get_key([self.store.datafile], config_hash, extra=index)
+			else:
+				key= self.preproc_cache.get_key(d["filepaths"], config_hash)
+
+			data= self.preproc_cache.get(key)
+			if data is not None:
+				sdata= SourceData()
+				if sdata.set_from_dict(d)<0:
+					logger.error("Failed to set source image data at index %d!" % (index))
+					return None, 0
+				sdata.img_cube= data
+				return sdata, nstages_det
+
+		# - Read source image data and apply deterministic stages
+		sdata= self.read_raw_data(index, read_crop, crop_size, crop_range)
+		if sdata is None:
+			return None, 0
+
+		if nstages_det>0:
+			data= self.preprocessor.run_stages(sdata.img_cube, 0, nstages_det, augmenter_index=d.get('augmenter_index', 0))
+			if data is None:
+				logger.error("Failed to pre-process source image data at index %d (sname=%s)!" % (index, sdata.sname))
+				return None, 0
+			sdata.img_cube= data
+
+			if use_cache:
+				self.preproc_cache.put(key, data)
+
+		return sdata, nstages_det
+
+	def preprocess_data(self, index, sdata, first_stage=0):
+		""" Apply pre-processing (starting from stage first_stage) to source data read at given index and check data integrity """
+
+		sname= sdata.sname
+		label= sdata.label
+		classid= sdata.id
+		d= self.datalist["data"][index]
+				
 		# - Check if more augmenters are required for this dataset
 		augmenter_index= 0
 		if 'augmenter_index' in d:
@@ -183,7 +427,10 @@ class DataGenerator(object):
 		if self.preprocessor is not None:
 			logger.debug("Apply pre-processing ...")
 			#data_proc= self.preprocessor(sdata.img_cube)
-			data_proc= self.preprocessor(sdata.img_cube, augmenter_index=augmenter_index)
+			if first_stage>0:
+				data_proc= self.preprocessor.run_stages(sdata.img_cube, first_stage, augmenter_index=augmenter_index)
+			else:
+				data_proc= self.preprocessor(sdata.img_cube, augmenter_index=augmenter_index)
 			if data_proc is None:
 				logger.error("Failed to pre-process source image data at index %d (sname=%s, label=%s, classid=%s)!" % (index, sname, str(label), str(classid)))
 				return None
@@ -198,19 +445,294 @@ class DataGenerator(object):
 
 		return sdata
 
+	def read_data_views_batch(self, indexes, read_crop=False, crop_size=32, nviews=1):
+		""" Read data views for a batch of data indexes, pre-processing all data in a single batch (see DataPreprocessor.apply_batch).
+				Raw data are read and deterministic stages applied once, remaining (augmentation) stages are applied 
+				to each of the nviews views. Returns the list of data views for each index.
+		"""
 
-	
+		sdata_views_list= [[None]*nviews for index in indexes]
+
+		# - Read raw data
+		sdata_list= [self.read_raw_data(index, read_crop, crop_size) for index in indexes]
+		good= [i for i in range(len(indexes)) if sdata_list[i] is not None]
+		if not good:
+			return sdata_views_list
+
+		raw_data= [sdata_list[i].img_cube for i in good]
+		augmenter_indexes= np.array([self.datalist["data"][indexes[i]].get('augmenter_index', 0) for i in good])
+		if np.any(augmenter_indexes<0):
+			logger.error("Invalid augmenter_index specified (must be [0, naugmenters-1]!")
+			return sdata_views_list
+
+		# - Apply deterministic pre-processing stages once, keeping only samples passing them
+		nstages_det= 0
+		if self.preprocessor is not None:
+			nstages_det= self.preprocessor.get_deterministic_stage_count()
+			if nstages_det>0:
+				data_det, valid_det= self.preprocessor.apply_batch(raw_data, last=nstages_det, augmenter_index=augmenter_indexes)
+				if data_det is None:
+					logger.error("Failed to pre-process data batch!")
+					return sdata_views_list
+
+				for j in np.where(~valid_det)[0]:
+					sdata= sdata_list[good[j]]
+					logger.error("Failed to pre-process source image data at index %d (sname=%s, label=%s, classid=%s)!" % (indexes[good[j]], sdata.sname, str(sdata.label), str(sdata.id)))
+				good= [good[j] for j in range(len(good)) if valid_det[j]]
+				raw_data= [data_det[j] for j in range(len(valid_det)) if valid_det[j]]
+				augmenter_indexes= augmenter_indexes[valid_det]
+				if not good:
+					return sdata_views_list
+
+		# - Apply remaining pre-processing stages to each data view
+		for k in range(nviews):
+			# - Stages may work in place, so pass a copy of data if they are needed for other views
+			data_in= raw_data if k==nviews-1 else [np.copy(item) for item in raw_data]
+
+			if self.preprocessor is None:
+				data= data_in
+				valid= np.ones(len(good), dtype=bool)
+			else:
+				data, valid= self.preprocessor.apply_batch(data_in, first=nstages_det, augmenter_index=augmenter_indexes)
+				if data is None:
+					logger.error("Failed to pre-process data batch (view %d)!" % (k+1))
+					continue
+
+			for j, i in enumerate(good):
+				sdata= sdata_list[i]
+				if not valid[j]:
+					logger.error("Failed to pre-process source image data at index %d (sname=%s, label=%s, classid=%s)!" % (indexes[i], sdata.sname, str(sdata.label), str(sdata.id)))
+					continue
+
+				# - Check data cube integrity
+				if not np.all(np.isfinite(data[j])):
+					logger.warn("Source image data at index %d (sname=%s, label=%s, classid=%s) has bad pixels!" % (indexes[i], sdata.sname, str(sdata.label), str(sdata.id)))
+					continue
+
+				sdata_view= sdata if k==0 else copy.copy(sdata)
+				sdata_view.img_cube= data[j]
+				sdata_views_list[i][k]= sdata_view
+
+		return sdata_views_list
+
+	def read_data_views_chunk(self, indexes, read_crop=False, crop_size=32, nviews=1):
+		""" Read data views for a chunk of data indexes, in batch mode if enabled. Returns the list of data views for each index """
+
+		if len(indexes)>1 and self.preproc_batch_size>1 and self.preproc_cache is None:
+			return self.read_data_views_batch(indexes, read_crop, crop_size, nviews)
+
+		return [self.read_data_views(index, read_crop, crop_size, nviews) for index in indexes]
+
+	def read_data_views(self, index, read_crop=False, crop_size=32, nviews=1):
+		""" Read nviews pre-processed data views at given index.
+				Data are read and deterministic pre-processing stages applied once, remaining (augmentation) stages are applied to each view.
+				If read_crop is enabled the same crop range is used for all views.
+		"""
+
+		if nviews==1:
+			return [self.read_data(index, read_crop, crop_size)]
+
+		# - Read data and apply deterministic pre-processing stages once
+		sdata, nstages_det= self.read_deterministic_data(index, read_crop, crop_size)
+		if sdata is None:
+			return [None]*nviews
+
+		# - Apply remaining stages to each view
+		#   NB: stages may work in place, so each view (but last) gets a copy of data
+		data= sdata.img_cube
+		sdata_views= []
+		for k in range(nviews):
+			sdata_view= sdata if k==nviews-1 else copy.copy(sdata)
+			if k<nviews-1:
+				sdata_view.img_cube= np.copy(data)
+			sdata_views.append(self.preprocess_data(index, sdata_view, first_stage=nstages_det))
+
+		return sdata_views
+
+	#############################
+	##     READ DATA SAMPLES
+	#############################
+	def get_sampler(self, class_probs):
+		""" Return a DataSampler drawing data indexes with given class probs (None on failure) """
+
+		if self.sampling not in ["weighted","stratified"]:
+			logger.error("Invalid/unknown sampling mode (%s) given!" % (self.sampling))
+			return None
+
+		sampler= DataSampler(self.labels, class_probs, mode=self.sampling)
+		if sampler.weights is None:
+			logger.error("Failed to create data sampler with given class probs!")
+			return None
+
+		logger.info("Created data sampler (mode=%s, #%d strata) for class rebalancing ..." % (self.sampling, len(sampler.strata)))
+
+		return sampler
+
+	def __generate_data_indexes(self, shuffle=True, sampler=None):
+		""" Generator returning an endless sequence of data indexes (random if shuffle is enabled, sequential otherwise).
+				If a sampler is given, indexes are drawn from it. Only indexes of this shard are returned if sharded.
+		"""
+
+		# - Set index generator (seeded if seed is given)
+		rng= np.random.RandomState(self.seed) if self.seed is not None else np.random
+
+		# - Draw indexes from sampler (taking one index every num_shards if sharded)
+		#   NB: all shards must draw the same index sequence to be disjoint and cover the sampled data, 
+		#       so a seed shared by all workers is required
+		if sampler is not None:
+			if self.num_shards>1 and self.seed is None:
+				logger.error("A seed shared by all shards is required to draw sharded data indexes from sampler (num_shards=%d)!" % (self.num_shards))
+				return
+			for counter, data_index in enumerate(sampler.generate_indexes(rng)):
+				if counter % self.num_shards == self.shard_index:
+					yield data_index
+			return
+
+		data_indexes= np.arange(self.shard_index, self.datasize, self.num_shards)
+		if data_indexes.size<=0:
+			logger.error("No data index in shard %d (num_shards=%d, datasize=%d)!" % (self.shard_index, self.num_shards, self.datasize))
+			return
+
+		counter= -1
+		while True:
+			counter = (counter + 1) % data_indexes.size
+			data_index= data_indexes[counter]
+			if shuffle:
+				data_index= rng.choice(data_indexes)
+			yield data_index
+
+	def __generate_data_views(self, shuffle=True, read_crop=False, crop_size=32, nviews=1, indexes=None, sampler=None):
+		""" Generator returning (data_index, data_views) tuples. Data are read in a pool of workers if nworkers>0.
+				If a list of indexes is given, data are read once in the given order, otherwise endlessly
+				(drawing indexes from sampler if given).
+		"""
+
+		# - Set size of index chunks read at once (>1 in batch pre-processing mode)
+		chunk_size= 1
+		if self.preproc_batch_size>1 and self.preproc_cache is None:
+			chunk_size= self.preproc_batch_size
+
+		# - Read data in this thread
+		if self.nworkers<=0:
+			index_iter= iter(indexes) if indexes is not None else self.__generate_data_indexes(shuffle, sampler=sampler)
+			for chunk in self.__generate_index_chunks(index_iter, chunk_size):
+				sdata_views_list= self.read_data_views_chunk(chunk, read_crop, crop_size, nviews)
+				for data_index, sdata_views in zip(chunk, sdata_views_list):
+					yield data_index, sdata_views
+			return
+
+		# - Read data in a pool of workers
+		#   NB: a bounded number of read tasks is kept pending, results are returned in submission order
+		logger.info("Starting %d reader workers (type=%s) ..." % (self.nworkers, self.worker_type))
+		use_threads= (self.worker_type=="thread")
+		if use_threads:
+			executor= ThreadPoolExecutor(max_workers=self.nworkers)
+		else:
+			executor= ProcessPoolExecutor(max_workers=self.nworkers, initializer=_init_reader_worker, initargs=(self,))
+
+		# - Set reader task seed generator (different for each shard)
+		rng= np.random.RandomState(self.seed + self.shard_index) if self.seed is not None else np.random
+		index_iter= iter(indexes) if indexes is not None else self.__generate_data_indexes(shuffle, sampler)
+		chunk_iter= self.__generate_index_chunks(index_iter, chunk_size)
+		npending_max= 2*self.nworkers
+		pending= deque()
+
+		try:
+			while True:
+				for chunk in chunk_iter:
+					if use_threads:
+						# NB: threads share global random generators, augmentations are not re-seeded (see seed option)
+						future= executor.submit(self.read_data_views_chunk, chunk, read_crop, crop_size, nviews)
+					else:
+						seed= int(rng.randint(0, 2**31-1))
+						future= executor.submit(_read_data_views_task, chunk, read_crop, crop_size, nviews, seed)
+					pending.append((chunk, future))
+					if len(pending)>=npending_max:
+						break
+
+				if not pending:
+					break
+
+				chunk, future= pending.popleft()
+				for data_index, sdata_views in zip(chunk, future.result()):
+					yield data_index, sdata_views
+
+		finally:
+			for chunk, future in pending:
+				future.cancel()
+			executor.shutdown(wait=False)
+
+	def __generate_index_chunks(self, index_iter, chunk_size=1):
+		""" Generator grouping data indexes in chunks of given size (last chunk can be smaller) """
+
+		chunk= []
+		for data_index in index_iter:
+			chunk.append(data_index)
+			if len(chunk)>=chunk_size:
+				yield chunk
+				chunk= []
+
+		if chunk:
+			yield chunk
+
+	#####################################
+	##     GENERATE INFERENCE DATA
+	#####################################
+	@prefetched
+	def generate_inference_data(self, batch_size=32, read_crop=False, crop_size=32, start_index=0, nrepeats=1, data_indexes=None):
+		""" Generator function reading all data once (nrepeats times) in order, for inference.
+				Returns (inputs, data_indexes) batches. Samples failing to be read are skipped, so that rows in inputs 
+				correspond to data at data_indexes. The last batch can be smaller than batch_size.
+				If data_indexes is given, only data at these indexes are read.
+		"""
+
+		if data_indexes is None:
+			data_indexes= range(start_index, self.datasize)
+		indexes= [index for i in range(nrepeats) for index in data_indexes]
+		sample_reader= self.__generate_data_views(shuffle=False, read_crop=read_crop, crop_size=crop_size, nviews=1, indexes=indexes)
+
+		logger.info("Starting inference data generator (#%d samples) ..." % (len(indexes)))
+
+		inputs= None
+		data_indexes= []
+		nfailed= 0
+
+		for data_index, sdata_views in sample_reader:
+			sdata= sdata_views[0]
+			if sdata is None:
+				logger.warn("Failed to read source data at index %d, skip it ..." % data_index)
+				nfailed+= 1
+				continue
+
+			if inputs is None:
+				inputs= np.zeros((batch_size,) + sdata.img_cube.shape, dtype=np.float32)
+
+			inputs[len(data_indexes)]= sdata.img_cube
+			data_indexes.append(data_index)
+
+			if len(data_indexes)>=batch_size:
+				yield inputs, data_indexes
+				inputs= np.zeros_like(inputs)
+				data_indexes= []
+
+		# - Return last partial batch
+		if data_indexes:
+			yield inputs[:len(data_indexes)], data_indexes
+
+		if nfailed>0:
+			logger.warn("#%d samples failed to be read and were skipped ..." % (nfailed))
 
 	#####################################
 	##     GENERATE CNN TRAIN DATA
 	#####################################
+	@prefetched
 	def generate_cnn_data(self, batch_size=32, shuffle=True, read_crop=False, crop_size=32, classtarget_map={}, nclasses=7, balance_classes=False, class_probs={}, skip_first_class=False):
 		""" Generator function for CNN classification task """
 
 		nb= 0
-		data_index= -1
-		data_indexes= np.arange(0, self.datasize)
 		target_ids= []
+		sampler= self.get_sampler(class_probs) if (balance_classes and class_probs) else None
+		sample_reader= self.__generate_data_views(shuffle, read_crop, crop_size, nviews=1, sampler=sampler)
 
 		logger.info("Starting data generator ...")
 
@@ -221,13 +743,11 @@ class DataGenerator(object):
 					logger.debug("Starting new batch ...")
 
 				# - Generate random data index and read data at this index
-				data_index = (data_index + 1) % self.datasize
-				if shuffle:
-					data_index= np.random.choice(data_indexes)
+				data_index, sdata_views= next(sample_reader)
+				sdata= sdata_views[0]
 
-				logger.debug("Reading data at index %d (batch %d/%d) ..." % (data_index, nb, batch_size))
+				logger.debug("Read data at index %d (batch %d/%d) ..." % (data_index, nb, batch_size))
 				
-				sdata= self.read_data(data_index, read_crop, crop_size)
 				if sdata is None:
 					logger.warn("Failed to read source data at index %d, skip to next ..." % data_index)
 					continue
@@ -248,26 +768,6 @@ class DataGenerator(object):
 					else:
 						target_id= classtarget_map[class_id]
 
-				# - Apply class rebalancing?
-				if balance_classes and class_probs:
-					accept= True
-					if multilabel:
-						# - Find the largest prob among available classes
-						#   Example probs={"COMPACT":0.5,"EXTENDED":0.7,"DIFFUSE":1.0} ==> ["COMPACT"] will be generated less frequently than ["COMPACT","EXTENDED","DIFFUSE"]
-						prob_max= 0
-						for item in class_name:
-							prob= class_probs[item]
-							if prob>prob_max:
-								prob_max= prob
-						prob= prob_max
-					else:
-						prob= class_probs[class_name]
-					  
-					r= random.uniform(0, 1)
-					accept= r<prob
-					if not accept:
-						continue
-					
 				# - Initialize return data
 				if nb==0:
 					inputs= np.zeros(inputs_shape, dtype=np.float32)
@@ -312,6 +812,7 @@ class DataGenerator(object):
 
 			except (GeneratorExit):
 				logger.info("Data generator complete execution ...")
+				sample_reader.close()
 				raise
 			except (KeyboardInterrupt):
 				logger.warn("Keyboard exception catched while generating data...")
@@ -323,12 +824,13 @@ class DataGenerator(object):
 	#####################################
 	##     GENERATE CAE TRAIN DATA
 	#####################################
+	@prefetched
 	def generate_cae_data(self, batch_size=32, shuffle=True, read_crop=False, crop_size=32, balance_classes=False, class_probs={}):
 		""" Generator function for CAE task """
 	
 		nb= 0
-		data_index= -1
-		data_indexes= np.arange(0,self.datasize)
+		sampler= self.get_sampler(class_probs) if (balance_classes and class_probs) else None
+		sample_reader= self.__generate_data_views(shuffle, read_crop, crop_size, nviews=1, sampler=sampler)
 
 		logger.info("Starting CAE data generator ...")
 
@@ -339,11 +841,8 @@ class DataGenerator(object):
 					logger.debug("Starting new batch ...")
 
 				# - Generate random data index and read data at this index
-				data_index = (data_index + 1) % self.datasize
-				if shuffle:
-					data_index= np.random.choice(data_indexes)
-
-				sdata= self.read_data(data_index, read_crop, crop_size)
+				data_index, sdata_views= next(sample_reader)
+				sdata= sdata_views[0]
 				if sdata is None:
 					logger.warn("Failed to read source data at index %d, skip to next ..." % data_index)
 					continue
@@ -351,30 +850,11 @@ class DataGenerator(object):
 				data_shape= sdata.img_cube.shape
 				inputs_shape= (batch_size,) + data_shape
 				
-				# - Apply class rebalancing?
+				# - Get class info
 				class_id= sdata.id
 				class_name= sdata.label
 				multilabel= (isinstance(class_id, list)) and (isinstance(class_name, list))
-				
-				if balance_classes and class_probs:					
-					accept= True
-					if multilabel:
-						# - Find the largest prob among available classes
-						#   Example probs={"COMPACT":0.5,"EXTENDED":0.7,"DIFFUSE":1.0} ==> ["COMPACT"] will be generated less frequently than ["COMPACT","EXTENDED","DIFFUSE"]
-						prob_max= 0
-						for item in class_name:
-							prob= class_probs[item]
-							if prob>prob_max:
-								prob_max= prob
-						prob= prob_max
-					else:
-						prob= class_probs[class_name]
-					  
-					r= random.uniform(0, 1)
-					accept= r<prob
-					if not accept:
-						continue
-						
+
 				# - Initialize return data
 				if nb==0:
 					inputs= np.zeros(inputs_shape, dtype=np.float32)
@@ -407,6 +887,7 @@ class DataGenerator(object):
 
 			except (GeneratorExit):
 				logger.info("Data generator complete execution ...")
+				sample_reader.close()
 				raise
 			except (KeyboardInterrupt):
 				logger.warn("Keyboard exception catched while generating data...")
@@ -420,12 +901,13 @@ class DataGenerator(object):
 	#####################################
 	##     GENERATE SIMCLR TRAIN DATA
 	#####################################
+	@prefetched
 	def generate_simclr_data(self, batch_size=32, shuffle=True, read_crop=False, crop_size=32, balance_classes=False, class_probs={}):
 		""" Generator function for SimCLR task """
 	
 		nb= 0
-		data_index= -1
-		data_indexes= np.arange(0,self.datasize)
+		sampler= self.get_sampler(class_probs) if (balance_classes and class_probs) else None
+		sample_reader= self.__generate_data_views(shuffle, read_crop, crop_size, nviews=2, sampler=sampler)
 
 		logger.info("Starting data generator ...")
 
@@ -436,17 +918,10 @@ class DataGenerator(object):
 					logger.debug("Starting new batch ...")
 
 				# - Generate random data index and pairs of augmented data for SimCLR
-				data_index = (data_index + 1) % self.datasize
-				if shuffle:
-					data_index= np.random.choice(data_indexes)
-
-				if read_crop:# NB: must read the same crop range for the data pair
-					sdata_1= self.read_data(data_index, read_crop=True, crop_size=crop_size, crop_range=None)
-					crop_range= (sdata_1.ixmin, sdata_1.ixmax, sdata_1.iymin, sdata_1.iymax)
-					sdata_2= self.read_data(data_index, read_crop=True, crop_size=crop_size, crop_range=crop_range)
-				else:
-					sdata_1= self.read_data(data_index)
-					sdata_2= self.read_data(data_index)
+				#   NB: if read_crop is enabled the same crop range is read for the data pair
+				data_index, sdata_views= next(sample_reader)
+				sdata_1= sdata_views[0]
+				sdata_2= sdata_views[1]
 				
 				if sdata_1 is None or sdata_2 is None:
 					logger.warn("Failed to read source data pair at index %d!" % (data_index))
@@ -455,31 +930,11 @@ class DataGenerator(object):
 				data_shape= sdata_1.img_cube.shape
 				inputs_shape= (batch_size,) + data_shape
 
-				# - Apply class rebalancing?
+				# - Get class info
 				class_id= sdata_1.id
 				class_name= sdata_1.label
 				multilabel= (isinstance(class_id, list)) and (isinstance(class_name, list))
-				
-				if balance_classes and class_probs:					
-					accept= True
-					if multilabel:
-						# - Find the largest prob among available classes
-						#   Example probs={"COMPACT":0.5,"EXTENDED":0.7,"DIFFUSE":1.0} ==> ["COMPACT"] will be generated less frequently than ["COMPACT","EXTENDED","DIFFUSE"]
-						prob_max= 0
-						for item in class_name:
-							prob= class_probs[item]
-							if prob>prob_max:
-								prob_max= prob
-						prob= prob_max
-					else:
-						prob= class_probs[class_name]
-					  
-					r= random.uniform(0, 1)
-					accept= r<prob
-					if not accept:
-						continue
-				
-				
+
 				# - Initialize return data
 				if nb==0:
 					# - The ref implementation (https://github.com/mwdhont/SimCLRv1-keras-tensorflow/blob/master/DataGeneratorSimCLR.py)
@@ -520,6 +975,7 @@ class DataGenerator(object):
 
 			except (GeneratorExit):
 				logger.info("Data generator complete execution ...")
+				sample_reader.close()
 				raise
 			except (KeyboardInterrupt):
 				logger.warn("Keyboard exception catched while generating data...")
@@ -529,12 +985,13 @@ class DataGenerator(object):
 				raise
 
 
+	@prefetched
 	def generate_simclr_data_v2(self, batch_size=32, shuffle=True, read_crop=False, crop_size=32, balance_classes=False, class_probs={}):
 		""" Generator function for SimCLR task (version 2) """
 	
 		nb= 0
-		data_index= -1
-		data_indexes= np.arange(0,self.datasize)
+		sampler= self.get_sampler(class_probs) if (balance_classes and class_probs) else None
+		sample_reader= self.__generate_data_views(shuffle, read_crop, crop_size, nviews=2, sampler=sampler)
 
 		logger.info("Starting data generator ...")
 
@@ -545,17 +1002,10 @@ class DataGenerator(object):
 					logger.debug("Starting new batch ...")
 
 				# - Generate random data index and pairs of augmented data for SimCLR
-				data_index = (data_index + 1) % self.datasize
-				if shuffle:
-					data_index= np.random.choice(data_indexes)
-
-				if read_crop:# NB: must read the same crop range for the data pair
-					sdata_1= self.read_data(data_index, read_crop=True, crop_size=crop_size, crop_range=None)
-					crop_range= (sdata_1.ixmin, sdata_1.ixmax, sdata_1.iymin, sdata_1.iymax)
-					sdata_2= self.read_data(data_index, read_crop=True, crop_size=crop_size, crop_range=crop_range)
-				else:
-					sdata_1= self.read_data(data_index)
-					sdata_2= self.read_data(data_index)
+				#   NB: if read_crop is enabled the same crop range is read for the data pair
+				data_index, sdata_views= next(sample_reader)
+				sdata_1= sdata_views[0]
+				sdata_2= sdata_views[1]
 				
 				if sdata_1 is None or sdata_2 is None:
 					logger.warn("Failed to read source data pair at index %d!" % (data_index))
@@ -564,17 +1014,10 @@ class DataGenerator(object):
 				data_shape= sdata_1.img_cube.shape
 				inputs_shape= (2*batch_size,) + data_shape
 
-				# - Apply class rebalancing?
+				# - Get class info
 				class_id= sdata_1.id
 				class_name= sdata_1.label
 
-				if balance_classes and class_probs:					
-					prob= class_probs[class_name]
-					r= random.uniform(0, 1)
-					accept= r<prob
-					if not accept:
-						continue
-				
 				# - Initialize return data
 				if nb==0:
 					# - The ref implementation (https://github.com/garder14/simclr-tensorflow2/blob/main/datasets.py)
@@ -606,6 +1049,7 @@ class DataGenerator(object):
 
 			except (GeneratorExit):
 				logger.info("Data generator complete execution ...")
+				sample_reader.close()
 				raise
 			except (KeyboardInterrupt):
 				logger.warn("Keyboard exception catched while generating data...")
@@ -617,12 +1061,13 @@ class DataGenerator(object):
 	#####################################
 	##     GENERATE BYOL TRAIN DATA
 	#####################################
+	@prefetched
 	def generate_byol_data(self, batch_size=32, shuffle=True, read_crop=False, crop_size=32, balance_classes=False, class_probs={}):
 		""" Generator function for BYOL task """
 	
 		nb= 0
-		data_index= -1
-		data_indexes= np.arange(0,self.datasize)
+		sampler= self.get_sampler(class_probs) if (balance_classes and class_probs) else None
+		sample_reader= self.__generate_data_views(shuffle, read_crop, crop_size, nviews=2, sampler=sampler)
 
 		logger.info("Starting data generator ...")
 
@@ -633,17 +1078,10 @@ class DataGenerator(object):
 					logger.debug("Starting new batch ...")
 
 				# - Generate random data index and pairs of augmented data
-				data_index = (data_index + 1) % self.datasize
-				if shuffle:
-					data_index= np.random.choice(data_indexes)
-
-				if read_crop:# NB: must read the same crop range for the data pair
-					sdata_1= self.read_data(data_index, read_crop=True, crop_size=crop_size, crop_range=None)
-					crop_range= (sdata_1.ixmin, sdata_1.ixmax, sdata_1.iymin, sdata_1.iymax)
-					sdata_2= self.read_data(data_index, read_crop=True, crop_size=crop_size, crop_range=crop_range)
-				else:
-					sdata_1= self.read_data(data_index)
-					sdata_2= self.read_data(data_index)
+				#   NB: if read_crop is enabled the same crop range is read for the data pair
+				data_index, sdata_views= next(sample_reader)
+				sdata_1= sdata_views[0]
+				sdata_2= sdata_views[1]
 				
 				if sdata_1 is None or sdata_2 is None:
 					logger.warn("Failed to read source data pair at index %d!" % (data_index))
@@ -652,17 +1090,10 @@ class DataGenerator(object):
 				data_shape= sdata_1.img_cube.shape
 				inputs_shape= (batch_size,) + data_shape
 
-				# - Apply class rebalancing?
+				# - Get class info
 				class_id= sdata_1.id
 				class_name= sdata_1.label
 
-				if balance_classes and class_probs:
-					prob= class_probs[class_name]
-					r= random.uniform(0, 1)
-					accept= r<prob
-					if not accept:
-						continue
-				
 				# - Initialize return data
 				if nb==0:
 					inputs_1= np.zeros(inputs_shape, dtype=np.float32)
@@ -691,6 +1122,7 @@ class DataGenerator(object):
 
 			except (GeneratorExit):
 				logger.info("Data generator complete execution ...")
+				sample_reader.close()
 				raise
 			except (KeyboardInterrupt):
 				logger.warn("Keyboard exception catched while generating data...")
@@ -702,12 +1134,13 @@ class DataGenerator(object):
 	#####################################
 	##     GENERATE TRAIN DATA
 	#####################################
+	@prefetched
 	def generate_data(self, batch_size=32, shuffle=True, read_crop=False, crop_size=32, balance_classes=False, class_probs={}):
 		""" Generator function reading nsamples images from disk and returning to caller """
 	
 		nb= 0
-		data_index= -1
-		data_indexes= np.arange(0,self.datasize)
+		sampler= self.get_sampler(class_probs) if (balance_classes and class_probs) else None
+		sample_reader= self.__generate_data_views(shuffle, read_crop, crop_size, nviews=1, sampler=sampler)
 		
 		logger.info("Starting data generator ...")
 
@@ -718,13 +1151,11 @@ class DataGenerator(object):
 					logger.debug("Starting new batch ...")
 
 				# - Generate random data index and read data at this index
-				data_index = (data_index + 1) % self.datasize
-				if shuffle:
-					data_index= np.random.choice(data_indexes)
+				data_index, sdata_views= next(sample_reader)
+				sdata= sdata_views[0]
 
-				logger.debug("Reading data at index %d (batch %d/%d) ..." % (data_index,nb, batch_size))
+				logger.debug("Read data at index %d (batch %d/%d) ..." % (data_index,nb, batch_size))
 				
-				sdata= self.read_data(data_index, read_crop, crop_size)
 				if sdata is None:
 					logger.warn("Failed to read source data at index %d, skip to next ..." % data_index)
 					continue
@@ -734,30 +1165,11 @@ class DataGenerator(object):
 
 				
 
-				# - Apply class rebalancing?
+				# - Get class info
 				class_id= sdata.id
 				class_name= sdata.label
 				multilabel= (isinstance(class_id, list)) and (isinstance(class_name, list))
 
-				if balance_classes and class_probs:
-					accept= True
-
-					if multilabel:
-						for item in class_name:
-							prob= class_probs[item]
-							r= random.uniform(0, 1)
-							if r<prob:
-								accept= False
-								break
-					else:
-						prob= class_probs[class_name]
-						r= random.uniform(0, 1)
-						accept= r<prob
-						
-					if not accept:
-						continue
-
-
 				# - Initialize return data
 				if nb==0:
 					inputs= np.zeros(inputs_shape, dtype=np.float32)
@@ -786,6 +1198,7 @@ class DataGenerator(object):
 
 			except (GeneratorExit):
 				logger.info("Data generator complete execution ...")
+				sample_reader.close()
 				raise
 			except (KeyboardInterrupt):
 				logger.warn("Keyboard exception catched while generating data...")
@@ -21,22 +21,29 @@ import logging
 from collections import Counter
 import json
 
+## LAZY IMPORTS
+#  NB: heavy backends are imported at first use, so that table-only tools (e.g. DataLoader on feature data) do not load them
+from .lazy_import import lazy_import, lazy_attr
+
 ## KERAS MODULES
-from tensorflow.keras.utils import to_categorical
+to_categorical= lazy_attr("tensorflow.keras.utils", "to_categorical")
 
 ## ASTROPY MODULES 
-from astropy.io import ascii
-from astropy.stats import sigma_clipped_stats
+ascii= lazy_import("astropy.io.ascii")
+sigma_clipped_stats= lazy_attr("astropy.stats", "sigma_clipped_stats")
 
 ## ADDON ML MODULES
-from sklearn.model_selection import train_test_split
-import imgaug
-from imgaug import augmenters as iaa
-from PIL import Image
+train_test_split= lazy_attr("sklearn.model_selection", "train_test_split")
+imgaug= lazy_import("imgaug")
+iaa= lazy_import("imgaug.augmenters")
+Image= lazy_import("PIL.Image")
 
 ## OPENCV
-import cv2
-cv2.setNumThreads(1) # workaround to avoid potential conflicts between TF and OpenCV multithreading (parallel_impl.cpp (240) WorkerThread 18: Can't spawn new thread: res = 11)
+def _set_cv2_threads(module):
+	""" Workaround to avoid potential conflicts between TF and OpenCV multithreading (parallel_impl.cpp (240) WorkerThread 18: Can't spawn new thread: res = 11) """
+	module.setNumThreads(1)
+
+cv2= lazy_import("cv2", on_load=_set_cv2_threads)
 
 ## PACKAGE MODULES
 from .utils import Utils
@@ -1035,7 +1042,7 @@ class DataLoader(object):
 	""" Read data from disk and provide it to the network
 
 			Arguments:
-				- datalist: Filelist (json) with input data
+				- datalist: Filelist (json) with input data or packed cutout store directory (see CutoutStore)
 				
 	"""
 	
@@ -1044,6 +1051,7 @@ class DataLoader(object):
 
 		# - Input data
 		self.datalistfile= filename
+		self.store= None
 		self.datalist= {}
 		self.datasize= 0
 		self.classids= []
@@ -1175,13 +1183,25 @@ class DataLoader(object):
 		""" Read json filelist """
 
 		# - Read data list
+		#   NB: if a packed cutout store is given, read the datalist from the store index
+		from .cutout_store import CutoutStore
 		self.datalist= {}
-		try:
-			with open(self.datalistfile) as fp:
-				self.datalist= json.load(fp)
-		except Exception as e:
-			logger.error("Failed to read data filelist %s!" % self.datalistfile)
-			return -1
+		self.store= None
+		if CutoutStore.is_store(self.datalistfile):
+			logger.info("Opening packed cutout store %s ..." % (self.datalistfile))
+			store= CutoutStore(self.datalistfile)
+			if store.open()<0:
+				logger.error("Failed to open cutout store %s!" % self.datalistfile)
+				return -1
+			self.store= store
+			self.datalist= store.datalist
+		else:
+			try:
+				with open(self.datalistfile) as fp:
+					self.datalist= json.load(fp)
+			except Exception as e:
+				logger.error("Failed to read data filelist %s!" % self.datalistfile)
+				return -1
 
 		# - Check number of channels per image
 		nchannels_set= set([len(item["filepaths"]) for item in self.datalist["data"]])
@@ -1219,7 +1239,11 @@ class DataLoader(object):
 			logger.error("Failed to set source image data %d!" % index)
 			return None
 
-		if sdata.read_imgs()<0:
+		if self.store is not None:
+			status= self.store.read_source_data(index, sdata)
+		else:
+			status= sdata.read_imgs()
+		if status<0:
 			logger.error("Failed to read source images %d!" % index)
 			return None
 
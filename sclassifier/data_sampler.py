@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+##################################################
+###          MODULE IMPORT
+##################################################
+## STANDARD MODULES
+import os
+import sys
+import time
+import datetime
+import numpy as np
+import logging
+
+##############################
+##     GLOBAL VARS
+##############################
+from sclassifier import logger
+
+
+##############################
+##     DATA SAMPLER
+##############################
+class DataSampler(object):
+	""" Draw data indexes for class rebalancing before any data is read.
+
+			Each sample is given a probability from its class label (class_probs). For multilabel samples
+			the largest probability among the sample classes is taken, e.g. with probs={"COMPACT":0.5,"EXTENDED":0.7}
+			["COMPACT"] samples are drawn less frequently than ["COMPACT","EXTENDED"] samples.
+			The resulting sample distribution is the same obtained by accepting each read sample with its probability,
+			but indexes are drawn in epochs of exactly datasize samples and no read sample is discarded.
+
+			Sampling modes:
+				- weighted: each epoch draws datasize indexes (with replacement) with probabilities proportional to sample probs
+				- stratified: each epoch contains a fixed number of samples per stratum (label or label set), proportional to
+				  the total stratum probability. Samples within a stratum are drawn without replacement from a permutation
+				  carried over epochs, so all samples of rare classes are visited. Epoch indexes are then shuffled.
+
+			Arguments:
+				- labels: list of sample labels (a list of labels for multilabel samples)
+				- class_probs: dictionary of class probabilities {label: prob}
+				- mode: sampling mode {"weighted","stratified"}
+	"""
+
+	def __init__(self, labels, class_probs, mode="weighted"):
+		""" Return a DataSampler object """
+
+		self.labels= labels
+		self.class_probs= class_probs
+		self.mode= mode
+		self.datasize= len(labels)
+
+		# - Compute sample probs
+		self.probs= self.get_sample_probs(labels, class_probs)
+		self.weights= None
+		self.strata= []
+		self.stratum_counts= []
+		self.perms= []
+		self.cursors= []
+
+		psum= np.sum(self.probs)
+		if psum>0:
+			self.weights= self.probs/psum
+			self.__init_strata()
+		else:
+			logger.warn("All samples have zero probability with given class probs, sampling disabled!")
+
+	#############################
+	##     SAMPLE PROBS
+	#############################
+	@classmethod
+	def get_sample_probs(cls, labels, class_probs):
+		""" Return the probability of each sample for given class probs (largest prob among classes for multilabel samples) """
+
+		probs= np.zeros(len(labels), dtype=np.float64)
+		missing_labels= set()
+
+		for i, label in enumerate(labels):
+			items= label if isinstance(label, list) else [label]
+			prob_max= 0
+			for item in items:
+				if item not in class_probs:
+					missing_labels.add(str(item))
+					prob= 1.
+				else:
+					prob= class_probs[item]
+				if prob>prob_max:
+					prob_max= prob
+			probs[i]= prob_max
+
+		if missing_labels:
+			logger.warn("Labels %s not present in class probs, setting their prob to 1 ..." % (str(sorted(missing_labels))))
+
+		return probs
+
+	def __init_strata(self):
+		""" Group samples in strata (samples with same label or label set) and compute number of samples per stratum in each epoch """
+
+		# - Group indexes by stratum
+		strata_map= {}
+		for i, label in enumerate(self.labels):
+			if self.probs[i]<=0:
+				continue
+			key= tuple(sorted(label)) if isinstance(label, list) else label
+			if key not in strata_map:
+				strata_map[key]= []
+			strata_map[key].append(i)
+
+		self.strata= [np.array(item, dtype=np.int64) for item in strata_map.values()]
+		self.perms= [None]*len(self.strata)
+		self.cursors= [0]*len(self.strata)
+
+		# - Compute stratum counts per epoch (largest remainder rounding, so that counts sum to datasize)
+		stratum_weights= np.array([np.sum(self.weights[item]) for item in self.strata])
+		counts_exact= stratum_weights*self.datasize
+		counts= np.floor(counts_exact).astype(np.int64)
+		nleft= self.datasize - np.sum(counts)
+		if nleft>0:
+			order= np.argsort(counts_exact-counts)[::-1]
+			counts[order[:nleft]]+= 1
+		self.stratum_counts= counts
+
+	#############################
+	##     GENERATE INDEXES
+	#############################
+	def generate_epoch_indexes(self, rng=np.random):
+		""" Return the data indexes of one epoch (datasize indexes) """
+
+		if self.weights is None:
+			return np.array([], dtype=np.int64)
+
+		if self.mode=="weighted":
+			return rng.choice(self.datasize, size=self.datasize, replace=True, p=self.weights)
+
+		elif self.mode=="stratified":
+			indexes= [self.__draw_from_stratum(i, n, rng) for i, n in enumerate(self.stratum_counts) if n>0]
+			indexes= np.concatenate(indexes)
+			rng.shuffle(indexes)
+			return indexes
+
+		else:
+			logger.error("Invalid/unknown sampling mode (%s) given!" % (self.mode))
+			return np.array([], dtype=np.int64)
+
+	def __draw_from_stratum(self, stratum_index, n, rng):
+		""" Draw n indexes from given stratum without replacement, continuing the stratum permutation of previous epochs """
+
+		stratum= self.strata[stratum_index]
+
+		drawn= []
+		while n>0:
+			if self.perms[stratum_index] is None or self.cursors[stratum_index]>=len(stratum):
+				self.perms[stratum_index]= rng.permutation(stratum)
+				self.cursors[stratum_index]= 0
+			cursor= self.cursors[stratum_index]
+			nsel= min(n, len(stratum)-cursor)
+			drawn.append(self.perms[stratum_index][cursor:cursor+nsel])
+			self.cursors[stratum_index]+= nsel
+			n-= nsel
+
+		return np.concatenate(drawn)
+
+	def generate_indexes(self, rng=np.random, nepochs=-1):
+		""" Generator returning data indexes epoch by epoch (endlessly if nepochs<0) """
+
+		if self.weights is None:
+			return
+
+		epoch= 0
+		while nepochs<0 or epoch<nepochs:
+			for index in self.generate_epoch_indexes(rng):
+				yield int(index)
+			epoch+= 1
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+##################################################
+###          MODULE IMPORT
+##################################################
+## STANDARD MODULES
+import os
+import sys
+import time
+import numpy as np
+import logging
+
+## ADDON MODULES
+import faiss
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+
+## PACKAGE MODULES
+from .faiss_utils import search_index_chunked, create_index, set_index_search_params
+from .faiss_utils import g_index_types, g_ivf_index_types
+
+##############################
+##     GLOBAL VARS
+##############################
+from sclassifier import logger
+
+
+##############################
+##     DEDUPLICATOR
+##############################
+class Deduplicator(object):
+	""" Group near-duplicate entries of a feature dataset (e.g. image embeddings) and select one representative entry per group.
+
+			A kNN graph (top-k neighbors with similarity above score_thr) is computed with faiss, searching the data in blocks
+			(see faiss_utils.search_index_chunked), and stored as a sparse matrix. Groups are the connected components of the graph.
+			Representative rules:
+				- first: entry with lowest row index
+				- medoid: entry with highest mean cosine similarity to the group members (lowest distance to group centroid with l2 metric)
+				- quality: entry with highest quality value (e.g. image SNR) given in input
+	"""
+
+	def __init__(self, k=64, score_thr=0.6, metric="cossim", rep_rule="medoid", index_type="flat", nlist=256, M=8, nprobe=10, ntrain_max=100000, chunk_size=65536, nthreads=1, seed=1):
+		""" Return a Deduplicator object """
+
+		# - Similarity search options
+		self.k= k
+		self.score_thr= score_thr # min cosine similarity (cossim) or max L2 squared distance (l2) of duplicates
+		self.metric= metric # {"cossim","l2"}
+		self.index_type= index_type
+		self.nlist= nlist
+		self.M= M
+		self.nprobe= nprobe
+		self.ntrain_max= ntrain_max
+		self.chunk_size= chunk_size
+		self.nthreads= nthreads
+		self.seed= seed
+
+		# - Representative selection options
+		self.rep_rule= rep_rule # {"first","medoid","quality"}
+
+		# - Outputs
+		self.data= None # search data (L2-normalized with cossim metric)
+		self.nedges= 0
+		self.ngroups= 0
+		self.labels= None # group id of each entry
+		self.group_sizes= None # number of entries in each group
+		self.representatives= None # row index of representative entry of each group
+
+	#############################
+	##     BUILD GRAPH
+	#############################
+	def build_graph(self, data):
+		""" Compute kNN graph of input data (N, nfeats). Returns CSR graph (indptr, indices, scores) or None on failure """
+
+		if data.ndim!=2 or data.shape[0]==0:
+			logger.error("Input data must be a non-empty 2D array!")
+			return None
+
+		N, nfeats= data.shape
+		self.data= np.array(data, dtype=np.float32, order='C', copy=True)
+
+		# - Create index
+		index_type= self.index_type
+		if self.metric=="cossim":
+			faiss.normalize_L2(self.data)
+			if index_type not in g_index_types:
+				logger.error("Invalid/unknown index type (%s) given!" % (index_type))
+				return None
+			if index_type in g_ivf_index_types and N<max(self.nlist, 256):
+				logger.warn("Too few data (%d) to train %s index (nlist=%d), using flat index ..." % (N, index_type, self.nlist))
+				index_type= "flat"
+			index= create_index(index_type, nfeats, self.nlist, self.M)
+			if index is None:
+				return None
+			distance= False
+
+		elif self.metric=="l2":
+			if index_type!="flat":
+				logger.warn("Only flat index is supported with l2 metric, using it ...")
+				index_type= "flat"
+			index= faiss.IndexIDMap2(faiss.IndexFlatL2(nfeats))
+			distance= True
+
+		else:
+			logger.error("Invalid/unknown metric (%s) given!" % (self.metric))
+			return None
+
+		# - Train & fill index
+		try:
+			if not index.is_trained:
+				rng= np.random.RandomState(self.seed)
+				train_indexes= np.arange(N) if N<=self.ntrain_max else np.sort(rng.choice(N, self.ntrain_max, replace=False))
+				logger.info("Training %s index on #%d samples ..." % (index_type, len(train_indexes)))
+				index.train(self.data[train_indexes])
+			index.add_with_ids(self.data, np.arange(N, dtype=np.int64))
+		except Exception as e:
+			logger.error("Failed to build index (err=%s)!" % (str(e)))
+			return None
+
+		set_index_search_params(index, index_type, nprobe=self.nprobe)
+		logger.info("Created %s index (ntotal=%d) ..." % (index_type, index.ntotal))
+
+		# - Search data against itself (self-matches excluded)
+		logger.info("Running similarity search (k=%d, chunk_size=%d, nthreads=%d) ..." % (self.k, self.chunk_size, self.nthreads))
+		t0= time.time()
+		graph= search_index_chunked(
+			index, self.data, self.k, self.score_thr,
+			exclude_ids=np.arange(N),
+			distance=distance,
+			chunk_size=self.chunk_size,
+			nthreads=self.nthreads
+		)
+		logger.info("Similarity search completed in %.1f s ..." % (time.time()-t0))
+
+		return graph
+
+	#############################
+	##     FIND GROUPS
+	#############################
+	def find_groups(self, graph):
+		""" Find groups of duplicates as connected components of the kNN graph. Returns (ngroups, labels) """
+
+		indptr, indices, scores= graph
+		N= len(indptr)-1
+
+		# - NB: use a unit-weight adjacency matrix, as zero scores (identical entries with l2 metric) are valid edges
+		adj= csr_matrix((np.ones(len(indices), dtype=np.int8), indices, indptr), shape=(N, N))
+		ngroups, labels= connected_components(adj, directed=False)
+
+		return ngroups, labels
+
+	#############################
+	##     SELECT REPRESENTATIVES
+	#############################
+	def __compute_medoid_scores(self, labels, ngroups):
+		""" Return mean similarity of each entry to its group members (minus distance to group centroid with l2 metric) """
+
+		N, nfeats= self.data.shape
+
+		# - Compute group vector sums
+		membership= csr_matrix((np.ones(N, dtype=np.float32), (labels, np.arange(N))), shape=(ngroups, N))
+		group_sums= np.asarray(membership.dot(self.data))
+
+		# - Compute scores in blocks of rows
+		#   NB: mean_j(x_i.x_j) = x_i.mean_j(x_j), so the mean similarity of an entry to the group members is its dot product with the group centroid
+		sizes= np.bincount(labels, minlength=ngroups).astype(np.float32)
+		centroids= group_sums/sizes[:, None]
+		scores= np.zeros(N, dtype=np.float32)
+
+		for start in range(0, N, self.chunk_size):
+			stop= min(start+self.chunk_size, N)
+			x= self.data[start:stop]
+			c= centroids[labels[start:stop]]
+			if self.metric=="cossim":
+				scores[start:stop]= np.einsum('ij,ij->i', x, c)
+			else:
+				scores[start:stop]= -np.einsum('ij,ij->i', x-c, x-c)
+
+		return scores
+
+	def select_representatives(self, labels, ngroups, quality=None):
+		""" Return row index of representative entry of each group according to rep_rule, or None on failure """
+
+		N= len(labels)
+
+		# - Compute ranking score (representative=max score in group)
+		if self.rep_rule=="first":
+			rank= -np.arange(N, dtype=np.float64)
+
+		elif self.rep_rule=="medoid":
+			if self.data is None:
+				logger.error("No search data available to compute group medoids (build graph first)!")
+				return None
+			rank= self.__compute_medoid_scores(labels, ngroups)
+
+		elif self.rep_rule=="quality":
+			if quality is None or len(quality)!=N:
+				logger.error("Quality values (one per entry) are required by quality rule!")
+				return None
+			rank= np.nan_to_num(np.asarray(quality, dtype=np.float64), nan=-np.inf)
+
+		else:
+			logger.error("Invalid/unknown representative rule (%s) given!" % (self.rep_rule))
+			return None
+
+		# - Sort by group, decreasing rank and row index, and take first entry of each group
+		order= np.lexsort((np.arange(N), -rank, labels))
+		labels_sorted= labels[order]
+		is_first= np.ones(N, dtype=bool)
+		is_first[1:]= labels_sorted[1:]!=labels_sorted[:-1]
+
+		representatives= np.zeros(ngroups, dtype=np.int64)
+		representatives[labels_sorted[is_first]]= order[is_first]
+
+		return representatives
+
+	#############################
+	##     RUN
+	#############################
+	def run(self, data, quality=None):
+		""" Find groups of duplicates in input data (N, nfeats) and select their representatives """
+
+		# - Build kNN graph
+		graph= self.build_graph(data)
+		if graph is None:
+			logger.error("Failed to build similarity graph!")
+			return -1
+
+		N= data.shape[0]
+		self.nedges= len(graph[1])
+
+		# - Find groups
+		self.ngroups, self.labels= self.find_groups(graph)
+		self.group_sizes= np.bincount(self.labels, minlength=self.ngroups)
+		logger.info("#nodes=%d, #edges=%d, #groups=%d (#%d with duplicates, max size=%d)" % (N, self.nedges, self.ngroups, np.count_nonzero(self.group_sizes>1), self.group_sizes.max()))
+
+		# - Select representatives
+		self.representatives= self.select_representatives(self.labels, self.ngroups, quality)
+		if self.representatives is None:
+			logger.error("Failed to select group representatives!")
+			return -1
+
+		return 0
+
+	#############################
+	##     OUTPUTS
+	#############################
+	def get_selected_indices(self):
+		""" Return sorted row indices of group representatives """
+		return np.sort(self.representatives)
+
+	def get_groups(self, min_size=2):
+		""" Return list of group members (row indices, representative first) for groups with at least min_size entries """
+
+		order= np.argsort(self.labels, kind='stable')
+		offsets= np.concatenate(([0], np.cumsum(self.group_sizes)))
+
+		groups= []
+		for gid in np.flatnonzero(self.group_sizes>=min_size):
+			members= order[offsets[gid]:offsets[gid+1]]
+			rep= self.representatives[gid]
+			groups.append(np.concatenate(([rep], members[members!=rep])))
+
+		return groups
@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+##################################################
+###          MODULE IMPORT
+##################################################
+## STANDARD MODULES
+import os
+import sys
+import time
+import datetime
+import numpy as np
+import logging
+import json
+import shutil
+
+## MODULES
+from sclassifier.utils import Utils
+
+##############################
+##     GLOBAL VARS
+##############################
+from sclassifier import logger
+
+
+##############################
+##     ARGS
+##############################
+def add_stream_embeddings_args(parser):
+	""" Add embedding streaming options (stream_embeddings, embeddings_chunk_size, resume_embeddings) to an argparse parser """
+
+	parser.add_argument('--stream_embeddings', dest='stream_embeddings', action='store_true',help='Write embeddings to file in chunks as they are predicted, allowing to resume interrupted runs (default=false)')	
+	parser.set_defaults(stream_embeddings=False)
+	parser.add_argument('-embeddings_chunk_size', '--embeddings_chunk_size', dest='embeddings_chunk_size', required=False, type=int, default=10000, action='store',help='Number of embedding rows written per chunk in streaming mode (default=10000)')
+	parser.add_argument('--resume_embeddings', dest='resume_embeddings', action='store_true',help='Resume streaming of embeddings from last completed chunk of a previous run (default=false)')	
+	parser.set_defaults(resume_embeddings=False)
+
+	return parser
+
+
+##############################
+##     EMBEDDING WRITER
+##############################
+class EmbeddingWriter(object):
+	""" Streaming writer of embedding (feature) tables. Format: sname z1 ... zN id
+
+			Rows are buffered and written to disk in chunks of chunk_size rows, so that memory stays bounded.
+			After each chunk a progress file (outfile + ".progress") is updated with the index of the next data
+			sample to be processed, so that an interrupted run can be resumed from the last completed chunk.
+			Ascii outputs are appended chunk by chunk to the output file. Binary outputs (.npz) are written as
+			chunk files in a temporary directory (outfile + ".chunks") and merged in the output file at close.
+
+			Arguments:
+				- outfile: output file
+				- chunk_size: number of rows per chunk
+	"""
+
+	def __init__(self, outfile, chunk_size=10000):
+		""" Return an EmbeddingWriter object """
+
+		self.outfile= outfile
+		self.chunk_size= chunk_size
+		self.binary= Utils.is_binary_table_file(outfile)
+		self.progressfile= outfile + ".progress"
+		self.chunkdir= outfile + ".chunks"
+
+		# - Progress info
+		self.datasize= 0
+		self.next_index= 0
+		self.nrows= 0
+		self.nchunks= 0
+		self.filesize= 0
+
+		# - Row buffer
+		self.buf_data= []
+		self.buf_snames= []
+		self.buf_ids= []
+		self.buf_next_index= 0
+
+	#############################
+	##     OPEN
+	#############################
+	def open(self, datasize, resume=False):
+		""" Open writer for a dataset of given size. If resume is true, restart from last completed chunk (if any).
+				Returns the index of the first data sample to be processed or -1 on failure.
+		"""
+
+		self.datasize= datasize
+
+		# - Resume from progress file?
+		if resume and os.path.isfile(self.progressfile):
+			if self.__read_progress()==0:
+				logger.info("Resuming embedding writing to file %s from data index %d (#%d rows in #%d chunks already written) ..." % (self.outfile, self.next_index, self.nrows, self.nchunks))
+				return self.next_index
+			logger.warn("Cannot resume from progress file %s, restarting from scratch ..." % (self.progressfile))
+
+		# - Start from scratch, removing previous outputs
+		self.next_index= 0
+		self.nrows= 0
+		self.nchunks= 0
+		self.filesize= 0
+
+		try:
+			for filename in [self.outfile, self.progressfile]:
+				if os.path.isfile(filename):
+					os.remove(filename)
+			if os.path.isdir(self.chunkdir):
+				shutil.rmtree(self.chunkdir)
+			if self.binary:
+				os.makedirs(self.chunkdir)
+		except Exception as e:
+			logger.error("Failed to prepare output files for embedding writer (err=%s)!" % (str(e)))
+			return -1
+
+		return 0
+
+	def __read_progress(self):
+		""" Read progress file and restore output file to last completed chunk """
+
+		try:
+			with open(self.progressfile, 'r') as fp:
+				progress= json.load(fp)
+		except Exception as e:
+			logger.warn("Failed to read progress file %s (err=%s)!" % (self.progressfile, str(e)))
+			return -1
+
+		if progress.get("datasize")!=self.datasize or progress.get("chunk_size")!=self.chunk_size:
+			logger.warn("Progress file %s refers to a different dataset size or chunk size!" % (self.progressfile))
+			return -1
+
+		self.next_index= progress["next_index"]
+		self.nrows= progress["nrows"]
+		self.nchunks= progress["nchunks"]
+		self.filesize= progress["filesize"]
+
+		# - Drop rows written after last checkpoint
+		try:
+			if self.binary:
+				if not os.path.isdir(self.chunkdir):
+					os.makedirs(self.chunkdir)
+				for filename in os.listdir(self.chunkdir):
+					if filename.startswith("chunk_") and int(filename[6:12])>=self.nchunks:
+						os.remove(os.path.join(self.chunkdir, filename))
+			elif os.path.isfile(self.outfile):
+				with open(self.outfile, 'r+') as fp:
+					fp.truncate(self.filesize)
+			elif self.filesize>0:
+				logger.warn("Output file %s is missing!" % (self.outfile))
+				return -1
+		except Exception as e:
+			logger.warn("Failed to restore output file %s to last checkpoint (err=%s)!" % (self.outfile, str(e)))
+			return -1
+
+		return 0
+
+	def __write_progress(self):
+		""" Write progress file (atomically) """
+
+		progress= {
+			"outfile": self.outfile,
+			"datasize": self.datasize,
+			"chunk_size": self.chunk_size,
+			"next_index": self.next_index,
+			"nrows": self.nrows,
+			"nchunks": self.nchunks,
+			"filesize": self.filesize
+		}
+
+		progressfile_tmp= self.progressfile + ".tmp"
+		with open(progressfile_tmp, 'w') as fp:
+			json.dump(progress, fp)
+		os.replace(progressfile_tmp, self.progressfile)
+
+	#############################
+	##     WRITE
+	#############################
+	def add(self, data, snames, classids, next_index):
+		""" Add rows to writer. next_index is the index of the next data sample to be processed after these rows """
+
+		self.buf_data.append(np.asarray(data))
+		self.buf_snames.extend(snames)
+		self.buf_ids.extend(classids)
+		self.buf_next_index= next_index
+
+		if len(self.buf_snames)>=self.chunk_size:
+			return self.flush()
+
+		return 0
+
+	def flush(self):
+		""" Write buffered rows as a new chunk and update progress """
+
+		if not self.buf_snames:
+			return 0
+
+		data= np.concatenate(self.buf_data, axis=0)
+		N= data.shape[0]
+		nvars= data.shape[1]
+
+		try:
+			if self.binary:
+				chunkfile= os.path.join(self.chunkdir, "chunk_%06d.npz" % (self.nchunks))
+				if Utils.write_feature_data(chunkfile, data, self.buf_snames, self.buf_ids)<0:
+					return -1
+			else:
+				# - Append rows to ascii file (header written with first chunk)
+				head= ""
+				if self.nrows==0:
+					head= "# sname " + " ".join(["z" + str(i+1) for i in range(nvars)]) + " id"
+				rows= np.concatenate(
+					(np.array(self.buf_snames).reshape(N,1), data, np.array(self.buf_ids).reshape(N,1)),
+					axis=1
+				)
+				Utils.write_ascii(rows, self.outfile, head, mode='at')
+				self.filesize= os.path.getsize(self.outfile)
+
+		except Exception as e:
+			logger.error("Failed to write embedding chunk no. %d (err=%s)!" % (self.nchunks, str(e)))
+			return -1
+
+		# - Update progress
+		self.nrows+= N
+		self.nchunks+= 1
+		self.next_index= self.buf_next_index
+		self.__write_progress()
+
+		logger.info("Embedding chunk no. %d written (#%d rows written, next data index=%d/%d) ..." % (self.nchunks, self.nrows, self.next_index, self.datasize))
+
+		self.buf_data= []
+		self.buf_snames= []
+		self.buf_ids= []
+
+		return 0
+
+	#############################
+	##     CLOSE
+	#############################
+	def close(self):
+		""" Write remaining rows, finalize output file and remove progress info """
+
+		if self.flush()<0:
+			return -1
+
+		if self.nrows<=0:
+			logger.warn("No embedding rows written to file %s!" % (self.outfile))
+
+		# - Merge binary chunks in output file
+		#   NB: data are merged in a memory-mapped array, streamed to the output file
+		if self.binary and self.nrows>0:
+			if self.__merge_chunks()<0:
+				logger.error("Failed to merge embedding chunks in file %s!" % (self.outfile))
+				return -1
+
+		# - Remove progress info
+		if os.path.isfile(self.progressfile):
+			os.remove(self.progressfile)
+		if os.path.isdir(self.chunkdir):
+			shutil.rmtree(self.chunkdir)
+
+		return 0
+
+	def __merge_chunks(self):
+		""" Merge binary chunk files in output file """
+
+		data= None
+		snames= []
+		classids= []
+		colnames= []
+		offset= 0
+
+		for i in range(self.nchunks):
+			chunkfile= os.path.join(self.chunkdir, "chunk_%06d.npz" % (i))
+			ret= Utils.read_binary_feature_data(chunkfile)
+			if not ret:
+				return -1
+			chunk_data, chunk_snames, chunk_ids, colnames= ret
+			if data is None:
+				datafile= os.path.join(self.chunkdir, "data.npy")
+				data= np.lib.format.open_memmap(datafile, mode='w+', dtype=np.float32, shape=(self.nrows, chunk_data.shape[1]))
+			data[offset:offset+chunk_data.shape[0]]= chunk_data
+			offset+= chunk_data.shape[0]
+			snames.extend(chunk_snames)
+			classids.extend(chunk_ids)
+
+		data.flush()
+		status= Utils.write_feature_data(self.outfile, data, snames, classids, colnames)
+		del data
+
+		return status
+
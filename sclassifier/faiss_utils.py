@@ -13,6 +13,7 @@ import string
 import time
 import signal
 from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
 import datetime
 import numpy as np
 import random
@@ -41,6 +42,171 @@ from .utils import NoIndent, MyEncoder
 ##############################
 from sclassifier import logger
 
+# - Index types supported by the index factory helpers
+g_index_types= ["flat", "ivfflat", "ivfpq", "opq_ivfpq", "hnsw"]
+g_ivf_index_types= ["ivfflat", "ivfpq", "opq_ivfpq"]
+g_pq_index_types= ["ivfpq", "opq_ivfpq"]
+
+
+###################################
+##   INDEX FACTORY
+###################################
+def get_index_factory_key(index_type, nlist=256, M=8, hnsw_m=32):
+	""" Return the faiss index_factory key of given index type {flat,ivfflat,ivfpq,opq_ivfpq,hnsw} or None if unknown.
+			Flat and HNSW indexes are wrapped in an IDMap2, so that all index types support add_with_ids.
+	"""
+	keys= {
+		"flat": "IDMap2,Flat",
+		"ivfflat": "IVF%d,Flat" % (nlist),
+		"ivfpq": "IVF%d,PQ%d" % (nlist, M),
+		"opq_ivfpq": "OPQ%d,IVF%d,PQ%d" % (M, nlist, M),
+		"hnsw": "IDMap2,HNSW%d" % (hnsw_m)
+	}
+	return keys.get(index_type, None)
+
+
+def create_index(index_type, nfeats, nlist=256, M=8, hnsw_m=32):
+	""" Create an (untrained) inner product index of given type with the faiss index factory. Returns None on failure """
+
+	key= get_index_factory_key(index_type, nlist, M, hnsw_m)
+	if key is None:
+		logger.error("Invalid/unknown index type (%s) given!" % (index_type))
+		return None
+
+	try:
+		index= faiss.index_factory(nfeats, key, faiss.METRIC_INNER_PRODUCT)
+	except Exception as e:
+		logger.error("Failed to create index %s (err=%s)!" % (key, str(e)))
+		return None
+
+	return index
+
+
+def set_index_search_params(index, index_type, nprobe=10, efsearch=64):
+	""" Set search-time parameters of given index: number of visited clusters (nprobe) for IVF indexes, efSearch for HNSW indexes """
+
+	ps= faiss.ParameterSpace()
+	if index_type in g_ivf_index_types:
+		ps.set_index_parameter(index, "nprobe", nprobe)
+	elif index_type=="hnsw":
+		ps.set_index_parameter(index, "efSearch", efsearch)
+
+
+###################################
+##   CHUNKED SEARCH ENGINE
+###################################
+def search_index_chunked(
+	index,
+	queries: np.ndarray,
+	k: int = 10,
+	threshold: float = 0.0,
+	exclude_ids: np.ndarray = None,
+	strict: bool = True,
+	distance: bool = False,
+	chunk_size: int = 65536,
+	nthreads: int = 1
+):
+	"""
+	Search query vectors against a Faiss index in blocks of chunk_size rows and return the top-k neighbors 
+	of each query as a CSR-style sparse graph. Self-exclusion, threshold and top-k filtering are applied vectorised per block,
+	so that only the (N, k+1) search output of the blocks being processed is kept in memory.
+
+	Parameters
+	----------
+	index : faiss.Index
+		Index with inner product metric filled with L2-normalized vectors (or with L2 metric, see distance option).
+	queries : np.ndarray
+		Shape (N, D). L2-normalized float32 query vectors.
+	k : int, optional
+		The maximum number of neighbors to retrieve for each query.
+	threshold : float, optional
+		The cosine similarity threshold for including neighbors.
+	exclude_ids : np.ndarray, optional
+		Shape (N,). Index id to be excluded from the results of each query (e.g. the query itself, -1=none). 
+		If given, a top-(k+1) search is done.
+	strict : bool, optional
+		If True neighbors must have score>threshold, otherwise score>=threshold.
+	distance : bool, optional
+		If True scores are distances (e.g. L2 index, sorted in ascending order) and neighbors must have score<threshold (or <=).
+	chunk_size : int, optional
+		The number of queries searched per block.
+	nthreads : int, optional
+		The number of blocks searched in parallel threads (Faiss releases the GIL during search). 
+		NB: each search call is also parallelized internally by Faiss (OpenMP).
+
+	Returns
+	-------
+	indptr : np.ndarray
+		Shape (N+1,). Neighbors of query i are stored in indices[indptr[i]:indptr[i+1]].
+	indices : np.ndarray
+		Index ids of the neighbors, sorted in descending order of similarity within each query.
+	scores : np.ndarray
+		Corresponding cosine similarity scores.
+	"""
+
+	N= queries.shape[0]
+	nsearch= k+1 if exclude_ids is not None else k
+	chunk_size= max(1, int(chunk_size))
+	if exclude_ids is not None:
+		exclude_ids= np.asarray(exclude_ids, dtype=np.int64)
+
+	# - Use int32 ids when possible to halve the graph size
+	id_dtype= np.int32 if index.ntotal<np.iinfo(np.int32).max else np.int64
+
+	def search_chunk(start):
+		stop= min(start+chunk_size, N)
+
+		# 1) Search block
+		distances, indices= index.search(queries[start:stop], nsearch)
+
+		# 2) Filter padded results, threshold and excluded ids
+		if distance:
+			mask= (indices>=0) & ((distances<threshold) if strict else (distances<=threshold))
+		else:
+			mask= (indices>=0) & ((distances>threshold) if strict else (distances>=threshold))
+		if exclude_ids is not None:
+			mask&= (indices!=exclude_ids[start:stop, None])
+
+		# 3) Keep only the first k valid neighbors (results are sorted from most to least similar)
+		mask&= (np.cumsum(mask, axis=1)<=k)
+
+		# NB: boolean masking is done in row-major order, so neighbors stay grouped by query
+		return mask.sum(axis=1), indices[mask].astype(id_dtype), distances[mask].astype(np.float32)
+
+	# - Search blocks
+	starts= range(0, N, chunk_size)
+	if nthreads>1 and N>chunk_size:
+		with ThreadPoolExecutor(max_workers=nthreads) as executor:
+			results= list(executor.map(search_chunk, starts))
+	else:
+		results= [search_chunk(start) for start in starts]
+
+	# - Build CSR arrays
+	indptr= np.zeros(N+1, dtype=np.int64)
+	if not results:
+		return indptr, np.zeros(0, dtype=id_dtype), np.zeros(0, dtype=np.float32)
+
+	np.cumsum(np.concatenate([item[0] for item in results]), out=indptr[1:])
+	indices= np.concatenate([item[1] for item in results])
+	scores= np.concatenate([item[2] for item in results])
+
+	return indptr, indices, scores
+
+
+def graph_to_lists(indptr, indices, scores):
+	""" Convert a CSR neighbor graph into lists of per-row neighbor indices and scores (array views) """
+	return np.split(indices, indptr[1:-1]), np.split(scores, indptr[1:-1])
+
+
+def graph_to_sparse_matrix(indptr, indices, scores, N=None):
+	""" Return a CSR neighbor graph as a scipy sparse matrix of shape (N, N) with similarity scores as values """
+	from scipy.sparse import csr_matrix
+
+	nrows= len(indptr)-1
+	if N is None:
+		N= nrows
+	return csr_matrix((scores, indices, indptr), shape=(nrows, N))
+
 
 ###################################
 ##   EXTRACT TOP-K SIMILAR DATA  ##
@@ -52,26 +218,35 @@ def get_top_k_similar_within_data(
 	large_data_thr: int = 1000000,
 	nlist: int = 100,
 	M: int = 8,
-	nprobe: int = 10
+	nprobe: int = 10,
+	chunk_size: int = 65536,
+	nthreads: int = 1,
+	return_graph: bool = False
 ):
-	""" Return top_k similar entries above a threshold within a data array. If data size larger than large_data_thr an approximate computation is used. """
+	""" Return top_k similar entries above a threshold within a data array. If data size larger than large_data_thr an approximate computation is used. 
+			If return_graph is True, results are returned as a CSR neighbor graph (indptr, indices, scores) rather than lists of arrays.
+	"""
 	
 	N, Nfeat = data.shape
 	if N>large_data_thr:
 		logger.info("Using approximate similarity search with IndexIVFPQ faiss index ...")
-		return get_approx_top_k_similar_within_data(data, k, threshold, nlist, M, nprobe)
+		return get_approx_top_k_similar_within_data(data, k, threshold, nlist, M, nprobe, chunk_size, nthreads, return_graph)
 	else:
-		return get_exact_top_k_similar_within_data(data, k, threshold)
+		return get_exact_top_k_similar_within_data(data, k, threshold, chunk_size, nthreads, return_graph)
 	
 
 def get_exact_top_k_similar_within_data(
 	data: np.ndarray, 
 	k: int = 10, 
-	threshold: float = 0.0
+	threshold: float = 0.0,
+	chunk_size: int = 65536,
+	nthreads: int = 1,
+	return_graph: bool = False
 ):
 	"""
 	For each observation in 'data', find the top-k most similar observations 
 	(rows) in 'data' itself based on cosine similarity that are above a configurable threshold.
+	Queries are searched in blocks of chunk_size rows (see search_index_chunked).
 
 	Parameters
 	----------
@@ -81,14 +256,15 @@ def get_exact_top_k_similar_within_data(
 		The number of neighbors to retrieve for each observation, excluding itself.
 	threshold : float, optional
 		The cosine similarity threshold for including neighbors.
+	chunk_size : int, optional
+		The number of rows searched per block.
+	nthreads : int, optional
+		The number of blocks searched in parallel threads.
+	return_graph : bool, optional
+		If True return the CSR neighbor graph (indptr, indices, scores) instead of lists.
 
 	Returns
 	-------
-	neighbors_indices : np.ndarray
-		Shape (N, k). neighbors_indices[i, :] gives the row indices of the top-k neighbors for the i-th row in the original data, excluding the row itself.
-	neighbors_scores : np.ndarray
-		Shape (N, k). neighbors_scores[i, :] gives the cosine similarity scores for those top-k neighbors.
-		
 	neighbors_indices_list : list of np.ndarray
 		List of length N. neighbors_indices_list[i] is an array of row indices for neighbors of row i that pass the threshold, truncated to length <= k.
 	neighbors_scores_list : list of np.ndarray
@@ -111,37 +287,19 @@ def get_exact_top_k_similar_within_data(
 	# 3) Add normalized data to the index
 	index.add(data_norm)
 
-	# 4) Search the entire dataset against itself
+	# 4) Search the entire dataset against itself in blocks
 	#    We'll do a top- (k+1) search because the self-match (row i matching row i)
 	#    will always have similarity = 1.0 and we want to exclude that.
-	distances, indices = index.search(data_norm, k + 1)
-	# distances: shape (N, k+1)
-	# indices:   shape (N, k+1)
-	
-	neighbors_indices_list = []
-	neighbors_scores_list = []
-    
-	for i in range(N):
-		# distances[i], indices[i] hold the top-(k+1) neighbors for row i, 
-		# sorted descending by similarity
-		row_indices = indices[i]
-		row_scores  = distances[i]
-
-		# Exclude the row itself (self-match), and filter by threshold
-		mask = (row_indices != i) & (row_scores > threshold)
-
-		valid_indices = row_indices[mask]
-		valid_scores  = row_scores[mask]
-
-		# Now keep only the top k from these valid neighbors
-		# (They are already sorted by similarity in descending order)
-		top_k_indices = valid_indices[:k]
-		top_k_scores  = valid_scores[:k]
-
-		neighbors_indices_list.append(top_k_indices)
-		neighbors_scores_list.append(top_k_scores)
-
-	return neighbors_indices_list, neighbors_scores_list
+	graph = search_index_chunked(
+		index, data_norm, k, threshold, 
+		exclude_ids=np.arange(N), 
+		chunk_size=chunk_size, 
+		nthreads=nthreads
+	)
+	if return_graph:
+		return graph
+
+	return graph_to_lists(*graph)
     
 
 # - Use this version for very large data
@@ -151,12 +309,16 @@ def get_approx_top_k_similar_within_data(
 	threshold: float = 0.8,
 	nlist: int = 100,
 	M: int = 8,
-	nprobe: int = 10
+	nprobe: int = 10,
+	chunk_size: int = 65536,
+	nthreads: int = 1,
+	return_graph: bool = False
 ):
 	"""
 	For each row in 'data', return up to k most similar observations 
 	whose cosine similarity is above 'threshold', using a Faiss IndexIVFPQ 
 	for approximate nearest neighbor search (Inner Product metric).
+	Queries are searched in blocks of chunk_size rows (see search_index_chunked).
 
 	Parameters
 	----------
@@ -172,6 +334,12 @@ def get_approx_top_k_similar_within_data(
 		The number of sub-quantizers in Product Quantization.
 	nprobe : int, optional
 		The number of clusters to visit during search. Larger nprobe = better recall but slower.
+	chunk_size : int, optional
+		The number of rows searched per block.
+	nthreads : int, optional
+		The number of blocks searched in parallel threads.
+	return_graph : bool, optional
+		If True return the CSR neighbor graph (indptr, indices, scores) instead of lists.
 
 	Returns
 	-------
@@ -211,32 +379,18 @@ def get_approx_top_k_similar_within_data(
 	# 6) Set the number of lists to probe. Higher nprobe => better recall but slower search
 	index.nprobe = nprobe
 
-	# 7) We'll do a top-(k+1) search for each row as a query 
+	# 7) We'll do a top-(k+1) search for each row as a query, in blocks
 	#    Because each row will find itself as the top match with similarity=1
-	#    shape: (N, k+1)
-	distances, indices = index.search(data_norm, k + 1)
-
-	neighbors_indices_list = []
-	neighbors_scores_list = []
-
-	for i in range(N):
-		row_indices = indices[i]
-		row_scores = distances[i]
-
-		# Exclude the row itself and filter by threshold
-		mask = (row_indices != i) & (row_scores > threshold)
-		valid_indices = row_indices[mask]
-		valid_scores = row_scores[mask]
-
-		# Keep only top k among the valid neighbors
-		# (They should already be in descending order of similarity)
-		top_k_indices = valid_indices[:k]
-		top_k_scores = valid_scores[:k]
-
-		neighbors_indices_list.append(top_k_indices)
-		neighbors_scores_list.append(top_k_scores)
-
-	return neighbors_indices_list, neighbors_scores_list
+	graph = search_index_chunked(
+		index, data_norm, k, threshold, 
+		exclude_ids=np.arange(N), 
+		chunk_size=chunk_size, 
+		nthreads=nthreads
+	)
+	if return_graph:
+		return graph
+
+	return graph_to_lists(*graph)
 	
 
 
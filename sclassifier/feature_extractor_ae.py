@@ -84,6 +84,10 @@ matplotlib.use('Agg')
 from .utils import Utils
 from .data_loader import DataLoader
 from .data_loader import SourceData
+from .tf_dataset import TFDatasetBuilder
+from .tf_utils import predict_in_batches, stream_embeddings_to_file, make_gradient_accumulation_model
+from .tf_utils import masked_chan_min_max, get_compile_options
+from .tf_distribute import get_num_workers, is_chief, distribute_data
 
 
 
@@ -255,6 +259,7 @@ class ChanNormalization(layers.Layer):
 	def __init__(self, norm_min=0., norm_max=1., name=None, **kwargs):
 		self.norm_min = norm_min
 		self.norm_max = norm_max
+		kwargs.setdefault('dtype', 'float32') # always compute in float32 (also with mixed precision)
 		super(ChanNormalization, self).__init__(name=name, **kwargs)
 
 	def build(self, input_shape):
@@ -284,8 +289,7 @@ class ChanNormalization(layers.Layer):
 		#data_min= tf.reduce_min(mask, axis=(1,2)) ## NB: WRONG not providing correct results with ragged tensor, don't use!!!
 		#data_max= tf.reduce_max(mask, axis=(1,2)) ## NB: WRONG not providing correct results with ragged tensor, don't use!!!
 
-		data_min= tf.reduce_min(tf.where(~cond, tf.ones_like(data) * 1.e+99, data), axis=(1,2))
-		data_max= tf.reduce_max(tf.where(~cond, tf.ones_like(data) * -1.e+99, data), axis=(1,2))
+		data_min, data_max= masked_chan_min_max(data, cond)
 		data_min= tf.expand_dims(tf.expand_dims(data_min, axis=1),axis=1)
 		data_max= tf.expand_dims(tf.expand_dims(data_max, axis=1),axis=1)
 		
@@ -359,6 +363,7 @@ class ChanDeNormalization(layers.Layer):
 	def __init__(self, norm_min=0., norm_max=1., name=None, **kwargs):
 		self.norm_min = norm_min
 		self.norm_max = norm_max
+		kwargs.setdefault('dtype', 'float32') # always compute in float32 (also with mixed precision)
 		super(ChanDeNormalization, self).__init__(name=name, **kwargs)
 
 	def build(self, input_shape):
@@ -381,8 +386,7 @@ class ChanDeNormalization(layers.Layer):
 
 		# - Compute input data min & max, excluding NANs & zeros
 		cond= tf.logical_and(tf.math.is_finite(data), tf.math.not_equal(data, 0.))
-		data_min= tf.reduce_min(tf.where(~cond, tf.ones_like(data) * 1.e+99, data), axis=(1,2))
-		data_max= tf.reduce_max(tf.where(~cond, tf.ones_like(data) * -1.e+99, data), axis=(1,2))
+		data_min, data_max= masked_chan_min_max(data, cond)
 		data_min= tf.expand_dims(tf.expand_dims(data_min, axis=1), axis=1)
 		data_max= tf.expand_dims(tf.expand_dims(data_max, axis=1), axis=1)
 		
@@ -453,6 +457,10 @@ class FeatExtractorAE(object):
 		self.validation_steps= 10
 		self.use_multiprocessing= True
 		self.nworkers= 0
+		self.use_tf_data= False
+		self.tf_data_cache= False
+		self.tf_data_cachefile= ""
+		self.predict_batch_size= 32
 		
 		# *****************************
 		# ** Model
@@ -498,6 +506,9 @@ class FeatExtractorAE(object):
 		# - Training options		
 		self.nepochs= 10
 		self.batch_size= 32
+		self.grad_accum_steps= 1 # if >1, gradients are accumulated over this number of batches before each optimizer update
+		self.use_xla= False # compile train & predict steps with XLA (graph mode)
+		self.strategy= None # tf.distribute strategy for multi-worker training (models & optimizer must be created in its scope)
 		self.learning_rate= 1.e-4
 		self.optimizer_default= 'adam'
 		self.optimizer= 'adam' # 'rmsprop'
@@ -577,6 +588,11 @@ class FeatExtractorAE(object):
 		self.outfile_nnout_metrics= 'losses.dat'
 		self.outfile_encoded_data= 'latent_data.dat'
 
+		# - Streaming options for embeddings (see tf_utils.stream_embeddings_to_file)
+		self.stream_embeddings= False
+		self.embeddings_chunk_size= 10000
+		self.resume_embeddings= False
+
 	#####################################
 	##     SETTERS/GETTERS
 	#####################################
@@ -622,6 +638,14 @@ class FeatExtractorAE(object):
 	#####################################
 	##     SET TRAIN DATA
 	#####################################
+	def __create_tf_dataset_builder(self, dg, cachefile_suffix=""):
+		""" Create tf.data dataset builder for given data generator """
+		ds_builder= TFDatasetBuilder(dg)
+		ds_builder.cache= self.tf_data_cache
+		if self.tf_data_cachefile!="":
+			ds_builder.cachefile= self.tf_data_cachefile + cachefile_suffix
+		return ds_builder
+
 	def __set_data(self):
 		""" Set train data & generator from loader """
 
@@ -635,11 +659,22 @@ class FeatExtractorAE(object):
 		self.nsamples= len(self.source_labels)
 
 		# - Create train data generator
-		self.train_data_generator= self.dg.generate_cae_data(
-			batch_size=self.batch_size, 
-			shuffle=self.shuffle_train_data,
-			balance_classes=self.balance_classes, class_probs=self.class_probs
-		)
+		if self.use_tf_data:
+			logger.info("Creating train tf.data dataset ...")
+			self.train_data_generator= self.__create_tf_dataset_builder(self.dg).build_cae_dataset(
+				batch_size=self.batch_size, 
+				shuffle=self.shuffle_train_data,
+				balance_classes=self.balance_classes, class_probs=self.class_probs
+			)
+			if self.train_data_generator is None:
+				logger.error("Failed to create train tf.data dataset!")
+				return -1
+		else:
+			self.train_data_generator= self.dg.generate_cae_data(
+				batch_size=self.batch_size, 
+				shuffle=self.shuffle_train_data,
+				balance_classes=self.balance_classes, class_probs=self.class_probs
+			)
 
 		#self.train_data_generator= self.dl.data_generator(
 		#	batch_size=self.batch_size, 
@@ -677,10 +712,16 @@ class FeatExtractorAE(object):
 
 			logger.info("Loading cv data in batches? %d (batch_size_cv=%d)" % (self.load_cv_data_in_batches, batch_size_cv))
 
-			self.crossval_data_generator= self.dg_cv.generate_cae_data(
-				batch_size=batch_size_cv, 
-				shuffle=False
-			)
+			if self.use_tf_data:
+				self.crossval_data_generator= self.__create_tf_dataset_builder(self.dg_cv, cachefile_suffix="_cv").build_cae_dataset(batch_size=batch_size_cv, shuffle=False)
+				if self.crossval_data_generator is None:
+					logger.error("Failed to create validation tf.data dataset!")
+					return -1
+			else:
+				self.crossval_data_generator= self.dg_cv.generate_cae_data(
+					batch_size=batch_size_cv, 
+					shuffle=False
+				)
 
 		#self.crossval_data_generator= self.dl.data_generator(
 		#	batch_size=self.batch_size, 
@@ -701,11 +742,7 @@ class FeatExtractorAE(object):
 		logger.info("Disabling data augmentation in test data generator ...")
 		self.dg_test.disable_augmentation()
 
-		self.test_data_generator= self.dg_test.generate_cae_data(
-			#batch_size=self.nsamples,
-			batch_size=1, 
-			shuffle=False
-		)
+		# - NB: test data are read in batches by generate_inference_data when predicting encoded data
 
 		#self.test_data_generator= self.dl.data_generator(
 		#	batch_size=self.nsamples, 
@@ -720,11 +757,6 @@ class FeatExtractorAE(object):
 		#	erode=self.erode, erode_kernel=self.erode_kernel
 		#)
 
-		# - Create standard generator (for reconstruction)
-		self.data_generator= self.dg_test.generate_cae_data(
-			batch_size=1, 
-			shuffle=False
-		)
 
 		#self.data_generator= self.dl.data_generator(
 		#	batch_size=1, 
@@ -821,7 +853,7 @@ class FeatExtractorAE(object):
 		#===========================	
 		###self.cae.compile(optimizer=self.optimizer, loss=self.loss, experimental_run_tf_function=False)
 		##if not tf.executing_eagerly():
-		self.cae.compile(optimizer=self.optimizer, loss=self.loss, run_eagerly=True) ### CORRECT
+		self.cae.compile(optimizer=self.optimizer, loss=self.loss, **get_compile_options(self.use_xla)) ### CORRECT
 		#self.cae.compile(optimizer=self.optimizer, loss=self.loss)
 		#self.cae.compile(optimizer=self.optimizer, loss=self.loss, run_eagerly=False)
 		
@@ -1036,17 +1068,17 @@ class FeatExtractorAE(object):
 	###########################
 	##     LOSS DEFINITION
 	###########################	
-	#@tf.function
+	@tf.function
 	def mse_loss_fcn(self, y_true, y_pred):
 		""" MSE loss function definition used for reconstruction loss """
 		return K.mean(mse(y_true, y_pred))
 
-	#@tf.function
+	@tf.function
 	def ce_loss_fcn(self, y_true, y_pred):
 		""" Cross-Entropy loss function definition used for reconstruction loss """
 		return K.mean(binary_crossentropy(y_true, y_pred))
 	
-	#@tf.function
+	@tf.function
 	def ssim_loss_fcn(self, y_true, y_pred):
 		""" SSIM Loss function definition used for reconstruction loss """
 	
@@ -1062,14 +1094,15 @@ class FeatExtractorAE(object):
 		# - Compute ssim loss
 		dssim= 0.5*(1.0-ssim_mean_sample)
 		loss= tf.cast(dssim, tf.float32)
-		logger.info("ssim_mean_sample=%f, dssim=%f" % (ssim_mean_sample, dssim))
+		if tf.executing_eagerly():
+			logger.info("ssim_mean_sample=%f, dssim=%f" % (ssim_mean_sample, dssim))
 		tf.print("ssim_mean_sample:", ssim_mean_sample, output_stream=sys.stdout)
 		tf.print("ssim loss:", loss, output_stream=sys.stdout)
 
 		return loss
 
 
-	#@tf.function
+	@tf.function
 	def kl_loss_fcn(self):
 		""" Kullback-Leibler loss function definition used for AE latent space regularization """
 
@@ -1079,7 +1112,7 @@ class FeatExtractorAE(object):
 		return kl_loss_mean
 
 
-	#@tf.function
+	@tf.function
 	def mse_reco_loss_fcn(self, y_true, y_pred):
 		""" MSE reco loss function definition """
 
@@ -1126,35 +1159,37 @@ class FeatExtractorAE(object):
 		y_true_flattened= K.flatten(y_true)
 		y_pred_flattened= K.flatten(y_pred)
 		
-		# - Extract sub tensorwith elements that are not NAN/inf.
+		# - Select elements that are not NAN/inf.
 		#   NB: Exclude also true elements that are =0 (i.e. masked in input data)
+		#   NB2: Masked elements are zeroed rather than gathered, so that tensor shapes stay static (needed by XLA)
 		mask= tf.logical_and(tf.logical_and(tf.math.is_finite(y_true_flattened),~tf.math.equal(y_true_flattened,0)), tf.math.is_finite(y_pred_flattened))
-		indexes= tf.where(mask)		
-		y_true_flattened_masked= tf.gather(y_true_flattened, indexes)
-		y_pred_flattened_masked= tf.gather(y_pred_flattened, indexes)
+		nmasked= tf.reduce_sum(tf.cast(mask, tf.float32))
+		sqdiff= tf.where(mask, tf.square(y_true_flattened - y_pred_flattened), tf.zeros_like(y_true_flattened))
 		
-		# - Check if vectors are not empty
-		y_true_isempty= tf.equal(tf.size(y_true_flattened_masked),0)	
-		y_pred_isempty= tf.equal(tf.size(y_pred_flattened_masked),0)
-		are_empty= tf.logical_or(y_true_isempty, y_pred_isempty)
+		# - Check if masked vectors are not empty
+		are_empty= tf.equal(nmasked, 0)
 		
-		# - Compute reconstruction loss term
+		# - Compute reconstruction loss term (mean squared error over selected elements)
 		#reco_loss_default= 1.e+99
 		reco_loss_default= tf.float32.max
-		reco_loss= tf.cond(are_empty, lambda: tf.constant(reco_loss_default), lambda: self.mse_loss_fcn(y_true_flattened_masked, y_pred_flattened_masked))
+		reco_loss= tf.where(are_empty, tf.constant(reco_loss_default), tf.reduce_sum(sqdiff)/tf.maximum(nmasked, 1.))
 		#reco_loss*= tf.cast(img_cube_size, tf.float32)
 		reco_loss= tf.cast(reco_loss, tf.float32)
 
 		return reco_loss
 
 	
-	#@tf.function
+	@tf.function
 	def loss(self, y_true, y_pred):
 		""" Loss function definition """
 
 		#data_shape_int= K.int_shape(y_true)
 		#tf.print("data_shape_int: ", data_shape_int, output_stream=sys.stdout)
 
+		# - Compute losses in float32 (outputs are in reduced precision with mixed precision)
+		y_true= tf.cast(y_true, tf.float32)
+		y_pred= tf.cast(y_pred, tf.float32)
+
 		# - Compute MSE reconstruction loss term
 		mse_loss= tf.zeros((),dtype=tf.float32)
 		if self.use_mse_loss and self.mse_loss_weight>0:
@@ -1178,7 +1213,8 @@ class FeatExtractorAE(object):
 
 		# - Compute the total loss
 		tot_loss= mse_loss + ssim_loss + kl_loss
-		logger.info("tot_loss=%f: mse=%f, ssim_loss=%f, kl_loss=%f" % (tot_loss, mse_loss, ssim_loss, kl_loss))
+		if tf.executing_eagerly():
+			logger.info("tot_loss=%f: mse=%f, ssim_loss=%f, kl_loss=%f" % (tot_loss, mse_loss, ssim_loss, kl_loss))
 		#tf.print("tot_loss: ", tot_loss, output_stream=sys.stdout)
 		#tf.print("mse_loss: ", mse_loss, output_stream=sys.stdout)
 		#tf.print("ssim_loss: ", ssim_loss, output_stream=sys.stdout)
@@ -1201,13 +1237,15 @@ class FeatExtractorAE(object):
 		scale= 1
 		if self.augmentation:
 			scale= self.augment_scale_factor
-		steps_per_epoch= scale*self.nsamples // self.batch_size
+		# - NB: with multi-worker training each worker reads a data shard
+		num_workers= get_num_workers(self.strategy)
+		steps_per_epoch= scale*self.nsamples // (self.batch_size*num_workers)
 
 		# - Set validation steps
 		val_steps_per_epoch= self.validation_steps
 		if self.has_cvdata:
 			if self.load_cv_data_in_batches:
-				val_steps_per_epoch= self.nsamples_cv // self.batch_size
+				val_steps_per_epoch= self.nsamples_cv // (self.batch_size*num_workers)
 			else:
 				val_steps_per_epoch= 1
 
@@ -1215,24 +1253,38 @@ class FeatExtractorAE(object):
 		#==   TRAIN AE
 		#===========================
 		# - Define tensorboard callback
-		log_dir = "logs/" + datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
-		tensorboard_cb = tf.keras.callbacks.TensorBoard(log_dir=log_dir, histogram_freq=1)
+		#   NB: only chief worker writes outputs
+		callbacks= []
+		if is_chief(self.strategy):
+			log_dir = "logs/" + datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+			tensorboard_cb = tf.keras.callbacks.TensorBoard(log_dir=log_dir, histogram_freq=1)
+			callbacks.append(tensorboard_cb)
+
+		# - Wrap model for gradient accumulation?
+		train_model= self.cae
+		if self.grad_accum_steps>1:
+			logger.info("Accumulating gradients over %d batches (effective batch size=%d) ..." % (self.grad_accum_steps, self.grad_accum_steps*self.batch_size))
+			train_model= make_gradient_accumulation_model(self.cae, self.grad_accum_steps)
+			train_model.compile(optimizer=self.optimizer, loss=self.loss, **get_compile_options(self.use_xla))
 
 		# - Start training
 		logger.info("Start autoencoder training (dataset_size=%d, batch_size=%d, steps_per_epoch=%d, val_steps_per_epoch=%d) ..." % (self.nsamples, self.batch_size, steps_per_epoch, val_steps_per_epoch))
 
-		self.fitout= self.cae.fit(
-			x=self.train_data_generator,
+		self.fitout= train_model.fit(
+			x=distribute_data(self.strategy, self.train_data_generator),
 			epochs=self.nepochs,
 			steps_per_epoch=steps_per_epoch,
-			validation_data=self.crossval_data_generator,
+			validation_data=distribute_data(self.strategy, self.crossval_data_generator),
 			validation_steps=val_steps_per_epoch,
 			use_multiprocessing=self.use_multiprocessing,
 			workers=self.nworkers,
 			verbose=2,
-			callbacks=[tensorboard_cb]
+			callbacks=callbacks
 		)
 
+		if not is_chief(self.strategy):
+			logger.info("Not chief worker, skip saving model & outputs ...")
+			return 0
 		
 		#===========================
 		#==   SAVE NN
@@ -1320,24 +1372,19 @@ class FeatExtractorAE(object):
 		#==   SAVE ENCODED DATA
 		#================================
 		logger.info("Saving encoded data to file ...")
+		if self.stream_embeddings:
+			return self.__stream_embeddings()
+
+		data_generator= self.dg_test.generate_inference_data(batch_size=self.predict_batch_size)
+		predout, data_indexes= predict_in_batches(self.encoder, data_generator, use_xla=self.use_xla)
+		if predout is None:
+			logger.error("No encoded data predicted!")
+			return -1
+
 		if self.use_vae:
-			self.encoded_data, _, _= self.encoder.predict(
-				x=self.test_data_generator,	
-				#steps=1,
-				steps=self.nsamples,
-    		verbose=2,
-    		workers=self.nworkers,
-    		use_multiprocessing=self.use_multiprocessing
-			)
+			self.encoded_data, _, _= predout
 		else:
-			self.encoded_data= self.encoder.predict(
-				x=self.test_data_generator,	
-				#steps=1,
-				steps=self.nsamples,
-    		verbose=2,
-    		workers=self.nworkers,
-    		use_multiprocessing=self.use_multiprocessing
-			)
+			self.encoded_data= predout
 
 		#print("encoded_data type=",type(self.encoded_data))
 		#print("encoded_data len=",len(self.encoded_data))
@@ -1350,8 +1397,8 @@ class FeatExtractorAE(object):
 		
 		
 		# - Merge encoded data
-		obj_names= np.array(self.source_names).reshape(N,1)
-		obj_ids= np.array(self.source_ids).reshape(N,1)
+		obj_names= np.array([self.source_names[index] for index in data_indexes]).reshape(N,1)
+		obj_ids= np.array([self.source_ids[index] for index in data_indexes]).reshape(N,1)
 		enc_data= np.concatenate(
 			(obj_names, self.encoded_data, obj_ids),
 			axis=1
@@ -1410,7 +1457,7 @@ class FeatExtractorAE(object):
 		#===========================
 		#==   PLOT RESULTS
 		#===========================
-		if self.draw:
+		if self.draw and is_chief(self.strategy):
 			logger.info("Plotting results ...")
 			self.__plot_results()
 
@@ -1448,16 +1495,16 @@ class FeatExtractorAE(object):
 		#===========================
 		#==   PREDICT
 		#===========================
-		predout= self.encoder.predict(
-			x=self.test_data_generator,	
-			#steps=1,	
-			steps=self.nsamples,
-    	verbose=2,
-    	workers=self.nworkers,
-    	use_multiprocessing=self.use_multiprocessing
-		)
+		if self.stream_embeddings:
+			return self.__stream_embeddings()
 
-		if type(predout)==tuple and len(predout)>0:
+		data_generator= self.dg_test.generate_inference_data(batch_size=self.predict_batch_size)
+		predout, data_indexes= predict_in_batches(self.encoder, data_generator, use_xla=self.use_xla)
+		if predout is None:
+			logger.error("No encoded data predicted!")
+			return -1
+
+		if isinstance(predout, (list, tuple)) and len(predout)>0:
 			self.encoded_data= predout[0]
 		else:
 			self.encoded_data= predout
@@ -1470,23 +1517,36 @@ class FeatExtractorAE(object):
 		
 		
 		# - Merge encoded data
-		obj_names= np.array(self.source_names).reshape(N,1)
-		obj_ids= np.array(self.source_ids).reshape(N,1)
-		enc_data= np.concatenate(
-			(obj_names, self.encoded_data, obj_ids),
-			axis=1
-		)
+		snames= [self.source_names[index] for index in data_indexes]
+		sids= [self.source_ids[index] for index in data_indexes]
 
 		# - Save latent data to file
+		#   NB: binary columnar format if file has .npz extension, ascii otherwise
 		logger.info("Saving predicted latent data to file %s ..." % (self.outfile_encoded_data))
-		znames_counter= list(range(1, Nvar+1))
-		znames= '{}{}'.format('z',' z'.join(str(item) for item in znames_counter))
-		head= '{} {} {}'.format("# sname", znames, "id")
-		Utils.write_ascii(enc_data, self.outfile_encoded_data, head)	
+		if Utils.write_feature_data(self.outfile_encoded_data, self.encoded_data, snames, sids)<0:
+			logger.error("Failed to save latent data to file %s!" % (self.outfile_encoded_data))
+			return -1
 
 		return 0
 
 	
+	#####################################
+	##     STREAM EMBEDDINGS
+	#####################################
+	def __stream_embeddings(self):
+		""" Save embeddings to file in chunks as batches are predicted (see tf_utils.stream_embeddings_to_file) """
+
+		status= stream_embeddings_to_file(
+			self.encoder, self.dg_test, self.outfile_encoded_data, self.source_names, self.source_ids,
+			batch_size=self.predict_batch_size,
+			chunk_size=self.embeddings_chunk_size,
+			resume=self.resume_embeddings,
+			use_xla=self.use_xla
+		)
+		self.encoded_data= None
+
+		return status
+
 	#####################################
 	##     RECONSTRUCT DATA
 	#####################################
@@ -1531,163 +1591,135 @@ class FeatExtractorAE(object):
 		#===========================
 		img_counter= 0
 		reco_metrics= []
+		data_indexes= []
+
+		logger.info("Reconstructing input images (batch_size=%d) ..." % (self.predict_batch_size))
+		data_generator= self.dg_test.generate_inference_data(batch_size=self.predict_batch_size)
 		
 		while True:
 			try:
-				sname= self.source_names[img_counter]
-				classid= self.source_ids[img_counter]
-
-				data, _= next(self.data_generator)
-				img_counter+= 1
-
+				data, indexes= next(data_generator)
+				nimgs= data.shape[0]
 				nchans= data.shape[3]
-	
-				#print("type(data)")
-				#print(type(data))
-				#print("data shape")
-				#print(data.shape)				
-				#print("nchans")
-				#print(nchans)
-
-				# - Get latent data for this output
-				predout= self.encoder.predict(
-					x= data,	
-					batch_size=1,
-    			verbose=2,
-    			workers=self.nworkers,
-    			use_multiprocessing=self.use_multiprocessing
-				)
-
-				#if type(predout)==tuple and len(predout)>0:
-				#	encoded_data= predout[0]
-				#else:
-				#	encoded_data= predout
 
-				#print("encoded_data shape")
-				#print(encoded_data.shape)	
-				#print(encoded_data)
-				#N= encoded_data.shape[0]
-				#Nvar= encoded_data.shape[1]
+				# - Get latent data for this batch
+				predout= self.encoder.predict_on_batch(data)
 		
-				# - Compute reconstructed image
-				logger.info("Reconstructing image sample no. %d (name=%s, id=%d) ..." % (img_counter, sname, classid))
+				# - Compute reconstructed images
 				if self.add_channorm_layer:
-					decoded_imgs = self.decoder.predict([predout,data])
+					decoded_imgs = self.decoder.predict_on_batch([predout,data])
 				else:
-					decoded_imgs = self.decoder.predict(predout)
-				###decoded_imgs = self.decoder.predict(self.encoded_data)
-				#print("type(decoded_imgs)")
-				#print(type(decoded_imgs))
-				#print("decoded_imgs.shape")
-				#print(decoded_imgs.shape)
-
-				# - Compute metrics
-				metric_list= []
-				img_list= []
-				metric_names= []
-
-				#print("pto 1")
-
-				for j in range(nchans):
-					inputdata_img= data[0,:,:,j]
-					recdata_img= decoded_imgs[0,:,:,j]
+					decoded_imgs = self.decoder.predict_on_batch(predout)
+				decoded_imgs= np.asarray(decoded_imgs)
+
+				for k in range(nimgs):
+					sname= self.source_names[indexes[k]]
+					classid= self.source_ids[indexes[k]]
+					img_counter+= 1
+					logger.info("Reconstructing image sample no. %d (name=%s, id=%d) ..." % (img_counter, sname, classid))
+
+					# - Compute metrics
+					metric_list= []
+					img_list= []
+					metric_names= []
+
+					for j in range(nchans):
+						inputdata_img= data[k,:,:,j]
+						recdata_img= decoded_imgs[k,:,:,j]
 					
-					cond= np.logical_and(inputdata_img!=0, np.isfinite(inputdata_img))
+						cond= np.logical_and(inputdata_img!=0, np.isfinite(inputdata_img))
 
-					inputdata_1d= inputdata_img[cond]
-					recdata_1d= recdata_img[cond]
-					recdata_img[~cond]= 0
+						inputdata_1d= inputdata_img[cond]
+						recdata_1d= recdata_img[cond]
+						recdata_img[~cond]= 0
 			
-					#print("pto 2")
-
-					#print("inputdata_img.shape")
-					#print(inputdata_img.shape)
-					#print("recdata_img.shape")
-					#print(recdata_img.shape)
-					#print("inputdata_1d shape")
-					#print(inputdata_1d.shape)
-					#print("recdata_1d shape")
-					#print(recdata_1d.shape)
-					#print("winsize")
-					#print(winsize)
-
-					# - Compute MSE
-					mse= mean_squared_error(inputdata_1d, recdata_1d)
+						#print("pto 2")
+
+						#print("inputdata_img.shape")
+						#print(inputdata_img.shape)
+						#print("recdata_img.shape")
+						#print(recdata_img.shape)
+						#print("inputdata_1d shape")
+						#print(inputdata_1d.shape)
+						#print("recdata_1d shape")
+						#print(recdata_1d.shape)
+						#print("winsize")
+						#print(winsize)
+
+						# - Compute MSE
+						mse= mean_squared_error(inputdata_1d, recdata_1d)
 					
-					#print("mse")
-					#print(mse)
-
-					# - Compute similarity index
-					#   NB: Need to normalize images to max otherwise the returned values are always ~1.
-					img_max= np.max([inputdata_img,recdata_img])
-					try:
-						ssim_mean, ssim_2d= structural_similarity(inputdata_img/img_max, recdata_img/img_max, full=True, win_size=winsize, data_range=1)
-					except Exception as e:
-						logger.error("ssim calculation failed for image no. %d (chan=%d, sname=%s, id=%d) (err=%s)!" % (img_counter, j+1, sname, classid, str(e)))
-						return -1
-					ssim_1d= ssim_2d[cond]
-					ssim_mean_mask= np.nanmean(ssim_1d)
-					ssim_min_mask= np.nanmin(ssim_1d)
-					ssim_max_mask= np.nanmax(ssim_1d)
-					ssim_std_mask= np.nanstd(ssim_1d)
-
-					if not np.isfinite(ssim_mean_mask):
-						logger.warn("Image no. %d (chan=%d): ssim_mean_mask is nan/inf!" % (img_counter, j+1))
-						ssim_mean_mask= -999
-
-					# - Append images
-					#recdata_img[~cond]= 0
-					ssim_2d[~cond]= 0
+						#print("mse")
+						#print(mse)
+
+						# - Compute similarity index
+						#   NB: Need to normalize images to max otherwise the returned values are always ~1.
+						img_max= np.max([inputdata_img,recdata_img])
+						try:
+							ssim_mean, ssim_2d= structural_similarity(inputdata_img/img_max, recdata_img/img_max, full=True, win_size=winsize, data_range=1)
+						except Exception as e:
+							logger.error("ssim calculation failed for image no. %d (chan=%d, sname=%s, id=%d) (err=%s)!" % (img_counter, j+1, sname, classid, str(e)))
+							return -1
+						ssim_1d= ssim_2d[cond]
+						ssim_mean_mask= np.nanmean(ssim_1d)
+						ssim_min_mask= np.nanmin(ssim_1d)
+						ssim_max_mask= np.nanmax(ssim_1d)
+						ssim_std_mask= np.nanstd(ssim_1d)
+
+						if not np.isfinite(ssim_mean_mask):
+							logger.warn("Image no. %d (chan=%d): ssim_mean_mask is nan/inf!" % (img_counter, j+1))
+							ssim_mean_mask= -999
+
+						# - Append images
+						#recdata_img[~cond]= 0
+						ssim_2d[~cond]= 0
 					
-					img_list.append([])		
-					img_list[j].append(inputdata_img)
-					img_list[j].append(recdata_img)
-					img_list[j].append(ssim_2d)
-
-					# - Append metrics
-					metric_list.append(mse)
-					metric_list.append(ssim_mean_mask)
-					metric_list.append(ssim_min_mask)
-					metric_list.append(ssim_max_mask)
-					metric_list.append(ssim_std_mask)
+						img_list.append([])		
+						img_list[j].append(inputdata_img)
+						img_list[j].append(recdata_img)
+						img_list[j].append(ssim_2d)
+
+						# - Append metrics
+						metric_list.append(mse)
+						metric_list.append(ssim_mean_mask)
+						metric_list.append(ssim_min_mask)
+						metric_list.append(ssim_max_mask)
+						metric_list.append(ssim_std_mask)
 	
-					metric_names.append("mse_ch" + str(j+1))
-					metric_names.append("ssim_mean_ch" + str(j+1))
-					metric_names.append("ssim_min_ch" + str(j+1))
-					metric_names.append("ssim_max_ch" + str(j+1))
-					metric_names.append("ssim_std_ch" + str(j+1))
+						metric_names.append("mse_ch" + str(j+1))
+						metric_names.append("ssim_mean_ch" + str(j+1))
+						metric_names.append("ssim_min_ch" + str(j+1))
+						metric_names.append("ssim_max_ch" + str(j+1))
+						metric_names.append("ssim_std_ch" + str(j+1))
 					
-				reco_metrics.append(metric_list)
+					reco_metrics.append(metric_list)
 				
-				# - Save input & reco images
-				if save_imgs:
-					outfile_plot= sname + '_id' + str(classid) + '.png'		
-					logger.info("Saving reco plot to file %s ..." % (outfile_plot))
-					fig = plt.figure(figsize=(20, 10))
-					nrows= len(img_list)
-					for i in range(nrows):
-						ncols= len(img_list[i])
-						for j in range(ncols):
-							index= j + i*ncols + 1
-							plt.subplot(nrows, ncols, index)
-							plt.imshow(img_list[i][j], origin='lower')
-							plt.colorbar()
-
-							outfile_fits= sname + '_id' + str(classid) + '_ch' + str(i+1) + '_plot' + str(j+1) + '.fits'
-							Utils.write_fits(img_list[i][j], outfile_fits)
+					# - Save input & reco images
+					if save_imgs:
+						outfile_plot= sname + '_id' + str(classid) + '.png'		
+						logger.info("Saving reco plot to file %s ..." % (outfile_plot))
+						fig = plt.figure(figsize=(20, 10))
+						nrows= len(img_list)
+						for i in range(nrows):
+							ncols= len(img_list[i])
+							for j in range(ncols):
+								index= j + i*ncols + 1
+								plt.subplot(nrows, ncols, index)
+								plt.imshow(img_list[i][j], origin='lower')
+								plt.colorbar()
+
+								outfile_fits= sname + '_id' + str(classid) + '_ch' + str(i+1) + '_plot' + str(j+1) + '.fits'
+								Utils.write_fits(img_list[i][j], outfile_fits)
 					
-					plt.savefig(outfile_plot)
-					#plt.tight_layout()
-					#plt.show()
-					plt.close()
+						plt.savefig(outfile_plot)
+						#plt.tight_layout()
+						#plt.show()
+						plt.close()
 					
-				# - Stop generator
-				if img_counter>=self.nsamples:
-					logger.info("Sample size (%d) reached, stop generation..." % self.nsamples)
-					break
+					data_indexes.append(indexes[k])
 
-			except (GeneratorExit, KeyboardInterrupt):
-				logger.info("Stop loop (keyboard interrupt) ...")
+			except (StopIteration, GeneratorExit, KeyboardInterrupt):
+				logger.info("Stop loop (end of data or keyboard interrupt) ...")
 				break
 			except Exception as e:
 				logger.warn("Stop loop (exception catched %s) ..." % str(e))
@@ -1701,8 +1733,8 @@ class FeatExtractorAE(object):
 
 		# - Save reco metrics
 		logger.info("Setting metric out data ...")
-		obj_names= np.array(self.source_names).reshape(N,1)
-		obj_ids= np.array(self.source_ids).reshape(N,1)
+		obj_names= np.array([self.source_names[index] for index in data_indexes]).reshape(N,1)
+		obj_ids= np.array([self.source_ids[index] for index in data_indexes]).reshape(N,1)
 		
 		if not reco_metrics:
 			logger.error("Empty reco metrics, check logs!")
@@ -1751,7 +1783,7 @@ class FeatExtractorAE(object):
 		#===========================
 		#==   SET LOSS & METRICS
 		#===========================	
-		self.cae.compile(optimizer=self.optimizer, loss=self.loss, run_eagerly=True) ### CORRECT
+		self.cae.compile(optimizer=self.optimizer, loss=self.loss, **get_compile_options(self.use_xla)) ### CORRECT
 		
 		# - Print and draw model
 		self.cae.summary()
@@ -1786,7 +1818,7 @@ class FeatExtractorAE(object):
 		#===========================
 		#==   SET LOSS & METRICS
 		#===========================	
-		self.cae.compile(optimizer=self.optimizer, loss=self.loss, run_eagerly=True) ### CORRECT
+		self.cae.compile(optimizer=self.optimizer, loss=self.loss, **get_compile_options(self.use_xla)) ### CORRECT
 		
 		return 0
 
@@ -1842,7 +1874,7 @@ class FeatExtractorAE(object):
 		#===========================
 		#==   SET LOSS & METRICS
 		#===========================	
-		self.cae.compile(optimizer=self.optimizer, loss=self.loss, run_eagerly=True) ### CORRECT
+		self.cae.compile(optimizer=self.optimizer, loss=self.loss, **get_compile_options(self.use_xla)) ### CORRECT
 		
 		# - Print and draw model
 		self.cae.summary()
@@ -93,7 +93,9 @@ matplotlib.use('Agg')
 
 ## PACKAGE MODULES
 from .utils import Utils
-from .tf_utils import byol_loss
+from .tf_utils import byol_loss, predict_in_batches, stream_embeddings_to_file, GradientAccumulator
+from .tf_distribute import get_num_workers, get_num_replicas, is_chief, compile_step
+from .tf_dataset import TFDatasetBuilder
 ##from .models import ResNet18, ResNet34
 from .models import resnet18, resnet34
 from .models import ProjectionHead, ClassificationHead
@@ -141,6 +143,10 @@ class FeatExtractorByol(object):
 		self.validation_steps= 10
 		self.use_multiprocessing= True
 		self.nworkers= 0
+		self.use_tf_data= False
+		self.tf_data_cache= False
+		self.tf_data_cachefile= ""
+		self.predict_batch_size= 32
 
 		# *****************************
 		# ** Model
@@ -195,6 +201,10 @@ class FeatExtractorByol(object):
 		self.weight_init_seed= None
 		self.shuffle_train_data= True
 		self.augment_scale_factor= 1
+		self.target_decay= 0.99 # momentum of target networks update (exponential moving average of online networks)
+		self.use_xla= False # compile train & predict steps with XLA
+		self.grad_accum_steps= 1 # if >1, gradients are accumulated over this number of batches before each optimizer (and target) update
+		self.strategy= None # tf.distribute strategy for multi-worker training (models & optimizer must be created in its scope)
 
 		self.load_cv_data_in_batches= True
 		self.balance_classes= False
@@ -214,6 +224,11 @@ class FeatExtractorByol(object):
 		self.shuffle_embeddings= False
 		self.outfile_tb_embeddings= 'feature_vecs.tsv'
 
+		# - Streaming options for embeddings (see tf_utils.stream_embeddings_to_file)
+		self.stream_embeddings= False
+		self.embeddings_chunk_size= 10000
+		self.resume_embeddings= False
+
 	#####################################
 	##     SETTERS/GETTERS
 	#####################################
@@ -256,6 +271,14 @@ class FeatExtractorByol(object):
 	#####################################
 	##     SET TRAIN DATA
 	#####################################
+	def __create_tf_dataset_builder(self, dg, cachefile_suffix=""):
+		""" Create tf.data dataset builder for given data generator """
+		ds_builder= TFDatasetBuilder(dg)
+		ds_builder.cache= self.tf_data_cache
+		if self.tf_data_cachefile!="":
+			ds_builder.cachefile= self.tf_data_cachefile + cachefile_suffix
+		return ds_builder
+
 	def __set_data(self):
 		""" Set train data & generator from loader """
 
@@ -268,11 +291,23 @@ class FeatExtractorByol(object):
 		self.nsamples= len(self.source_labels)
 
 		# - Create train data generator
-		self.train_data_generator= self.dg.generate_byol_data(
-			batch_size=self.batch_size, 
-			shuffle=self.shuffle_train_data,
-			balance_classes=self.balance_classes, class_probs=self.class_probs
-		)
+		if self.use_tf_data:
+			logger.info("Creating train tf.data dataset ...")
+			ds= self.__create_tf_dataset_builder(self.dg).build_byol_dataset(
+				batch_size=self.batch_size, 
+				shuffle=self.shuffle_train_data,
+				balance_classes=self.balance_classes, class_probs=self.class_probs
+			)
+			if ds is None:
+				logger.error("Failed to create train tf.data dataset!")
+				return -1
+			self.train_data_generator= iter(ds) # NB: train loop fetches data with next()
+		else:
+			self.train_data_generator= self.dg.generate_byol_data(
+				batch_size=self.batch_size, 
+				shuffle=self.shuffle_train_data,
+				balance_classes=self.balance_classes, class_probs=self.class_probs
+			)
 
 
 		# - Create cross validation data generator
@@ -298,10 +333,17 @@ class FeatExtractorByol(object):
 
 			logger.info("Loading cv data in batches? %d (batch_size_cv=%d)" % (self.load_cv_data_in_batches, batch_size_cv))
 
-			self.crossval_data_generator= self.dg_cv.generate_byol_data(
-				batch_size=batch_size_cv, 
-				shuffle=False
-			)
+			if self.use_tf_data:
+				ds= self.__create_tf_dataset_builder(self.dg_cv, cachefile_suffix="_cv").build_byol_dataset(batch_size=batch_size_cv, shuffle=False)
+				if ds is None:
+					logger.error("Failed to create validation tf.data dataset!")
+					return -1
+				self.crossval_data_generator= iter(ds)
+			else:
+				self.crossval_data_generator= self.dg_cv.generate_byol_data(
+					batch_size=batch_size_cv, 
+					shuffle=False
+				)
 
 
 		# - Create test data generator
@@ -310,10 +352,7 @@ class FeatExtractorByol(object):
 		logger.info("Disabling data augmentation in test data generator ...")
 		self.dg_test.disable_augmentation()
 
-		self.test_data_generator= self.dg_test.generate_cae_data(
-			batch_size=1, 
-			shuffle=False
-		)
+		# - NB: test data are read in batches by generate_inference_data when saving embeddings
 
 		# - Create embeddings data generator
 		logger.info("Creating test data generator for embeddings (deep-copying train data generator) ...")
@@ -321,11 +360,6 @@ class FeatExtractorByol(object):
 		logger.info("Disabling data augmentation in test data generator for embeddings ...")
 		self.dg_test_embeddings.disable_augmentation()
 
-		self.test_data_generator_embeddings= self.dg_test_embeddings.generate_data(
-			batch_size=1, 
-			shuffle=self.shuffle_embeddings
-		)
-		
 		return 0
 
 
@@ -678,44 +712,93 @@ class FeatExtractorByol(object):
 	#####################################
 	##     TRAIN NN
 	#####################################
-	@tf.function
-	def __train_step_pretraining(self, x1, x2):  # (bs, 32, 32, 3), (bs, 32, 32, 3)
-		""" Train step pretraining """
-		
-		# Forward pass
+	def __get_online_variables(self):
+		""" Return the trainable variables of online networks """
+		return self.f_online.trainable_variables + self.g_online.trainable_variables + self.q_online.trainable_variables
+
+	def __compute_grads(self, x1, x2):
+		""" Compute loss and gradients wrt online networks variables (single gradient over all online networks) """
+
+		# Forward pass (target networks, no gradient)
 		h_target_1 = self.f_target(x1, training=True)
 		z_target_1 = self.g_target(h_target_1, training=True)
 
 		h_target_2 = self.f_target(x2, training=True)
 		z_target_2 = self.g_target(h_target_2, training=True)
+		z_target = tf.stop_gradient(tf.concat([z_target_2, z_target_1], axis=0))
 
-		with tf.GradientTape(persistent=True) as tape:
+		# Forward pass (online networks)
+		with tf.GradientTape() as tape:
 			h_online_1 = self.f_online(x1, training=True)
 			z_online_1 = self.g_online(h_online_1, training=True)
 			p_online_1 = self.q_online(z_online_1, training=True)
-            
+
 			h_online_2 = self.f_online(x2, training=True)
 			z_online_2 = self.g_online(h_online_2, training=True)
 			p_online_2 = self.q_online(z_online_2, training=True)
-            
+
 			p_online = tf.concat([p_online_1, p_online_2], axis=0)
-			z_target = tf.concat([z_target_2, z_target_1], axis=0)
 			loss = byol_loss(p_online, z_target)
+			loss_scaled = loss / get_num_replicas() # gradients are summed over replicas
 
-		# Backward pass (update online networks)
-		grads = tape.gradient(loss, self.f_online.trainable_variables)
-		self.optimizer.apply_gradients(zip(grads, self.f_online.trainable_variables))
+		grads = tape.gradient(loss_scaled, self.__get_online_variables())
 
-		grads = tape.gradient(loss, self.g_online.trainable_variables)
-		self.optimizer.apply_gradients(zip(grads, self.g_online.trainable_variables))
+		return loss, grads
 
-		grads = tape.gradient(loss, self.q_online.trainable_variables)
-		self.optimizer.apply_gradients(zip(grads, self.q_online.trainable_variables))        
-
-		del tape
+	def __train_step_pretraining(self, x1, x2):  # (bs, 32, 32, 3), (bs, 32, 32, 3)
+		""" Train step pretraining: update online networks with a single gradient and optimizer apply. 
+				Target networks are updated after the step in the same graph (see __get_train_step).
+		"""
 		
+		# Forward & backward pass (update online networks)
+		loss, grads = self.__compute_grads(x1, x2)
+		self.optimizer.apply_gradients(zip(grads, self.__get_online_variables()))
+		
+		return loss
+
+	def __accum_step_pretraining(self, x1, x2):  # (bs, 32, 32, 3), (bs, 32, 32, 3)
+		""" Train step pretraining with gradient accumulation: gradients are applied and target networks updated in __apply_step_pretraining """
+
+		loss, grads = self.__compute_grads(x1, x2)
+		self.grad_accumulator.accumulate(grads)
+
 		return loss
 
+	def __apply_step_pretraining(self):
+		""" Apply accumulated gradients (target networks are updated after the step, see __get_train_step) """
+		return self.grad_accumulator.apply()
+
+	def __update_target_networks(self):
+		""" Update target networks weights as exponential moving average of online networks weights (in graph) """
+
+		# - NB: all weights are updated (also non-trainable ones, e.g. batchnorm moving stats), as done with get/set_weights
+		target_weights = self.f_target.weights + self.g_target.weights
+		online_weights = self.f_online.weights + self.g_online.weights
+
+		updates = []
+		for w_target, w_online in zip(target_weights, online_weights):
+			updates.append( w_target.assign_sub((1. - self.target_decay) * (w_target - w_online)) )
+
+		return tf.group(*updates)
+
+	def __get_train_step(self):
+		""" Return compiled train step and apply step functions (with XLA if enabled, run on each replica if distributed). 
+				Target networks are updated after each optimizer update, in cross-replica context if distributed.
+				Apply step is None if gradients are not accumulated (optimizer update done in train step). 
+		"""
+		logger.info("Compiling BYOL train step (XLA=%d, grad_accum_steps=%d) ..." % (self.use_xla, self.grad_accum_steps))
+
+		if self.grad_accum_steps<=1:
+			self.grad_accumulator= None
+			return compile_step(self.__train_step_pretraining, self.use_xla, self.strategy, post_fcn=self.__update_target_networks), None
+
+		logger.info("Accumulating gradients over %d batches (effective batch size=%d) ..." % (self.grad_accum_steps, self.grad_accum_steps*self.batch_size))
+		self.grad_accumulator= GradientAccumulator(self.optimizer, self.__get_online_variables(), self.grad_accum_steps)
+		train_step= compile_step(self.__accum_step_pretraining, self.use_xla, self.strategy)
+		apply_step= compile_step(self.__apply_step_pretraining, self.use_xla, self.strategy, post_fcn=self.__update_target_networks, reduce_outputs=False)
+
+		return train_step, apply_step
+
 	@tf.function
 	def __val_step_pretraining(self, x1, x2):  # (bs, 32, 32, 3), (bs, 32, 32, 3)
 		""" Validation step pretraining """
@@ -748,13 +831,16 @@ class FeatExtractorByol(object):
 		#===========================
 		# - Initialize train/test loss vs epoch
 		self.train_loss_vs_epoch= np.zeros((1,self.nepochs))	
-		steps_per_epoch= self.nsamples // self.batch_size
+
+		# - NB: with multi-worker training each worker reads a data shard
+		num_workers= get_num_workers(self.strategy)
+		steps_per_epoch= self.nsamples // (self.batch_size*num_workers)
 
 		# - Set validation steps
 		val_steps_per_epoch= self.validation_steps
 		if self.has_cvdata:
 			if self.load_cv_data_in_batches:
-				val_steps_per_epoch= self.nsamples_cv // self.batch_size
+				val_steps_per_epoch= self.nsamples_cv // (self.batch_size*num_workers)
 			else:
 				val_steps_per_epoch= 1
 
@@ -767,6 +853,8 @@ class FeatExtractorByol(object):
 		losses_train = []
 		losses_val = []
 		log_every= 1
+		train_step, apply_step= self.__get_train_step()
+		nsteps_done= 0
 
 		for epoch_id in range(self.nepochs):
 			  
@@ -776,23 +864,13 @@ class FeatExtractorByol(object):
 			for batch_id in range(steps_per_epoch):
 				# - Fetch train data from generator
 				x1, x2= next(self.train_data_generator)
-				loss = self.__train_step_pretraining(x1, x2)
+				loss = train_step(x1, x2)
 				losses_train_batch.append(float(loss))
 
-				# - Update target networks (exponential moving average of online networks)
-				beta = 0.99
-
-				f_target_weights = self.f_target.get_weights()
-				f_online_weights = self.f_online.get_weights()
-				for i in range(len(f_online_weights)):
-					f_target_weights[i] = beta * f_target_weights[i] + (1 - beta) * f_online_weights[i]
-				self.f_target.set_weights(f_target_weights)
-            
-				g_target_weights = self.g_target.get_weights()
-				g_online_weights = self.g_online.get_weights()
-				for i in range(len(g_online_weights)):
-					g_target_weights[i] = beta * g_target_weights[i] + (1 - beta) * g_online_weights[i]
-				self.g_target.set_weights(g_target_weights)
+				# - Apply accumulated gradients?
+				nsteps_done+= 1
+				if apply_step is not None and nsteps_done % self.grad_accum_steps == 0:
+					apply_step()
 
 				# - Print train losses in batch				
 				if (batch_id + 1) % log_every == 0:
@@ -818,7 +896,11 @@ class FeatExtractorByol(object):
 				logger.info("Epoch %d/%d: train_loss=%f, val_loss=%f " % (epoch_id+1, self.nepochs, loss_train, loss_val))
 			else:
 				logger.info("Epoch %d/%d: train_loss=%f" % (epoch_id+1, self.nepochs, loss_train))
-		
+
+		# - Only chief worker writes outputs
+		if not is_chief(self.strategy):
+			logger.info("Not chief worker, skip saving model & outputs ...")
+			return 0
 		
 		#===========================
 		#==   SAVE NN
@@ -932,20 +1014,36 @@ class FeatExtractorByol(object):
 	########################################
 	##     SAVE EMBEDDINGS
 	########################################
+	def __stream_embeddings(self):
+		""" Save embeddings to file in chunks as batches are predicted (see tf_utils.stream_embeddings_to_file) """
+
+		status= stream_embeddings_to_file(
+			self.f_online, self.dg_test, self.outfile_encoded_data, self.source_names, self.source_ids,
+			batch_size=self.predict_batch_size,
+			chunk_size=self.embeddings_chunk_size,
+			resume=self.resume_embeddings,
+			use_xla=self.use_xla
+		)
+		self.encoded_data= None
+
+		return status
+
 	def __save_embeddings(self):
 		""" Save embeddings """
 
+		# - Stream embeddings to file?
+		if self.stream_embeddings:
+			return self.__stream_embeddings()
+
 		# - Apply model to input
-		logger.info("Running BYOL prediction on input data ...")
-		predout= self.f_online.predict(
-			x=self.test_data_generator,	
-			steps=self.nsamples,
-    	verbose=2,
-    	workers=self.nworkers,
-    	use_multiprocessing=self.use_multiprocessing
-		)
+		logger.info("Running BYOL prediction on input data (batch_size=%d) ..." % (self.predict_batch_size))
+		data_generator= self.dg_test.generate_inference_data(batch_size=self.predict_batch_size)
+		predout, data_indexes= predict_in_batches(self.f_online, data_generator, use_xla=self.use_xla)
+		if predout is None:
+			logger.error("No predictions made on input data!")
+			return -1
 
-		if type(predout)==tuple and len(predout)>0:
+		if isinstance(predout, (list, tuple)) and len(predout)>0:
 			self.encoded_data= predout[0]
 		else:
 			self.encoded_data= predout
@@ -957,19 +1055,15 @@ class FeatExtractorByol(object):
 		
 		# - Merge encoded data
 		logger.info("Adding source info data to encoded data ...")
-		obj_names= np.array(self.source_names).reshape(N,1)
-		obj_ids= np.array(self.source_ids).reshape(N,1)
-		enc_data= np.concatenate(
-			(obj_names, self.encoded_data, obj_ids),
-			axis=1
-		)
+		snames= [self.source_names[index] for index in data_indexes]
+		sids= [self.source_ids[index] for index in data_indexes]
 
 		# - Save latent data to file
+		#   NB: binary columnar format if file has .npz extension, ascii otherwise
 		logger.info("Saving predicted latent data to file %s ..." % (self.outfile_encoded_data))
-		znames_counter= list(range(1, Nvar+1))
-		znames= '{}{}'.format('z',' z'.join(str(item) for item in znames_counter))
-		head= '{} {} {}'.format("# sname", znames, "id")
-		Utils.write_ascii(enc_data, self.outfile_encoded_data, head)	
+		if Utils.write_feature_data(self.outfile_encoded_data, self.encoded_data, snames, sids)<0:
+			logger.error("Failed to save latent data to file %s!" % (self.outfile_encoded_data))
+			return -1
 
 		return 0
 
@@ -980,39 +1074,37 @@ class FeatExtractorByol(object):
 	def __save_tb_embeddings(self):
 		""" Save embeddings for tensorboard visualization """
 		
-		# - Set nembeddings to be saved: -1=ALL
-		if self.nembeddings_save==-1 or self.nembeddings_save>self.nsamples:
-			n_embeddings= self.nsamples
-		else:
-			n_embeddings= self.nembeddings_save
-
-		# - Loop and save
+		# - Set data indexes of embeddings to be saved: -1=ALL
+		data_indexes= list(range(self.nsamples))
+		if self.shuffle_embeddings:
+			random.shuffle(data_indexes)
+		if self.nembeddings_save!=-1 and self.nembeddings_save<len(data_indexes):
+			data_indexes= data_indexes[:self.nembeddings_save]
+
+		# - Loop over batches and save
 		imgs= []
 		img_embeddings= []
 		labels= []
 
-		for i in range(n_embeddings):
+		data_generator= self.dg_test_embeddings.generate_inference_data(
+			batch_size=self.predict_batch_size,
+			data_indexes=data_indexes
+		)
 
-			# - Get data from generator
-			data, sdata= next(self.test_data_generator_embeddings)
-			class_id= sdata.id
-			class_name= sdata.label
+		for data, indexes in data_generator:
 			nimgs= data.shape[0]
 			nchannels= data.shape[3]
 
-			# - Get latent data for this output
-			predout= self.f_online.predict(
-				x= data,	
-				batch_size=1,
-    		verbose=2,
-    		workers=self.nworkers,
-    		use_multiprocessing=self.use_multiprocessing
-			)
+			# - Get latent data for this batch
+			predout= self.f_online.predict_on_batch(data)
+			if isinstance(predout, (list, tuple)):
+				predout= predout[0]
+			predout= np.asarray(predout)
 
 			# - Save embeddings & labels	
 			for j in range(nimgs):
 				img_embeddings.append(predout[j])
-				labels.append(class_id)
+				labels.append(self.source_ids[indexes[j]])
 
 			# - Save images (if nchan=1 or nchan=3)
 			if nchannels==1 or nchannels==3:
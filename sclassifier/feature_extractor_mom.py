@@ -15,6 +15,7 @@ import json
 from collections import defaultdict
 import operator as op
 import copy
+from concurrent.futures import ProcessPoolExecutor
 
 ## COMMAND-LINE ARG MODULES
 import getopt
@@ -58,6 +59,18 @@ from matplotlib import patches
 ## MODULES
 from sclassifier import logger
 
+# - Feature extractor instance used by worker processes
+_worker_fe= None
+
+def _init_worker(fe):
+	""" Set feature extractor used by worker process """
+	global _worker_fe
+	_worker_fe= fe
+
+def _process_sources_task(indexes):
+	""" Process sources at given indexes in a worker process """
+	return _worker_fe.process_sources(indexes)
+
 
 #####################################
 ##     SData
@@ -1251,9 +1264,15 @@ class FeatExtractorMom(object):
 		# - Draw options
 		self.draw= False
 
+		# - Parallel options
+		#   NB: if nworkers>1 sources are processed in a pool of worker processes, in chunks of chunk_size sources
+		self.nworkers= 1
+		self.chunk_size= 0 # if <=0 set from data size and number of workers
+
 		# - Output options
 		self.save= True
 		self.par_dict_list= []
+		self.failed_snames= []
 		self.outfile= "features_moments.csv"
 
 
@@ -1288,10 +1307,7 @@ class FeatExtractorMom(object):
 
 		# - Loop over data and extract params per each source
 		logger.info("Loop over data and extract params per each source ...")
-		for i in range(self.datasize):
-			if self.__process_sdata(i)<0:
-				logger.error("Failed to read and process source data %d, skip to next..." % (i))
-				continue
+		self.__process_all_sources()
 			
 		# - Save data
 		if self.save:
@@ -1312,10 +1328,7 @@ class FeatExtractorMom(object):
 
 		# - Loop over data and extract params per each source
 		logger.info("Loop over data and extract params per each source ...")
-		for i in range(self.datasize):
-			if self.__process_sdata(i)<0:
-				logger.error("Failed to read and process source data %d, skip to next..." % (i))
-				continue
+		self.__process_all_sources()
 			
 		# - Save data
 		if self.save:
@@ -1325,6 +1338,52 @@ class FeatExtractorMom(object):
 		return 0
 
 
+	def process_sources(self, indexes):
+		""" Process sources at given indexes. Returns a list of (index, status, par_dict) tuples (par_dict is None if no features are to be saved) """
+
+		results= []
+		for index in indexes:
+			try:
+				status, par_dict= self.__process_sdata(index)
+			except Exception as e:
+				logger.error("Exception caught while processing source data %d (err=%s)!" % (index, str(e)))
+				status, par_dict= -1, None
+			results.append( (index, status, par_dict) )
+
+		return results
+
+	def __process_all_sources(self):
+		""" Process all sources (in a pool of worker processes if nworkers>1) and merge features in input order """
+
+		# - Process sources
+		if self.nworkers<=1 or self.datasize<=1:
+			results= self.process_sources(range(self.datasize))
+		else:
+			chunk_size= self.chunk_size
+			if chunk_size<=0:
+				chunk_size= max(1, int(np.ceil(self.datasize/float(4*self.nworkers))))
+			chunks= [list(range(i, min(i+chunk_size, self.datasize))) for i in range(0, self.datasize, chunk_size)]
+
+			logger.info("Processing #%d sources in a pool of %d workers (#%d chunks of size %d) ..." % (self.datasize, self.nworkers, len(chunks), chunk_size))
+			results= []
+			with ProcessPoolExecutor(max_workers=self.nworkers, initializer=_init_worker, initargs=(self,)) as executor:
+				for chunk_results in executor.map(_process_sources_task, chunks):
+					results.extend(chunk_results)
+
+		# - Merge results in input order and report failures
+		self.failed_snames= []
+		for index, status, par_dict in results:
+			if status<0:
+				logger.error("Failed to read and process source data %d (sname=%s), skip to next..." % (index, self.snames[index]))
+				self.failed_snames.append(self.snames[index])
+				continue
+			if par_dict is not None:
+				self.par_dict_list.append(par_dict)
+
+		logger.info("#%d/%d sources processed (#%d failed) ..." % (self.datasize-len(self.failed_snames), self.datasize, len(self.failed_snames)))
+
+		return 0
+
 	def __save_data(self):
 		""" Save data to file """
 
@@ -1345,7 +1404,7 @@ class FeatExtractorMom(object):
 
 
 	def __process_sdata(self, index):
-		""" Process source data """
+		""" Process source data. Returns status and feature dict (None if no features are to be saved) """
 
 		#===========================
 		#==    READ DATA
@@ -1355,7 +1414,7 @@ class FeatExtractorMom(object):
 		ret= self.__read_sdata(index)
 		if ret is None:
 			logger.error("Failed to read source data %d!" % (index))
-			return -1
+			return -1, None
 
 		sdata= ret[0]
 		sdata_mask= ret[1]
@@ -1368,14 +1427,14 @@ class FeatExtractorMom(object):
 			logger.info("Shrinking img+mask on source masked data %d ..." % (index))
 			if sdata_mask.shrink_masks(self.erode_kernels)<0:
 				logger.warn("Failed to shrink mask for source masked data %d!" % (index))
-				return -1
+				return -1, None
 
 		# - Expand img & mask in masked sdata?
 		if self.grow_masks:
 			logger.info("Expanding img+mask on source masked data %d ..." % (index))
 			if sdata_mask.grow_masks(self.dilate_kernels)<0:
 				logger.warn("Failed to expand mask for source masked data %d!" % (index))
-				return -1
+				return -1, None
 
 		masks= sdata_mask.img_data_mask
 		#mask_ref= masks[self.refch]
@@ -1387,13 +1446,13 @@ class FeatExtractorMom(object):
 		has_good_data= sdata.has_good_data(check_mask=False, check_bad=True, check_neg=False, check_same=True)
 		if not has_good_data:
 			logger.warn("Source data %d are bad (too may NANs or equal pixel values)!" % (index))
-			return -1
+			return -1, None
 
 		# - Check masked data
 		has_good_mask_data= sdata_mask.has_good_data(check_mask=False, check_bad=True, check_neg=True, check_same=True)
 		if not has_good_mask_data:
 			logger.warn("Source mask data %d are bad (too may NANs/negative or equal pixel values)!" % (index))
-			return -1
+			return -1, None
 
 		#===========================
 		#==  CHECK AE RECO ACCURACY
@@ -1408,7 +1467,7 @@ class FeatExtractorMom(object):
 		logger.info("Computing bkg on source data %d ..." % (index))
 		if sdata.compute_bkg(masks)<0:
 			logger.warn("Failed to compute bkg for source data %d!" % (index))
-			return -1
+			return -1, None
 
 		bkg_levels= sdata.bkg_levels
 
@@ -1425,7 +1484,7 @@ class FeatExtractorMom(object):
 		#	logger.info("Subtracting bkg on source data %d ..." % (index))
 		#	if sdata.subtract_bkg(bkg_levels, self.subtract_bkg_only_refch)<0:
 		#		logger.warn("Failed to subtract bkg for source data %d!" % (index))
-		#		return -1
+		#		return -1, None
 
 		# - Compute integrated flux (no source extraction here, only sum of pixel fluxes in mask)
 		logger.info("Computing flux on source data %d ..." % (index))
@@ -1446,7 +1505,7 @@ class FeatExtractorMom(object):
 		logger.info("Computing moments on source data %d ..." % (index))	
 		if sdata.compute_img_moments()<0:
 			logger.warn("Failed to compute moments for source data %d!" % (index))
-			return -1
+			return -1, None
 
 		#===========================
 		#==    COMPUTE SSIM
@@ -1455,7 +1514,7 @@ class FeatExtractorMom(object):
 			logger.info("Computing ssim pars on source data %d ..." % (index))	
 			if sdata.compute_ssim_pars(self.ssim_winsize)<0:
 				logger.warn("Failed to compute SSIM pars for source data %d!" % (index))
-				return -1
+				return -1, None
 
 		#===========================
 		#==   FILL SOURCE OUT DATA
@@ -1467,22 +1526,18 @@ class FeatExtractorMom(object):
 		par_dict= sdata.param_dict
 		if par_dict is None or not par_dict:
 			logger.warn("Feature dict for source data %d is empty or None, skip it ..." % (index))
+			return 0, None
 			
-		else:
-			# - Select features?
-			if self.select_feat and self.selfeatids:
-				ret= sdata.select_features(self.selfeatids)
-				par_dict= sdata.param_dict
-
-				if ret==0:
-					self.par_dict_list.append(par_dict)
-				else:
-					logger.warn("Failed to select features for source data %d, skip it ..." % (index))
-
-			else:
-				self.par_dict_list.append(par_dict)
+		# - Select features?
+		if self.select_feat and self.selfeatids:
+			ret= sdata.select_features(self.selfeatids)
+			par_dict= sdata.param_dict
+
+			if ret!=0:
+				logger.warn("Failed to select features for source data %d, skip it ..." % (index))
+				return 0, None
 		
-		return 0
+		return 0, par_dict
 
 
 	def __read_sdata(self, index):
@@ -97,7 +97,10 @@ matplotlib.use('Agg')
 from .utils import Utils
 #from .data_loader import DataLoader
 #from .data_loader import SourceData
-from .tf_utils import SoftmaxCosineSim, nt_xent_loss
+from .tf_utils import SoftmaxCosineSim, NTXentLoss, nt_xent_loss, nt_xent_loss_fused, predict_in_batches, stream_embeddings_to_file
+from .tf_utils import GradientAccumulator, make_gradient_accumulation_model, get_compile_options
+from .tf_distribute import get_num_workers, get_num_replicas, is_chief, distribute_data, compile_step
+from .tf_dataset import TFDatasetBuilder
 from .models import resnet18, resnet34
 
 
@@ -159,26 +162,30 @@ class WarmUpCosineDecay(keras.optimizers.schedules.LearningRateSchedule):
 		
 
 class SaveModelCheckpointCB(tf.keras.callbacks.Callback):
-	""" Define custom callback to save model every epoch """
+	""" Define custom callback to save model every epoch. 
+			If save_model is given, it is saved in place of the trained model (e.g. the functional model wrapped for gradient accumulation) 
+	"""
 	
-	def __init__(self, encoder_model):
+	def __init__(self, encoder_model, save_model=None):
 		super().__init__()
 		self.encoder= encoder_model
+		self.save_model= save_model
 	
 	def __save(self, epoch):
 		""" Save model & encoder model & weights """
 		
 		cpid= epoch + 1
+		model= self.save_model if self.save_model is not None else self.model
 		
 		#- Save the model weights
 		weight_filepath= 'weights_' + f'cp{cpid:04d}.h5'
 		logger.info("Saving model weights to file %s ..." % (weight_filepath))
-		self.model.save_weights(weight_filepath, overwrite=True)
+		model.save_weights(weight_filepath, overwrite=True)
 				
 		#- Save the model
 		model_filepath= 'model_' + f'cp{cpid:04d}.h5'
 		logger.info("Saving full model to file %s ..." % (model_filepath))
-		self.model.save(model_filepath, overwrite=True)
+		model.save(model_filepath, overwrite=True)
 		
 		# - Save encoder
 		#   NB: Saving the encoder weights directly does not work when 
@@ -191,7 +198,7 @@ class SaveModelCheckpointCB(tf.keras.callbacks.Callback):
 			# - Get encoder weights from model
 			logger.info("Retrieving current encoder weights at epoch %d from trained model ..." % (epoch))
 			try:
-				encoder_weights= self.model.get_layer("base_model").get_weights()
+				encoder_weights= model.get_layer("base_model").get_weights()
 			except Exception as e:
 				logger.error("Failed to retrieve current encoder weights from model!")
 				return -1
@@ -265,6 +272,10 @@ class FeatExtractorSimCLR(object):
 		self.validation_steps= 10
 		self.use_multiprocessing= True
 		self.nworkers= 0
+		self.use_tf_data= False
+		self.tf_data_cache= False
+		self.tf_data_cachefile= ""
+		self.predict_batch_size= 32
 
 		# *****************************
 		# ** Model
@@ -319,6 +330,9 @@ class FeatExtractorSimCLR(object):
 		self.nepochs_done= 0
 		self.nepochs_warmup= 10
 		self.nepochs_schedule_tot= 100
+		self.grad_accum_steps= 1 # if >1, gradients are accumulated over this number of batches before each optimizer update
+		self.use_xla= False # compile train & predict steps with XLA (graph mode)
+		self.strategy= None # tf.distribute strategy for multi-worker training (models & optimizer must be created in its scope)
 		
 		self.temperature = 0.1 # 0.5
 		self.ph_regul= 0.005
@@ -334,6 +348,12 @@ class FeatExtractorSimCLR(object):
 
 		self.use_simclr_impl_v2= False
 
+		# - Contrastive loss options
+		#   NB: if use_fused_ntxent, a vectorised NT-Xent loss is used in both implementations (in v1 the model is compiled without loss).
+		#       If ntxent_block_size>0, similarities are computed in blocks of this size to bound memory with large batches.
+		self.use_fused_ntxent= False
+		self.ntxent_block_size= 0
+
 		# *****************************
 		# ** Output
 		# *****************************
@@ -350,6 +370,11 @@ class FeatExtractorSimCLR(object):
 		self.outfile_tb_embeddings= 'feature_vecs.tsv'
 		self.save_model_every_epoch= False
 
+		# - Streaming options for embeddings (see tf_utils.stream_embeddings_to_file)
+		self.stream_embeddings= False
+		self.embeddings_chunk_size= 10000
+		self.resume_embeddings= False
+
 	#####################################
 	##     SETTERS/GETTERS
 	#####################################
@@ -398,6 +423,14 @@ class FeatExtractorSimCLR(object):
 	#####################################
 	##     SET TRAIN DATA
 	#####################################
+	def __create_tf_dataset_builder(self, dg, cachefile_suffix=""):
+		""" Create tf.data dataset builder for given data generator """
+		ds_builder= TFDatasetBuilder(dg)
+		ds_builder.cache= self.tf_data_cache
+		if self.tf_data_cachefile!="":
+			ds_builder.cachefile= self.tf_data_cachefile + cachefile_suffix
+		return ds_builder
+
 	def __set_data(self):
 		""" Set train data & generator from loader """
 
@@ -410,7 +443,27 @@ class FeatExtractorSimCLR(object):
 		self.nsamples= len(self.source_labels)
 
 		# - Create train data generator
-		if self.use_simclr_impl_v2:
+		if self.use_tf_data:
+			logger.info("Creating train tf.data dataset ...")
+			ds_builder= self.__create_tf_dataset_builder(self.dg)
+			if self.use_simclr_impl_v2:
+				ds= ds_builder.build_simclr_dataset_v2(
+					batch_size=self.batch_size, 
+					shuffle=self.shuffle_train_data,
+					balance_classes=self.balance_classes, class_probs=self.class_probs
+				)
+			else:
+				ds= ds_builder.build_simclr_dataset(
+					batch_size=self.batch_size, 
+					shuffle=self.shuffle_train_data,
+					balance_classes=self.balance_classes, class_probs=self.class_probs
+				)
+			if ds is None:
+				logger.error("Failed to create train tf.data dataset!")
+				return -1
+			self.train_data_generator= iter(ds) if self.use_simclr_impl_v2 else ds # NB: v2 train loop fetches data with next()
+
+		elif self.use_simclr_impl_v2:
 			self.train_data_generator= self.dg.generate_simclr_data_v2(
 				batch_size=self.batch_size, 
 				shuffle=self.shuffle_train_data,
@@ -446,7 +499,17 @@ class FeatExtractorSimCLR(object):
 
 			logger.info("Loading cv data in batches? %d (batch_size_cv=%d)" % (self.load_cv_data_in_batches, batch_size_cv))
 
-			if self.use_simclr_impl_v2:
+			if self.use_tf_data:
+				ds_builder= self.__create_tf_dataset_builder(self.dg_cv, cachefile_suffix="_cv")
+				if self.use_simclr_impl_v2:
+					ds= ds_builder.build_simclr_dataset_v2(batch_size=batch_size_cv, shuffle=False)
+				else:
+					ds= ds_builder.build_simclr_dataset(batch_size=batch_size_cv, shuffle=False)
+				if ds is None:
+					logger.error("Failed to create validation tf.data dataset!")
+					return -1
+				self.crossval_data_generator= iter(ds) if self.use_simclr_impl_v2 else ds
+			elif self.use_simclr_impl_v2:
 				self.crossval_data_generator= self.dg_cv.generate_simclr_data_v2(
 					batch_size=batch_size_cv, 
 					shuffle=False
@@ -466,10 +529,7 @@ class FeatExtractorSimCLR(object):
 			logger.info("Disabling data augmentation in test data generator ...")
 			self.dg_test.disable_augmentation()
 
-		self.test_data_generator= self.dg_test.generate_cae_data(
-			batch_size=1, 
-			shuffle=False
-		)
+		# - NB: test data are read in batches by generate_inference_data when saving embeddings
 
 		# - Create embeddings data generator
 		logger.info("Creating test data generator for embeddings (deep-copying train data generator) ...")
@@ -479,11 +539,6 @@ class FeatExtractorSimCLR(object):
 			logger.info("Disabling data augmentation in test data generator for embeddings ...")
 			self.dg_test_embeddings.disable_augmentation()
 
-		self.test_data_generator_embeddings= self.dg_test_embeddings.generate_data(
-			batch_size=1, 
-			shuffle=self.shuffle_embeddings
-		)
-		
 		return 0
 
 
@@ -843,7 +898,11 @@ class FeatExtractorSimCLR(object):
 		# - Create softmax cosine similarity layer
 		feat_dim= K.int_shape(projhead_outputs[0])[1]
 		##soft_cos_sim= SoftmaxCosineSim(batch_size=self.batch_size, feat_dim=self.latent_dim) # NB: Don't understand why in original code feat_dim is equal to encoder output shape
-		soft_cos_sim= SoftmaxCosineSim(batch_size=self.batch_size, feat_dim=feat_dim, temperature=self.temperature)
+		if self.use_fused_ntxent:
+			logger.info("Using fused NT-Xent loss (block_size=%d) ..." % (self.ntxent_block_size))
+			soft_cos_sim= NTXentLoss(temperature=self.temperature, block_size=self.ntxent_block_size)
+		else:
+			soft_cos_sim= SoftmaxCosineSim(batch_size=self.batch_size, feat_dim=feat_dim, temperature=self.temperature)
 
 		model_outputs= soft_cos_sim(projhead_outputs)
 
@@ -859,7 +918,7 @@ class FeatExtractorSimCLR(object):
 		self.model= Model(inputs=model_inputs, outputs=model_outputs, name='SimCLR')
 
 		logger.info("Compiling SimCLR model ...")
-		self.model.compile(optimizer=self.optimizer, loss=self.loss_type, run_eagerly=True)	
+		self.model.compile(optimizer=self.optimizer, loss=self.__get_model_loss(), **get_compile_options(self.use_xla))	
 
 		# - Print model summary
 		logger.info("Printing SimCLR model architecture ...")
@@ -868,6 +927,18 @@ class FeatExtractorSimCLR(object):
 		return 0
 
 
+	def __get_model_loss(self):
+		""" Return the loss used to compile the model (None if loss is added by the NTXentLoss layer) """
+		if self.use_fused_ntxent:
+			return None
+		return self.loss_type
+
+	def __compute_loss(self, z):
+		""" Compute the SimCLR loss for projections z (2*bs, d) with positive pairs at consecutive positions """
+		if self.use_fused_ntxent:
+			return nt_xent_loss_fused(z, temperature=tf.constant(self.temperature), block_size=self.ntxent_block_size)
+		return nt_xent_loss(z, temperature=tf.constant(self.temperature))
+
 	#####################################
 	##     CREATE MODEL v2
 	##      (https://github.com/garder14/simclr-tensorflow2)   
@@ -1054,32 +1125,49 @@ class FeatExtractorSimCLR(object):
 	#####################################
 	##     TRAIN NN
 	#####################################
-	@tf.function
 	def __train_step_pretraining(self, x):  # (2*bs, ny, nx, 3)
 		""" Train step pretraining """
         
 		# Forward pass
-		with tf.GradientTape(persistent=True) as tape:
+		with tf.GradientTape() as tape:
 			h = self.encoder(x, training=True)  # (2*bs, 256)
 			z = self.projhead(h, training=True)  # (2*bs, 128)
-			loss = nt_xent_loss(z, temperature=tf.constant(self.temperature))
+			loss = self.__compute_loss(z)
+			loss_scaled = loss / get_num_replicas() # gradients are summed over replicas
         
 		# Backward pass
-		grads = tape.gradient(loss, self.encoder.trainable_variables)
-		self.optimizer.apply_gradients(zip(grads, self.encoder.trainable_variables))
-		grads = tape.gradient(loss, self.projhead.trainable_variables)
-		self.optimizer.apply_gradients(zip(grads, self.projhead.trainable_variables))
-		del tape
+		# - NB: a single optimizer update over encoder & projection head variables, so that optimizer iterations 
+		#       (and LR schedule) advance by one per step
+		variables = self.encoder.trainable_variables + self.projhead.trainable_variables
+		grads = tape.gradient(loss_scaled, variables)
+		self.optimizer.apply_gradients(zip(grads, variables))
+
+		return loss
+
+	def __accum_step_pretraining(self, x):  # (2*bs, ny, nx, 3)
+		""" Train step pretraining with gradient accumulation (gradients are applied in __apply_step_pretraining) """
+
+		with tf.GradientTape() as tape:
+			h = self.encoder(x, training=True)
+			z = self.projhead(h, training=True)
+			loss = self.__compute_loss(z)
+			loss_scaled = loss / get_num_replicas() # gradients are summed over replicas
+
+		grads = tape.gradient(loss_scaled, self.grad_accumulator.variables)
+		self.grad_accumulator.accumulate(grads)
 
 		return loss
 
-	@tf.function
+	def __apply_step_pretraining(self):
+		""" Apply accumulated gradients """
+		return self.grad_accumulator.apply()
+
 	def __val_step_pretraining(self, x):  # (2*bs, ny, nx, 3)
 		""" Validation step pretraining """
 
 		h = self.encoder(x, training=False)
 		z = self.projhead(h, training=False)
-		loss = nt_xent_loss(z, temperature=tf.constant(self.temperature))
+		loss = self.__compute_loss(z)
 
 		return loss
 
@@ -1094,13 +1182,16 @@ class FeatExtractorSimCLR(object):
 		#===========================
 		# - Initialize train/test loss vs epoch
 		self.train_loss_vs_epoch= np.zeros((1,self.nepochs))	
-		steps_per_epoch= self.nsamples // self.batch_size
+
+		# - NB: with multi-worker training each worker reads a data shard
+		num_workers= get_num_workers(self.strategy)
+		steps_per_epoch= self.nsamples // (self.batch_size*num_workers)
 
 		# - Set validation steps
 		val_steps_per_epoch= self.validation_steps
 		if self.has_cvdata:
 			if self.load_cv_data_in_batches:
-				val_steps_per_epoch= self.nsamples_cv // self.batch_size
+				val_steps_per_epoch= self.nsamples_cv // (self.batch_size*num_workers)
 			else:
 				val_steps_per_epoch= 1
 				
@@ -1109,9 +1200,11 @@ class FeatExtractorSimCLR(object):
 		#===========================
 		if self.use_warmup_lr_schedule:
 			# - Define learning rate schedule
-			total_steps = steps_per_epoch*self.nepochs_schedule_tot
-			warmup_steps= steps_per_epoch*self.nepochs_warmup
-			steps_done= steps_per_epoch*self.nepochs_done
+			#   NB: steps are optimizer updates (one every grad_accum_steps batches)
+			opt_steps_per_epoch= max(steps_per_epoch // self.grad_accum_steps, 1)
+			total_steps = opt_steps_per_epoch*self.nepochs_schedule_tot
+			warmup_steps= opt_steps_per_epoch*self.nepochs_warmup
+			steps_done= opt_steps_per_epoch*self.nepochs_done
 			#target_lr= 0.1*self.batch_size/256. # taken from BYOL paper (https://hal.inria.fr/hal-02869787v1/document)
 			target_lr= self.learning_rate
 			lr_min= 1.e-6
@@ -1131,7 +1224,7 @@ class FeatExtractorSimCLR(object):
 			
 			# - Compile model again
 			logger.info("Compiling SimCLR model after optimizer update ...")
-			self.model.compile(optimizer=self.optimizer, loss=self.loss_type, run_eagerly=True)	
+			self.model.compile(optimizer=self.optimizer, loss=self.__get_model_loss(), **get_compile_options(self.use_xla))	
 
 
 		#===========================
@@ -1141,19 +1234,26 @@ class FeatExtractorSimCLR(object):
 		#   NB: Disabling callbacks as val_loss is not reliable
 		callbacks= None
 		#checkpoint, earlyStopping, reduce_lr = self.get_callbacks()
-		if self.save_model_every_epoch:
-			checkpointCB= SaveModelCheckpointCB(encoder_model=self.encoder)
+		if self.save_model_every_epoch and is_chief(self.strategy):
+			checkpointCB= SaveModelCheckpointCB(encoder_model=self.encoder, save_model=self.model)
 			callbacks= [checkpointCB]
 			logger.info("Adding SaveModelCheckpointCB to model callbacks ...")
 
+		# - Wrap model for gradient accumulation?
+		train_model= self.model
+		if self.grad_accum_steps>1:
+			logger.info("Accumulating gradients over %d batches (effective batch size=%d) ..." % (self.grad_accum_steps, self.grad_accum_steps*self.batch_size))
+			train_model= make_gradient_accumulation_model(self.model, self.grad_accum_steps)
+			train_model.compile(optimizer=self.optimizer, loss=self.__get_model_loss(), **get_compile_options(self.use_xla))
+
 		# - Train model
 		logger.info("Start SimCLR training (dataset_size=%d, batch_size=%d, steps_per_epoch=%d, val_steps_per_epoch=%d) ..." % (self.nsamples, self.batch_size, steps_per_epoch, val_steps_per_epoch))
 
-		self.fitout= self.model.fit(
-			x=self.train_data_generator,
+		self.fitout= train_model.fit(
+			x=distribute_data(self.strategy, self.train_data_generator),
 			epochs=self.nepochs,
 			steps_per_epoch=steps_per_epoch,
-			validation_data=self.crossval_data_generator,
+			validation_data=distribute_data(self.strategy, self.crossval_data_generator),
 			validation_steps=val_steps_per_epoch,
 			#callbacks=[checkpoint, earlyStopping, reduce_lr],
 			callbacks=callbacks,
@@ -1162,6 +1262,11 @@ class FeatExtractorSimCLR(object):
 			verbose=2
 		)
 
+		# - Only chief worker writes outputs
+		if not is_chief(self.strategy):
+			logger.info("Not chief worker, skip saving model & outputs ...")
+			return 0
+
 		#===========================
 		#==   SAVE NN
 		#===========================
@@ -1293,13 +1398,16 @@ class FeatExtractorSimCLR(object):
 		#===========================
 		# - Initialize train/test loss vs epoch
 		self.train_loss_vs_epoch= np.zeros((1,self.nepochs))	
-		steps_per_epoch= self.nsamples // self.batch_size
+
+		# - NB: with multi-worker training each worker reads a data shard
+		num_workers= get_num_workers(self.strategy)
+		steps_per_epoch= self.nsamples // (self.batch_size*num_workers)
 
 		# - Set validation steps
 		val_steps_per_epoch= self.validation_steps
 		if self.has_cvdata:
 			if self.load_cv_data_in_batches:
-				val_steps_per_epoch= self.nsamples_cv // self.batch_size
+				val_steps_per_epoch= self.nsamples_cv // (self.batch_size*num_workers)
 			else:
 				val_steps_per_epoch= 1
 
@@ -1313,6 +1421,23 @@ class FeatExtractorSimCLR(object):
 		losses_val = []
 		log_every= 1
 
+		# - Set gradient accumulation
+		self.grad_accumulator= None
+		nsteps_done= 0
+		if self.grad_accum_steps>1:
+			logger.info("Accumulating gradients over %d batches (effective batch size=%d) ..." % (self.grad_accum_steps, self.grad_accum_steps*self.batch_size))
+			self.grad_accumulator= GradientAccumulator(
+				self.optimizer, 
+				self.encoder.trainable_variables + self.projhead.trainable_variables,
+				self.grad_accum_steps
+			)
+
+		# - Compile train & validation steps (with XLA if enabled, run on each replica if distributed)
+		train_step= compile_step(self.__train_step_pretraining, self.use_xla, self.strategy)
+		accum_step= compile_step(self.__accum_step_pretraining, self.use_xla, self.strategy)
+		apply_step= compile_step(self.__apply_step_pretraining, self.use_xla, self.strategy, reduce_outputs=False)
+		val_step= compile_step(self.__val_step_pretraining, self.use_xla, self.strategy)
+
 		for epoch_id in range(self.nepochs):
 			  
 			# - Run train
@@ -1321,7 +1446,13 @@ class FeatExtractorSimCLR(object):
 			for batch_id in range(steps_per_epoch):
 				# - Fetch train data from generator
 				x= next(self.train_data_generator)
-				loss = self.__train_step_pretraining(x)
+				if self.grad_accumulator is None:
+					loss = train_step(x)
+				else:
+					loss = accum_step(x)
+					nsteps_done+= 1
+					if nsteps_done % self.grad_accum_steps == 0:
+						apply_step()
 				losses_train_batch.append(float(loss))
 
 				# - Print train losses in batch				
@@ -1333,7 +1464,7 @@ class FeatExtractorSimCLR(object):
 			if self.has_cvdata:
 				for batch_id in range(val_steps_per_epoch):
 					x= next(self.crossval_data_generator)
-					loss = self.__val_step_pretraining(x)
+					loss = val_step(x)
 					losses_val_batch.append(float(loss))
 				
 					if (batch_id + 1) % log_every == 0:
@@ -1348,6 +1479,11 @@ class FeatExtractorSimCLR(object):
 				logger.info("Epoch %d/%d: train_loss=%f, val_loss=%f " % (epoch_id+1, self.nepochs, loss_train, loss_val))
 			else:
 				logger.info("Epoch %d/%d: train_loss=%f" % (epoch_id+1, self.nepochs, loss_train))
+
+		# - Only chief worker writes outputs
+		if not is_chief(self.strategy):
+			logger.info("Not chief worker, skip saving model & outputs ...")
+			return 0
 		
 		#===========================
 		#==   SAVE NN
@@ -1470,26 +1606,47 @@ class FeatExtractorSimCLR(object):
 	########################################
 	##     SAVE EMBEDDINGS
 	########################################
+	def __stream_embeddings(self):
+		""" Save embeddings to file in chunks as batches are predicted (see tf_utils.stream_embeddings_to_file) """
+
+		status= stream_embeddings_to_file(
+			self.encoder, self.dg_test, self.outfile_encoded_data, self.source_names, self.source_ids,
+			batch_size=self.predict_batch_size,
+			chunk_size=self.embeddings_chunk_size,
+			resume=self.resume_embeddings,
+			use_xla=self.use_xla
+		)
+		self.encoded_data= None
+
+		return status
+
 	def __save_embeddings(self):
 		""" Save embeddings """
 
-		# - Set step size
-		nsteps= self.nsamples
+		# - Stream embeddings to file?
+		if self.stream_embeddings:
+			if self.augment_test:
+				logger.warn("Streaming embeddings is not supported with test data augmentation, saving all embeddings at the end ...")
+			else:
+				return self.__stream_embeddings()
+
+		# - Set number of data passes
+		nrepeats= 1
 		if self.augment_test:
-			nsteps= self.augment_scale_factor * self.nsamples
+			nrepeats= self.augment_scale_factor
 		
 		# - Apply model to input
-		logger.info("Running SimCLR prediction on input data (nsteps=%d) ..." % (nsteps))
-		predout= self.encoder.predict(
-			x=self.test_data_generator,
-			#steps=self.nsamples,
-			steps=nsteps,
-    	verbose=2,
-    	workers=self.nworkers,
-    	use_multiprocessing=self.use_multiprocessing
+		logger.info("Running SimCLR prediction on input data (nrepeats=%d, batch_size=%d) ..." % (nrepeats, self.predict_batch_size))
+		data_generator= self.dg_test.generate_inference_data(
+			batch_size=self.predict_batch_size,
+			nrepeats=nrepeats
 		)
+		predout, data_indexes= predict_in_batches(self.encoder, data_generator, use_xla=self.use_xla)
+		if predout is None:
+			logger.error("No predictions made on input data!")
+			return -1
 
-		if type(predout)==tuple and len(predout)>0:
+		if isinstance(predout, (list, tuple)) and len(predout)>0:
 			self.encoded_data= predout[0]
 		else:
 			self.encoded_data= predout
@@ -1497,29 +1654,17 @@ class FeatExtractorSimCLR(object):
 		N= self.encoded_data.shape[0]
 		Nvar= self.encoded_data.shape[1]
 		
-		# - Merge encoded data
+		# - Set source info of encoded data
 		logger.info("Adding source info data to encoded data ...")
-		snames= self.source_names
-		sids= self.source_ids
-		if self.augment_test:
-			snames= self.source_names*self.augment_scale_factor
-			sids= self.source_ids*self.augment_scale_factor
-		
-		#obj_names= np.array(self.source_names).reshape(N,1)
-		#obj_ids= np.array(self.source_ids).reshape(N,1)
-		obj_names= np.array(snames).reshape(N,1)
-		obj_ids= np.array(sids).reshape(N,1)
-		enc_data= np.concatenate(
-			(obj_names, self.encoded_data, obj_ids),
-			axis=1
-		)
+		snames= [self.source_names[index] for index in data_indexes]
+		sids= [self.source_ids[index] for index in data_indexes]
 
 		# - Save latent data to file
+		#   NB: binary columnar format if file has .npz extension, ascii otherwise
 		logger.info("Saving predicted latent data to file %s ..." % (self.outfile_encoded_data))
-		znames_counter= list(range(1, Nvar+1))
-		znames= '{}{}'.format('z',' z'.join(str(item) for item in znames_counter))
-		head= '{} {} {}'.format("# sname", znames, "id")
-		Utils.write_ascii(enc_data, self.outfile_encoded_data, head)
+		if Utils.write_feature_data(self.outfile_encoded_data, self.encoded_data, snames, sids)<0:
+			logger.error("Failed to save latent data to file %s!" % (self.outfile_encoded_data))
+			return -1
 
 		return 0
 
@@ -1530,47 +1675,40 @@ class FeatExtractorSimCLR(object):
 	def __save_tb_embeddings(self):
 		""" Save embeddings for tensorboard visualization """
 		
-		# - Set nembeddings to be saved: -1=ALL
-		if self.nembeddings_save==-1 or self.nembeddings_save>self.nsamples:
-			n_embeddings= self.nsamples
-			if self.augment_test:
-				n_embeddings= self.augment_scale_factor * self.nsamples
-		else:
-			n_embeddings= self.nembeddings_save
-
-		# - Loop and save
+		# - Set data indexes of embeddings to be saved: -1=ALL
+		nrepeats= 1
+		if self.augment_test:
+			nrepeats= self.augment_scale_factor
+		data_indexes= [index for i in range(nrepeats) for index in range(self.nsamples)]
+		if self.shuffle_embeddings:
+			random.shuffle(data_indexes)
+		if self.nembeddings_save!=-1 and self.nembeddings_save<len(data_indexes):
+			data_indexes= data_indexes[:self.nembeddings_save]
+
+		# - Loop over batches and save
 		imgs= []
 		img_embeddings= []
 		labels= []
 
-		for i in range(n_embeddings):
+		data_generator= self.dg_test_embeddings.generate_inference_data(
+			batch_size=self.predict_batch_size,
+			data_indexes=data_indexes
+		)
 
-			# - Get data from generator
-			data, sdata= next(self.test_data_generator_embeddings)
-			class_id= sdata.id
-			class_name= sdata.label
+		for data, indexes in data_generator:
 			nimgs= data.shape[0]
 			nchannels= data.shape[3]
 
-			#print("== data shape ==")
-			#print(data.shape)
-
-			# - Get latent data for this output
-			predout= self.encoder.predict(
-				x= data,	
-				batch_size=1,
-    		verbose=2,
-    		workers=self.nworkers,
-    		use_multiprocessing=self.use_multiprocessing
-			)
-
-			#print("== predout shape ==")
-			#print(predout.shape)
+			# - Get latent data for this batch
+			predout= self.encoder.predict_on_batch(data)
+			if isinstance(predout, (list, tuple)):
+				predout= predout[0]
+			predout= np.asarray(predout)
 
 			# - Save embeddings & labels	
 			for j in range(nimgs):
 				img_embeddings.append(predout[j])
-				labels.append(class_id)
+				labels.append(self.source_ids[indexes[j]])
 
 			# - Save images (if nchan=1 or nchan=3)
 			if nchannels==1 or nchannels==3:
@@ -1682,7 +1820,7 @@ class FeatExtractorSimCLR(object):
 		#==   LOAD MODEL ARCHITECTURE
 		#==============================
 		try:
-			self.model= load_model(modelfile, custom_objects={'SoftmaxCosineSim': SoftmaxCosineSim, 'WarmUpCosineDecay': WarmUpCosineDecay})
+			self.model= load_model(modelfile, custom_objects={'SoftmaxCosineSim': SoftmaxCosineSim, 'NTXentLoss': NTXentLoss, 'WarmUpCosineDecay': WarmUpCosineDecay})
 			
 		except Exception as e:
 			logger.warn("Failed to load model from file %s (err=%s)!" % (modelfile, str(e)))
@@ -1709,7 +1847,7 @@ class FeatExtractorSimCLR(object):
 		#===========================
 		#==   SET LOSS & METRICS
 		#===========================	
-		self.model.compile(optimizer=self.optimizer, loss=self.loss_type, run_eagerly=True)
+		self.model.compile(optimizer=self.optimizer, loss=self.__get_model_loss(), **get_compile_options(self.use_xla))
 
 		# - Print and draw model
 		self.model.summary()
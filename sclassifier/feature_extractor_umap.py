@@ -319,42 +319,54 @@ class FeatExtractorUMAP(object):
 	def set_data_from_file(self, filename):
 		""" Set data from input file. Expected format: sname, N features, classid """
 
-		# - Read table
-		row_start= 0
-		try:
-			table= ascii.read(filename, data_start=row_start)
-		except:
-			logger.error("Failed to read feature file %s!" % filename)
-			return -1
-	
-		print(table.colnames)
-		print(table)
-
-		ncols= len(table.colnames)
-		nfeat= ncols-2
-
-		# - Set data vectors
-		rowIndex= 0
-		self.data_labels= []
-		self.data_classids= []
-		self.source_names= []
-		featdata= []
-
-		for data in table:
-			sname= data[0]
-			classid= data[ncols-1]
+		# - Read binary table? (selected by file extension)
+		if Utils.is_binary_table_file(filename):
+			ret= Utils.read_binary_feature_data(filename)
+			if not ret:
+				logger.error("Failed to read feature file %s!" % filename)
+				return -1
+			featdata, self.source_names, self.data_classids, colnames= ret
 			if self.classid_label_map:
-				label= self.classid_label_map[classid]
+				self.data_labels= [self.classid_label_map[classid] for classid in self.data_classids]
 			else:
-				label= str(classid)
+				self.data_labels= [str(classid) for classid in self.data_classids]
+		else:
+			# - Read table
+			row_start= 0
+			try:
+				table= ascii.read(filename, data_start=row_start)
+			except:
+				logger.error("Failed to read feature file %s!" % filename)
+				return -1
+	
+			print(table.colnames)
+			print(table)
+
+			ncols= len(table.colnames)
+			nfeat= ncols-2
+
+			# - Set data vectors
+			rowIndex= 0
+			self.data_labels= []
+			self.data_classids= []
+			self.source_names= []
+			featdata= []
+
+			for data in table:
+				sname= data[0]
+				classid= data[ncols-1]
+				if self.classid_label_map:
+					label= self.classid_label_map[classid]
+				else:
+					label= str(classid)
 
-			self.source_names.append(sname)
-			self.data_labels.append(label)
-			self.data_classids.append(classid)
-			featdata_curr= []
-			for k in range(nfeat):
-				featdata_curr.append(data[k+1])
-			featdata.append(featdata_curr)
+				self.source_names.append(sname)
+				self.data_labels.append(label)
+				self.data_classids.append(classid)
+				featdata_curr= []
+				for k in range(nfeat):
+					featdata_curr.append(data[k+1])
+				featdata.append(featdata_curr)
 
 		# - Select data columns?
 		if self.selcols:
@@ -366,6 +378,7 @@ class FeatExtractorUMAP(object):
 			logger.error("Empty feature data vector read!")
 			return -1
 		
+		data_shape= self.data.shape
 		self.nsamples= data_shape[0]
 		self.nfeatures= data_shape[1]
 		logger.info("#nsamples=%d" % (self.nsamples))
@@ -24,11 +24,12 @@ from collections import Counter
 import csv
 import io
 
-## ASTRO MODULES
-from astropy.io import ascii
-
 ## SCLASSIFIER MODULES
 from .utils import Utils
+from .lazy_import import lazy_import
+
+## ASTRO MODULES (imported at first use)
+ascii= lazy_import("astropy.io.ascii")
 
 ##############################
 ##     GLOBAL VARS
@@ -178,7 +179,23 @@ class FeatMerger(object):
 	#===========================
 	def __save(self, outfile):
 		""" Save merged data """
+
+		if not self.par_dict_list:
+			logger.error("No merged feature data to be saved!")
+			return -1
 	
+		# - Write binary columnar table? (selected by file extension)
+		if Utils.is_binary_table_file(outfile):
+			logger.info("Saving merged feature data to binary table %s ..." % (outfile))
+			parnames= list(self.par_dict_list[0].keys())
+			snames= [d[parnames[0]] for d in self.par_dict_list]
+			classids= [d[parnames[-1]] for d in self.par_dict_list]
+			data= np.array([[d[k] for k in parnames[1:-1]] for d in self.par_dict_list], dtype=np.float32).reshape(len(snames),-1)
+			if Utils.write_feature_data(outfile, data, snames, classids, colnames=parnames)<0:
+				logger.error("Failed to write merged feature data to binary table %s!" % (outfile))
+				return -1
+			return 0
+
 		# - Write CSV
 		outfile_noext= os.path.splitext(outfile)[0]
 		outfile_csv= outfile_noext + '.csv'
@@ -215,6 +232,8 @@ class FeatMerger(object):
 			if os.path.exists(outfile_csv):
 				os.remove(outfile_csv)
 
+		return 0
+
 	#===========================
 	#==   RUN
 	#===========================
@@ -229,7 +248,9 @@ class FeatMerger(object):
 
 		# - Save data
 		logger.info("Saving merged data to file %s ..." % (outfile))
-		self.__save(outfile)
+		if self.__save(outfile)<0:
+			logger.error("Failed to save merged data!")
+			return -1
 		
 		return 0
 
@@ -244,7 +265,9 @@ class FeatMerger(object):
 
 		# - Save data
 		logger.info("Saving merged data to file %s ..." % (outfile))
-		self.__save(outfile)
+		if self.__save(outfile)<0:
+			logger.error("Failed to save merged data!")
+			return -1
 		
 		return 0
 
@@ -28,9 +28,8 @@ import pickle
 from sclassifier import logger
 
 ## SCI MODULES
-from skimage.metrics import mean_squared_error
-from skimage.metrics import structural_similarity
-from scipy.stats import kurtosis, skew
+#  NB: plotting & optional backends are imported at first use (see lazy_import)
+from .lazy_import import lazy_import, set_agg_backend
 from sklearn.model_selection import cross_val_score
 from sklearn.model_selection import RepeatedStratifiedKFold, StratifiedKFold
 from sklearn.feature_selection import RFE, RFECV
@@ -48,9 +47,7 @@ from lightgbm import early_stopping, log_evaluation, record_evaluation
 from lightgbm import plot_tree
 
 ## GRAPHICS MODULES
-import matplotlib
-import matplotlib.pyplot as plt
-matplotlib.use('Agg')
+plt= lazy_import("matplotlib.pyplot", on_load=set_agg_backend)
 
 ## PACKAGE MODULES
 from .utils import Utils
@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+##################################################
+###          MODULE IMPORT
+##################################################
+## STANDARD MODULES
+import os
+import sys
+import time
+import numpy as np
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+## ADDON MODULES
+import faiss
+from scipy.fft import dctn
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+
+## PACKAGE MODULES
+from .utils import Utils
+
+##############################
+##     GLOBAL VARS
+##############################
+from sclassifier import logger
+
+# - Image hasher instance used by worker processes
+_worker_hasher= None
+
+def _init_worker(hasher):
+	""" Set image hasher used by worker process """
+	global _worker_hasher
+	_worker_hasher= hasher
+
+def _compute_hashes_task(filenames):
+	""" Compute hashes of given image files in a worker process """
+	return [_worker_hasher.compute_hash(filename) for filename in filenames]
+
+
+##############################
+##     IMG HASHER
+##############################
+class ImgHasher(object):
+	""" Find exact and near-exact duplicated images with compact perceptual hashes, as a cheap pre-filter before computing embeddings.
+
+			Each image is read and zscaled (Utils.load_img_as_npy_float), resized to (4*hash_size, 4*hash_size) and hashed to hash_size^2 bits:
+				- dct: sign of low-frequency 2D DCT coefficients with respect to their median (DC term excluded from median)
+				- mean: block-mean values on a (hash_size, hash_size) grid with respect to their median
+			Images with identical hashes are grouped directly, unique hashes within max_dist bits (Hamming distance) are searched with a
+			binary faiss index and linked into groups (connected components). The first image of each group is retained.
+	"""
+
+	def __init__(self, hash_method="dct", hash_size=8, max_dist=4, apply_zscale=True, contrast=0.25, nworkers=1, chunk_size=0, large_data_thr=1000000):
+		""" Return an ImgHasher object """
+
+		# - Hash options
+		self.hash_method= hash_method # {"dct","mean"}
+		self.hash_size= hash_size # hash has hash_size^2 bits
+		self.apply_zscale= apply_zscale
+		self.contrast= contrast
+
+		# - Parallel options
+		#   NB: if nworkers>1 images are hashed in a pool of worker processes, in chunks of chunk_size images
+		self.nworkers= nworkers
+		self.chunk_size= chunk_size
+
+		# - Duplicate search options
+		self.max_dist= max_dist # max number of different bits between near-duplicates (0=exact duplicates only)
+		self.large_data_thr= large_data_thr # number of unique hashes above which a multi-hash index is used
+		self.search_chunk_size= 65536
+
+		# - Outputs
+		self.hashes= None
+		self.valid= None
+		self.nexact= 0
+		self.ngroups= 0
+		self.labels= None # group id of each image
+		self.group_sizes= None # number of images in each group
+		self.representatives= None # row index of retained image of each group
+
+	@property
+	def nbits(self):
+		""" Return number of bits of hashes """
+		return self.hash_size*self.hash_size
+
+	@property
+	def nbytes(self):
+		""" Return number of bytes of packed hashes (NB: bits are zero-padded to a multiple of 8) """
+		return (self.nbits+7)//8
+
+	#############################
+	##     COMPUTE HASHES
+	#############################
+	def compute_hash(self, filename):
+		""" Return packed hash (uint8 array of nbytes) of given image file or None on failure """
+
+		img= Utils.load_img_as_npy_float(
+			filename,
+			add_chan_axis=False, add_batch_axis=False,
+			resize=True, resize_size=4*self.hash_size,
+			apply_zscale=self.apply_zscale, contrast=self.contrast,
+			set_nans_to_min=True
+		)
+		if img is None:
+			return None
+		if img.ndim==3:
+			img= img[:,:,0]
+
+		n= self.hash_size
+		if self.hash_method=="dct":
+			vals= dctn(img, type=2, norm='ortho')[:n, :n].flatten()
+			bits= vals>np.median(vals[1:])
+		elif self.hash_method=="mean":
+			h, w= img.shape[0]//n*n, img.shape[1]//n*n
+			vals= img[:h, :w].reshape(n, h//n, n, w//n).mean(axis=(1,3)).flatten()
+			bits= vals>np.median(vals)
+		else:
+			logger.error("Invalid/unknown hash method (%s) given!" % (self.hash_method))
+			return None
+
+		return np.packbits(bits)
+
+	def compute_hashes(self, filenames):
+		""" Compute hashes of given image files (in a pool of worker processes if nworkers>1). Returns (hashes (N, nbytes), valid flags) """
+
+		N= len(filenames)
+		t0= time.time()
+
+		if self.nworkers<=1 or N<=1:
+			results= [self.compute_hash(filename) for filename in filenames]
+		else:
+			chunk_size= self.chunk_size
+			if chunk_size<=0:
+				chunk_size= max(1, int(np.ceil(N/float(4*self.nworkers))))
+			chunks= [filenames[i:i+chunk_size] for i in range(0, N, chunk_size)]
+
+			logger.info("Hashing #%d images in a pool of %d workers (#%d chunks of size %d) ..." % (N, self.nworkers, len(chunks), chunk_size))
+			results= []
+			with ProcessPoolExecutor(max_workers=self.nworkers, initializer=_init_worker, initargs=(self,)) as executor:
+				for chunk_results in executor.map(_compute_hashes_task, chunks):
+					results.extend(chunk_results)
+
+		hashes= np.zeros((N, self.nbytes), dtype=np.uint8)
+		valid= np.zeros(N, dtype=bool)
+		for i, h in enumerate(results):
+			if h is not None:
+				hashes[i]= h
+				valid[i]= True
+
+		logger.info("#%d/%d images hashed in %.1f s ..." % (np.count_nonzero(valid), N, time.time()-t0))
+
+		return hashes, valid
+
+	#############################
+	##     FIND DUPLICATES
+	#############################
+	def __create_index(self, nhashes):
+		""" Create binary index: multi-hash index for large data (exact range search within max_dist bits), flat index otherwise """
+
+		# - NB: with max_dist+1 substrings, near-duplicates have at least one identical substring (pigeonhole)
+		nhash= self.max_dist+1
+		b= min(self.nbits//nhash, 64)
+		if nhashes>self.large_data_thr and b>=8:
+			logger.info("Creating binary multi-hash index (nbits=%d, nhash=%d, b=%d) ..." % (self.nbits, nhash, b))
+			return faiss.IndexBinaryMultiHash(8*self.nbytes, nhash, b)
+
+		return faiss.IndexBinaryFlat(8*self.nbytes)
+
+	def __find_near_duplicates(self, hashes):
+		""" Return (ngroups, labels) of connected components of unique hashes within max_dist bits """
+
+		N= hashes.shape[0]
+		if self.max_dist<=0 or N<=1:
+			return N, np.arange(N)
+
+		index= self.__create_index(N)
+		index.add(hashes)
+
+		# - Range search in blocks (NB: results have distance<radius, self-matches are harmless)
+		rows= []
+		cols= []
+		for start in range(0, N, self.search_chunk_size):
+			stop= min(start+self.search_chunk_size, N)
+			lims, _, indices= index.range_search(hashes[start:stop], self.max_dist+1)
+			# NB: lims are returned as uint64, that numpy cannot safely cast to repeat counts
+			rows.append(np.repeat(np.arange(start, stop), np.diff(lims).astype(np.int64)))
+			cols.append(indices)
+
+		rows= np.concatenate(rows)
+		cols= np.concatenate(cols)
+		adj= csr_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(N, N))
+
+		return connected_components(adj, directed=False)
+
+	def find_duplicates(self, hashes, valid=None):
+		""" Group images with identical or near-identical hashes and select the first image of each group. Images with invalid hashes are not grouped """
+
+		N= hashes.shape[0]
+		if valid is None:
+			valid= np.ones(N, dtype=bool)
+		valid_indexes= np.flatnonzero(valid)
+		invalid_indexes= np.flatnonzero(~valid)
+
+		# - Group identical hashes
+		uhashes, inverse= np.unique(hashes[valid_indexes], axis=0, return_inverse=True)
+		inverse= inverse.reshape(-1)
+		self.nexact= len(valid_indexes)-uhashes.shape[0]
+		logger.info("#%d unique hashes found over #%d valid images (#%d exact duplicates) ..." % (uhashes.shape[0], len(valid_indexes), self.nexact))
+
+		# - Group near-identical hashes
+		t0= time.time()
+		nugroups, ulabels= self.__find_near_duplicates(uhashes)
+		logger.info("#%d groups of unique hashes found within %d bits in %.1f s ..." % (nugroups, self.max_dist, time.time()-t0))
+
+		# - Set image groups (invalid images in single groups)
+		self.labels= np.zeros(N, dtype=np.int64)
+		self.labels[valid_indexes]= ulabels[inverse]
+		self.labels[invalid_indexes]= nugroups + np.arange(len(invalid_indexes))
+		self.ngroups= nugroups + len(invalid_indexes)
+		self.group_sizes= np.bincount(self.labels, minlength=self.ngroups)
+
+		# - Select first image of each group
+		order= np.argsort(self.labels, kind='stable')
+		labels_sorted= self.labels[order]
+		is_first= np.ones(N, dtype=bool)
+		is_first[1:]= labels_sorted[1:]!=labels_sorted[:-1]
+		self.representatives= np.zeros(self.ngroups, dtype=np.int64)
+		self.representatives[labels_sorted[is_first]]= order[is_first]
+
+		logger.info("#%d/%d images retained (#%d groups with duplicates) ..." % (self.ngroups, N, np.count_nonzero(self.group_sizes>1)))
+
+		return 0
+
+	def run(self, filenames):
+		""" Hash given image files and find duplicates """
+
+		if self.hash_method not in ["dct", "mean"]:
+			logger.error("Invalid/unknown hash method (%s) given!" % (self.hash_method))
+			return -1
+
+		hashes, valid= self.compute_hashes(filenames)
+		if not valid.any():
+			logger.error("No image hashed successfully!")
+			return -1
+
+		self.hashes= hashes
+		self.valid= valid
+
+		return self.find_duplicates(hashes, valid)
+
+	#############################
+	##     OUTPUTS
+	#############################
+	def get_selected_indices(self):
+		""" Return sorted row indices of retained images """
+		return np.sort(self.representatives)
+
+	def get_hex_hashes(self):
+		""" Return hashes as hex strings ('' for images not hashed) """
+		return [h.tobytes().hex() if v else "" for h, v in zip(self.hashes, self.valid)]
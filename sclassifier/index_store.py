@@ -0,0 +1,472 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+##################################################
+###          MODULE IMPORT
+##################################################
+## STANDARD MODULES
+import os
+import sys
+import time
+import datetime
+import numpy as np
+import logging
+import json
+import copy
+
+## ADDON MODULES
+import faiss
+
+## PACKAGE MODULES
+from .utils import Utils
+from .faiss_utils import search_index_chunked, graph_to_lists
+from .faiss_utils import create_index, get_index_factory_key, set_index_search_params
+from .faiss_utils import g_index_types, g_ivf_index_types, g_pq_index_types
+from .index_tuner import IndexTuner
+
+##############################
+##     GLOBAL VARS
+##############################
+from sclassifier import logger
+
+
+##############################
+##     INDEX STORE
+##############################
+class IndexStore(object):
+	""" Persistent faiss similarity index over feature data (e.g. survey embeddings), built once and updated incrementally.
+
+			Vectors are L2-normalized (inner product = cosine similarity) and added with integer store ids, so that entries can
+			be appended (IVF indexes are not retrained) or removed without rebuilding the index (not supported by HNSW).
+			The store is a directory containing:
+				- index.faiss: faiss index (flat, IVFFlat, IVFPQ, OPQ+IVFPQ or HNSW) with vectors added with store ids
+				- index.json: metadata in datalist format ({"data": [{"index_id", "sname", "label", "id", ...}]}) and index options
+				- tuning.json: index tuning report (only if index type was selected with IndexTuner)
+	"""
+
+	index_filename= "index.faiss"
+	meta_filename= "index.json"
+	tuning_filename= "tuning.json"
+
+	def __init__(self, path=""):
+		""" Return an IndexStore object """
+
+		self.path= path
+		self.index= None
+		self.index_type= "" # {"flat","ivfflat","ivfpq","opq_ivfpq","hnsw"}
+		self.index_key= ""
+		self.nfeats= 0
+		self.nprobe= 10
+		self.efsearch= 64
+		self.tuning_report= None
+		self.ntrain= 0
+		self.next_id= 0
+		self.read_only= False
+		self.entries= []
+		self.id_map= {} # store id -> position in entries
+
+	@property
+	def size(self):
+		""" Return number of entries in store """
+		return len(self.entries)
+
+	#############################
+	##     CHECK STORE
+	#############################
+	@classmethod
+	def is_store(cls, path):
+		""" Check if given path is an index store directory """
+		if not path or not os.path.isdir(path):
+			return False
+		return os.path.isfile(os.path.join(path, cls.index_filename)) and os.path.isfile(os.path.join(path, cls.meta_filename))
+
+	#############################
+	##     HELPER METHODS
+	#############################
+	@classmethod
+	def normalize_data(cls, data):
+		""" Return a L2-normalized float32 copy of input data """
+		data= np.array(data, dtype=np.float32, order='C', copy=True)
+		if data.ndim==1:
+			data= np.expand_dims(data, axis=0)
+		faiss.normalize_L2(data)
+		return data
+
+	@classmethod
+	def read_feature_data(cls, filename, datalist_key="data", selcols=[]):
+		""" Read feature data file (.json, datalist entries with feats). Returns (data, entries) or (None, []) on failure """
+
+		try:
+			with open(filename, 'r') as fp:
+				datadict= json.load(fp)
+			entries= datadict[datalist_key]
+		except Exception as e:
+			logger.error("Failed to read data file %s or missing key %s (err=%s)!" % (filename, datalist_key, str(e)))
+			return None, []
+
+		if not entries:
+			logger.error("Read datalist is empty!")
+			return None, []
+
+		featdata= []
+		for idx, item in enumerate(entries):
+			if 'feats' not in item:
+				logger.error("Missing feats data in entry %d of data file %s!" % (idx, filename))
+				return None, []
+			featdata.append(item['feats'])
+
+		data= np.array(featdata, dtype=np.float32)
+		if selcols:
+			data= Utils.get_selected_data_cols(data, selcols)
+			if data is None:
+				return None, []
+
+		return data, entries
+
+	def __set_id_map(self):
+		""" Set store id to entry position map """
+		self.id_map= {entry["index_id"]: i for i, entry in enumerate(self.entries)}
+
+	def __set_search_params(self):
+		""" Set number of clusters visited in search for IVF indexes or efSearch for HNSW indexes """
+		set_index_search_params(self.index, self.index_type, self.nprobe, self.efsearch)
+
+	#############################
+	##     CREATE
+	#############################
+	def create(self, data, entries=[], index_type="auto", large_data_thr=1000000, nlist=256, M=8, nprobe=10, ntrain_max=100000, seed=1, hnsw_m=32, efsearch=64, tuner=None):
+		""" Create index from feature data (N, nfeats) and entry metadata (N dicts, e.g. datalist entries without feats).
+				Index types: {flat,ivfflat,ivfpq,opq_ivfpq,hnsw,auto,tune}. If index_type is auto, an IVFPQ index is used if N>large_data_thr,
+				otherwise an exact flat index. If index_type is tune, index type and parameters are selected by benchmarking candidate
+				indexes with given IndexTuner (default tuner if None), and the tuning report is saved with the store.
+				IVF indexes are trained once on at most ntrain_max random samples.
+		"""
+
+		if data.ndim!=2 or data.shape[0]==0:
+			logger.error("Input data must be a non-empty 2D array!")
+			return -1
+
+		N, nfeats= data.shape
+		if entries and len(entries)!=N:
+			logger.error("Given entries have size (%d) different than feature data (%d)!" % (len(entries), N))
+			return -1
+
+		data_norm= self.normalize_data(data)
+
+		# - Select index type & parameters
+		tuning_report= None
+		if index_type=="auto":
+			index_type= "ivfpq" if N>large_data_thr else "flat"
+
+		elif index_type=="tune":
+			if tuner is None:
+				tuner= IndexTuner(ntrain_max=ntrain_max, seed=seed)
+			tuning_report= tuner.run(data_norm)
+			if tuning_report is None:
+				logger.error("Index tuning failed!")
+				return -1
+			selected= tuning_report["selected"]
+			index_type= selected["index_type"]
+			nlist= selected["nlist"] if selected["nlist"]>0 else nlist
+			M= selected["M"] if selected["M"]>0 else M
+			hnsw_m= selected["hnsw_m"]
+			nprobe= selected["nprobe"] if selected["nprobe"]>0 else nprobe
+			efsearch= selected["efsearch"] if selected["efsearch"]>0 else efsearch
+
+		if index_type not in g_index_types:
+			logger.error("Invalid/unknown index type (%s) given!" % (index_type))
+			return -1
+
+		if index_type in g_ivf_index_types and N<max(nlist, 256):
+			logger.warn("Too few data (%d) to train %s index (nlist=%d), using flat index ..." % (N, index_type, nlist))
+			index_type= "flat"
+
+		if index_type in g_pq_index_types and nfeats % M!=0:
+			logger.error("Number of features (%d) must be a multiple of the number of PQ sub-quantizers (M=%d)!" % (nfeats, M))
+			return -1
+
+		# - Create index
+		index_key= get_index_factory_key(index_type, nlist, M, hnsw_m)
+		index= create_index(index_type, nfeats, nlist, M, hnsw_m)
+		if index is None:
+			return -1
+
+		ntrain= 0
+		if not index.is_trained:
+			rng= np.random.RandomState(seed)
+			train_indexes= np.arange(N) if N<=ntrain_max else np.sort(rng.choice(N, ntrain_max, replace=False))
+			ntrain= len(train_indexes)
+			logger.info("Training %s index on #%d samples (N=%d, nfeats=%d) ..." % (index_key, ntrain, N, nfeats))
+			t0= time.time()
+			index.train(data_norm[train_indexes])
+			logger.info("Index trained in %.1f s ..." % (time.time()-t0))
+		else:
+			logger.info("Creating %s index (N=%d, nfeats=%d) ..." % (index_key, N, nfeats))
+
+		self.index= index
+		self.index_type= index_type
+		self.index_key= index_key
+		self.nfeats= nfeats
+		self.nprobe= nprobe
+		self.efsearch= efsearch
+		self.ntrain= ntrain
+		self.tuning_report= tuning_report
+		self.next_id= 0
+		self.read_only= False
+		self.entries= []
+		self.id_map= {}
+		self.__set_search_params()
+
+		# - Add data
+		if self.__add_normalized(data_norm, entries) is None:
+			return -1
+
+		return 0
+
+	#############################
+	##     ADD/REMOVE
+	#############################
+	def add(self, data, entries=[]):
+		""" Append feature data (N, nfeats) and entry metadata to index, without retraining. Returns the store ids of added entries or None on failure """
+
+		if self.index is None:
+			logger.error("Index not created or opened!")
+			return None
+
+		if data.ndim!=2 or data.shape[1]!=self.nfeats:
+			logger.error("Input data must be a 2D array with %d features!" % (self.nfeats))
+			return None
+
+		if entries and len(entries)!=data.shape[0]:
+			logger.error("Given entries have size (%d) different than feature data (%d)!" % (len(entries), data.shape[0]))
+			return None
+
+		return self.__add_normalized(self.normalize_data(data), entries)
+
+	def __add_normalized(self, data_norm, entries=[]):
+		""" Add normalized data with new store ids """
+
+		if self.read_only:
+			logger.error("Index store opened in read-only (memory-mapped) mode, cannot add entries!")
+			return None
+
+		N= data_norm.shape[0]
+		ids= np.arange(self.next_id, self.next_id + N, dtype=np.int64)
+
+		try:
+			self.index.add_with_ids(data_norm, ids)
+		except Exception as e:
+			logger.error("Failed to add data to index (err=%s)!" % (str(e)))
+			return None
+
+		for i in range(N):
+			entry= copy.deepcopy(entries[i]) if entries else {}
+			entry.pop("feats", None)
+			entry["index_id"]= int(ids[i])
+			self.entries.append(entry)
+
+		self.next_id+= N
+		self.__set_id_map()
+
+		if self.index_type in g_ivf_index_types and self.ntrain>0 and self.size>10*self.ntrain:
+			logger.warn("Index size (%d) is >10 times the IVF training sample size (%d), consider recreating the store if recall degrades ..." % (self.size, self.ntrain))
+
+		logger.info("#%d entries added to index (size=%d) ..." % (N, self.size))
+
+		return [int(item) for item in ids]
+
+	def remove(self, ids):
+		""" Remove entries with given store ids from index. Returns number of removed entries or -1 on failure """
+
+		if self.index is None:
+			logger.error("Index not created or opened!")
+			return -1
+
+		if self.read_only:
+			logger.error("Index store opened in read-only (memory-mapped) mode, cannot remove entries!")
+			return -1
+
+		ids= [int(item) for item in ids if int(item) in self.id_map]
+		if not ids:
+			logger.warn("None of the given ids is present in store, nothing removed ...")
+			return 0
+
+		try:
+			nremoved= self.index.remove_ids(faiss.IDSelectorBatch(np.array(ids, dtype=np.int64)))
+		except Exception as e:
+			logger.error("Failed to remove ids from index (err=%s)!" % (str(e)))
+			return -1
+
+		ids_set= set(ids)
+		self.entries= [entry for entry in self.entries if entry["index_id"] not in ids_set]
+		self.__set_id_map()
+
+		logger.info("#%d entries removed from index (size=%d) ..." % (nremoved, self.size))
+
+		return int(nremoved)
+
+	def get_ids(self, snames):
+		""" Return store ids of entries with given source names """
+		snames_set= set(snames)
+		return [entry["index_id"] for entry in self.entries if entry.get("sname", None) in snames_set]
+
+	def get_entry(self, index_id):
+		""" Return metadata entry of given store id (None if not present) """
+		pos= self.id_map.get(int(index_id), None)
+		if pos is None:
+			return None
+		return self.entries[pos]
+
+	#############################
+	##     SAVE/OPEN
+	#############################
+	def save(self, path=""):
+		""" Save index and metadata to store directory """
+
+		if path!="":
+			self.path= path
+		if self.path=="":
+			logger.error("Empty store path given!")
+			return -1
+
+		if self.index is None:
+			logger.error("Index not created or opened, nothing to save!")
+			return -1
+
+		try:
+			if not os.path.isdir(self.path):
+				os.makedirs(self.path)
+		except Exception as e:
+			logger.error("Failed to create store directory %s (err=%s)!" % (self.path, str(e)))
+			return -1
+
+		# - Write index and metadata to temporary files and replace the old ones
+		indexfile= os.path.join(self.path, self.index_filename)
+		metafile= os.path.join(self.path, self.meta_filename)
+		tuningfile= os.path.join(self.path, self.tuning_filename)
+		meta= {
+			"data": self.entries,
+			"index_type": self.index_type,
+			"index_key": self.index_key,
+			"nfeats": self.nfeats,
+			"nprobe": self.nprobe,
+			"efsearch": self.efsearch,
+			"ntrain": self.ntrain,
+			"next_id": self.next_id,
+			"date": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+		}
+
+		try:
+			faiss.write_index(self.index, indexfile + ".tmp")
+			with open(metafile + ".tmp", 'w') as fp:
+				json.dump(meta, fp)
+			os.replace(indexfile + ".tmp", indexfile)
+			os.replace(metafile + ".tmp", metafile)
+			if self.tuning_report is not None:
+				with open(tuningfile + ".tmp", 'w') as fp:
+					json.dump(self.tuning_report, fp, indent=2)
+				os.replace(tuningfile + ".tmp", tuningfile)
+		except Exception as e:
+			logger.error("Failed to save index store to %s (err=%s)!" % (self.path, str(e)))
+			return -1
+
+		logger.info("Saved index store %s (#%d entries) ..." % (self.path, self.size))
+
+		return 0
+
+	def open(self, mmap=False):
+		""" Read store metadata and index. If mmap is enabled, the index is memory-mapped in read-only mode (for queries only) """
+
+		indexfile= os.path.join(self.path, self.index_filename)
+		metafile= os.path.join(self.path, self.meta_filename)
+
+		# - Read metadata
+		try:
+			with open(metafile, 'r') as fp:
+				meta= json.load(fp)
+		except Exception as e:
+			logger.error("Failed to read index store metadata file %s (err=%s)!" % (metafile, str(e)))
+			return -1
+
+		# - Read index
+		self.read_only= False
+		try:
+			if mmap:
+				try:
+					self.index= faiss.read_index(indexfile, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+					self.read_only= True
+				except Exception as e:
+					logger.warn("Failed to memory-map index file %s (err=%s), reading it in memory ..." % (indexfile, str(e)))
+					self.index= faiss.read_index(indexfile)
+			else:
+				self.index= faiss.read_index(indexfile)
+		except Exception as e:
+			logger.error("Failed to read index file %s (err=%s)!" % (indexfile, str(e)))
+			return -1
+
+		self.entries= meta["data"]
+		self.index_type= meta["index_type"]
+		self.nfeats= meta["nfeats"]
+		self.index_key= meta.get("index_key", "")
+		self.nprobe= meta.get("nprobe", self.nprobe)
+		self.efsearch= meta.get("efsearch", self.efsearch)
+		self.ntrain= meta.get("ntrain", 0)
+		self.next_id= meta["next_id"]
+		self.__set_id_map()
+		self.__set_search_params()
+
+		# - Read tuning report (if any)
+		self.tuning_report= None
+		tuningfile= os.path.join(self.path, self.tuning_filename)
+		if os.path.isfile(tuningfile):
+			try:
+				with open(tuningfile, 'r') as fp:
+					self.tuning_report= json.load(fp)
+			except Exception as e:
+				logger.warn("Failed to read index tuning report %s (err=%s) ..." % (tuningfile, str(e)))
+
+		# - Check consistency between index and metadata
+		if self.index.ntotal!=self.size or self.index.d!=self.nfeats:
+			logger.error("Index (ntotal=%d, d=%d) is not consistent with store metadata (size=%d, nfeats=%d)!" % (self.index.ntotal, self.index.d, self.size, self.nfeats))
+			return -1
+
+		logger.info("Opened index store %s (type=%s, #%d entries, nfeats=%d, mmap=%s) ..." % (self.path, self.index_type, self.size, self.nfeats, str(self.read_only)))
+
+		return 0
+
+	#############################
+	##     SEARCH
+	#############################
+	def search(self, data_vectors, k=10, threshold=0.0, exclude_ids=None, chunk_size=65536, nthreads=1, return_graph=False):
+		""" Return the store ids and cosine similarity scores of the top-k entries most similar to each row of data_vectors
+				with score>=threshold, sorted in descending order of similarity. If exclude_ids (one store id per query, -1=none)
+				is given, the corresponding entry is excluded from the query results (e.g. to skip self-matches).
+				Queries are searched in blocks of chunk_size rows (see faiss_utils.search_index_chunked).
+				Returns (ids_list, scores_list), or the CSR neighbor graph (indptr, ids, scores) if return_graph is True, or None on failure.
+		"""
+
+		if self.index is None:
+			logger.error("Index not created or opened!")
+			return None
+
+		data_norm= self.normalize_data(data_vectors)
+		if data_norm.shape[1]!=self.nfeats:
+			logger.error("Index has %d features, but query vectors have %d features. They must match!" % (self.nfeats, data_norm.shape[1]))
+			return None
+
+		if exclude_ids is not None and len(exclude_ids)!=data_norm.shape[0]:
+			logger.error("Number of excluded ids (%d) is different than number of query vectors (%d)!" % (len(exclude_ids), data_norm.shape[0]))
+			return None
+
+		graph= search_index_chunked(
+			self.index, data_norm, k, threshold,
+			exclude_ids=exclude_ids,
+			strict=False,
+			chunk_size=chunk_size,
+			nthreads=nthreads
+		)
+		if return_graph:
+			return graph
+
+		return graph_to_lists(*graph)
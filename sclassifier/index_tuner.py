@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+##################################################
+###          MODULE IMPORT
+##################################################
+## STANDARD MODULES
+import os
+import sys
+import time
+import datetime
+import numpy as np
+import logging
+import math
+
+## ADDON MODULES
+import faiss
+
+## PACKAGE MODULES
+from .faiss_utils import create_index, get_index_factory_key, set_index_search_params
+from .faiss_utils import g_ivf_index_types, g_pq_index_types
+
+##############################
+##     GLOBAL VARS
+##############################
+from sclassifier import logger
+
+
+##############################
+##     INDEX TUNER
+##############################
+class IndexTuner(object):
+	""" Select the faiss index type and parameters for a feature dataset by benchmarking candidate indexes on a held-out sample.
+
+			A set of query vectors is held out from the (normalized) data and searched against the remaining base vectors.
+			For each candidate index (flat, IVFFlat, IVFPQ, HNSW, optionally OPQ+IVFPQ), search-time parameters (nprobe, efSearch)
+			are increased until the recall@k against exact search reaches target_recall, measuring the query throughput.
+			The fastest operating point meeting the target recall is selected (the exact flat index always meets it).
+	"""
+
+	def __init__(self, k=10, target_recall=0.95, nqueries=1000, nbase_max=0, ntrain_max=100000, index_types=["flat", "ivfflat", "ivfpq", "hnsw"], use_opq=False, nlist=0, M=0, hnsw_m=32, seed=1):
+		""" Return an IndexTuner object """
+
+		self.k= k
+		self.target_recall= target_recall
+		self.nqueries= nqueries
+		self.nbase_max= nbase_max # 0=use all non-query data as search base
+		self.ntrain_max= ntrain_max
+		self.index_types= list(index_types)
+		if use_opq and "opq_ivfpq" not in self.index_types:
+			self.index_types.append("opq_ivfpq")
+		self.nlist= nlist # 0=auto
+		self.M= M # 0=auto
+		self.hnsw_m= hnsw_m
+		self.seed= seed
+
+		# - Search-time parameter values scanned
+		self.nprobe_values= [1, 2, 4, 8, 16, 32, 64, 128, 256, 512]
+		self.efsearch_values= [16, 32, 64, 128, 256, 512, 1024]
+
+		self.report= None
+
+	#############################
+	##     CANDIDATES
+	#############################
+	def __get_nlist(self, nbase):
+		""" Return number of IVF clusters: power of 2 close to 4*sqrt(nbase), with at least 39 training points per cluster """
+		if self.nlist>0:
+			return self.nlist
+		nlist= 2**int(round(math.log2(4*math.sqrt(nbase))))
+		nlist= min(nlist, 2**int(math.log2(max(nbase//39, 1))))
+		return max(nlist, 1)
+
+	def __get_M_values(self, nfeats):
+		""" Return number of PQ sub-quantizers to be tested (must divide the number of features) """
+		if self.M>0:
+			return [self.M] if nfeats % self.M==0 else []
+		return [M for M in [8, 16, 32] if M<=nfeats and nfeats % M==0]
+
+	def __get_candidates(self, nbase, nfeats):
+		""" Return list of candidate index configurations (excluding flat) """
+
+		nlist= self.__get_nlist(nbase)
+		M_values= self.__get_M_values(nfeats)
+		candidates= []
+
+		for index_type in self.index_types:
+			if index_type=="flat":
+				continue
+			elif index_type in g_ivf_index_types and nbase<max(nlist, 256):
+				logger.warn("Too few base data (%d) to train %s index (nlist=%d), skipping it ..." % (nbase, index_type, nlist))
+				continue
+			elif index_type in g_pq_index_types and not M_values:
+				logger.warn("No valid number of PQ sub-quantizers for nfeats=%d, skipping %s index ..." % (nfeats, index_type))
+				continue
+
+			if index_type in g_pq_index_types:
+				for M in M_values:
+					candidates.append({"index_type": index_type, "nlist": nlist, "M": M, "hnsw_m": self.hnsw_m})
+			elif index_type=="ivfflat":
+				candidates.append({"index_type": index_type, "nlist": nlist, "M": 0, "hnsw_m": self.hnsw_m})
+			elif index_type=="hnsw":
+				candidates.append({"index_type": index_type, "nlist": 0, "M": 0, "hnsw_m": self.hnsw_m})
+			else:
+				logger.warn("Invalid/unknown index type (%s), skipping it ..." % (index_type))
+
+		return candidates
+
+	#############################
+	##     BENCHMARK
+	#############################
+	def __compute_recall(self, indices, gt_indices):
+		""" Return recall@k of search results (fraction of exact top-k neighbors retrieved) """
+		nfound= (indices[:, :, None]==gt_indices[:, None, :]).any(axis=2).sum()
+		return float(nfound)/float(gt_indices.size)
+
+	def __benchmark_search(self, index, queries, gt_indices):
+		""" Search queries and return (recall, qps) """
+		t0= time.perf_counter()
+		_, indices= index.search(queries, self.k)
+		dt= max(time.perf_counter()-t0, 1.e-9)
+		return self.__compute_recall(indices, gt_indices), queries.shape[0]/dt
+
+	def __benchmark_candidate(self, cfg, base, queries, gt_indices, rng):
+		""" Build candidate index on base data and scan its search-time parameter until the target recall is reached. Returns list of operating points """
+
+		index_type= cfg["index_type"]
+		nbase, nfeats= base.shape
+		key= get_index_factory_key(index_type, cfg["nlist"], cfg["M"], cfg["hnsw_m"])
+
+		index= create_index(index_type, nfeats, cfg["nlist"], cfg["M"], cfg["hnsw_m"])
+		if index is None:
+			return []
+
+		# - Train & fill index
+		t0= time.perf_counter()
+		try:
+			if not index.is_trained:
+				train_indexes= np.arange(nbase) if nbase<=self.ntrain_max else np.sort(rng.choice(nbase, self.ntrain_max, replace=False))
+				index.train(base[train_indexes])
+			index.add_with_ids(base, np.arange(nbase, dtype=np.int64))
+		except Exception as e:
+			logger.warn("Failed to build index %s (err=%s), skipping it ..." % (key, str(e)))
+			return []
+		build_time= time.perf_counter()-t0
+
+		# - Scan search parameter values
+		if index_type in g_ivf_index_types:
+			param_name= "nprobe"
+			param_values= [item for item in self.nprobe_values if item<=cfg["nlist"]]
+		else:
+			param_name= "efsearch"
+			param_values= [item for item in self.efsearch_values if item>=self.k]
+
+		points= []
+		for value in param_values:
+			if param_name=="nprobe":
+				set_index_search_params(index, index_type, nprobe=value)
+			else:
+				set_index_search_params(index, index_type, efsearch=value)
+
+			recall, qps= self.__benchmark_search(index, queries, gt_indices)
+			point= dict(cfg)
+			point.update({"index_key": key, "nprobe": value if param_name=="nprobe" else 0, "efsearch": value if param_name=="efsearch" else 0, "recall": recall, "qps": qps, "build_time": build_time})
+			points.append(point)
+			logger.info("Index %s (%s=%d): recall@%d=%.3f, qps=%.1f ..." % (key, param_name, value, self.k, recall, qps))
+
+			# - Larger values only slow down search
+			if recall>=self.target_recall:
+				break
+
+		return points
+
+	#############################
+	##     RUN
+	#############################
+	def run(self, data_norm):
+		""" Run tuning over L2-normalized feature data (N, nfeats). Returns the tuning report dictionary (selected configuration in "selected") or None on failure """
+
+		if data_norm.ndim!=2:
+			logger.error("Input data must be a 2D array!")
+			return None
+
+		N, nfeats= data_norm.shape
+		nqueries= min(self.nqueries, N//10)
+		if nqueries<=0 or N-nqueries<self.k:
+			logger.error("Too few data (%d) to tune index with k=%d!" % (N, self.k))
+			return None
+
+		# - Hold out query sample
+		rng= np.random.RandomState(self.seed)
+		perm= rng.permutation(N)
+		query_indexes= np.sort(perm[:nqueries])
+		base_indexes= perm[nqueries:]
+		if self.nbase_max>0 and len(base_indexes)>self.nbase_max:
+			base_indexes= base_indexes[:self.nbase_max]
+		base_indexes= np.sort(base_indexes)
+
+		queries= np.ascontiguousarray(data_norm[query_indexes], dtype=np.float32)
+		base= np.ascontiguousarray(data_norm[base_indexes], dtype=np.float32)
+		nbase= base.shape[0]
+		logger.info("Tuning index on #%d base data with #%d held-out queries (k=%d, target_recall=%.3f) ..." % (nbase, nqueries, self.k, self.target_recall))
+
+		# - Compute ground truth with exact search (also the flat index operating point)
+		cfg= {"index_type": "flat", "nlist": 0, "M": 0, "hnsw_m": self.hnsw_m}
+		t0= time.perf_counter()
+		index= create_index("flat", nfeats)
+		if index is None:
+			return None
+		index.add_with_ids(base, np.arange(nbase, dtype=np.int64))
+		build_time= time.perf_counter()-t0
+
+		t0= time.perf_counter()
+		_, gt_indices= index.search(queries, self.k)
+		qps= nqueries/max(time.perf_counter()-t0, 1.e-9)
+		del index
+
+		flat_point= dict(cfg)
+		flat_point.update({"index_key": get_index_factory_key("flat"), "nprobe": 0, "efsearch": 0, "recall": 1.0, "qps": qps, "build_time": build_time})
+		logger.info("Index %s: recall@%d=1.000, qps=%.1f ..." % (flat_point["index_key"], self.k, qps))
+
+		# - Benchmark candidates
+		points= [flat_point] if "flat" in self.index_types else []
+		for cfg in self.__get_candidates(nbase, nfeats):
+			points.extend(self.__benchmark_candidate(cfg, base, queries, gt_indices, rng))
+
+		if not points:
+			logger.error("No index candidate benchmarked!")
+			return None
+
+		# - Select fastest operating point meeting target recall (highest recall if none)
+		good_points= [item for item in points if item["recall"]>=self.target_recall]
+		if good_points:
+			selected= max(good_points, key=lambda item: item["qps"])
+		else:
+			selected= max(points, key=lambda item: (item["recall"], item["qps"]))
+			logger.warn("No index candidate reaches target recall %.3f, selecting the one with highest recall (%.3f) ..." % (self.target_recall, selected["recall"]))
+
+		logger.info("Selected index %s (nprobe=%d, efsearch=%d, recall@%d=%.3f, qps=%.1f) ..." % (selected["index_key"], selected["nprobe"], selected["efsearch"], self.k, selected["recall"], selected["qps"]))
+
+		self.report= {
+			"k": self.k,
+			"target_recall": self.target_recall,
+			"nqueries": nqueries,
+			"nbase": nbase,
+			"nfeats": nfeats,
+			"ntrain_max": self.ntrain_max,
+			"results": points,
+			"selected": selected,
+			"date": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+		}
+
+		return self.report
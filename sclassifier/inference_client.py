@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+##################################################
+###          MODULE IMPORT
+##################################################
+## STANDARD MODULES
+import os
+import sys
+import logging
+import json
+import socket
+import urllib.request
+
+##############################
+##     GLOBAL VARS
+##############################
+from sclassifier import logger
+
+
+##############################
+##     INFERENCE CLIENT
+##############################
+class InferenceClient(object):
+	""" Thin client for InferenceService servers (see run_inference_server.py). It only uses standard modules.
+
+			Arguments:
+				- socket_path: server Unix socket path (if empty HTTP is used)
+				- url: server HTTP url (e.g. http://127.0.0.1:8080)
+				- timeout: request timeout in seconds
+	"""
+
+	def __init__(self, socket_path="", url="http://127.0.0.1:8080", timeout=600):
+		""" Return an InferenceClient object """
+		self.socket_path= socket_path
+		self.url= url.rstrip("/")
+		self.timeout= timeout
+
+	def request(self, cmd, data=[], **options):
+		""" Send request to server and return the response dictionary (None on failure) """
+
+		request= dict(options)
+		request["cmd"]= cmd
+		request["data"]= data
+
+		try:
+			if self.socket_path!="":
+				return self.__request_unix(request)
+			return self.__request_http(request)
+		except Exception as e:
+			logger.error("Request to inference server failed (err=%s)!" % (str(e)))
+			return None
+
+	def __request_unix(self, request):
+		""" Send json line request over Unix socket """
+
+		with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+			sock.settimeout(self.timeout)
+			sock.connect(self.socket_path)
+			sock.sendall((json.dumps(request) + "\n").encode("utf-8"))
+			with sock.makefile("rb") as fp:
+				line= fp.readline()
+
+		return json.loads(line.decode("utf-8"))
+
+	def __request_http(self, request):
+		""" Send json request over HTTP """
+
+		cmd= request.pop("cmd")
+		if cmd=="info":
+			req= urllib.request.Request(self.url + "/info", method="GET")
+		else:
+			body= json.dumps(request).encode("utf-8")
+			req= urllib.request.Request(self.url + "/" + cmd, data=body, headers={"Content-Type": "application/json"}, method="POST")
+
+		with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+			return json.loads(resp.read().decode("utf-8"))
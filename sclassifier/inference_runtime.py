@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+##################################################
+###          MODULE IMPORT
+##################################################
+## STANDARD MODULES
+import os
+import sys
+import time
+import datetime
+import numpy as np
+import logging
+import json
+import re
+
+## TFLITE INTERPRETER
+#  NB: lightweight tflite_runtime package is used if installed, otherwise the interpreter is taken from tensorflow
+try:
+	from tflite_runtime.interpreter import Interpreter as TFLiteInterpreter
+except ImportError:
+	TFLiteInterpreter= None
+
+##############################
+##     GLOBAL VARS
+##############################
+from sclassifier import logger
+
+
+def sort_output_names(names):
+	""" Return output names sorted by name prefix and numeric suffix (e.g. output_2 before output_10) """
+
+	def sort_key(name):
+		match= re.match(r"^(.*?)(\d+)$", name)
+		if match is None:
+			return (name, -1)
+		return (match.group(1), int(match.group(2)))
+
+	return sorted(names, key=sort_key)
+
+
+##############################
+##     INFERENCE MODEL
+##############################
+class InferenceModel(object):
+	""" Lightweight runtime for models exported with ModelExporter (SavedModel directory or .tflite file).
+			It does not import the training stack (keras models, trainers): SavedModels are loaded with tf.saved_model,
+			TFLite models with tflite_runtime (if installed) or tf.lite. Inputs are float32 arrays of shape (N, ny, nx, nchan),
+			outputs are float32 arrays (a list for multi-output models, in export order).
+
+			Arguments:
+				- path: SavedModel directory or .tflite file
+				- nthreads: number of threads used by TFLite interpreter (None=default)
+	"""
+
+	def __init__(self, path, nthreads=None):
+		""" Return an InferenceModel object """
+
+		self.path= path
+		self.nthreads= nthreads
+		self.format= "tflite" if path.endswith(".tflite") else "saved_model"
+		self.info= {}
+		self.input_shape= None
+		self.output_names= []
+
+		# - Loaded model
+		self.model= None
+		self.serve_fcn= None
+		self.interpreter= None
+		self.runner= None
+
+	#############################
+	##     LOAD
+	#############################
+	def load(self):
+		""" Load exported model and its export info. Returns 0 on success, -1 otherwise """
+
+		# - Read export info (written by ModelExporter)
+		infofile= self.get_info_file(self.path)
+		if os.path.isfile(infofile):
+			try:
+				with open(infofile, 'r') as fp:
+					self.info= json.load(fp)
+			except Exception as e:
+				logger.warn("Failed to read export info file %s (err=%s)!" % (infofile, str(e)))
+		self.input_shape= self.info.get("input_shape", None)
+		self.output_names= self.info.get("output_names", [])
+
+		# - Load model
+		if self.format=="tflite":
+			status= self.__load_tflite()
+		else:
+			status= self.__load_saved_model()
+		if status<0:
+			return -1
+
+		logger.info("Loaded %s model %s (input_shape=%s, outputs=%s, quantization=%s) ..." % (self.format, self.path, str(self.input_shape), str(self.output_names), self.info.get("quantization", "none")))
+
+		return 0
+
+	@classmethod
+	def get_info_file(cls, path):
+		""" Return export info file of given exported model """
+		if path.endswith(".tflite"):
+			return path + ".json"
+		return os.path.join(path, "export_info.json")
+
+	def __load_saved_model(self):
+		""" Load SavedModel serving signature """
+
+		try:
+			import tensorflow as tf
+			self.model= tf.saved_model.load(self.path)
+			self.serve_fcn= self.model.signatures["serving_default"]
+		except Exception as e:
+			logger.error("Failed to load SavedModel from %s (err=%s)!" % (self.path, str(e)))
+			return -1
+
+		if not self.output_names:
+			self.output_names= sort_output_names(self.serve_fcn.structured_outputs.keys())
+
+		return 0
+
+	def __load_tflite(self):
+		""" Load TFLite interpreter """
+
+		interpreter_class= TFLiteInterpreter
+		if interpreter_class is None:
+			try:
+				import tensorflow as tf
+				interpreter_class= tf.lite.Interpreter
+			except Exception as e:
+				logger.error("Neither tflite_runtime nor tensorflow are available (err=%s)!" % (str(e)))
+				return -1
+
+		try:
+			self.interpreter= interpreter_class(model_path=self.path, num_threads=self.nthreads)
+			self.interpreter.allocate_tensors()
+		except Exception as e:
+			logger.error("Failed to load TFLite model from %s (err=%s)!" % (self.path, str(e)))
+			return -1
+
+		# - Use serving signature runner if available (outputs by name), otherwise raw input/output tensors
+		try:
+			if "serving_default" in self.interpreter.get_signature_list():
+				self.runner= self.interpreter.get_signature_runner("serving_default")
+		except Exception:
+			self.runner= None
+
+		if not self.output_names:
+			if self.runner is not None:
+				self.output_names= sort_output_names(self.interpreter.get_signature_list()["serving_default"]["outputs"])
+			else:
+				self.output_names= [item["name"] for item in self.interpreter.get_output_details()]
+
+		return 0
+
+	#############################
+	##     PREDICT
+	#############################
+	def predict(self, inputs):
+		""" Run inference on a batch of inputs. Returns a float32 array (a list of arrays for multi-output models) """
+
+		inputs= np.ascontiguousarray(inputs, dtype=np.float32)
+		if self.format=="tflite":
+			outputs= self.__predict_tflite(inputs)
+		else:
+			outputs= self.serve_fcn(inputs=inputs)
+			outputs= [outputs[name].numpy() for name in self.output_names]
+
+		outputs= [np.asarray(item, dtype=np.float32) for item in outputs]
+		if len(outputs)==1:
+			return outputs[0]
+		return outputs
+
+	def __predict_tflite(self, inputs):
+		""" Run TFLite inference on a batch of inputs, resizing input tensor to batch size if needed """
+
+		if self.runner is not None:
+			outputs= self.runner(inputs=inputs)
+			return [outputs[name] for name in self.output_names]
+
+		input_details= self.interpreter.get_input_details()[0]
+		if tuple(input_details["shape"])!=inputs.shape:
+			self.interpreter.resize_tensor_input(input_details["index"], inputs.shape)
+			self.interpreter.allocate_tensors()
+
+		self.interpreter.set_tensor(input_details["index"], inputs)
+		self.interpreter.invoke()
+
+		return [self.interpreter.get_tensor(item["index"]).copy() for item in self.interpreter.get_output_details()]
+
+	def predict_in_batches(self, data_generator):
+		""" Run inference on (inputs, data_indexes) batches returned by a generator (e.g. DataGenerator.generate_inference_data).
+				Returns model outputs (a list of float32 arrays for multi-output models) and the data indexes of output rows
+		"""
+
+		outputs= None
+		data_indexes= []
+
+		for inputs, indexes in data_generator:
+			predout= self.predict(inputs)
+			if not isinstance(predout, list):
+				predout= [predout]
+			if outputs is None:
+				outputs= [[] for item in predout]
+			for i in range(len(predout)):
+				outputs[i].append(predout[i])
+			data_indexes.extend(indexes)
+
+		if outputs is None:
+			logger.warn("No data returned by generator, no predictions made!")
+			return None, []
+
+		outputs= [np.concatenate(item, axis=0) for item in outputs]
+		if len(outputs)==1:
+			outputs= outputs[0]
+
+		return outputs, data_indexes
+
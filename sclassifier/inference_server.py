@@ -0,0 +1,476 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+##################################################
+###          MODULE IMPORT
+##################################################
+## STANDARD MODULES
+import os
+import sys
+import time
+import datetime
+import numpy as np
+import logging
+import json
+import queue
+import threading
+import socketserver
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+## PACKAGE MODULES
+from sclassifier import __version__
+from .data_loader import SourceData
+from .inference_runtime import InferenceModel
+
+##############################
+##     GLOBAL VARS
+##############################
+from sclassifier import logger
+
+# - Commands supported by the inference service
+g_commands= ["features", "classify", "search", "info"]
+
+
+##############################
+##     INFERENCE TASK
+##############################
+class InferenceTask(object):
+	""" Pre-processed inputs of one request, waiting to be run in a micro-batch """
+
+	def __init__(self, inputs):
+		""" Return an InferenceTask object """
+		self.inputs= inputs
+		self.feats= None
+		self.error= ""
+		self.done= threading.Event()
+
+	def wait(self, timeout=None):
+		""" Wait for task to be processed. Returns False on timeout """
+		return self.done.wait(timeout)
+
+
+##############################
+##     INFERENCE SERVICE
+##############################
+class InferenceService(object):
+	""" Resident inference service keeping pre-processing pipeline, encoder, classifier and similarity index loaded
+			across requests (see run_inference_server.py).
+
+			Requests are dictionaries with keys:
+				- cmd: {"features","classify","search"}
+				- data: list of datalist entries (dicts with filepaths, sname, ...) or image paths (.fits)
+				- k, score_thr: similarity search options (optional)
+			Entries are read and pre-processed in the request thread, then encoder inference is run on micro-batches
+			collecting the entries of concurrent requests (up to max_batch_size samples or max_latency seconds).
+
+			Arguments:
+				- preprocessor: DataPreprocessor applied to read images (None=no pre-processing)
+	"""
+
+	def __init__(self, preprocessor=None):
+		""" Return an InferenceService object """
+
+		self.preprocessor= preprocessor
+
+		# - Models
+		self.encoder= None # InferenceModel
+		self.classifier= None # SClassifier
+		self.index_store= None # IndexStore
+
+		# - Micro-batching options
+		self.max_batch_size= 32
+		self.max_latency= 0.01 # max time (s) to wait for more requests before running a batch
+		self.task_timeout= 600 # max time (s) a request waits for its batch
+
+		# - Default similarity search options
+		self.k= 10
+		self.score_thr= 0.0
+
+		# - Batching worker
+		self.task_queue= queue.Queue()
+		self.worker= None
+		self.running= False
+
+		# - Stats
+		#   NB: requests are processed in concurrent server threads
+		self.stats_lock= threading.Lock()
+		self.nrequests= 0
+		self.nbatches= 0
+		self.nsamples= 0
+
+	#############################
+	##     LOAD
+	#############################
+	def load_encoder(self, path, nthreads=None):
+		""" Load encoder exported with ModelExporter (SavedModel directory or .tflite file) """
+
+		encoder= InferenceModel(path, nthreads=nthreads)
+		if encoder.load()<0:
+			logger.error("Failed to load encoder model %s!" % (path))
+			return -1
+
+		self.encoder= encoder
+
+		return 0
+
+	def load_classifier(self, modelfile, scalerfile="", multiclass=True, normalize=False):
+		""" Load SClassifier model (.sav) trained on encoder features """
+
+		from .classifier import SClassifier
+
+		classifier= SClassifier(multiclass=multiclass)
+		classifier.normalize= normalize
+		if classifier.load_model(modelfile, scalerfile)<0:
+			logger.error("Failed to load classifier model %s!" % (modelfile))
+			return -1
+
+		self.classifier= classifier
+
+		return 0
+
+	def load_index(self, path, datalist_key="data", selcols=[], large_data_thr=1000000, nlist=256, M=8, nprobe=10, mmap=False):
+		""" Load similarity index from an index store directory, or create it from a feature data file (.json, entries with feats) """
+
+		from .index_store import IndexStore
+
+		store= IndexStore(path)
+		if IndexStore.is_store(path):
+			if store.open(mmap=mmap)<0:
+				logger.error("Failed to open index store %s!" % (path))
+				return -1
+		else:
+			data, entries= IndexStore.read_feature_data(path, datalist_key, selcols)
+			if data is None:
+				logger.error("Failed to read feature data file %s!" % (path))
+				return -1
+			if store.create(data, entries, large_data_thr=large_data_thr, nlist=nlist, M=M, nprobe=nprobe)<0:
+				logger.error("Failed to create similarity index!")
+				return -1
+
+		self.index_store= store
+		logger.info("Similarity index loaded with #%d entries ..." % (store.size))
+
+		return 0
+
+	#############################
+	##     START/STOP
+	#############################
+	def start(self):
+		""" Start micro-batching worker """
+
+		if self.encoder is None:
+			logger.error("No encoder loaded, cannot start service!")
+			return -1
+
+		self.running= True
+		self.worker= threading.Thread(target=self.__run_batches, daemon=True)
+		self.worker.start()
+
+		return 0
+
+	def stop(self):
+		""" Stop micro-batching worker """
+
+		self.running= False
+		self.task_queue.put(None)
+		if self.worker is not None:
+			self.worker.join()
+			self.worker= None
+
+		return 0
+
+	def get_info(self):
+		""" Return service info """
+		return {
+			"version": __version__,
+			"encoder": self.encoder.path if self.encoder is not None else "",
+			"classifier": self.classifier.classifier if self.classifier is not None else "",
+			"index_size": self.index_store.size if self.index_store is not None else 0,
+			"nrequests": self.nrequests,
+			"nbatches": self.nbatches,
+			"nsamples": self.nsamples
+		}
+
+	#############################
+	##     MICRO-BATCHING
+	#############################
+	def __run_batches(self):
+		""" Collect tasks from queue and run encoder on micro-batches of their inputs """
+
+		while self.running:
+			task= self.task_queue.get()
+			if task is None:
+				break
+
+			# - Collect more tasks until batch is full or max latency is reached
+			tasks= [task]
+			nsamples= task.inputs.shape[0]
+			t_end= time.time() + self.max_latency
+			while nsamples<self.max_batch_size:
+				try:
+					task= self.task_queue.get(timeout=max(t_end-time.time(), 0))
+				except queue.Empty:
+					break
+				if task is None:
+					self.running= False
+					break
+				tasks.append(task)
+				nsamples+= task.inputs.shape[0]
+
+			self.__process_tasks(tasks)
+
+		# - Release pending tasks
+		while not self.task_queue.empty():
+			task= self.task_queue.get()
+			if task is not None:
+				task.error= "Service stopped"
+				task.done.set()
+
+	def __process_tasks(self, tasks):
+		""" Run encoder on concatenated task inputs and split features back to tasks """
+
+		try:
+			inputs= np.concatenate([task.inputs for task in tasks], axis=0)
+			feats= []
+			for i in range(0, inputs.shape[0], self.max_batch_size):
+				outputs= self.encoder.predict(inputs[i:i+self.max_batch_size])
+				if isinstance(outputs, list):
+					outputs= outputs[0]
+				feats.append(outputs.reshape(outputs.shape[0], -1))
+			feats= np.concatenate(feats, axis=0)
+
+			offset= 0
+			for task in tasks:
+				n= task.inputs.shape[0]
+				task.feats= feats[offset:offset+n]
+				offset+= n
+
+			self.nbatches+= 1
+			self.nsamples+= inputs.shape[0]
+
+		except Exception as e:
+			logger.error("Failed to run encoder on batch (err=%s)!" % (str(e)))
+			for task in tasks:
+				task.error= "Encoder inference failed"
+
+		for task in tasks:
+			task.done.set()
+
+	#############################
+	##     READ DATA
+	#############################
+	def __read_entry(self, entry):
+		""" Read and pre-process a request entry (datalist entry or image path). Returns the data cube or None """
+
+		if isinstance(entry, str):
+			entry= {"filepaths": [entry], "sname": os.path.basename(entry)}
+
+		sdata= SourceData()
+		if sdata.set_from_dict(entry)<0:
+			return None
+
+		if sdata.read_imgs()<0 or sdata.img_cube is None:
+			logger.warn("Failed to read image data of entry %s!" % (str(sdata.filepaths)))
+			return None
+
+		data= sdata.img_cube
+		if self.preprocessor is not None:
+			data= self.preprocessor(data, augmenter_index=entry.get('augmenter_index', 0))
+			if data is None:
+				logger.warn("Failed to pre-process image data of entry %s!" % (str(sdata.filepaths)))
+				return None
+
+		sdata.img_cube= data
+		if sdata.has_bad_pixels(check_fract=False, thr=0):
+			logger.warn("Image data of entry %s has bad pixels!" % (str(sdata.filepaths)))
+			return None
+
+		return data.astype(np.float32)
+
+	#############################
+	##     PROCESS REQUEST
+	#############################
+	def process(self, request):
+		""" Process a request and return the response dictionary """
+
+		with self.stats_lock:
+			self.nrequests+= 1
+
+		cmd= request.get("cmd", "features")
+		entries= request.get("data", [])
+		if cmd not in g_commands:
+			return {"status": -1, "error": "Invalid/unknown command %s" % (cmd)}
+		if cmd=="info":
+			return {"status": 0, "info": self.get_info()}
+		if cmd=="classify" and self.classifier is None:
+			return {"status": -1, "error": "No classifier loaded"}
+		if cmd=="search" and self.index_store is None:
+			return {"status": -1, "error": "No similarity index loaded"}
+		if not isinstance(entries, list) or not entries:
+			return {"status": -1, "error": "Empty or invalid data list"}
+		if not self.running:
+			return {"status": -1, "error": "Service not running"}
+
+		# - Read & pre-process entries
+		results= []
+		inputs= []
+		for entry in entries:
+			sname= entry.get("sname", "") if isinstance(entry, dict) else os.path.basename(str(entry))
+			results.append({"sname": sname, "status": -1})
+			data= self.__read_entry(entry)
+			if data is not None:
+				inputs.append(data)
+				results[-1]["status"]= 0
+
+		good= [i for i in range(len(results)) if results[i]["status"]==0]
+		if not good:
+			return {"status": -1, "error": "No entries read", "data": results}
+
+		try:
+			inputs= np.stack(inputs, axis=0)
+		except Exception as e:
+			return {"status": -1, "error": "Pre-processed entries have different shapes (err=%s)" % (str(e)), "data": results}
+
+		# - Run encoder in micro-batch
+		task= InferenceTask(inputs)
+		self.task_queue.put(task)
+		if not task.wait(self.task_timeout):
+			return {"status": -1, "error": "Request timed out", "data": results}
+		if task.error!="":
+			return {"status": -1, "error": task.error, "data": results}
+
+		feats= task.feats
+		for i, index in enumerate(good):
+			results[index]["feats"]= [float(item) for item in feats[i]]
+
+		# - Run classifier
+		if cmd=="classify":
+			pred= self.classifier.predict_data(feats)
+			if pred is None:
+				return {"status": -1, "error": "Classifier predict failed", "data": results}
+			classids, labels, probs= pred
+			for i, index in enumerate(good):
+				results[index]["id"]= int(classids[i])
+				results[index]["label"]= labels[i]
+				results[index]["prob"]= float(probs[i])
+
+		# - Run similarity search
+		elif cmd=="search":
+			k= int(request.get("k", self.k))
+			score_thr= float(request.get("score_thr", self.score_thr))
+			nn= self.index_store.search(feats, k=k, threshold=score_thr)
+			if nn is None:
+				return {"status": -1, "error": "Similarity search failed", "data": results}
+			for i, index in enumerate(good):
+				nn_indices= [int(item) for item in nn[0][i]]
+				results[index]["nn_indices"]= nn_indices
+				results[index]["nn_scores"]= [float(item) for item in nn[1][i]]
+				results[index]["nn_snames"]= [self.index_store.get_entry(item).get("sname", "") for item in nn_indices]
+
+		return {"status": 0, "data": results}
+
+
+##############################
+##     SERVERS
+##############################
+class InferenceHTTPHandler(BaseHTTPRequestHandler):
+	""" HTTP handler: POST /<cmd> with json body {"data": [...], ...}, GET /info """
+
+	def __send_json(self, response, code=200):
+		body= json.dumps(response).encode("utf-8")
+		self.send_response(code)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def do_GET(self):
+		if self.path.strip("/")!="info":
+			self.__send_json({"status": -1, "error": "Invalid path %s" % (self.path)}, code=404)
+			return
+		self.__send_json(self.server.service.process({"cmd": "info"}))
+
+	def do_POST(self):
+		try:
+			length= int(self.headers.get("Content-Length", 0))
+			request= json.loads(self.rfile.read(length).decode("utf-8"))
+		except Exception as e:
+			self.__send_json({"status": -1, "error": "Invalid json request (err=%s)" % (str(e))}, code=400)
+			return
+
+		if not isinstance(request, dict):
+			self.__send_json({"status": -1, "error": "Invalid json request (a json object is expected)"}, code=400)
+			return
+
+		cmd= self.path.strip("/")
+		if cmd not in g_commands:
+			self.__send_json({"status": -1, "error": "Invalid path %s" % (self.path)}, code=404)
+			return
+
+		request["cmd"]= cmd
+		try:
+			response= self.server.service.process(request)
+		except Exception as e:
+			logger.error("Failed to process request (err=%s)!" % (str(e)))
+			self.__send_json({"status": -1, "error": "Failed to process request (err=%s)" % (str(e))}, code=500)
+			return
+
+		self.__send_json(response)
+
+	def log_message(self, format, *args):
+		logger.debug(format % args)
+
+
+class InferenceUnixHandler(socketserver.StreamRequestHandler):
+	""" Unix socket handler: one json request per line, one json response per line """
+
+	def __process_line(self, line):
+		""" Decode json request line and return the response dictionary """
+
+		try:
+			request= json.loads(line.decode("utf-8"))
+		except Exception as e:
+			return {"status": -1, "error": "Invalid json request (err=%s)" % (str(e))}
+
+		if not isinstance(request, dict):
+			return {"status": -1, "error": "Invalid json request (a json object is expected)"}
+
+		try:
+			return self.server.service.process(request)
+		except Exception as e:
+			logger.error("Failed to process request (err=%s)!" % (str(e)))
+			return {"status": -1, "error": "Failed to process request (err=%s)" % (str(e))}
+
+	def handle(self):
+		for line in self.rfile:
+			line= line.strip()
+			if not line:
+				continue
+			response= self.__process_line(line)
+			self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+			self.wfile.flush()
+
+
+def create_server(service, socket_path="", host="127.0.0.1", port=8080):
+	""" Create a threaded server for given service, listening on a Unix socket (if socket_path is given) or on HTTP host:port.
+			Returns None on failure.
+	"""
+
+	try:
+		if socket_path!="":
+			if os.path.exists(socket_path):
+				os.remove(socket_path)
+			server= socketserver.ThreadingUnixStreamServer(socket_path, InferenceUnixHandler)
+			logger.info("Listening on Unix socket %s ..." % (socket_path))
+		else:
+			server= ThreadingHTTPServer((host, port), InferenceHTTPHandler)
+			logger.info("Listening on http://%s:%d ..." % (host, port))
+	except Exception as e:
+		logger.error("Failed to create server (err=%s)!" % (str(e)))
+		return None
+
+	server.daemon_threads= True
+	server.service= service
+
+	return server
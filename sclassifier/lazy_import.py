@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+##################################################
+###          MODULE IMPORT
+##################################################
+## STANDARD MODULES
+import sys
+import types
+import importlib
+
+
+##############################
+##     HELPER METHODS
+##############################
+def import_object(name):
+	""" Import module or module attribute given its full dotted name (e.g. tensorflow.keras.utils) """
+
+	try:
+		return importlib.import_module(name)
+	except ImportError:
+		parent, _, child= name.rpartition('.')
+		if parent=="":
+			raise
+		return getattr(import_object(parent), child)
+
+def set_agg_backend(module=None):
+	""" Set matplotlib non-interactive backend (on_load hook for matplotlib.pyplot) """
+	import matplotlib
+	matplotlib.use('Agg')
+
+
+##############################
+##     LAZY MODULE
+##############################
+class LazyModule(types.ModuleType):
+	""" Module proxy importing the module at first attribute access, used to defer heavy backends
+			(tensorflow, imgaug, opencv, skimage, astropy, matplotlib, ...) until they are actually needed.
+			An on_load hook (if given) is called with the imported module, e.g. to set backend options.
+	"""
+
+	def __init__(self, name, on_load=None):
+		""" Return a LazyModule object """
+		super(LazyModule, self).__init__(name)
+		self.__dict__["_lazy_on_load"]= on_load
+		self.__dict__["_lazy_module"]= None
+
+	def _load(self):
+		""" Import module (once) and copy its attributes to the proxy """
+
+		module= self.__dict__["_lazy_module"]
+		if module is None:
+			module= import_object(self.__name__)
+			self.__dict__["_lazy_module"]= module
+			on_load= self.__dict__["_lazy_on_load"]
+			if on_load is not None:
+				on_load(module)
+			self.__dict__.update(module.__dict__)
+		return module
+
+	def __getattr__(self, attr):
+		return getattr(self._load(), attr)
+
+	def __dir__(self):
+		return dir(self._load())
+
+	def __repr__(self):
+		if self.__dict__["_lazy_module"] is None:
+			return "<lazy module '%s' (not loaded)>" % (self.__name__)
+		return repr(self.__dict__["_lazy_module"])
+
+
+class LazyAttr(object):
+	""" Proxy of a module attribute (function or class) importing the module at first call or attribute access.
+			NB: not usable as base class or in isinstance checks, use a LazyModule for those.
+	"""
+
+	def __init__(self, modname, attr):
+		""" Return a LazyAttr object """
+		self._modname= modname
+		self._attr= attr
+		self._obj= None
+
+	def _load(self):
+		""" Import module attribute (once) """
+		if self._obj is None:
+			self._obj= getattr(import_object(self._modname), self._attr)
+		return self._obj
+
+	def __call__(self, *args, **kwargs):
+		return self._load()(*args, **kwargs)
+
+	def __getattr__(self, attr):
+		if attr.startswith("_"):
+			raise AttributeError(attr)
+		return getattr(self._load(), attr)
+
+	def __repr__(self):
+		return "<lazy attribute '%s.%s'>" % (self._modname, self._attr)
+
+
+def lazy_import(name, on_load=None):
+	""" Return module if already imported, otherwise a LazyModule importing it at first use """
+
+	if name in sys.modules and on_load is None:
+		return sys.modules[name]
+	return LazyModule(name, on_load=on_load)
+
+def lazy_attr(modname, attr):
+	""" Return attribute of module if already imported, otherwise a LazyAttr importing it at first use """
+
+	module= sys.modules.get(modname, None)
+	if module is not None and not isinstance(module, LazyModule) and hasattr(module, attr):
+		return getattr(module, attr)
+	return LazyAttr(modname, attr)
@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+##################################################
+###          MODULE IMPORT
+##################################################
+## STANDARD MODULES
+import os
+import sys
+import time
+import datetime
+import numpy as np
+import logging
+import json
+import shutil
+import tempfile
+
+## TENSORFLOW & KERAS MODULES
+import tensorflow as tf
+from tensorflow.keras.models import load_model
+from tensorflow.keras.models import model_from_json
+
+## PACKAGE MODULES
+from sclassifier import __version__
+from .tf_utils import SoftmaxCosineSim, NTXentLoss
+from .tf_utils import ChanMinMaxNorm, ChanMaxScale, ChanPosDef, ChanMaxRatio, ChanMeanRatio, ChanSumRatio
+from .feature_extractor_ae import ChanNormalization, ChanDeNormalization
+from .feature_extractor_simclr import WarmUpCosineDecay
+from .inference_runtime import InferenceModel
+
+##############################
+##     GLOBAL VARS
+##############################
+from sclassifier import logger
+
+
+##############################
+##     MODEL EXPORTER
+##############################
+class ModelExporter(object):
+	""" Export trained keras models (SimCLR/BYOL/AE encoders, SClassifierNN classifiers) to inference artifacts
+			loadable with InferenceModel, without the training stack.
+
+			Exported formats:
+				- SavedModel: traced inference graph with a fixed serving signature (inputs: float32 (None, ny, nx, nchan),
+				  outputs: float32 output_0, ..., output_N), no keras objects or training ops
+				- TFLite: converted from the SavedModel, optionally with post-training quantization
+				  (dynamic range, float16 or int8 weights & activations calibrated on DataGenerator samples)
+			An export info file (json) is written next to each artifact.
+	"""
+
+	def __init__(self):
+		""" Return a ModelExporter object """
+
+		self.model= None
+		self.modelfile= ""
+		self.input_shape= None # (ny, nx, nchan), taken from model if not given
+		self.output_names= []
+
+		# - TFLite options
+		self.quantization= "none" # {"none","dynamic","float16","int8"}
+		self.nsamples_calib= 200 # number of DataGenerator samples used for int8 calibration
+		self.full_integer= False # if true, int8 quantization fails if an op has no int8 kernel (otherwise kept in float)
+		self.allow_select_ops= False # if true, ops not supported by TFLite builtins are taken from TF (runtime needs full tensorflow)
+		self.nthreads= None
+
+	#############################
+	##     LOAD MODEL
+	#############################
+	@classmethod
+	def get_custom_objects(cls):
+		""" Return custom objects needed to load models saved by sclassifier trainers """
+		return {
+			'SoftmaxCosineSim': SoftmaxCosineSim,
+			'NTXentLoss': NTXentLoss,
+			'WarmUpCosineDecay': WarmUpCosineDecay,
+			'ChanNormalization': ChanNormalization,
+			'ChanDeNormalization': ChanDeNormalization,
+			'ChanMinMaxNorm': ChanMinMaxNorm,
+			'ChanMaxScale': ChanMaxScale,
+			'ChanPosDef': ChanPosDef,
+			'ChanMaxRatio': ChanMaxRatio,
+			'ChanMeanRatio': ChanMeanRatio,
+			'ChanSumRatio': ChanSumRatio,
+		}
+
+	def load_model(self, modelfile, weightfile=""):
+		""" Load keras model from file (.h5 model or .json architecture) and weights (if given) """
+
+		custom_objects= self.get_custom_objects()
+
+		try:
+			if modelfile.endswith(".json"):
+				with open(modelfile, 'r') as fp:
+					self.model= model_from_json(fp.read(), custom_objects=custom_objects)
+			else:
+				self.model= load_model(modelfile, custom_objects=custom_objects, compile=False)
+		except Exception as e:
+			logger.error("Failed to load model from file %s (err=%s)!" % (modelfile, str(e)))
+			return -1
+
+		if weightfile!="":
+			try:
+				self.model.load_weights(weightfile)
+			except Exception as e:
+				logger.error("Failed to load weights from file %s (err=%s)!" % (weightfile, str(e)))
+				return -1
+
+		self.modelfile= modelfile
+
+		return self.set_model(self.model)
+
+	def set_model(self, model):
+		""" Set model to be exported """
+
+		self.model= model
+
+		# - Set input shape from model
+		if self.input_shape is None:
+			input_shape= tuple(self.model.inputs[0].shape[1:])
+			if None in input_shape:
+				logger.error("Model input shape %s is not fully defined, set input_shape!" % (str(input_shape)))
+				return -1
+			self.input_shape= input_shape
+
+		noutputs= len(self.model.outputs)
+		self.output_names= ["output_%d" % (i) for i in range(noutputs)]
+
+		logger.info("Set model %s to be exported (input_shape=%s, #%d outputs) ..." % (self.model.name, str(self.input_shape), noutputs))
+
+		return 0
+
+	#############################
+	##     SAVED MODEL
+	#############################
+	def __get_serving_module(self):
+		""" Return a tf.Module with the model variables and the traced serving function """
+
+		model= self.model
+		input_spec= tf.TensorSpec(shape=(None,) + tuple(self.input_shape), dtype=tf.float32, name="inputs")
+
+		@tf.function(input_signature=[input_spec])
+		def serve(inputs):
+			outputs= model(inputs, training=False)
+			if not isinstance(outputs, (list, tuple)):
+				outputs= [outputs]
+			return {name: tf.cast(item, tf.float32) for name, item in zip(self.output_names, outputs)}
+
+		module= tf.Module()
+		module.model= model
+		module.serve= serve
+
+		return module
+
+	def export_saved_model(self, outdir):
+		""" Export model as SavedModel with fixed serving signature to given directory """
+
+		if self.model is None:
+			logger.error("No model set to be exported!")
+			return -1
+
+		logger.info("Exporting model to SavedModel %s ..." % (outdir))
+		try:
+			module= self.__get_serving_module()
+			tf.saved_model.save(module, outdir, signatures={"serving_default": module.serve})
+		except Exception as e:
+			logger.error("Failed to export SavedModel to %s (err=%s)!" % (outdir, str(e)))
+			return -1
+
+		return self.__write_export_info(outdir, "saved_model", "none")
+
+	#############################
+	##     TFLITE
+	#############################
+	def __get_representative_dataset(self, data_generator):
+		""" Return representative dataset function yielding nsamples_calib pre-processed samples for int8 calibration """
+
+		def representative_dataset():
+			nsamples= 0
+			for inputs, indexes in data_generator.generate_inference_data(batch_size=1):
+				yield [inputs.astype(np.float32)]
+				nsamples+= 1
+				if nsamples>=self.nsamples_calib:
+					break
+			logger.info("#%d samples used for int8 calibration ..." % (nsamples))
+
+		return representative_dataset
+
+	def export_tflite(self, outfile, data_generator=None, saved_model_dir=""):
+		""" Export model as TFLite file, with post-training quantization if enabled.
+				The model is first exported as SavedModel (to a temporary directory if saved_model_dir is not given).
+				A DataGenerator (with augmentation disabled) must be given for int8 quantization.
+		"""
+
+		if self.quantization not in ["none","dynamic","float16","int8"]:
+			logger.error("Invalid/unknown quantization (%s) given!" % (self.quantization))
+			return -1
+
+		if self.quantization=="int8" and data_generator is None:
+			logger.error("A data generator is required for int8 calibration!")
+			return -1
+
+		# - Export SavedModel
+		tmpdir= None
+		if saved_model_dir=="":
+			tmpdir= tempfile.mkdtemp(prefix="sclassifier_export_")
+			saved_model_dir= os.path.join(tmpdir, "saved_model")
+			if self.export_saved_model(saved_model_dir)<0:
+				shutil.rmtree(tmpdir, ignore_errors=True)
+				return -1
+
+		# - Convert model
+		logger.info("Converting model to TFLite file %s (quantization=%s) ..." % (outfile, self.quantization))
+		try:
+			converter= tf.lite.TFLiteConverter.from_saved_model(saved_model_dir, signature_keys=["serving_default"])
+
+			supported_ops= [tf.lite.OpsSet.TFLITE_BUILTINS]
+			if self.quantization!="none":
+				converter.optimizations= [tf.lite.Optimize.DEFAULT]
+			if self.quantization=="float16":
+				converter.target_spec.supported_types= [tf.float16]
+			elif self.quantization=="int8":
+				converter.representative_dataset= self.__get_representative_dataset(data_generator)
+				if self.full_integer:
+					supported_ops= [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+			if self.allow_select_ops:
+				supported_ops.append(tf.lite.OpsSet.SELECT_TF_OPS)
+			converter.target_spec.supported_ops= supported_ops
+
+			tflite_model= converter.convert()
+
+			with open(outfile, 'wb') as fp:
+				fp.write(tflite_model)
+
+		except Exception as e:
+			logger.error("Failed to convert model to TFLite (err=%s)!" % (str(e)))
+			return -1
+
+		finally:
+			if tmpdir is not None:
+				shutil.rmtree(tmpdir, ignore_errors=True)
+
+		logger.info("TFLite model written to file %s (size=%.1f MB) ..." % (outfile, os.path.getsize(outfile)/1024.**2))
+
+		return self.__write_export_info(outfile, "tflite", self.quantization)
+
+	#############################
+	##     EXPORT INFO
+	#############################
+	def __write_export_info(self, path, export_format, quantization):
+		""" Write export info file next to exported model """
+
+		info= {
+			"format": export_format,
+			"modelfile": self.modelfile,
+			"model_name": self.model.name,
+			"input_shape": [int(item) for item in self.input_shape],
+			"output_names": self.output_names,
+			"quantization": quantization,
+			"select_tf_ops": bool(self.allow_select_ops and export_format=="tflite"),
+			"sclassifier_version": __version__,
+			"date": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+		}
+
+		infofile= InferenceModel.get_info_file(path)
+		try:
+			with open(infofile, 'w') as fp:
+				json.dump(info, fp, indent=2)
+		except Exception as e:
+			logger.error("Failed to write export info file %s (err=%s)!" % (infofile, str(e)))
+			return -1
+
+		return 0
+
+	#############################
+	##     VALIDATE
+	#############################
+	def validate(self, path, data_generator, nsamples=100, batch_size=32):
+		""" Compare exported model outputs with keras model outputs on nsamples data samples.
+				Returns a dictionary with max abs difference and mean cosine similarity of first outputs, or None on failure.
+		"""
+
+		runtime= InferenceModel(path, nthreads=self.nthreads)
+		if runtime.load()<0:
+			logger.error("Failed to load exported model %s for validation!" % (path))
+			return None
+
+		data_indexes= list(range(min(nsamples, data_generator.datasize)))
+		diff_max= 0.
+		cos_sims= []
+		t_keras= 0.
+		t_runtime= 0.
+
+		for inputs, indexes in data_generator.generate_inference_data(batch_size=batch_size, data_indexes=data_indexes):
+			t0= time.time()
+			y_ref= self.model(inputs, training=False)
+			if isinstance(y_ref, (list, tuple)):
+				y_ref= y_ref[0]
+			y_ref= np.asarray(y_ref, dtype=np.float32)
+			t1= time.time()
+			y= runtime.predict(inputs)
+			if isinstance(y, list):
+				y= y[0]
+			t2= time.time()
+			t_keras+= t1-t0
+			t_runtime+= t2-t1
+
+			y_ref= y_ref.reshape(y_ref.shape[0], -1)
+			y= y.reshape(y.shape[0], -1)
+			diff_max= max(diff_max, float(np.max(np.abs(y - y_ref))))
+			norms= np.linalg.norm(y, axis=1)*np.linalg.norm(y_ref, axis=1)
+			cos_sims.extend( list(np.sum(y*y_ref, axis=1)/np.maximum(norms, 1.e-12)) )
+
+		if not cos_sims:
+			logger.error("No data read for validation!")
+			return None
+
+		results= {
+			"nsamples": len(cos_sims),
+			"diff_max": diff_max,
+			"cos_sim_mean": float(np.mean(cos_sims)),
+			"cos_sim_min": float(np.min(cos_sims)),
+			"time_keras": t_keras,
+			"time_runtime": t_runtime
+		}
+
+		logger.info("Exported model validation (#%d samples): max|diff|=%g, cos_sim(mean/min)=%f/%f, time(keras/runtime)=%.2f/%.2f s" % (results["nsamples"], diff_max, results["cos_sim_mean"], results["cos_sim_min"], t_keras, t_runtime))
+
+		return results
+
@@ -29,6 +29,8 @@ import json
 from sclassifier import logger
 
 ## SCI MODULES
+#  NB: plotting & optional backends are imported at first use (see lazy_import)
+from .lazy_import import lazy_import, set_agg_backend
 from sklearn.ensemble import IsolationForest
 from sklearn.preprocessing import StandardScaler, MinMaxScaler, RobustScaler
 from sklearn.model_selection import GridSearchCV
@@ -38,9 +40,7 @@ from sklearn import model_selection
 from sklearn.metrics import make_scorer, f1_score
 
 ## GRAPHICS MODULES
-import matplotlib
-import matplotlib.pyplot as plt
-matplotlib.use('Agg')
+plt= lazy_import("matplotlib.pyplot", on_load=set_agg_backend)
 
 ## PACKAGE MODULES
 from .utils import Utils
@@ -234,42 +234,54 @@ class OutlierFinder(object):
 	def set_data_from_file(self, filename):
 		""" Set data from input file. Expected format: sname, N features, classid """
 
-		# - Read table
-		row_start= 0
-		try:
-			table= ascii.read(filename, data_start=row_start)
-		except:
-			logger.error("Failed to read feature file %s!" % filename)
-			return -1
-	
-		print(table.colnames)
-		print(table)
-
-		ncols= len(table.colnames)
-		nfeat= ncols-2
-
-		# - Set data vectors
-		rowIndex= 0
-		self.data_labels= []
-		self.data_classids= []
-		self.source_names= []
-		featdata= []
-
-		for data in table:
-			sname= data[0]
-			classid= data[ncols-1]
+		# - Read binary table? (selected by file extension)
+		if Utils.is_binary_table_file(filename):
+			ret= Utils.read_binary_feature_data(filename)
+			if not ret:
+				logger.error("Failed to read feature file %s!" % filename)
+				return -1
+			featdata, self.source_names, self.data_classids, colnames= ret
 			if self.classid_label_map:
-				label= self.classid_label_map[classid]
+				self.data_labels= [self.classid_label_map[classid] for classid in self.data_classids]
 			else:
-				label= str(classid)
+				self.data_labels= [str(classid) for classid in self.data_classids]
+		else:
+			# - Read table
+			row_start= 0
+			try:
+				table= ascii.read(filename, data_start=row_start)
+			except:
+				logger.error("Failed to read feature file %s!" % filename)
+				return -1
+	
+			print(table.colnames)
+			print(table)
+
+			ncols= len(table.colnames)
+			nfeat= ncols-2
+
+			# - Set data vectors
+			rowIndex= 0
+			self.data_labels= []
+			self.data_classids= []
+			self.source_names= []
+			featdata= []
+
+			for data in table:
+				sname= data[0]
+				classid= data[ncols-1]
+				if self.classid_label_map:
+					label= self.classid_label_map[classid]
+				else:
+					label= str(classid)
 
-			self.source_names.append(sname)
-			self.data_labels.append(label)
-			self.data_classids.append(classid)
-			featdata_curr= []
-			for k in range(nfeat):
-				featdata_curr.append(data[k+1])
-			featdata.append(featdata_curr)
+				self.source_names.append(sname)
+				self.data_labels.append(label)
+				self.data_classids.append(classid)
+				featdata_curr= []
+				for k in range(nfeat):
+					featdata_curr.append(data[k+1])
+				featdata.append(featdata_curr)
 
 		# - Select data columns?
 		if self.selcols:
@@ -281,6 +293,7 @@ class OutlierFinder(object):
 			logger.error("Empty feature data vector read!")
 			return -1
 
+		data_shape= self.data.shape
 		self.nsamples= data_shape[0]
 		self.nfeatures= data_shape[1]
 		logger.info("#nsamples=%d" % (self.nsamples))
@@ -857,39 +870,27 @@ class OutlierFinder(object):
 		outlier_scores_df= np.array(self.anomaly_scores_df).reshape(N,1)
 		outlier_score_orig= np.array(self.anomaly_scores_orig).reshape(N,1)
 
+		# - Set columns to be saved
+		columns= [snames]
+		colnames= ["sname"]
 		if self.save_features:
-			znames_counter= list(range(1, Nfeat+1))
-			znames= '{}{}'.format('z',' z'.join(str(item) for item in znames_counter))
-			
-			if self.save_labels_in_ascii:
-				outdata= np.concatenate(
-					(snames, self.data, objlabels, outlier_outputs, outlier_score_orig),
-					axis=1
-				)
-				head= '{} {} {}'.format("# sname",znames," label is_outlier outlier_score")
-			else:
-				outdata= np.concatenate(
-					(snames, self.data, objids, outlier_outputs, outlier_score_orig),
-					axis=1
-				)
-				head= '{} {} {}'.format("# sname",znames," id is_outlier outlier_score")
+			columns.append(self.data)
+			colnames.extend(["z" + str(i+1) for i in range(Nfeat)])
+
+		if self.save_labels_in_ascii:
+			columns.append(objlabels)
+			colnames.append("label")
 		else:
-			if self.save_labels_in_ascii:
-				outdata= np.concatenate(
-					(snames, objlabels, outlier_outputs, outlier_score_orig),
-					axis=1
-				)
-				head= "# sname label is_outlier outlier_score"
-			else:
-				outdata= np.concatenate(
-					(snames, objids, outlier_outputs, outlier_score_orig),
-					axis=1
-				)
-				head= "# sname id is_outlier outlier_score"
+			columns.append(objids)
+			colnames.append("id")
+
+		columns.extend([outlier_outputs, outlier_score_orig])
+		colnames.extend(["is_outlier", "outlier_score"])
 		
 		# - Save outlier data 
+		#   NB: binary columnar format if file has .npz extension, ascii otherwise
 		logger.info("Saving outlier output data to file %s ..." % (self.outfile))
-		Utils.write_ascii(outdata, self.outfile, head)
+		Utils.write_table(self.outfile, columns, colnames)
 
 		return 0
 
@@ -80,6 +80,9 @@ except Exception as e:
 	nproc= 1
 	procId= 0
 
+# - MPI tags used by dynamic source scheduler
+TAG_REQUEST= 1
+TAG_WORK= 2
 
 
 ##############################
@@ -244,6 +247,14 @@ class Pipeline(object):
 		self.negative_pix_fract_thr= 0.9
 		self.bad_pix_fract_thr= 0.05
 
+		# - Source scheduling options
+		#   NB: static: sources are split in equal parts among procs
+		#       dynamic: procs request chunks of chunk_size sources to master as soon as they are free
+		#   If MPI is not available, sources are processed in a pool of nworkers processes 
+		self.scheduling= "static"
+		self.chunk_size= 0 # if <=0 set from number of sources and procs/workers
+		self.nworkers= 1
+
 		# - Output data
 		self.outfile_sclass= "classified_data.dat"
 		self.outfile_sclass_metrics= "classification_metrics.dat"
@@ -507,20 +518,39 @@ class Pipeline(object):
 		fem.selfeatids= selcols
 		fem.negative_pix_fract_thr= self.negative_pix_fract_thr
 		fem.bad_pix_fract_thr= self.bad_pix_fract_thr
-			
-		logger.info("[PROC %d] Extracting color features from cutout data (nsources=%d) ..." % (procId, len(self.datalist_proc)))
-		if fem.run_from_datalist(self.datalist_proc, self.datalist_mask_proc)<0:
-			logger.error("[PROC %d] Failed to extract color features (see logs)!" % (procId))
-			return -1
+		fem.nworkers= self.nworkers if comm is None else 1
+		fem.chunk_size= self.chunk_size
 
-		param_dict_list= fem.par_dict_list
+		if self.use_dynamic_scheduling():
+			# - Extract features in source chunks assigned dynamically by master
+			datalist= self.datadict["data"]
+			datalist_mask= self.datadict_mask["data"]
+
+			def process_fcn(indexes):
+				fem.par_dict_list= []
+				if fem.run_from_datalist([datalist[i] for i in indexes], [datalist_mask[i] for i in indexes])<0:
+					logger.warn("[PROC %d] Failed to extract color features for source chunk [%d,%d] (see logs)!" % (procId, indexes[0], indexes[-1]))
+					return []
+				return fem.par_dict_list
+
+			logger.info("[PROC %d] Extracting color features from cutout data with dynamic scheduling (nsources=%d) ..." % (procId, len(datalist)))
+			param_dict_list= self.run_dynamic_scheduler(len(datalist), process_fcn)
+			colfeat_dict_list= [param_dict_list] if procId==MASTER else None
 
-		# - Merge parameters found by each proc
-		if comm is None:
-			colfeat_dict_list= param_dict_list
 		else:
-			logger.info("[PROC %d] Gathering color features ... " % (procId))
-			colfeat_dict_list= comm.gather(param_dict_list, root=MASTER)
+			logger.info("[PROC %d] Extracting color features from cutout data (nsources=%d) ..." % (procId, len(self.datalist_proc)))
+			if fem.run_from_datalist(self.datalist_proc, self.datalist_mask_proc)<0:
+				logger.error("[PROC %d] Failed to extract color features (see logs)!" % (procId))
+				return -1
+
+			param_dict_list= fem.par_dict_list
+
+			# - Merge parameters found by each proc
+			if comm is None:
+				colfeat_dict_list= [param_dict_list]
+			else:
+				logger.info("[PROC %d] Gathering color features ... " % (procId))
+				colfeat_dict_list= comm.gather(param_dict_list, root=MASTER)
 		
 		if procId==MASTER:
 			print("colfeat_dict_list")
@@ -591,25 +621,49 @@ class Pipeline(object):
 		sic.bad_pix_fract_thr= self.bad_pix_fract_thr
 		sic.save= self.save_spectral_index_data
 		sic.outfile= self.outfile_feat_alpha
+		sic.nworkers= self.nworkers if comm is None else 1
+		sic.chunk_size= self.chunk_size
 
 		print("self.alpha_img_group_1")
 		print(self.alpha_img_group_1)
 		print("self.alpha_img_group_2")
 		print(self.alpha_img_group_2)
 			
-		logger.info("[PROC %d] Measuring spectral index from cutout data (nsources=%d) ..." % (procId, len(self.datalist_radio_mask_proc)))
-		if sic.run_from_datalist(self.datalist_radio_mask_proc, self.alpha_img_group_1, self.alpha_img_group_2)<0:
-			logger.error("[PROC %d] Failed to measure spectral index (see logs)!" % (procId))
-			return -1
-
-		param_dict_list= sic.par_dict_list
+		if self.use_dynamic_scheduling():
+			# - Compute spectral index in source chunks assigned dynamically by master
+			#   NB: output file is written by master after merging
+			datalist= self.datadict_radio_mask["data"]
+			sic.save= False
+
+			def process_fcn(indexes):
+				sic.par_dict_list= []
+				if sic.run_from_datalist([datalist[i] for i in indexes], self.alpha_img_group_1, self.alpha_img_group_2)<0:
+					logger.warn("[PROC %d] Failed to measure spectral index for source chunk [%d,%d] (see logs)!" % (procId, indexes[0], indexes[-1]))
+					return []
+				return sic.par_dict_list
+
+			logger.info("[PROC %d] Measuring spectral index from cutout data with dynamic scheduling (nsources=%d) ..." % (procId, len(datalist)))
+			param_dict_list= self.run_dynamic_scheduler(len(datalist), process_fcn)
+			alphafeat_dict_list= [param_dict_list] if procId==MASTER else None
+
+			if procId==MASTER and self.save_spectral_index_data:
+				sic.par_dict_list= param_dict_list
+				sic.save_data()
 
-		# - Merge parameters found by each proc
-		if comm is None:
-			alphafeat_dict_list= param_dict_list
 		else:
-			logger.info("[PROC %d] Gathering spectral index features ... " % (procId))
-			alphafeat_dict_list= comm.gather(param_dict_list, root=MASTER)
+			logger.info("[PROC %d] Measuring spectral index from cutout data (nsources=%d) ..." % (procId, len(self.datalist_radio_mask_proc)))
+			if sic.run_from_datalist(self.datalist_radio_mask_proc, self.alpha_img_group_1, self.alpha_img_group_2)<0:
+				logger.error("[PROC %d] Failed to measure spectral index (see logs)!" % (procId))
+				return -1
+
+			param_dict_list= sic.par_dict_list
+
+			# - Merge parameters found by each proc
+			if comm is None:
+				alphafeat_dict_list= [param_dict_list]
+			else:
+				logger.info("[PROC %d] Gathering spectral index features ... " % (procId))
+				alphafeat_dict_list= comm.gather(param_dict_list, root=MASTER)
 		
 		if procId==MASTER:
 			print("alphafeat_dict_list")
@@ -996,8 +1050,90 @@ class Pipeline(object):
 			self.datalist_radio_mask_proc= self.datadict_radio_mask["data"][imin:imax+1]
 
 	
+		if self.use_dynamic_scheduling():
+			logger.info("[PROC %d] Sources will be assigned to processors dynamically in chunks ..." % (procId))
+
 		return 0
 
+	def use_dynamic_scheduling(self):
+		""" Check if sources are to be scheduled dynamically among MPI procs """
+		return self.scheduling=="dynamic" and comm is not None and nproc>1
+
+	def run_dynamic_scheduler(self, nsources, process_fcn):
+		""" Process sources in chunks dynamically assigned by master to free procs.
+				process_fcn(indexes) is called on each chunk and must return a list of results. 
+				Returns the results of all chunks merged in input order on master, None on other procs.
+		"""
+
+		# - Set chunks
+		chunk_size= self.chunk_size
+		if chunk_size<=0:
+			chunk_size= max(1, int(np.ceil(nsources/float(4*nproc))))
+		chunks= [list(range(i, min(i+chunk_size, nsources))) for i in range(0, nsources, chunk_size)]
+		nchunks= len(chunks)
+
+		#==========================
+		#==   WORKER PROCS
+		#==========================
+		if procId!=MASTER:
+			# - Request a chunk to master, sending results of previous chunk (if any)
+			msg= (-1, None)
+			nprocessed= 0
+			while True:
+				comm.send(msg, dest=MASTER, tag=TAG_REQUEST)
+				chunk_id= comm.recv(source=MASTER, tag=TAG_WORK)
+				if chunk_id<0:
+					break
+				msg= (chunk_id, process_fcn(chunks[chunk_id]))
+				nprocessed+= len(chunks[chunk_id])
+
+			logger.info("[PROC %d] #%d sources processed by this processor ..." % (procId, nprocessed))
+			return None
+
+		#==========================
+		#==   MASTER PROC
+		#==========================
+		logger.info("[PROC %d] Scheduling #%d sources in #%d chunks of size %d among #%d procs ..." % (procId, nsources, nchunks, chunk_size, nproc))
+		chunk_results= [None]*nchunks
+		nprocessed_per_proc= [0]*nproc
+		next_chunk= 0
+		nactive= nproc-1
+		status= MPI.Status()
+
+		while nactive>0:
+			# - Process a chunk if no request is pending
+			#   NB: master is busy for one chunk at most before serving requests
+			if next_chunk<nchunks and not comm.Iprobe(source=MPI.ANY_SOURCE, tag=TAG_REQUEST):
+				chunk_id= next_chunk
+				next_chunk+= 1
+				chunk_results[chunk_id]= process_fcn(chunks[chunk_id])
+				nprocessed_per_proc[MASTER]+= len(chunks[chunk_id])
+				continue
+
+			# - Serve request: store results and send next chunk (or stop if no chunks are left)
+			chunk_id, results= comm.recv(source=MPI.ANY_SOURCE, tag=TAG_REQUEST, status=status)
+			rank= status.Get_source()
+			if chunk_id>=0:
+				chunk_results[chunk_id]= results
+				nprocessed_per_proc[rank]+= len(chunks[chunk_id])
+
+			if next_chunk<nchunks:
+				comm.send(next_chunk, dest=rank, tag=TAG_WORK)
+				next_chunk+= 1
+			else:
+				comm.send(-1, dest=rank, tag=TAG_WORK)
+				nactive-= 1
+
+		logger.info("[PROC %d] #sources processed per proc: %s" % (procId, str(nprocessed_per_proc)))
+
+		# - Merge chunk results in input order
+		merged_results= []
+		for results in chunk_results:
+			if results:
+				merged_results.extend(results)
+
+		return merged_results
+
 
 	#=========================
 	#==   RUN
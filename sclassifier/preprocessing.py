@@ -22,6 +22,8 @@ import math
 import logging
 from collections import Counter
 import json
+import hashlib
+import warnings
 
 ## ASTROPY MODULES 
 from astropy.io import ascii
@@ -64,6 +66,59 @@ import tensorflow as tf
 #	logger.warn("Cannot import module tensorflow_models, not a problem if you don't use ColorJitterer pre-processor...")
 
 
+##############################
+##     BATCH HELPERS
+##############################
+def _get_valid_mask(data):
+	""" Return mask of valid pixels (non-zero and finite) """
+	return np.logical_and(data!=0, np.isfinite(data))
+
+def _masked_min(data, cond, axis, keepdims=True):
+	""" Return min of data over given axis excluding pixels where cond is False (+inf if no pixel is selected) """
+	return np.min(np.where(cond, data, np.inf), axis=axis, keepdims=keepdims)
+
+def _masked_max(data, cond, axis, keepdims=True):
+	""" Return max of data over given axis excluding pixels where cond is False (-inf if no pixel is selected) """
+	return np.max(np.where(cond, data, -np.inf), axis=axis, keepdims=keepdims)
+
+def _get_center_box(ny, nx, mask_fract):
+	""" Return range (xmin,xmax,ymin,ymax) of box centred in image with size equal to mask_fract of image size """
+	xc= int(nx/2)
+	yc= int(ny/2)
+	dy= int(ny*mask_fract/2.)
+	dx= int(nx*mask_fract/2.)
+	return xc - dx, xc + dx, yc - dy, yc + dy
+
+def _get_channel_slice(chid):
+	""" Return channel slice for stages applied to all channels (chid=-1) or to a selected channel """
+	if chid==-1:
+		return slice(None)
+	return slice(chid, chid+1)
+
+def _stack_if_same_shape(data_list, valid=None):
+	""" Stack list of data cubes in an array if all (valid) cubes have the same shape, otherwise return the list. 
+			Invalid entries are set to zero (if stacked) or None.
+	"""
+	if isinstance(data_list, np.ndarray):
+		return data_list
+
+	nsamples= len(data_list)
+	if valid is None:
+		valid= np.ones(nsamples, dtype=bool)
+	shapes= set([data_list[i].shape for i in range(nsamples) if valid[i] and data_list[i] is not None])
+	if len(shapes)!=1:
+		return [data_list[i] if valid[i] else None for i in range(nsamples)]
+
+	shape= list(shapes)[0]
+	dtype= np.result_type(*[data_list[i] for i in range(nsamples) if valid[i]])
+	data= np.zeros((nsamples,) + shape, dtype=dtype)
+	for i in range(nsamples):
+		if valid[i]:
+			data[i]= data_list[i]
+
+	return data
+
+
 ##############################
 ##     PREPROCESSOR CLASS
 ##############################
@@ -87,6 +142,9 @@ class DataPreprocessor(object):
 		#self.pipeline= Utils.compose_fcns(*self.fcns)
 		self.pipeline= Utils.compose_fcns_v2(*self.fcns)
 
+		# - Hash of stage parameters (computed on demand)
+		self.config_hashes= {}
+
 	#def __call__(self, data):
 	#	""" Apply sequence of pre-processing steps """
 	#	return self.pipeline(data)
@@ -95,6 +153,47 @@ class DataPreprocessor(object):
 		""" Apply sequence of pre-processing steps """
 		return self.pipeline(data, **kwargs)
 
+	def apply_batch(self, data, first=0, last=None, **kwargs):
+		""" Apply sequence of pre-processing steps (stages in range [first, last)) to a batch of data, given as an array of shape (N,ny,nx,nchans) or as a list of N data cubes.
+				Stages with a vectorised batch method (apply_batch) are applied to the whole batch when all cubes have the same shape,
+				other stages are applied per sample. Per-sample kwargs (e.g. augmenter_index) can be given as arrays of size N.
+				Returns the pre-processed data (array or list if cubes have different shapes) and the mask of valid samples.
+		"""
+
+		nsamples= len(data)
+		valid= np.ones(nsamples, dtype=bool)
+		data= _stack_if_same_shape(data)
+
+		stages= self.get_stages()
+		if last is None:
+			last= len(stages)
+
+		for stage in stages[first:last]:
+			if isinstance(data, np.ndarray) and hasattr(stage, "apply_batch"):
+				# - Apply stage to the whole batch
+				data, ok= stage.apply_batch(data, **kwargs)
+				if data is None:
+					logger.error("Pre-processing stage %s failed on batch!" % (type(stage).__name__))
+					return None, None
+				valid= np.logical_and(valid, ok)
+			else:
+				# - Apply stage per sample
+				data_out= [None]*nsamples
+				for i in range(nsamples):
+					if not valid[i]:
+						continue
+					sample_kwargs= {key: (value[i] if isinstance(value, (list, np.ndarray)) else value) for key, value in kwargs.items()}
+					data_out[i]= stage(data[i], **sample_kwargs)
+					if data_out[i] is None:
+						valid[i]= False
+				data= _stack_if_same_shape(data_out, valid)
+
+			if not np.any(valid):
+				logger.warn("All samples in batch failed pre-processing at stage %s!" % (type(stage).__name__))
+				break
+
+		return data, valid
+
 	def disable_augmentation(self):
 		""" Disable augmentation pre-processing (if existing) """
 
@@ -116,6 +215,61 @@ class DataPreprocessor(object):
 			self.fcns= fcns_new
 			#self.pipeline= Utils.compose_fcns(*self.fcns)
 			self.pipeline= Utils.compose_fcns_v2(*self.fcns)
+			self.config_hashes= {}
+
+	def get_stages(self):
+		""" Return the list of pre-processing stage instances (in application order) """
+		return [fcn.__self__ for fcn in reversed(self.fcns)]
+
+	def get_deterministic_stage_count(self):
+		""" Return the number of leading stages giving the same output at each call (e.g. stages before the first augmenter) """
+
+		nstages= 0
+		for stage in self.get_stages():
+			if isinstance(stage, (Augmenter, Augmenters, ColorJitterer)):
+				break
+			nstages+= 1
+
+		return nstages
+
+	def get_config_hash(self, nstages=None):
+		""" Return a hash of type and parameters of the first nstages stages (all if None) """
+
+		stages= self.get_stages()
+		if nstages is None:
+			nstages= len(stages)
+
+		if nstages in self.config_hashes:
+			return self.config_hashes[nstages]
+
+		def to_serializable(obj):
+			if isinstance(obj, np.ndarray):
+				return obj.tolist()
+			if isinstance(obj, np.generic):
+				return obj.item()
+			return str(obj)
+
+		config= [{"stage": type(stage).__name__, "pars": vars(stage)} for stage in stages[:nstages]]
+		config_str= json.dumps(config, sort_keys=True, default=to_serializable)
+		config_hash= hashlib.sha1(config_str.encode()).hexdigest()
+		self.config_hashes[nstages]= config_hash
+
+		return config_hash
+
+	def run_stages(self, data, first=0, last=None, **kwargs):
+		""" Apply stages in range [first, last) to data (last=None means up to the last stage) """
+
+		stages= self.get_stages()
+		if last is None:
+			last= len(stages)
+
+		for stage in stages[first:last]:
+			data= stage(data, **kwargs)
+			if data is None:
+				logger.error("Pre-processing stage %s failed!" % (type(stage).__name__))
+				return None
+
+		return data
 		
 
 #######################################
@@ -746,6 +900,28 @@ class MinMaxNormalizer(object):
 
 		return data_norm
 
+	def apply_batch(self, data, **kwargs):
+		""" Apply transformation to a batch of data of shape (N,ny,nx,nchans). Return transformed data and mask of valid samples """
+
+		# - Compute per-channel min/max of each sample
+		if self.exclude_zeros:
+			cond= _get_valid_mask(data)
+		else:
+			cond= np.isfinite(data)
+		ok= np.all(np.any(cond, axis=(1,2)), axis=-1)
+		if not np.all(ok):
+			logger.warn("#%d samples have channels with no valid pixels ..." % (np.count_nonzero(~ok)))
+
+		data_min= _masked_min(data, cond, axis=(1,2))
+		data_max= _masked_max(data, cond, axis=(1,2))
+
+		# - Normalize data
+		with np.errstate(divide='ignore', invalid='ignore'):
+			data_norm= (data-data_min)/(data_max-data_min) * (self.norm_max-self.norm_min) + self.norm_min
+		data_norm[~cond]= 0 # Restore 0 and nans set in original data
+
+		return data_norm, ok
+
 ##############################
 ##   AbsMinMaxNormalizer
 ##############################
@@ -780,6 +956,22 @@ class AbsMinMaxNormalizer(object):
 		
 		return data_norm
 
+	def apply_batch(self, data, **kwargs):
+		""" Apply transformation to a batch of data of shape (N,ny,nx,nchans). Return transformed data and mask of valid samples """
+
+		# - Find absolute min & max across all channels of each sample
+		cond= _get_valid_mask(data)
+		ok= np.any(cond, axis=(1,2,3))
+		data_min= _masked_min(data, cond, axis=(1,2,3))
+		data_max= _masked_max(data, cond, axis=(1,2,3))
+
+		# - Normalize data
+		with np.errstate(divide='ignore', invalid='ignore'):
+			data_norm= (data-data_min)/(data_max-data_min) * (self.norm_max-self.norm_min) + self.norm_min
+		data_norm[~cond]= 0 # Restore 0 and nans set in original data
+
+		return data_norm, ok
+
 
 
 ##############################
@@ -811,6 +1003,20 @@ class MaxScaler(object):
 		
 		return data_scaled
 
+	def apply_batch(self, data, **kwargs):
+		""" Apply transformation to a batch of data of shape (N,ny,nx,nchans). Return transformed data and mask of valid samples """
+
+		# - Find max for each channel of each sample
+		cond= _get_valid_mask(data)
+		data_max= _masked_max(data, cond, axis=(1,2))
+
+		# - Scale data
+		with np.errstate(divide='ignore', invalid='ignore'):
+			data_scaled= data/data_max
+		data_scaled[~cond]= 0 # Restore 0 and nans set in original data
+
+		return data_scaled, np.ones(data.shape[0], dtype=bool)
+
 
 ##############################
 ##   AbsMaxScaler
@@ -861,6 +1067,28 @@ class AbsMaxScaler(object):
 		
 		return data_scaled
 
+	def apply_batch(self, data, **kwargs):
+		""" Apply transformation to a batch of data of shape (N,ny,nx,nchans). Return transformed data and mask of valid samples """
+
+		# - Find absolute max of each sample
+		cond= _get_valid_mask(data)
+		if self.use_mask_box:
+			xmin, xmax, ymin, ymax= _get_center_box(data.shape[1], data.shape[2], self.mask_fract)
+			box_mask= np.zeros(data.shape[1:3], dtype=bool)
+			box_mask[ymin:ymax, xmin:xmax]= True
+			cond_max= np.logical_and(cond, box_mask[np.newaxis,:,:,np.newaxis])
+		else:
+			cond_max= cond
+
+		data_max= _masked_max(data, cond_max, axis=(1,2,3))
+
+		# - Scale data
+		with np.errstate(divide='ignore', invalid='ignore'):
+			data_scaled= data/data_max
+		data_scaled[~cond]= 0 # Restore 0 and nans set in original data
+
+		return data_scaled, np.any(cond_max, axis=(1,2,3))
+
 
 ##############################
 ##   ChanMaxScaler
@@ -924,6 +1152,33 @@ class ChanMaxScaler(object):
 
 		return data_scaled
 
+	def apply_batch(self, data, **kwargs):
+		""" Apply transformation to a batch of data of shape (N,ny,nx,nchans). Return transformed data and mask of valid samples """
+
+		cond= _get_valid_mask(data)
+
+		# - Find max of each channel (in box) for each sample
+		data_box= data
+		if self.use_mask_box:
+			xmin, xmax, ymin, ymax= _get_center_box(data.shape[1], data.shape[2], self.mask_fract)
+			data_box= data[:, ymin:ymax, xmin:xmax, :]
+
+		cond_box= _get_valid_mask(data_box)
+		chan_max= _masked_max(data_box, cond_box, axis=(1,2), keepdims=False)
+		data_max= chan_max[:, self.chref]
+
+		# - Check that channels are not entirely negatives
+		ok= np.all(np.logical_and(np.isfinite(chan_max), chan_max>0), axis=-1)
+		if not np.all(ok):
+			logger.warn("#%d samples have channels with max<=0 or not finite ..." % (np.count_nonzero(~ok)))
+
+		# - Scale data
+		with np.errstate(divide='ignore', invalid='ignore'):
+			data_scaled= data/data_max[:, np.newaxis, np.newaxis, np.newaxis]
+		data_scaled[~cond]= 0 # Restore 0 and nans set in original data
+
+		return data_scaled, ok
+
 ##############################
 ##   MinShifter
 ##############################
@@ -962,6 +1217,22 @@ class MinShifter(object):
 
 		return data_shifted
 
+	def apply_batch(self, data, **kwargs):
+		""" Apply transformation to a batch of data of shape (N,ny,nx,nchans). Return transformed data and mask of valid samples """
+
+		# - Shift selected channels
+		chans= _get_channel_slice(self.chid)
+		data_shifted= np.copy(data)
+		data_sel= data[..., chans]
+		cond= _get_valid_mask(data_sel)
+		ok= np.all(np.any(cond, axis=(1,2)), axis=-1)
+
+		data_sel_shifted= data_sel - _masked_min(data_sel, cond, axis=(1,2))
+		data_sel_shifted[~cond]= 0 # Set 0 and nans in original data to min
+		data_shifted[..., chans]= data_sel_shifted
+
+		return data_shifted, ok
+
 
 ##############################
 ##   Shifter
@@ -998,6 +1269,23 @@ class Shifter(object):
 
 		return data_shifted
 
+	def apply_batch(self, data, **kwargs):
+		""" Apply transformation to a batch of data of shape (N,ny,nx,nchans). Return transformed data and mask of valid samples """
+
+		# - Check size of offsets
+		nchannels= data.shape[-1]
+		noffsets= len(self.offsets)
+		if noffsets<=0 or noffsets!=nchannels:
+			logger.error("Empty offsets or size different from data channels!")
+			return None, None
+
+		# - Shift data
+		cond= _get_valid_mask(data)
+		data_shifted= (data-np.asarray(self.offsets))
+		data_shifted[~cond]= 0
+
+		return data_shifted, np.ones(data.shape[0], dtype=bool)
+
 
 ##############################
 ##   Standardizer
@@ -1038,6 +1326,25 @@ class Standardizer(object):
 
 		return data_norm
 
+	def apply_batch(self, data, **kwargs):
+		""" Apply transformation to a batch of data of shape (N,ny,nx,nchans). Return transformed data and mask of valid samples """
+
+		# - Check size of means/sigmas
+		nchannels= data.shape[-1]
+		if len(self.means)<=0 or len(self.means)!=nchannels:
+			logger.error("Empty means or size different from data channels!")
+			return None, None
+		if len(self.sigmas)<=0 or len(self.sigmas)!=nchannels:
+			logger.error("Empty sigmas or size different from data channels!")
+			return None, None
+
+		# - Transform data
+		cond= _get_valid_mask(data)
+		data_norm= (data-np.asarray(self.means))/np.asarray(self.sigmas)
+		data_norm[~cond]= 0
+
+		return data_norm, np.ones(data.shape[0], dtype=bool)
+
 ##############################
 ##   NegativeDataFixer
 ##############################
@@ -1075,6 +1382,20 @@ class NegativeDataFixer(object):
 
 		return data_shifted
 
+	def apply_batch(self, data, **kwargs):
+		""" Apply transformation to a batch of data of shape (N,ny,nx,nchans). Return transformed data and mask of valid samples """
+
+		# - Find entirely negative channels of each sample and shift them to min
+		cond= _get_valid_mask(data)
+		data_min= _masked_min(data, cond, axis=(1,2))
+		data_max= _masked_max(data, cond, axis=(1,2))
+		is_neg= np.broadcast_to(data_max<=0, data.shape)
+
+		data_shifted= np.where(is_neg, data-data_min, data)
+		data_shifted[np.logical_and(is_neg, ~cond)]= 0 # Set 0 and nans in original data to min
+
+		return data_shifted, np.ones(data.shape[0], dtype=bool)
+
 		
 ##############################
 ##   Scaler
@@ -1116,6 +1437,23 @@ class Scaler(object):
 
 		return data_scaled
 
+	def apply_batch(self, data, **kwargs):
+		""" Apply transformation to a batch of data of shape (N,ny,nx,nchans). Return transformed data and mask of valid samples """
+
+		# - Check size of scale factors
+		nchannels= data.shape[-1]
+		nscales= len(self.scale_factors)
+		if nscales<=0 or nscales!=nchannels:
+			logger.error("Empty scale factors or size different from data channels!")
+			return None, None
+
+		# - Apply scale factors and restore NANs values
+		cond= _get_valid_mask(data)
+		data_scaled= data*np.asarray(self.scale_factors)
+		data_scaled[~cond]= 0
+
+		return data_scaled, np.ones(data.shape[0], dtype=bool)
+
 
 ##############################
 ##   LogStretcher
@@ -1181,6 +1519,37 @@ class LogStretcher(object):
 
 		return data_transf
 
+	def apply_batch(self, data, **kwargs):
+		""" Apply transformation to a batch of data of shape (N,ny,nx,nchans). Return transformed data and mask of valid samples """
+
+		# - Select channels to be transformed
+		chans= [i for i in range(data.shape[-1]) if self.chid==-1 or i!=self.chid]
+		data_sel= data[..., chans]
+		badpix_cond= ~_get_valid_mask(data_sel)
+		cond= np.logical_and(data_sel>0, np.isfinite(data_sel))
+
+		# - Check that there are pixel >0 for log transform
+		ok= np.all(np.any(cond, axis=(1,2)), axis=-1)
+		if not np.all(ok):
+			logger.warn("#%d samples have channels with all pixels negative that cannot be log transformed ..." % (np.count_nonzero(~ok)))
+
+		# - Apply log
+		data_lg= np.log10(np.where(cond, data_sel, 1))
+		data_lg= np.where(cond, data_lg, _masked_min(data_lg, cond, axis=(1,2)))
+
+		# - Apply min/max norm data using input parameters
+		if self.minmaxnorm:
+			data_lg= (data_lg-self.data_norm_min)/(self.data_norm_max-self.data_norm_min)
+			if self.clip_neg:
+				data_lg[data_lg<0]= 0
+			data_lg[badpix_cond]= 0
+
+		# - Set in cube
+		data_transf= np.copy(data)
+		data_transf[..., chans]= data_lg
+
+		return data_transf, ok
+
 ##############################
 ##   BorderMasker
 ##############################
@@ -1227,6 +1596,19 @@ class BorderMasker(object):
 			data_masked[:,:,i]= data_ch
 	
 		return data_masked
+
+	def apply_batch(self, data, **kwargs):
+		""" Apply transformation to a batch of data of shape (N,ny,nx,nchans). Return transformed data and mask of valid samples """
+
+		# - Mask all channels at border
+		xmin, xmax, ymin, ymax= _get_center_box(data.shape[1], data.shape[2], self.mask_fract)
+		mask= np.zeros(data.shape[1:3], dtype=bool)
+		mask[ymin:ymax, xmin:xmax]= True
+
+		data_masked= np.copy(data)
+		data_masked[:, ~mask, :]= 0
+
+		return data_masked, np.ones(data.shape[0], dtype=bool)
 		
 		
 ##############################
@@ -1394,6 +1776,34 @@ class BkgSubtractor(object):
 
 		return data_bkgsub
 
+	def apply_batch(self, data, **kwargs):
+		""" Apply transformation to a batch of data of shape (N,ny,nx,nchans). Return transformed data and mask of valid samples """
+
+		# - Select channels
+		chans= _get_channel_slice(self.chid)
+		data_sel= data[..., chans]
+		cond= _get_valid_mask(data_sel)
+
+		# - Mask region at image center (where source is supposed to be)?
+		#   NB: masked pixels are set to NaN, ignored in sigma-clipped stats
+		bkgdata= np.array(data_sel, dtype=np.float64)
+		if self.use_mask_box:
+			xmin, xmax, ymin, ymax= _get_center_box(data.shape[1], data.shape[2], self.mask_fract)
+			bkgdata[:, ymin:ymax, xmin:xmax, :]= 0
+		bkgdata[~_get_valid_mask(bkgdata)]= np.nan
+
+		# - Compute and subtract mean bkg from data
+		bkgval, _, _ = sigma_clipped_stats(bkgdata, sigma=self.sigma, axis=(1,2))
+		bkgval= np.asarray(bkgval).reshape(data.shape[0], 1, 1, -1)
+		ok= np.all(np.isfinite(bkgval), axis=(1,2,3))
+
+		data_bkgsub= np.copy(data)
+		data_sel_bkgsub= data_sel - bkgval
+		data_sel_bkgsub[~cond]= 0
+		data_bkgsub[..., chans]= data_sel_bkgsub
+
+		return data_bkgsub, ok
+
 
 ##############################
 ##   SigmaClipShifter
@@ -1453,6 +1863,30 @@ class SigmaClipShifter(object):
 
 		return data_clipped
 
+	def apply_batch(self, data, **kwargs):
+		""" Apply transformation to a batch of data of shape (N,ny,nx,nchans). Return transformed data and mask of valid samples """
+
+		# - Select channels
+		chans= _get_channel_slice(self.chid)
+		data_sel= data[..., chans]
+		cond= _get_valid_mask(data_sel)
+
+		# - Compute sigma-clipped stats of each channel (NaN pixels are ignored)
+		data_nan= np.where(cond, data_sel, np.nan)
+		clipmean, median, stddev = sigma_clipped_stats(data_nan, sigma=self.sigma, axis=(1,2))
+		newzero= (np.asarray(clipmean) + self.sigma*np.asarray(stddev)).reshape(data.shape[0], 1, 1, -1)
+		ok= np.all(np.isfinite(newzero), axis=(1,2,3))
+
+		# - Clip all pixels that are below new zero
+		data_sel_clipped= data_sel - newzero
+		data_sel_clipped[data_sel_clipped<0]= 0
+		data_sel_clipped[~cond]= 0
+
+		data_clipped= np.copy(data)
+		data_clipped[..., chans]= data_sel_clipped
+
+		return data_clipped, ok
+
 
 ##############################
 ##   SigmaClipper
@@ -1506,6 +1940,30 @@ class SigmaClipper(object):
 			data_clipped[:,:,i]= data_ch_clipped
 
 		return data_clipped
+
+	def apply_batch(self, data, **kwargs):
+		""" Apply transformation to a batch of data of shape (N,ny,nx,nchans). Return transformed data and mask of valid samples """
+
+		# - Select channels
+		chans= _get_channel_slice(self.chid)
+		data_sel= data[..., chans]
+		cond= _get_valid_mask(data_sel)
+
+		# - Compute clip bounds of each channel (NaN pixels are ignored)
+		data_nan= np.where(cond, data_sel, np.nan)
+		res= sigma_clip(data_nan, sigma_lower=self.sigma_low, sigma_upper=self.sigma_up, axis=(1,2), masked=True, return_bounds=True)
+		thr_low= np.asarray(res[1]).reshape(data.shape[0], 1, 1, -1)
+		thr_up= np.asarray(res[2]).reshape(data.shape[0], 1, 1, -1)
+		ok= np.all(np.logical_and(np.isfinite(thr_low), np.isfinite(thr_up)), axis=(1,2,3))
+
+		# - Clip data
+		data_sel_clipped= np.minimum(np.maximum(data_sel, thr_low), thr_up)
+		data_sel_clipped[~cond]= 0
+
+		data_clipped= np.copy(data)
+		data_clipped[..., chans]= data_sel_clipped
+
+		return data_clipped, ok
 		
 		
 #################################
@@ -1550,6 +2008,23 @@ class PercentileThresholder(object):
 		
 		return data_thresholded
 
+	def apply_batch(self, data, **kwargs):
+		""" Apply transformation to a batch of data of shape (N,ny,nx,nchans). Return transformed data and mask of valid samples """
+
+		# - Compute percentile of each channel (NaN pixels are ignored)
+		cond= _get_valid_mask(data)
+		ok= np.all(np.any(cond, axis=(1,2)), axis=-1)
+		with warnings.catch_warnings():
+			warnings.simplefilter("ignore", category=RuntimeWarning) # all-NaN channels
+			p= np.nanpercentile(np.where(cond, data, np.nan), self.percthr, axis=(1,2), keepdims=True)
+
+		# - Threshold each channel and restore 0 and nans set in original data
+		data_thresholded= np.copy(data)
+		data_thresholded[data<p]= 0
+		data_thresholded[~cond]= 0
+
+		return data_thresholded, ok
+
 ##############################
 ##   Resizer
 ##############################
@@ -1677,6 +2152,17 @@ class CenterCropper(object):
 			logger.error("Cropped image is None!")
 		
 		return data_cropped
+
+	def apply_batch(self, data, **kwargs):
+		""" Apply transformation to a batch of data of shape (N,ny,nx,nchans). Return transformed data and mask of valid samples """
+
+		try:
+			data_cropped= self.transform.augment_images(data)
+		except Exception as e:
+			logger.error("Failed to crop batch images (err=%s)!" % str(e))
+			return None, None
+
+		return np.asarray(data_cropped), np.ones(data.shape[0], dtype=bool)
 			
 
 ##############################
@@ -1748,6 +2234,41 @@ class ChanDivider(object):
 			
 		return data_norm
 
+	def apply_batch(self, data, **kwargs):
+		""" Apply transformation to a batch of data of shape (N,ny,nx,nchans). Return transformed data and mask of valid samples """
+
+		# - Init ref channel
+		cond= _get_valid_mask(data)
+		data_ref= data[..., self.chref]
+		cond_ref= _get_valid_mask(data_ref)
+
+		# - Divide other channels by reference channel
+		data_denom= np.where(data_ref==0, 1, data_ref)
+		with np.errstate(divide='ignore', invalid='ignore'):
+			data_norm= data/data_denom[..., np.newaxis]
+		data_norm[~cond_ref]= 0 # set ratio to zero if ref pixel flux was zero or nan
+		data_norm[..., self.chref]= data_ref
+		data_norm[~cond]= 0
+
+		# - Apply log transform to ratio channels?
+		if self.logtransf:
+			data_transf= np.where(data_norm<=0, 1, data_norm)
+			data_transf= np.log10(data_transf)
+			data_transf[~cond]= 0
+
+			if self.trim:
+				data_transf[data_transf>self.trim_max]= self.trim_max
+				data_transf[data_transf<self.trim_min]= self.trim_min
+
+			data_transf[..., self.chref]= data_norm[..., self.chref]
+			data_norm= data_transf
+
+		# - Strip ref channel
+		if self.strip_chref:
+			data_norm= np.delete(data_norm, self.chref, axis=-1)
+
+		return data_norm, np.ones(data.shape[0], dtype=bool)
+
 
 ##############################
 ##   ZScaleTransformer
@@ -1794,6 +2315,39 @@ class ZScaleTransformer(object):
 
 		return data_stretched
 
+	def apply_batch(self, data, **kwargs):
+		""" Apply transformation to a batch of data of shape (N,ny,nx,nchans). Return transformed data and mask of valid samples.
+				NB: zscale limits are computed per image channel, the stretch is applied to the whole batch
+		"""
+
+		# - Check constrast dim vs nchans
+		nchans= data.shape[-1]
+		if len(self.contrasts)<nchans:
+			logger.error("Invalid constrasts given (constrast list size=%d < nchans=%d)" % (len(self.contrasts), nchans))
+			return None, None
+
+		cond= _get_valid_mask(data)
+		nsamples= data.shape[0]
+		vmins= np.zeros((nsamples,1,1,nchans))
+		vmaxs= np.ones((nsamples,1,1,nchans))
+		stretch_chans= np.array([self.contrasts[i]>0 for i in range(nchans)])
+
+		# - Compute zscale limits of each channel
+		for i in range(nchans):
+			if not stretch_chans[i]:
+				continue
+			transform= ZScaleInterval(contrast=self.contrasts[i]) # able to handle NANs
+			for j in range(nsamples):
+				vmins[j,0,0,i], vmaxs[j,0,0,i]= transform.get_limits(data[j,:,:,i])
+
+		# - Stretch data
+		with np.errstate(divide='ignore', invalid='ignore'):
+			data_transf= np.clip((data-vmins)/(vmaxs-vmins), 0., 1.)
+		data_stretched= np.where(stretch_chans, data_transf, data).astype(data.dtype)
+		data_stretched[~cond]= 0 # Restore 0 and nans set in original data
+
+		return data_stretched, np.ones(nsamples, dtype=bool)
+
 
 ##############################
 ##   HistEqualizer
@@ -2422,6 +2976,19 @@ class Augmenter(object):
 
 		return data_aug
 
+	def apply_batch(self, data, **kwargs):
+		""" Apply transformation to a batch of data of shape (N,ny,nx,nchans). Return transformed data and mask of valid samples.
+				NB: augmentation parameters are sampled independently for each image
+		"""
+
+		try:
+			data_aug= self.augmenter.augment_images(data)
+		except Exception as e:
+			logger.error("Failed to augment batch data (err=%s)!" % str(e))
+			return None, None
+
+		return _stack_if_same_shape(data_aug), np.ones(len(data), dtype=bool)
+
 
 
 
@@ -2553,6 +3120,29 @@ class Augmenters(object):
 
 		return data_aug
 
+	def apply_batch(self, data, **kwargs):
+		""" Apply transformation to a batch of data of shape (N,ny,nx,nchans). Return transformed data and mask of valid samples.
+				augmenter_index can be given per sample, images are grouped by augmenter
+		"""
+
+		# - Retrieve augmenter indexes from kwargs
+		nsamples= len(data)
+		augmenter_indexes= np.broadcast_to(np.asarray(kwargs.get('augmenter_index', 0)), (nsamples,))
+
+		# - Augment images with each augmenter
+		data_aug= [None]*nsamples
+		for augmenter_index in np.unique(augmenter_indexes):
+			sel= np.flatnonzero(augmenter_indexes==augmenter_index)
+			try:
+				data_aug_sel= self.augmenters[augmenter_index].augment_images(data[sel])
+			except Exception as e:
+				logger.error("Failed to augment batch data with augmenter %d (err=%s)!" % (augmenter_index, str(e)))
+				return None, None
+			for i, index in enumerate(sel):
+				data_aug[index]= data_aug_sel[i]
+
+		return _stack_if_same_shape(data_aug), np.ones(nsamples, dtype=bool)
+
 
 
 
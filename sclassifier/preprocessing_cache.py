@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+##################################################
+###          MODULE IMPORT
+##################################################
+## STANDARD MODULES
+import os
+import sys
+import time
+import datetime
+import numpy as np
+import logging
+import hashlib
+import uuid
+
+##############################
+##     GLOBAL VARS
+##############################
+from sclassifier import logger
+
+
+##############################
+##     PREPROCESSING CACHE
+##############################
+class PreprocessingCache(object):
+	""" On-disk cache of pre-processed data, with size-bounded LRU eviction.
+
+			Entries are stored as .npy files in the cache directory. Keys are computed from the identity
+			of input files (path, size, modification time) and a hash of the pre-processing stage parameters
+			(see DataPreprocessor.get_config_hash), so that modified inputs or pipelines never hit stale entries.
+			Entry access times are refreshed at each hit, the least recently used entries are removed when
+			the cache size exceeds max_size.
+
+			Arguments:
+				- cachedir: cache directory
+				- max_size: max cache size in bytes (<=0 means unlimited)
+	"""
+
+	entry_ext= ".npy"
+
+	def __init__(self, cachedir, max_size=10*1024**3):
+		""" Return a PreprocessingCache object """
+
+		self.cachedir= cachedir
+		self.max_size= max_size
+		self.evict_fract= 0.9 # after eviction, cache size is reduced to this fraction of max_size
+		self.size= 0
+		self.nhits= 0
+		self.nmisses= 0
+
+	#############################
+	##     OPEN CACHE
+	#############################
+	def open(self):
+		""" Create cache directory (if not existing) and compute current cache size """
+
+		try:
+			if not os.path.isdir(self.cachedir):
+				os.makedirs(self.cachedir)
+		except Exception as e:
+			logger.error("Failed to create cache directory %s (err=%s)!" % (self.cachedir, str(e)))
+			return -1
+
+		self.size= sum([item[2] for item in self.__list_entries()])
+
+		logger.info("Opened pre-processing cache %s (size=%.1f MB, max_size=%.1f MB) ..." % (self.cachedir, self.size/1024.**2, self.max_size/1024.**2))
+
+		return 0
+
+	def __list_entries(self):
+		""" Return list of cache entries (path, last access time, size). NB: entry mtime is refreshed at each hit """
+
+		entries= []
+		try:
+			with os.scandir(self.cachedir) as it:
+				for item in it:
+					if not item.name.endswith(self.entry_ext):
+						continue
+					try:
+						st= item.stat()
+					except OSError: # removed by another process
+						continue
+					entries.append( (item.path, st.st_mtime, st.st_size) )
+		except Exception as e:
+			logger.warn("Failed to list cache directory %s (err=%s)!" % (self.cachedir, str(e)))
+
+		return entries
+
+	#############################
+	##     KEYS
+	#############################
+	def get_key(self, filepaths, config_hash, extra=""):
+		""" Return cache key for given input files and pre-processing configuration hash.
+				Returns None if input files cannot be accessed.
+		"""
+
+		h= hashlib.sha1()
+		for filepath in filepaths:
+			try:
+				st= os.stat(filepath)
+			except OSError as e:
+				logger.warn("Failed to stat file %s (err=%s), cannot compute cache key!" % (filepath, str(e)))
+				return None
+			h.update( ("%s|%d|%d;" % (os.path.abspath(filepath), st.st_size, st.st_mtime_ns)).encode() )
+
+		h.update( ("%s|%s" % (config_hash, str(extra))).encode() )
+
+		return h.hexdigest()
+
+	def __get_entry_path(self, key):
+		""" Return file path of given entry """
+		return os.path.join(self.cachedir, key + self.entry_ext)
+
+	#############################
+	##     GET/PUT
+	#############################
+	def get(self, key):
+		""" Return cached data for given key or None if not present """
+
+		if key is None:
+			return None
+
+		entrypath= self.__get_entry_path(key)
+		try:
+			data= np.load(entrypath, allow_pickle=False)
+		except Exception:
+			self.nmisses+= 1
+			return None
+
+		# - Refresh entry time for LRU eviction
+		try:
+			os.utime(entrypath, None)
+		except OSError:
+			pass
+
+		self.nhits+= 1
+
+		return data
+
+	def put(self, key, data):
+		""" Store data with given key. Returns 0 on success, -1 otherwise """
+
+		if key is None or data is None:
+			return -1
+
+		# - Write to a temporary file and move it atomically (cache can be shared by reader processes)
+		entrypath= self.__get_entry_path(key)
+		entrypath_tmp= os.path.join(self.cachedir, "%s.%s.tmp" % (key, uuid.uuid4().hex))
+		try:
+			with open(entrypath_tmp, 'wb') as fp:
+				np.save(fp, np.asarray(data), allow_pickle=False)
+			os.replace(entrypath_tmp, entrypath)
+		except Exception as e:
+			logger.warn("Failed to write cache entry %s (err=%s)!" % (entrypath, str(e)))
+			if os.path.isfile(entrypath_tmp):
+				os.remove(entrypath_tmp)
+			return -1
+
+		self.size+= np.asarray(data).nbytes
+
+		# - Evict entries if needed
+		if self.max_size>0 and self.size>self.max_size:
+			self.evict()
+
+		return 0
+
+	#############################
+	##     EVICTION
+	#############################
+	def evict(self):
+		""" Remove least recently used entries until cache size is below evict_fract*max_size """
+
+		entries= self.__list_entries()
+		self.size= sum([item[2] for item in entries])
+		size_thr= self.evict_fract*self.max_size
+		if self.size<=size_thr:
+			return 0
+
+		entries.sort(key=lambda item: item[1])
+		nremoved= 0
+
+		for entrypath, mtime, size in entries:
+			if self.size<=size_thr:
+				break
+			try:
+				os.remove(entrypath)
+			except OSError: # removed by another process
+				pass
+			self.size-= size
+			nremoved+= 1
+
+		logger.info("Evicted #%d entries from pre-processing cache (size=%.1f MB) ..." % (nremoved, self.size/1024.**2))
+
+		return nremoved
+
+	def clear(self):
+		""" Remove all cache entries """
+
+		for entrypath, mtime, size in self.__list_entries():
+			try:
+				os.remove(entrypath)
+			except OSError:
+				pass
+		self.size= 0
+
+	def get_stats(self):
+		""" Return cache statistics dictionary """
+
+		nreqs= self.nhits + self.nmisses
+		hit_rate= float(self.nhits)/nreqs if nreqs>0 else 0.
+		return {"nhits": self.nhits, "nmisses": self.nmisses, "hit_rate": hit_rate, "size": self.size}
+
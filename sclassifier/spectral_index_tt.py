@@ -20,6 +20,7 @@ import math
 import logging
 import shutil
 import csv
+from concurrent.futures import ProcessPoolExecutor
 
 ## COMMAND-LINE ARG MODULES
 import getopt
@@ -36,6 +37,18 @@ from scipy.stats import linregress
 from sclassifier import logger
 from sclassifier.utils import Utils
 
+# - Spectral index calculator instance used by worker processes
+_worker_sic= None
+
+def _init_worker(sic):
+	""" Set spectral index calculator used by worker process """
+	global _worker_sic
+	_worker_sic= sic
+
+def _process_sources_task(indexes, img_group_1, img_group_2):
+	""" Process sources at given indexes in a worker process """
+	return _worker_sic.process_sources(indexes, img_group_1, img_group_2)
+
 #####################################
 ##   SpectralIndexTTHelper class
 #####################################
@@ -554,10 +567,16 @@ class SpectralIndexTTCalculator(object):
 		# - Alpha calculation options
 		self.alpha_rcoeff_thr= 0.9
 		self.img_freqs= []
+
+		# - Parallel options
+		#   NB: if nworkers>1 sources are processed in a pool of worker processes, in chunks of chunk_size sources
+		self.nworkers= 1
+		self.chunk_size= 0 # if <=0 set from data size and number of workers
 		
 		# - Output options
 		self.save= True
 		self.par_dict_list= []
+		self.failed_snames= []
 		self.outfile= "features_alpha.csv"
 
 	#===========================
@@ -598,15 +617,12 @@ class SpectralIndexTTCalculator(object):
 
 		# - Loop over data and extract params per each source
 		logger.info("Loop over data and extract params per each source ...")
-		for i in range(self.datasize):
-			if self.__process_source(i, img_group_1, img_group_2)<0:
-				logger.warn("Failed to process source %d, skip to next ..." % (i))
-				continue 
+		self.__process_all_sources(img_group_1, img_group_2)
 
 		# - Save data
 		if self.save:
 			logger.info("Saving data to file %s ..." % (self.outfile))
-			self.__save_data()
+			self.save_data()
 
 		return 0
 
@@ -635,15 +651,12 @@ class SpectralIndexTTCalculator(object):
 
 		# - Loop over data and extract params per each source
 		logger.info("Loop over data and extract params per each source ...")
-		for i in range(self.datasize):
-			if self.__process_source(i, img_group_1, img_group_2)<0:
-				logger.warn("Failed to process source %d, skip to next ..." % (i))
-				continue 
+		self.__process_all_sources(img_group_1, img_group_2)
 			
 		# - Save data
 		if self.save:
 			logger.info("Saving data to file %s ..." % (self.outfile))
-			self.__save_data()
+			self.save_data()
 
 		return 0
 
@@ -651,13 +664,60 @@ class SpectralIndexTTCalculator(object):
 	#===========================
 	#==    PROCESS SOURCE
 	#===========================
+	def process_sources(self, indexes, img_group_1, img_group_2):
+		""" Process sources at given indexes. Returns a list of (index, status, par_dict) tuples (par_dict is None if no reliable index was computed) """
+
+		results= []
+		for index in indexes:
+			try:
+				status, par_dict= self.__process_source(index, img_group_1, img_group_2)
+			except Exception as e:
+				logger.error("Exception caught while processing source %d (err=%s)!" % (index, str(e)))
+				status, par_dict= -1, None
+			results.append( (index, status, par_dict) )
+
+		return results
+
+	def __process_all_sources(self, img_group_1, img_group_2):
+		""" Process all sources (in a pool of worker processes if nworkers>1) and merge results in input order """
+
+		# - Process sources
+		if self.nworkers<=1 or self.datasize<=1:
+			results= self.process_sources(range(self.datasize), img_group_1, img_group_2)
+		else:
+			chunk_size= self.chunk_size
+			if chunk_size<=0:
+				chunk_size= max(1, int(np.ceil(self.datasize/float(4*self.nworkers))))
+			chunks= [list(range(i, min(i+chunk_size, self.datasize))) for i in range(0, self.datasize, chunk_size)]
+			nchunks= len(chunks)
+
+			logger.info("Processing #%d sources in a pool of %d workers (#%d chunks of size %d) ..." % (self.datasize, self.nworkers, nchunks, chunk_size))
+			results= []
+			with ProcessPoolExecutor(max_workers=self.nworkers, initializer=_init_worker, initargs=(self,)) as executor:
+				for chunk_results in executor.map(_process_sources_task, chunks, [img_group_1]*nchunks, [img_group_2]*nchunks):
+					results.extend(chunk_results)
+
+		# - Merge results in input order and report failures
+		self.failed_snames= []
+		for index, status, par_dict in results:
+			if status<0:
+				logger.warn("Failed to process source %d (sname=%s), skip to next ..." % (index, self.snames[index]))
+				self.failed_snames.append(self.snames[index])
+				continue
+			if par_dict is not None:
+				self.par_dict_list.append(par_dict)
+
+		logger.info("#%d/%d sources processed (#%d failed) ..." % (self.datasize-len(self.failed_snames), self.datasize, len(self.failed_snames)))
+
+		return 0
+
 	def __process_source(self, index, img_group_1, img_group_2):
-		""" Process source and compute spectral index data """
+		""" Process source and compute spectral index data. Returns status and par dict (None if index is not reliable) """
 
 		# - Check index
 		if index<0 or index>=self.datasize:
 			logger.error("Invalid index %d given!" % (index))
-			return -1
+			return -1, None
 
 		# - Process source
 		d= self.datalist[index]
@@ -669,22 +729,21 @@ class SpectralIndexTTCalculator(object):
 
 		if sih.run(img_group_1, img_group_2)<0:
 			logger.warn("Failed to compute spectral index for source %d ..." % (index))
-			return -1
+			return -1, None
 
-		# - Append out dict to list if a good index was estimated
+		# - Return out dict if a good index was estimated
 		has_good_alpha= sih.has_good_alpha
 		par_dict= sih.param_dict
 		
 		if par_dict is None or not par_dict:
 			logger.warn("Feature dict for source data %d is empty or None, skip it ..." % (index))
-			return -1
+			return -1, None
 
-		if has_good_alpha:
-			self.par_dict_list.append(par_dict)
-		else:
+		if not has_good_alpha:
 			logger.warn("Spectral index computed for source %d is not reliable, skip it ..." % (index))
+			return 0, None
 
-		return 0
+		return 0, par_dict
 
 	#============================
 	#==     READ DATA LIST
@@ -745,7 +804,7 @@ class SpectralIndexTTCalculator(object):
 	#===========================
 	#==    SAVE DATA
 	#===========================
-	def __save_data(self):
+	def save_data(self):
 		""" Save data to file """
 
 		if self.par_dict_list:
@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+##################################################
+###          MODULE IMPORT
+##################################################
+## STANDARD MODULES
+import os
+import sys
+import time
+import datetime
+import numpy as np
+import random
+import math
+import logging
+
+## TENSORFLOW & KERAS MODULES
+import tensorflow as tf
+from tensorflow.keras.utils import to_categorical
+
+## SKLEARN MODULES
+from sklearn.preprocessing import MultiLabelBinarizer
+
+## PACKAGE MODULES
+from .data_loader import SourceData
+from .data_sampler import DataSampler
+
+##############################
+##     GLOBAL VARS
+##############################
+from sclassifier import logger
+
+
+##############################
+##     TF DATASET BUILDER
+##############################
+class TFDatasetBuilder(object):
+	""" Build tf.data input pipelines on top of a DataGenerator.
+
+			Source data are read (read_raw_data) and pre-processed (preprocess_data) by the
+			DataGenerator inside tf.numpy_function calls mapped in parallel, so that I/O, pre-processing
+			and model computation are overlapped. Outputs have the same layout of the corresponding
+			DataGenerator.generate_* methods.
+
+			Arguments:
+				- DataGenerator class (datalist must be already read)
+	"""
+
+	def __init__(self, data_generator):
+		""" Return a TFDatasetBuilder object """
+
+		self.dg= data_generator
+
+		# - Pipeline options
+		self.num_parallel_calls= tf.data.AUTOTUNE
+		self.deterministic= False
+		self.prefetch_size= tf.data.AUTOTUNE
+		self.shuffle_buffer_size= 10000 # used only when caching raw data
+
+		# - Cache options
+		#   NB: raw (not pre-processed) data are cached, pre-processing and augmentation are run at every epoch
+		self.cache= False
+		self.cachefile= "" # if empty cache in memory
+
+		# - Shard options (e.g. for multi-worker training), taken from data generator
+		self.num_shards= data_generator.num_shards
+		self.shard_index= data_generator.shard_index
+
+		# - Data shape (after pre-processing), inferred from data if not given
+		self.data_shape= None
+
+	#####################################
+	##     HELPER METHODS
+	#####################################
+	def __get_data_shape(self, read_crop=False, crop_size=32):
+		""" Infer pre-processed data shape by reading the first valid sample """
+
+		if self.data_shape is not None:
+			return self.data_shape
+
+		for index in range(self.dg.datasize):
+			sdata= self.dg.read_data(index, read_crop, crop_size)
+			if sdata is not None:
+				self.data_shape= sdata.img_cube.shape
+				logger.info("Inferred pre-processed data shape (%s) from sample at index %d ..." % (str(self.data_shape), index))
+				return self.data_shape
+
+		logger.error("Failed to read any data sample to infer data shape!")
+		return None
+
+	def __get_cnn_targets(self, classtarget_map={}, nclasses=7, skip_first_class=False):
+		""" Return the target vector of each data sample (same encoding as in DataGenerator.generate_cnn_data) """
+
+		target_ids= []
+		multilabel= False
+		for class_id, class_name in zip(self.dg.classids, self.dg.labels):
+			multilabel= (isinstance(class_id, list)) and (isinstance(class_name, list))
+			target_id= class_id
+			if classtarget_map:
+				if multilabel:
+					target_id= [classtarget_map[item] for item in class_id]
+				else:
+					target_id= classtarget_map[class_id]
+			target_ids.append(target_id)
+
+		if multilabel:
+			mlb = MultiLabelBinarizer(classes=np.arange(0, nclasses))
+			targets= mlb.fit_transform(target_ids).astype('float32')
+			if skip_first_class:
+				targets= targets[:, 1:nclasses]
+		else:
+			targets= to_categorical(np.array(target_ids), num_classes=nclasses).astype('float32')
+
+		return targets
+
+	def __read_raw(self, index, read_crop, crop_size):
+		""" Read raw data at given index (numpy function) """
+		sdata= self.dg.read_raw_data(int(index), read_crop, crop_size)
+		if sdata is None:
+			return np.zeros((1,1,1), dtype=np.float32), False
+		return sdata.img_cube.astype(np.float32), True
+
+	def __preprocess(self, index, data, nviews):
+		""" Apply pre-processing to raw data read at given index (numpy function). 
+				Deterministic stages are applied once, remaining (augmentation) stages nviews times.
+		"""
+
+		index= int(index)
+		d= self.dg.datalist["data"][index]
+		failed= tuple([np.zeros(self.data_shape, dtype=np.float32)]*nviews) + (False,)
+
+		# - Apply deterministic stages once
+		nstages_det= 0
+		if self.dg.preprocessor is not None and nviews>1:
+			nstages_det= self.dg.preprocessor.get_deterministic_stage_count()
+			data= self.dg.preprocessor.run_stages(np.array(data, dtype=np.float32), 0, nstages_det, augmenter_index=d.get('augmenter_index', 0))
+			if data is None:
+				return failed
+
+		# - Apply remaining stages to each view
+		views= []
+		for i in range(nviews):
+			sdata= SourceData()
+			sdata.set_from_dict(d)
+			sdata.img_cube= np.array(data, dtype=np.float32) # copy, stages may work in place
+			sdata= self.dg.preprocess_data(index, sdata, first_stage=nstages_det)
+			if sdata is None:
+				return failed
+			views.append(sdata.img_cube.astype(np.float32))
+
+		return tuple(views) + (True,)
+
+	#####################################
+	##     BUILD DATASET
+	#####################################
+	def __build_dataset(self, batch_size=32, shuffle=True, read_crop=False, crop_size=32, nviews=1, balance_classes=False, class_probs={}, repeat=True):
+		""" Build a dataset returning batches of ((view_1, ..., view_n), index) """
+
+		# - Infer data shape
+		data_shape= self.__get_data_shape(read_crop, crop_size)
+		if data_shape is None:
+			return None
+
+		use_cache= self.cache
+		if use_cache and read_crop:
+			logger.warn("Caching is not supported when reading random crops, disabling it ...")
+			use_cache= False
+
+		# - Create class rebalancing sampler?
+		#   NB: when caching raw data, cached samples are filtered by acceptance prob
+		sampler= None
+		if balance_classes and class_probs and not use_cache:
+			sampler= self.dg.get_sampler(class_probs)
+
+		# - Create index dataset
+		#   NB: with a sampler, each iteration returns the indexes of one epoch drawn before reading data
+		if sampler is not None:
+			rng= np.random.RandomState(self.dg.seed) if self.dg.seed is not None else np.random
+			ds= tf.data.Dataset.from_generator(
+				lambda: sampler.generate_indexes(rng, nepochs=1),
+				output_signature=tf.TensorSpec(shape=(), dtype=tf.int64)
+			)
+		else:
+			ds= tf.data.Dataset.range(self.dg.datasize)
+
+		if self.num_shards>1:
+			logger.info("Sharding dataset (num_shards=%d, shard_index=%d) ..." % (self.num_shards, self.shard_index))
+			ds= ds.shard(self.num_shards, self.shard_index)
+
+		if shuffle and not use_cache and sampler is None:
+			ds= ds.shuffle(self.dg.datasize, reshuffle_each_iteration=True)
+
+		# - Read raw data
+		def read_fcn(index):
+			data, ok= tf.numpy_function(
+				lambda i: self.__read_raw(i, read_crop, crop_size),
+				[index],
+				[tf.float32, tf.bool]
+			)
+			data.set_shape([None, None, None])
+			return index, data, ok
+
+		ds= ds.map(read_fcn, num_parallel_calls=self.num_parallel_calls, deterministic=self.deterministic)
+		ds= ds.filter(lambda index, data, ok: ok)
+
+		# - Cache raw data?
+		if use_cache:
+			logger.info("Caching raw data (cachefile=%s) ..." % (self.cachefile))
+			ds= ds.cache(self.cachefile)
+			if shuffle:
+				ds= ds.shuffle(min(self.shuffle_buffer_size, self.dg.datasize), reshuffle_each_iteration=True)
+
+		if repeat:
+			ds= ds.repeat()
+
+		# - Apply class rebalancing to cached data?
+		if balance_classes and class_probs and use_cache:
+			accept_probs= tf.constant(DataSampler.get_sample_probs(self.dg.labels, class_probs).astype(np.float32))
+			ds= ds.filter(lambda index, data, ok: tf.random.uniform([]) < tf.gather(accept_probs, index))
+
+		# - Apply pre-processing
+		def preprocess_fcn(index, data, ok):
+			outputs= tf.numpy_function(
+				lambda i, x: self.__preprocess(i, x, nviews),
+				[index, data],
+				[tf.float32]*nviews + [tf.bool]
+			)
+			views= outputs[:nviews]
+			for view in views:
+				view.set_shape(data_shape)
+			return tuple(views), index, outputs[-1]
+
+		ds= ds.map(preprocess_fcn, num_parallel_calls=self.num_parallel_calls, deterministic=self.deterministic)
+		ds= ds.filter(lambda views, index, ok: ok)
+		ds= ds.map(lambda views, index, ok: (views, index))
+
+		# - Batch data
+		ds= ds.batch(batch_size, drop_remainder=repeat)
+
+		return ds
+
+	def __finalize(self, ds):
+		""" Add prefetching to dataset """
+		return ds.prefetch(self.prefetch_size)
+
+	def build_cnn_dataset(self, batch_size=32, shuffle=True, read_crop=False, crop_size=32, classtarget_map={}, nclasses=7, balance_classes=False, class_probs={}, skip_first_class=False):
+		""" Build dataset for CNN classification task (same outputs as DataGenerator.generate_cnn_data) """
+
+		ds= self.__build_dataset(batch_size, shuffle, read_crop, crop_size, 1, balance_classes, class_probs)
+		if ds is None:
+			return None
+
+		targets= tf.constant(self.__get_cnn_targets(classtarget_map, nclasses, skip_first_class))
+		ds= ds.map(lambda views, index: (views[0], tf.gather(targets, index)))
+
+		return self.__finalize(ds)
+
+	def build_cae_dataset(self, batch_size=32, shuffle=True, read_crop=False, crop_size=32, balance_classes=False, class_probs={}):
+		""" Build dataset for CAE task (same outputs as DataGenerator.generate_cae_data) """
+
+		ds= self.__build_dataset(batch_size, shuffle, read_crop, crop_size, 1, balance_classes, class_probs)
+		if ds is None:
+			return None
+
+		ds= ds.map(lambda views, index: (views[0], views[0]))
+
+		return self.__finalize(ds)
+
+	def build_simclr_dataset(self, batch_size=32, shuffle=True, read_crop=False, crop_size=32, balance_classes=False, class_probs={}):
+		""" Build dataset for SimCLR task (same outputs as DataGenerator.generate_simclr_data) """
+
+		ds= self.__build_dataset(batch_size, shuffle, read_crop, crop_size, 2, balance_classes, class_probs)
+		if ds is None:
+			return None
+
+		# - Return a tuple (len=2xbatch_size) of tensors of shape (1, ny, nx, nchan), first all views #1 then all views #2
+		#   Targets are [I|O|I|O] as in DataGenerator.generate_simclr_data
+		eye= np.eye(batch_size, dtype=np.float32)
+		zeros= np.zeros((batch_size, batch_size), dtype=np.float32)
+		y= tf.constant(np.concatenate([eye, zeros, eye, zeros], 1))
+
+		def format_fcn(views, index):
+			x= tf.concat([views[0], views[1]], axis=0)
+			return tuple(tf.split(x, 2*batch_size, axis=0)), y
+
+		ds= ds.map(format_fcn)
+
+		return self.__finalize(ds)
+
+	def build_simclr_dataset_v2(self, batch_size=32, shuffle=True, read_crop=False, crop_size=32, balance_classes=False, class_probs={}):
+		""" Build dataset for SimCLR task (version 2). Returns tensors of shape (2*batch_size, ny, nx, nchan) with pair views at consecutive positions """
+
+		ds= self.__build_dataset(batch_size, shuffle, read_crop, crop_size, 2, balance_classes, class_probs)
+		if ds is None:
+			return None
+
+		inputs_shape= (2*batch_size,) + tuple(self.data_shape)
+
+		def format_fcn(views, index):
+			x= tf.stack([views[0], views[1]], axis=1) # (bs, 2, ny, nx, nchan)
+			return tf.reshape(x, inputs_shape)
+
+		ds= ds.map(format_fcn)
+
+		return self.__finalize(ds)
+
+	def build_byol_dataset(self, batch_size=32, shuffle=True, read_crop=False, crop_size=32, balance_classes=False, class_probs={}):
+		""" Build dataset for BYOL task (same outputs as DataGenerator.generate_byol_data) """
+
+		ds= self.__build_dataset(batch_size, shuffle, read_crop, crop_size, 2, balance_classes, class_probs)
+		if ds is None:
+			return None
+
+		ds= ds.map(lambda views, index: (views[0], views[1]))
+
+		return self.__finalize(ds)
@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+##################################################
+###          MODULE IMPORT
+##################################################
+## STANDARD MODULES
+import os
+import sys
+import time
+import datetime
+import numpy as np
+import logging
+import json
+import socket
+import contextlib
+from itertools import chain
+
+## TENSORFLOW & KERAS MODULES
+import tensorflow as tf
+
+##############################
+##     GLOBAL VARS
+##############################
+from sclassifier import logger
+
+
+###############################################
+##     CREATE STRATEGY
+###############################################
+def get_mpi_worker_hosts(base_port=12345):
+	""" Return (worker_hosts, worker_index) from MPI ranks (hostname:base_port+rank), or ([], -1) if MPI is not available """
+
+	try:
+		from mpi4py import MPI as MPI
+	except Exception as e:
+		logger.error("Failed to import mpi4py module (err=%s), cannot get worker hosts from MPI!" % str(e))
+		return [], -1
+
+	comm= MPI.COMM_WORLD
+	procId= comm.Get_rank()
+	hostnames= comm.allgather(socket.gethostname())
+	worker_hosts= ["%s:%d" % (hostname, base_port + rank) for rank, hostname in enumerate(hostnames)]
+
+	return worker_hosts, procId
+
+def set_tf_config(worker_hosts, worker_index):
+	""" Set TF_CONFIG environment variable for given worker hosts (host:port list) and worker index """
+
+	tf_config= {
+		"cluster": {"worker": list(worker_hosts)},
+		"task": {"type": "worker", "index": int(worker_index)}
+	}
+	os.environ["TF_CONFIG"]= json.dumps(tf_config)
+
+	return 0
+
+def create_strategy(worker_hosts=[], worker_index=-1, use_mpi=False, base_port=12345, collective_impl="ring"):
+	""" Create a MultiWorkerMirroredStrategy for data-parallel training over CPU worker processes.
+			Cluster is taken (in order of priority) from MPI ranks (if use_mpi), from the given worker hosts and index,
+			or from TF_CONFIG environment variable. Must be called at program start, before any other TF operation.
+			Returns None on failure.
+	"""
+
+	# - Set cluster
+	if use_mpi:
+		worker_hosts, worker_index= get_mpi_worker_hosts(base_port)
+		if not worker_hosts:
+			return None
+
+	if worker_hosts:
+		if worker_index<0 or worker_index>=len(worker_hosts):
+			logger.error("Invalid worker index (%d) given (#%d workers)!" % (worker_index, len(worker_hosts)))
+			return None
+		set_tf_config(worker_hosts, worker_index)
+	elif "TF_CONFIG" not in os.environ:
+		logger.error("No worker hosts given and TF_CONFIG environment variable not set, cannot create multi-worker strategy!")
+		return None
+
+	# - Set collective communication implementation
+	#   NB: NCCL is GPU only, ring all-reduce over gRPC is used on CPU nodes
+	if collective_impl=="ring":
+		implementation= tf.distribute.experimental.CommunicationImplementation.RING
+	elif collective_impl=="auto":
+		implementation= tf.distribute.experimental.CommunicationImplementation.AUTO
+	else:
+		logger.error("Invalid/unknown collective implementation (%s) given!" % (collective_impl))
+		return None
+
+	# - Create strategy
+	try:
+		strategy= tf.distribute.MultiWorkerMirroredStrategy(
+			communication_options=tf.distribute.experimental.CommunicationOptions(implementation=implementation)
+		)
+	except Exception as e:
+		logger.error("Failed to create multi-worker strategy (err=%s)!" % (str(e)))
+		return None
+
+	logger.info("Created multi-worker strategy (worker %d/%d, #%d replicas in sync, collective_impl=%s) ..." % (get_worker_index(strategy), get_num_workers(strategy), strategy.num_replicas_in_sync, collective_impl))
+
+	return strategy
+
+###############################################
+##     STRATEGY INFO
+###############################################
+def get_num_workers(strategy=None):
+	""" Return number of workers in strategy cluster (1 if no strategy is given) """
+
+	if strategy is None or getattr(strategy, "cluster_resolver", None) is None:
+		return 1
+
+	cluster_spec= strategy.cluster_resolver.cluster_spec().as_dict()
+	nworkers= len(cluster_spec.get("worker", [])) + len(cluster_spec.get("chief", []))
+
+	return max(nworkers, 1)
+
+def get_worker_index(strategy=None):
+	""" Return index of this worker in strategy cluster (0 if no strategy is given) """
+
+	if strategy is None or getattr(strategy, "cluster_resolver", None) is None:
+		return 0
+
+	task_type= strategy.cluster_resolver.task_type
+	task_id= strategy.cluster_resolver.task_id or 0
+	cluster_spec= strategy.cluster_resolver.cluster_spec().as_dict()
+	if task_type=="worker" and "chief" in cluster_spec:
+		return task_id + 1
+
+	return task_id
+
+def is_chief(strategy=None):
+	""" Return True if this worker is the chief (the only one writing outputs, e.g. model checkpoints) """
+
+	if strategy is None or getattr(strategy, "cluster_resolver", None) is None:
+		return True
+
+	task_type= strategy.cluster_resolver.task_type
+	task_id= strategy.cluster_resolver.task_id
+	return (task_type is None) or (task_type=="chief") or (task_type=="worker" and task_id==0 and "chief" not in strategy.cluster_resolver.cluster_spec().as_dict())
+
+def get_num_replicas():
+	""" Return number of replicas in sync in the current context (1 if not distributed) """
+
+	ctx= tf.distribute.get_replica_context()
+	if ctx is not None:
+		return ctx.num_replicas_in_sync
+	return tf.distribute.get_strategy().num_replicas_in_sync
+
+def get_strategy_scope(strategy=None):
+	""" Return strategy scope (a null context if no strategy is given) """
+	if strategy is None:
+		return contextlib.nullcontext()
+	return strategy.scope()
+
+###############################################
+##     DISTRIBUTE DATA
+###############################################
+def shard_data_generator(dg, strategy=None):
+	""" Shard data generator over strategy workers (each worker reads a disjoint subset of data). The generator seed must be the same on all workers """
+
+	if dg is None:
+		return 0
+
+	dg.num_shards= get_num_workers(strategy)
+	dg.shard_index= get_worker_index(strategy)
+
+	if dg.num_shards>1:
+		# - Set a seed shared by all workers (required to draw disjoint shards from class rebalancing sampler)
+		if dg.seed is None:
+			logger.warn("No data generator seed given, setting it to 1 on all workers for sharding ...")
+			dg.seed= 1
+		logger.info("Sharding data generator %s (num_shards=%d, shard_index=%d, seed=%d) ..." % (dg.datalistfile, dg.num_shards, dg.shard_index, dg.seed))
+
+	return 0
+
+def _as_tuple(item):
+	""" Convert (nested) lists of arrays to (nested) tuples """
+	if isinstance(item, (list, tuple)):
+		return tuple([_as_tuple(x) for x in item])
+	return item
+
+def distribute_data(strategy, data):
+	""" Return input data (python generator or tf.data dataset) distributed with given strategy for Model.fit.
+			Data are assumed to be already sharded per worker (see shard_data_generator), so each worker dataset is used
+			as is by its replica (no auto-sharding or re-batching). Returns input data if no strategy is given.
+	"""
+
+	if strategy is None or data is None:
+		return data
+
+	if isinstance(data, tf.data.Dataset):
+		ds= data
+
+	else:
+		# - Peek first batch to get output signature
+		first= _as_tuple(next(data))
+		output_signature= tf.nest.map_structure(
+			lambda x: tf.TensorSpec(shape=(None,) + np.shape(x)[1:], dtype=tf.as_dtype(np.asarray(x).dtype)),
+			first
+		)
+
+		def generator():
+			for item in chain([first], data):
+				yield _as_tuple(item)
+
+		ds= tf.data.Dataset.from_generator(generator, output_signature=output_signature)
+
+	def dataset_fn(input_context):
+		options= tf.data.Options()
+		options.experimental_distribute.auto_shard_policy= tf.data.experimental.AutoShardPolicy.OFF
+		return ds.with_options(options)
+
+	return strategy.distribute_datasets_from_function(dataset_fn)
+
+###############################################
+##     DISTRIBUTE STEPS
+###############################################
+def compile_step(step_fcn, use_xla=False, strategy=None, post_fcn=None, reduce_outputs=True):
+	""" Return compiled step function (with XLA if enabled). If a strategy is given, the step is run on each replica
+			(gradients are all-reduced by the optimizer, XLA is not used) and outputs are averaged over replicas. post_fcn (if given)
+			is run after the step, in cross-replica context (e.g. to update non-trainable model copies).
+	"""
+
+	if strategy is None:
+		if post_fcn is None:
+			return tf.function(step_fcn, jit_compile=use_xla)
+
+		def step_with_post_fcn(*args):
+			outputs= step_fcn(*args)
+			post_fcn()
+			return outputs
+
+		return tf.function(step_with_post_fcn, jit_compile=use_xla)
+
+	# - Run replica step directly within the outer tf.function
+	#   NB: the optimizer cross-replica merge_call (gradient all-reduce) cannot be run in a nested tf.function or in
+	#       an XLA cluster, so XLA is not used with a strategy
+	if use_xla:
+		logger.warn("XLA compilation is not supported with a distribution strategy, ignoring it ...")
+
+	def distributed_step(*args):
+		outputs= strategy.run(step_fcn, args=args)
+		if post_fcn is not None:
+			post_fcn()
+		if reduce_outputs:
+			return strategy.reduce(tf.distribute.ReduceOp.MEAN, outputs, axis=None)
+		return strategy.experimental_local_results(outputs)[0]
+
+	return tf.function(distributed_step)
+
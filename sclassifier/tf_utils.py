@@ -73,6 +73,62 @@ from tensorflow.keras.activations import softmax
 ##############################
 from sclassifier import logger
 from .utils import Utils
+from .embedding_writer import EmbeddingWriter
+
+###############################################
+##     PERFORMANCE MODE
+###############################################
+def cpu_supports_bf16():
+	""" Return True if CPU has native bfloat16 instructions (AVX512-BF16 or AMX-BF16) """
+	try:
+		with open("/proc/cpuinfo", 'r') as f:
+			for line in f:
+				if line.startswith("flags"):
+					flags= line.split()
+					return ("avx512_bf16" in flags) or ("amx_bf16" in flags)
+	except Exception:
+		pass
+	return False
+
+def set_performance_mode(mixed_precision=False, force_mixed_precision=False):
+	""" Set global keras dtype policy. If mixed_precision is enabled, layers compute in bfloat16 (keeping float32 variables)
+			provided that the CPU supports bfloat16 natively (or if force_mixed_precision). Returns the policy name set.
+	"""
+
+	policy= "float32"
+	if mixed_precision:
+		if cpu_supports_bf16() or tf.config.list_physical_devices('GPU') or force_mixed_precision:
+			policy= "mixed_bfloat16"
+		else:
+			logger.warn("CPU does not support bfloat16 natively, mixed precision not enabled ...")
+
+	logger.info("Setting keras global dtype policy to %s ..." % (policy))
+	tf.keras.mixed_precision.set_global_policy(policy)
+
+	return policy
+
+def get_compile_options(use_xla=False, run_eagerly=False):
+	""" Return Model.compile execution options: graph (default), graph compiled with XLA, or eager (e.g. for debugging) """
+	if use_xla:
+		return {"run_eagerly": False, "jit_compile": True}
+	return {"run_eagerly": run_eagerly}
+
+def masked_chan_min(inputs, cond):
+	""" Return min of each channel (over axis 1,2) of inputs, computed only over elements where cond is true.
+			Masked elements are replaced by the dtype max value (so that sentinels stay finite in any precision).
+	"""
+	return tf.reduce_min(tf.where(~cond, tf.ones_like(inputs) * inputs.dtype.max, inputs), axis=(1,2))
+
+def masked_chan_max(inputs, cond):
+	""" Return max of each channel (over axis 1,2) of inputs, computed only over elements where cond is true.
+			Masked elements are replaced by the dtype lowest value (so that sentinels stay finite in any precision).
+	"""
+	return tf.reduce_max(tf.where(~cond, tf.ones_like(inputs) * inputs.dtype.min, inputs), axis=(1,2))
+
+def masked_chan_min_max(inputs, cond):
+	""" Return min & max of each channel (over axis 1,2) of inputs, computed only over elements where cond is true """
+	return masked_chan_min(inputs, cond), masked_chan_max(inputs, cond)
+
 
 ###############################################
 ##     ChanMinMaxNorm LAYER
@@ -93,6 +149,7 @@ class ChanMinMaxNorm(layers.Layer):
 	def __init__(self, norm_min=0., norm_max=1., name=None, **kwargs):
 		self.norm_min = norm_min
 		self.norm_max = norm_max
+		kwargs.setdefault('dtype', 'float32') # always compute in float32 (also with mixed precision)
 		super(ChanMinMaxNorm, self).__init__(name=name, **kwargs)
 
 	def build(self, input_shape):
@@ -107,8 +164,7 @@ class ChanMinMaxNorm(layers.Layer):
 		# - Compute input data min & max, excluding NANs & zeros
 		cond= tf.logical_and(tf.math.is_finite(inputs), tf.math.not_equal(inputs, 0.))
 		
-		data_min= tf.reduce_min(tf.where(~cond, tf.ones_like(inputs) * 1.e+99, inputs), axis=(1,2))
-		data_max= tf.reduce_max(tf.where(~cond, tf.ones_like(inputs) * -1.e+99, inputs), axis=(1,2))
+		data_min, data_max= masked_chan_min_max(inputs, cond)
 		
 		##### DEBUG ############
 		#tf.print("data_min (before norm)", data_min, output_stream=sys.stdout)
@@ -161,6 +217,7 @@ class ChanMaxScale(layers.Layer):
 	"""
 
 	def __init__(self, name=None, **kwargs):
+		kwargs.setdefault('dtype', 'float32')
 		super(ChanMaxScale, self).__init__(name=name, **kwargs)
 
 	def build(self, input_shape):
@@ -173,8 +230,7 @@ class ChanMaxScale(layers.Layer):
 		# - Compute input data min & max, excluding NANs & zeros
 		cond= tf.logical_and(tf.math.is_finite(inputs), tf.math.not_equal(inputs, 0.))
 		
-		data_min= tf.reduce_min(tf.where(~cond, tf.ones_like(inputs) * 1.e+99, inputs), axis=(1,2))
-		data_max= tf.reduce_max(tf.where(~cond, tf.ones_like(inputs) * -1.e+99, inputs), axis=(1,2))
+		data_min, data_max= masked_chan_min_max(inputs, cond)
 		data_min= tf.expand_dims(tf.expand_dims(data_min, axis=1),axis=1)
 		data_max= tf.expand_dims(tf.expand_dims(data_max, axis=1),axis=1)
 		
@@ -221,6 +277,7 @@ class ChanPosDef(layers.Layer):
 	"""
 
 	def __init__(self, name=None, **kwargs):
+		kwargs.setdefault('dtype', 'float32')
 		super(ChanPosDef, self).__init__(name=name, **kwargs)
 
 	def build(self, input_shape):
@@ -233,8 +290,7 @@ class ChanPosDef(layers.Layer):
 		# - Compute input data min & max, excluding NANs & zeros
 		cond= tf.logical_and(tf.math.is_finite(inputs), tf.math.not_equal(inputs, 0.))
 		
-		data_min= tf.reduce_min(tf.where(~cond, tf.ones_like(inputs) * 1.e+99, inputs), axis=(1,2))
-		#data_max= tf.reduce_max(tf.where(~cond, tf.ones_like(inputs) * -1.e+99, inputs), axis=(1,2))
+		data_min= masked_chan_min(inputs, cond)
 		data_min= tf.expand_dims(tf.expand_dims(data_min, axis=1),axis=1)
 		#data_max= tf.expand_dims(tf.expand_dims(data_max, axis=1),axis=1)
 
@@ -280,6 +336,7 @@ class ChanMaxRatio(layers.Layer):
 	"""
 
 	def __init__(self, name=None, **kwargs):
+		kwargs.setdefault('dtype', 'float32')
 		super(ChanMaxRatio, self).__init__(name=name, **kwargs)
 
 	def build(self, input_shape):
@@ -291,7 +348,7 @@ class ChanMaxRatio(layers.Layer):
 		
 		# - Compute input data channel max, excluding NANs & zeros
 		cond= tf.logical_and(tf.math.is_finite(inputs), tf.math.not_equal(inputs, 0.))
-		data_max= tf.reduce_max(tf.where(~cond, tf.ones_like(inputs) * -1.e+99, inputs), axis=(1,2))
+		data_max= masked_chan_max(inputs, cond)
 		#data_max= tf.expand_dims(tf.expand_dims(data_max, axis=1),axis=1)
 		
 		# - Compute absolute max across channels
@@ -320,6 +377,7 @@ class ChanMeanRatio(layers.Layer):
 	"""
 
 	def __init__(self, name=None, **kwargs):
+		kwargs.setdefault('dtype', 'float32')
 		super(ChanMeanRatio, self).__init__(name=name, **kwargs)
 
 	def build(self, input_shape):
@@ -331,7 +389,7 @@ class ChanMeanRatio(layers.Layer):
 		
 		# - Compute input data channel max, excluding NANs & zeros
 		cond= tf.logical_and(tf.math.is_finite(inputs), tf.math.not_equal(inputs, 0.))
-		npix= tf.reduce_sum( tf.cast(cond, tf.float32), axis=(1,2) )
+		npix= tf.reduce_sum( tf.cast(cond, inputs.dtype), axis=(1,2) )
 		pix_sum= tf.reduce_sum(tf.where(~cond, tf.ones_like(inputs) * 0, inputs), axis=(1,2))
 		data_mean= tf.math.divide_no_nan(pix_sum, npix)
 		
@@ -361,6 +419,7 @@ class ChanSumRatio(layers.Layer):
 	"""
 
 	def __init__(self, name=None, **kwargs):
+		kwargs.setdefault('dtype', 'float32')
 		super(ChanSumRatio, self).__init__(name=name, **kwargs)
 
 	def build(self, input_shape):
@@ -421,13 +480,13 @@ class SoftmaxCosineSim(layers.Layer):
 				O = Zero matrix of size (batch_size x batch_size)
 	"""
 
-	def __init__(self, batch_size, feat_dim, **kwargs):
-		super(SoftmaxCosineSim, self).__init__()
+	def __init__(self, batch_size, feat_dim, temperature=0.1, **kwargs):
+		super(SoftmaxCosineSim, self).__init__(dtype='float32') # softmax computed in float32 (also with mixed precision)
 		self.batch_size = batch_size
 		self.feat_dim = feat_dim
 		self.units = (batch_size, 4 * feat_dim)
 		self.input_dim = [(None, feat_dim)] * (batch_size * 2)
-		self.temperature = 0.1
+		self.temperature = temperature
 		self.LARGE_NUM = 1e9
 
 	def get_config(self):
@@ -445,39 +504,28 @@ class SoftmaxCosineSim(layers.Layer):
 		return config
 
 	def call(self, inputs):
-		z1 = []
-		z2 = []
-
-		for index in range(self.batch_size):
-			# 0-index assumes that batch_size in generator is equal to 1
-			z1.append(
-				tf.math.l2_normalize(inputs[index][0], -1)
-				#tf.math.l2_normalize(inputs[index], -1)
-			)
-			z2.append(
-				tf.math.l2_normalize(inputs[self.batch_size + index][0], -1)
-				#tf.math.l2_normalize(inputs[self.batch_size + index], -1)
-			)
-
-		# Gather hidden1/hidden2 across replicas and create local labels.
-		z1_large = z1
-		z2_large = z2
-
-		masks = tf.one_hot(tf.range(self.batch_size), self.batch_size)
-
-		# Products of vectors of same side of network (z_i), count as negative examples
-		# Values on the diagonal are put equal to a very small value
-		# -> exclude product between 2 identical values, no added value
-		logits_aa = tf.matmul(z1, z1_large, transpose_b=True) / self.temperature
-		logits_aa = logits_aa - masks * self.LARGE_NUM
-
-		logits_bb = tf.matmul(z2, z2_large, transpose_b=True) / self.temperature
-		logits_bb = logits_bb - masks * self.LARGE_NUM
+		# - Inputs are 2*batch_size tensors of shape (1, feat_dim) (batch_size in generator is equal to 1),
+		#   first all views #1 then all views #2. Stack them into a single (2*batch_size, feat_dim) tensor
+		z = tf.math.l2_normalize(tf.concat(inputs, axis=0), -1)
+
+		# - Compute all similarities with a single product:
+		#     [[aa, ab],
+		#      [ba, bb]]
+		#   Products of vectors of same side of network (z_i), count as negative examples
+		#   Values on the diagonal are put equal to a very small value
+		#   -> exclude product between 2 identical values, no added value
+		masks = tf.one_hot(tf.range(2 * self.batch_size), 2 * self.batch_size)
+		logits = tf.matmul(z, z, transpose_b=True) / self.temperature
+		logits = logits - masks * self.LARGE_NUM
 
 		# Similarity between two transformation sides of the network (z_i and z_j)
-		# -> diagonal should be as close as possible to 1
-		logits_ab = tf.matmul(z1, z2_large, transpose_b=True) / self.temperature
-		logits_ba = tf.matmul(z2, z1_large, transpose_b=True) / self.temperature
+		# -> diagonal of ab/ba should be as close as possible to 1
+		logits_a = logits[:self.batch_size]
+		logits_b = logits[self.batch_size:]
+		logits_aa = logits_a[:, :self.batch_size]
+		logits_ab = logits_a[:, self.batch_size:]
+		logits_ba = logits_b[:, :self.batch_size]
+		logits_bb = logits_b[:, self.batch_size:]
 
 		part1 = softmax(tf.concat([logits_ab, logits_aa], 1))
 		part2 = softmax(tf.concat([logits_ba, logits_bb], 1))
@@ -486,14 +534,46 @@ class SoftmaxCosineSim(layers.Layer):
 		return output
 
 
+###############################################
+##     NTXentLoss LAYER
+###############################################
+class NTXentLoss(layers.Layer):
+	""" Custom Keras layer: takes all z-projections as input (first all views #1 then all views #2) and adds 
+			the NT-Xent loss to the model losses (see nt_xent_loss_fused). Model must be compiled with loss=None.
+			Returns the loss value.
+	"""
+
+	def __init__(self, temperature=0.1, block_size=0, **kwargs):
+		kwargs.setdefault('dtype', 'float32') # loss computed in float32 (also with mixed precision)
+		super(NTXentLoss, self).__init__(**kwargs)
+		self.temperature = temperature
+		self.block_size = block_size
+
+	def get_config(self):
+		config = super().get_config().copy()
+		config.update(
+			{
+				"temperature": self.temperature,
+				"block_size": self.block_size,
+			}
+		)
+		return config
+
+	def call(self, inputs):
+		z = tf.concat(inputs, axis=0) if isinstance(inputs, (list, tuple)) else inputs
+		loss = nt_xent_loss_fused(z, self.temperature, block_size=self.block_size, interleaved=False)
+		self.add_loss(loss)
+		return tf.reshape(loss, [1, 1])
+
+
 ###############################################
 ##     BYOL LOSS DEFINITION
 ###############################################
 # - Taken from https://github.com/garder14/byol-tensorflow2/blob/main/losses.py
 def byol_loss(p, z):
 	""" BYOL loss definition """
-	p = tf.math.l2_normalize(p, axis=1)  # (2*bs, 128)
-	z = tf.math.l2_normalize(z, axis=1)  # (2*bs, 128)
+	p = tf.math.l2_normalize(tf.cast(p, tf.float32), axis=1)  # (2*bs, 128)
+	z = tf.math.l2_normalize(tf.cast(z, tf.float32), axis=1)  # (2*bs, 128)
 
 	similarities = tf.reduce_sum(tf.multiply(p, z), axis=1)
 	return 2 - 2 * tf.reduce_mean(similarities)
@@ -505,7 +585,7 @@ def byol_loss(p, z):
 def nt_xent_loss(z, temperature):
 	""" SimCLR loss definition """
 
-	z = tf.math.l2_normalize(z, axis=1)  # (2*bs, 128)
+	z = tf.math.l2_normalize(tf.cast(z, tf.float32), axis=1)  # (2*bs, 128)
 
 	similarity_matrix = tf.matmul(z, z, transpose_b=True)  # compute pairwise cosine similarities
 	similarity_matrix_edit = tf.exp(similarity_matrix / temperature)  # divide by temperature and apply exp
@@ -521,7 +601,184 @@ def nt_xent_loss(z, temperature):
 	losses = -tf.math.log(numerators/denominators)
 
 	return tf.reduce_mean(losses)
+
+def get_nt_xent_positive_indexes(n, interleaved=True):
+	""" Return the index of the positive sample of each of the n projections. 
+			If interleaved, positive pairs are at consecutive positions ([0,1],[2,3],...), otherwise first all views #1 then all views #2 
+	"""
+	indexes= tf.range(n)
+	if interleaved:
+		return tf.bitwise.bitwise_xor(indexes, 1)
+	return tf.math.floormod(indexes + n//2, n)
+
+def nt_xent_loss_fused(z, temperature, block_size=0, interleaved=True):
+	""" Vectorised SimCLR loss definition. z has shape (2*bs, d), with positive pairs at consecutive positions if interleaved 
+			(same layout of nt_xent_loss) or first all views #1 then all views #2.
+			Loss is computed in log-space as mean(logsumexp(negatives) - positive) without building masks or exp matrices.
+			If block_size>0, similarities are computed in blocks of block_size rows, so that peak memory is block_size x 2*bs
+			rather than (2*bs)^2 both in forward and backward pass (gradient is computed blockwise with a custom gradient).
+	"""
+
+	# - Compute in float32 also when training with reduced precision
+	z = tf.math.l2_normalize(tf.cast(z, tf.float32), axis=1)
+	temperature = tf.cast(temperature, tf.float32)
+	n = tf.shape(z)[0]
+	pos_indexes = get_nt_xent_positive_indexes(n, interleaved)
+	positives = tf.reduce_sum(z * tf.gather(z, pos_indexes), axis=1) / temperature
+
+	if block_size<=0:
+		logits = tf.matmul(z, z, transpose_b=True) / temperature
+		logits = logits - tf.eye(n) * 1e9 # discard self-similarities
+		return tf.reduce_mean(tf.reduce_logsumexp(logits, axis=1) - positives)
+
+	return _nt_xent_loss_blockwise(z, pos_indexes, temperature, block_size)
+
+def _nt_xent_loss_blockwise(z, pos_indexes, temperature, block_size):
+	""" NT-Xent loss computed in row blocks of given size (z is l2-normalized) """
+
+	n = tf.shape(z)[0]
+	nblocks = (n + block_size - 1) // block_size
+
+	def get_block_logits(z, i):
+		start = i * block_size
+		z_block = z[start:start+block_size]
+		logits = tf.matmul(z_block, z, transpose_b=True) / temperature
+		rows = tf.range(start, start + tf.shape(z_block)[0])
+		logits = logits - tf.one_hot(rows, n) * 1e9 # discard self-similarities
+		return start, z_block, logits
+
+	@tf.custom_gradient
+	def loss_fcn(z):
+		# - Compute logsumexp over negatives block by block
+		def lse_step(i, lse_blocks):
+			_, _, logits = get_block_logits(z, i)
+			return i + 1, lse_blocks.write(i, tf.reduce_logsumexp(logits, axis=1))
+
+		_, lse_blocks = tf.while_loop(
+			lambda i, lse_blocks: i < nblocks, lse_step,
+			[tf.constant(0), tf.TensorArray(tf.float32, size=nblocks, infer_shape=False)]
+		)
+		lse = lse_blocks.concat()
+		z_pos = tf.gather(z, pos_indexes)
+		loss = tf.reduce_mean(lse - tf.reduce_sum(z * z_pos, axis=1) / temperature)
+
+		def grad(dy):
+			# - dL/dz = ((P + P^T) z - 2 z_pos) / (n*T), with P the softmax over negatives, recomputed block by block
+			def grad_step(i, g):
+				start, z_block, logits = get_block_logits(z, i)
+				nrows = tf.shape(z_block)[0]
+				probs = tf.exp(logits - tf.expand_dims(lse[start:start+nrows], 1))
+				g_rows = tf.matmul(probs, z)
+				g_cols = tf.matmul(probs, z_block, transpose_a=True)
+				g = g + g_cols + tf.pad(g_rows, [[start, n-start-nrows], [0, 0]])
+				return i + 1, g
+
+			_, g = tf.while_loop(
+				lambda i, g: i < nblocks, grad_step,
+				[tf.constant(0), tf.zeros_like(z)]
+			)
+			return dy * (g - 2. * z_pos) / (tf.cast(n, tf.float32) * temperature)
+
+		return loss, grad
+
+	return loss_fcn(z)
 	
+###############################################
+##     GRADIENT ACCUMULATION
+###############################################
+def build_optimizer_weights(optimizer, variables):
+	""" Create optimizer slot variables for given variables (needed before applying gradients conditionally in graph) """
+	if hasattr(optimizer, "_create_all_weights"): # legacy keras optimizers
+		optimizer._create_all_weights(variables)
+	elif hasattr(optimizer, "build"):
+		optimizer.build(variables)
+	_ = optimizer.iterations
+
+class GradientAccumulator(object):
+	""" Accumulate gradients over nsteps micro-batches and apply their mean with a single optimizer update.
+			Optimizer iterations (used by lr schedules) are thus incremented once every nsteps micro-batches.
+
+			Arguments:
+				- optimizer: keras optimizer
+				- variables: list of trainable variables
+				- nsteps: number of micro-batches accumulated per update
+	"""
+
+	def __init__(self, optimizer, variables, nsteps):
+		self.optimizer= optimizer
+		self.variables= list(variables)
+		self.nsteps= nsteps
+		# - NB: accumulators are replica-local (on read sync), gradients are all-reduced by the optimizer when applied
+		self.grads= [
+			tf.Variable(tf.zeros_like(v), trainable=False, synchronization=tf.VariableSynchronization.ON_READ, aggregation=tf.VariableAggregation.SUM) 
+			for v in self.variables
+		]
+		self.counter= tf.Variable(0, trainable=False, dtype=tf.int64, synchronization=tf.VariableSynchronization.ON_READ, aggregation=tf.VariableAggregation.ONLY_FIRST_REPLICA)
+		build_optimizer_weights(self.optimizer, self.variables)
+
+	def accumulate(self, grads):
+		""" Add gradients of a micro-batch """
+		for g_accum, g in zip(self.grads, grads):
+			if g is None:
+				continue
+			g_accum.assign_add(tf.cast(g, g_accum.dtype) / self.nsteps)
+		self.counter.assign_add(1)
+
+	def apply(self):
+		""" Apply accumulated gradients and reset them """
+		self.optimizer.apply_gradients(zip([tf.identity(g) for g in self.grads], self.variables))
+		for g_accum in self.grads:
+			g_accum.assign(tf.zeros_like(g_accum))
+		return tf.constant(True)
+
+	def apply_if_ready(self):
+		""" Apply accumulated gradients if nsteps micro-batches were accumulated (in graph) """
+		return tf.cond(
+			tf.equal(self.counter % self.nsteps, 0),
+			self.apply,
+			lambda: tf.constant(False)
+		)
+
+class GradientAccumulationModel(Model):
+	""" Functional model accumulating gradients over accum_steps batches before each optimizer update (see GradientAccumulator).
+			Use make_gradient_accumulation_model to wrap an existing model (layers and weights are shared).
+	"""
+
+	def __init__(self, *args, accum_steps=1, **kwargs):
+		super(GradientAccumulationModel, self).__init__(*args, **kwargs)
+		self.accum_steps= accum_steps
+		self.accumulator= None
+
+	def compile(self, *args, **kwargs):
+		super(GradientAccumulationModel, self).compile(*args, **kwargs)
+		self.accumulator= GradientAccumulator(self.optimizer, self.trainable_variables, self.accum_steps)
+
+	def train_step(self, data):
+		# - Unpack data
+		if isinstance(data, tuple):
+			x= data[0]
+			y= data[1] if len(data)>1 else None
+			sample_weight= data[2] if len(data)>2 else None
+		else:
+			x, y, sample_weight= data, None, None
+
+		# - Compute and accumulate gradients, apply them every accum_steps batches
+		with tf.GradientTape() as tape:
+			y_pred= self(x, training=True)
+			loss= self.compiled_loss(y, y_pred, sample_weight, regularization_losses=self.losses)
+		grads= tape.gradient(loss, self.trainable_variables)
+		self.accumulator.accumulate(grads)
+		self.accumulator.apply_if_ready()
+
+		# - Update metrics
+		self.compiled_metrics.update_state(y, y_pred, sample_weight)
+		return {m.name: m.result() for m in self.metrics}
+
+def make_gradient_accumulation_model(model, accum_steps):
+	""" Return a GradientAccumulationModel sharing layers and weights with input functional model """
+	return GradientAccumulationModel(inputs=model.inputs, outputs=model.outputs, name=model.name, accum_steps=accum_steps)
+
+
 ###############################################
 ##     TF UTILS
 ###############################################
@@ -631,8 +888,10 @@ def extract_tf_features_from_img(filename, modelfile, weightfile, imgsize=224, z
 	#return np.array(feats_list)
 	return np.expand_dims(np.array(feats_list), axis=0)	# shape (1,Nfeat)
 	
-def extract_tf_features_from_datalist(datalist, modelfile, weightfile, imgsize=224, zscale=True, contrast=0.25, nmax=-1):
-	""" Function to extract features from datalist using TF trained encoder models """
+def extract_tf_features_from_datalist(datalist, modelfile, weightfile, imgsize=224, zscale=True, contrast=0.25, nmax=-1, batch_size=32, return_indices=False):
+	""" Function to extract features from datalist using TF trained encoder models. 
+			Images failing to be read are skipped: if return_indices is enabled, the datalist indices of feature rows are also returned.
+	"""
 
 	# - Load model
 	logger.info("Loading model (path=%s, weights=%s) ..." % (modelfile, weightfile))
@@ -641,8 +900,11 @@ def extract_tf_features_from_datalist(datalist, modelfile, weightfile, imgsize=2
 		logger.error("Failed to load model and/or weights!")
 		return None
 
-	# - Loop over datalist and extract features per each image
+	# - Loop over datalist and extract features per each batch of images
 	features= []
+	indices= []
+	batch_imgs= []
+	batch_indices= []
 	nsamples= len(datalist)
 
 	for idx, item in enumerate(datalist):
@@ -657,7 +919,7 @@ def extract_tf_features_from_datalist(datalist, modelfile, weightfile, imgsize=2
 		filename= item["filepaths"][0]
 		image_npy= Utils.load_img_as_npy_float(
 			filename,
-			add_chan_axis=True, add_batch_axis=True,
+			add_chan_axis=True, add_batch_axis=False,
 			resize=True, resize_size=imgsize,
 			apply_zscale=zscale, contrast=contrast,
 			set_nans_to_min=False
@@ -666,18 +928,117 @@ def extract_tf_features_from_datalist(datalist, modelfile, weightfile, imgsize=2
 			logger.warn("Failed to load image %s, skip it ..." % (filename))
 			continue
 
-		# - Run model inference
-		feats= model.predict(
-			x=image_npy,
-			batch_size=1,
-			verbose=0,
-			workers=1,
-			use_multiprocessing=False
-		)
-		feats_list= list(feats[0])
-		feats_list= [float(item) for item in feats_list]
-		features.append(feats_list)
-    
-	return np.array(features)
-  
-  
+		batch_imgs.append(image_npy)
+		batch_indices.append(idx)
+
+		# - Run model inference on batch
+		if len(batch_imgs)>=batch_size:
+			features.append(np.asarray(model.predict_on_batch(np.stack(batch_imgs))))
+			indices.extend(batch_indices)
+			batch_imgs= []
+			batch_indices= []
+
+	# - Run model inference on last (partial) batch
+	if batch_imgs:
+		features.append(np.asarray(model.predict_on_batch(np.stack(batch_imgs))))
+		indices.extend(batch_indices)
+
+	if features:
+		features= np.concatenate(features, axis=0).astype(float)
+	else:
+		features= np.array([])
+
+	if return_indices:
+		return features, indices
+	return features
+
+def get_predict_function(model, use_xla=False):
+	""" Return the function used to run model inference on a batch (compiled with XLA if use_xla) """
+	if not use_xla:
+		return model.predict_on_batch
+
+	predict_fcn= tf.function(lambda x: model(x, training=False), jit_compile=True)
+	return lambda x: tf.nest.map_structure(lambda t: t.numpy(), predict_fcn(x))
+
+def predict_in_batches(model, data_generator, use_xla=False):
+	""" Run model inference on (inputs, data_indexes) batches returned by a generator (e.g. DataGenerator.generate_inference_data).
+			Returns model outputs (a list of float32 arrays for multi-output models) and the data indexes of output rows
+	"""
+
+	outputs= None
+	data_indexes= []
+	predict_fcn= get_predict_function(model, use_xla)
+
+	for inputs, indexes in data_generator:
+		predout= predict_fcn(inputs)
+		if not isinstance(predout, (list, tuple)):
+			predout= [predout]
+		if outputs is None:
+			outputs= [[] for item in predout]
+		for i in range(len(predout)):
+			outputs[i].append(np.asarray(predout[i], dtype=np.float32))
+		data_indexes.extend(indexes)
+
+	if outputs is None:
+		logger.warn("No data returned by generator, no predictions made!")
+		return None, []
+
+	outputs= [np.concatenate(item, axis=0) for item in outputs]
+	if len(outputs)==1:
+		outputs= outputs[0]
+
+	return outputs, data_indexes
+
+
+def stream_predictions(model, data_generator, writer, source_names, source_ids, use_xla=False):
+	""" Run model inference on (inputs, data_indexes) batches returned by a generator and stream the rows of the 
+			first model output to an EmbeddingWriter (closed at the end). Returns the number of rows predicted or -1 on failure
+	"""
+
+	nrows= 0
+	predict_fcn= get_predict_function(model, use_xla)
+
+	for inputs, indexes in data_generator:
+		predout= predict_fcn(inputs)
+		if isinstance(predout, (list, tuple)):
+			predout= predout[0]
+		snames= [source_names[index] for index in indexes]
+		sids= [source_ids[index] for index in indexes]
+		if writer.add(np.asarray(predout, dtype=np.float32), snames, sids, next_index=indexes[-1]+1)<0:
+			logger.error("Failed to write predictions!")
+			return -1
+		nrows+= len(indexes)
+
+	if writer.close()<0:
+		logger.error("Failed to finalize prediction output file!")
+		return -1
+
+	return nrows
+
+def stream_embeddings_to_file(model, dg, outfile, source_names, source_ids, batch_size=32, chunk_size=10000, resume=False, use_xla=False):
+	""" Run model inference on data generator samples and write the embeddings to file in chunks as batches are predicted 
+			(bounded memory). If resume is enabled, a previous interrupted run is resumed from its last completed chunk 
+			(see EmbeddingWriter). Returns 0 on success or -1 on failure
+	"""
+
+	# - Open writer (resuming from last completed chunk if requested)
+	writer= EmbeddingWriter(outfile, chunk_size=chunk_size)
+	start_index= writer.open(dg.datasize, resume=resume)
+	if start_index<0:
+		logger.error("Failed to open embedding writer for file %s!" % (outfile))
+		return -1
+
+	# - Apply model to input and write embeddings
+	logger.info("Running prediction on input data and streaming embeddings to file %s (start_index=%d, chunk_size=%d) ..." % (outfile, start_index, chunk_size))
+	data_generator= dg.generate_inference_data(
+		batch_size=batch_size,
+		start_index=start_index
+	)
+	nrows= stream_predictions(model, data_generator, writer, source_names, source_ids, use_xla=use_xla)
+	if nrows<0:
+		logger.error("Failed to stream embeddings to file %s!" % (outfile))
+		return -1
+
+	logger.info("#%d embedding rows predicted and saved (#%d in total) ..." % (nrows, writer.nrows))
+
+	return 0
@@ -30,55 +30,65 @@ import re
 from _ctypes import PyObj_FromPtr  # see https://stackoverflow.com/a/15012814/355230
 
 ## ASTRO MODULES
+#  NB: heavy backends are imported at first use (see lazy_import), so that table-only tools do not load them
 import warnings
-from astropy.io import fits
-from astropy.io.fits.verify import VerifyWarning
+from .lazy_import import lazy_import, lazy_attr
 warnings.filterwarnings('ignore', category=UserWarning, append=True)
-warnings.simplefilter('ignore', category=VerifyWarning)
-from astropy.wcs import FITSFixedWarning
-warnings.filterwarnings('ignore', category=FITSFixedWarning)
+
+def _set_astropy_warning_filters(module=None):
+	""" Ignore astropy FITS verify and WCS fix warnings (on_load hook) """
+	from astropy.io.fits.verify import VerifyWarning
+	from astropy.wcs import FITSFixedWarning
+	warnings.simplefilter('ignore', category=VerifyWarning)
+	warnings.filterwarnings('ignore', category=FITSFixedWarning)
 
 # Suppress `Invalid 'BLANK' keyword in header.` warnings
 #from astropy.io.fits.verify import VerifyWarning
 #warnings.simplefilter('ignore', category=VerifyWarning)
 
-from astropy.wcs import WCS
-from astropy.io import ascii
-from astropy.table import Column
-from astropy.nddata.utils import Cutout2D
-from astropy.stats import sigma_clipped_stats
-from astropy.stats import sigma_clip
-from astropy.visualization import ZScaleInterval
-import regions
+fits= lazy_import("astropy.io.fits", on_load=_set_astropy_warning_filters)
+WCS= lazy_attr("astropy.wcs", "WCS")
+ascii= lazy_import("astropy.io.ascii")
+Column= lazy_attr("astropy.table", "Column")
+Cutout2D= lazy_attr("astropy.nddata.utils", "Cutout2D")
+sigma_clipped_stats= lazy_attr("astropy.stats", "sigma_clipped_stats")
+sigma_clip= lazy_attr("astropy.stats", "sigma_clip")
+ZScaleInterval= lazy_attr("astropy.visualization", "ZScaleInterval")
+regions= lazy_import("regions")
 
-import fitsio
-from fitsio import FITS, FITSHDR
+fitsio= lazy_import("fitsio")
+FITS= lazy_attr("fitsio", "FITS")
+FITSHDR= lazy_attr("fitsio", "FITSHDR")
 
-from PIL import Image
+Image= lazy_import("PIL.Image")
 
 ## MONTAGE MODULES
 #from montage_wrapper.commands import mImgtbl
 
 ## IMG PROCESSING MODULES
-import skimage.color
-import skimage.io
-import skimage.transform
-import skimage.measure
-from skimage.segmentation import join_segmentations
-from skimage.filters import median as median_filter
-from skimage.morphology import disk
+def _import_skimage_submodules(module=None):
+	""" Import skimage submodules used in this module (on_load hook) """
+	import skimage.color
+	import skimage.io
+	import skimage.transform
+	import skimage.measure
+
+skimage= lazy_import("skimage", on_load=_import_skimage_submodules)
+join_segmentations= lazy_attr("skimage.segmentation", "join_segmentations")
+median_filter= lazy_attr("skimage.filters", "median")
+disk= lazy_attr("skimage.morphology", "disk")
 ##from mahotas.features import zernike
 
-from scipy.ndimage.morphology import distance_transform_edt
-from scipy.ndimage.filters import gaussian_filter
+distance_transform_edt= lazy_attr("scipy.ndimage", "distance_transform_edt")
+gaussian_filter= lazy_attr("scipy.ndimage", "gaussian_filter")
 
 ## SCUTOUT MODULES
-import scutout
-from scutout.config import Config
+scutout= lazy_import("scutout")
+Config= lazy_attr("scutout.config", "Config")
 
 ## GRAPHICS MODULES
-import matplotlib.pyplot as plt
-from matplotlib import patches
+plt= lazy_import("matplotlib.pyplot")
+patches= lazy_import("matplotlib.patches")
 
 logger = logging.getLogger(__name__)
 
@@ -98,6 +108,9 @@ g_class_label_id_map= {
 	"QSO": 6000
 }
 
+# - File extensions of binary columnar tables
+g_binary_table_exts= [".npz"]
+
 ###########################
 ##     CLASS DEFINITIONS
 ###########################
@@ -194,8 +207,8 @@ class Utils(object):
 		return functools.reduce(lambda f, g: lambda x, **kwargs: f(g(x,**kwargs),**kwargs), funcs)
 
 	@classmethod
-	def write_ascii(cls,data,filename,header=''):
-		""" Write data to ascii file """
+	def write_ascii(cls,data,filename,header='',mode='wt'):
+		""" Write data to ascii file (mode='at' to append rows to existing file) """
 
 		# - Skip if data is empty
 		if data.size<=0:
@@ -204,20 +217,19 @@ class Utils(object):
 			return
 
 		# - Open file and write header
-		fout = open(filename, 'wt')
+		fout = open(filename, mode)
 		if header:
 			fout.write(header)
 			fout.write('\n')	
-			fout.flush()	
 		
-		# - Write data to file
+		# - Write data to file (in blocks of rows)
 		nrows= data.shape[0]
 		ncols= data.shape[1]
-		for i in range(nrows):
-			fields= '  '.join(map(str, data[i,:]))
-			fout.write(fields)
+		block_size= 10000
+		for i in range(0, nrows, block_size):
+			lines= ['  '.join(map(str, row)) for row in data[i:i+block_size]]
+			fout.write('\n'.join(lines))
 			fout.write('\n')	
-			fout.flush()	
 
 		fout.close()
 
@@ -291,6 +303,16 @@ class Utils(object):
 	def read_feature_data(cls, filename, selcols=[]):
 		""" Read data table. Format: sname data classid """	
 
+		# - Read binary table?
+		if cls.is_binary_table_file(filename):
+			ret= cls.read_binary_feature_data(filename)
+			if not ret:
+				return ()
+			data, snames, classids, colnames= ret
+			if selcols:
+				data= cls.get_selected_data_cols(data, selcols)
+			return (data, snames, classids)
+
 		# - Read table
 		row_start= 0
 		table= ascii.read(filename, data_start=row_start)
@@ -319,6 +341,20 @@ class Utils(object):
 	def read_feature_data_dict(cls, filename, colprefix="", allow_novars=False):
 		""" Read data table and return dict. Format: sname data classid """	
 
+		# - Read binary table?
+		if cls.is_binary_table_file(filename):
+			ret= cls.read_binary_feature_data(filename)
+			if not ret:
+				return ()
+			data, snames, classids, colnames= ret
+			if data.shape[1]<=0:
+				if allow_novars:
+					logger.warn("No var columns present in file (ndim=%d) ..." % (len(colnames)))
+				else:
+					logger.error("Too few cols present in file (ndim=%d)!" % (len(colnames)))
+					return ()
+			return cls.__make_feature_data_dict(data, snames, classids, colnames, colprefix=colprefix)
+
 		# - Read table
 		row_start= 0
 		table= ascii.read(filename, data_start=row_start)
@@ -362,6 +398,23 @@ class Utils(object):
 	def read_sel_feature_data_dict(cls, filename, selcolids, colprefix=""):
 		""" Read data table and return dict. Format: sname data classid """	
 
+		# - Read binary table?
+		if cls.is_binary_table_file(filename):
+			ret= cls.read_binary_feature_data(filename)
+			if not ret:
+				return ()
+			data, snames, classids, colnames= ret
+			nvars= data.shape[1]
+			if nvars<=0:
+				logger.error("Too few cols present in file (ndim=%d)!" % (len(colnames)))
+				return ()
+			for colid in selcolids:
+				if colid<0 or colid>=nvars:
+					logger.error("Given sel column id (%d) exceed range of available columns [0,%d]!" % (colid, nvars))
+					return ()
+			colnames_sel= [colnames[0]] + [colnames[colid+1] for colid in selcolids] + [colnames[-1]] # NB: selcolid=0 is the first feature not sname
+			return cls.__make_feature_data_dict(data[:,selcolids], snames, classids, colnames_sel, colprefix=colprefix)
+
 		# - Read table
 		row_start= 0
 		table= ascii.read(filename, data_start=row_start)
@@ -419,6 +472,145 @@ class Utils(object):
 
 		return d
 
+	@classmethod
+	def __make_feature_data_dict(cls, data, snames, classids, colnames, colprefix=""):
+		""" Return feature data dict (same format of read_feature_data_dict) from feature data arrays """
+
+		varnames= [colprefix + item for item in colnames[1:-1]]
+		d= OrderedDict()
+
+		for sname, featvars, classid in zip(snames, data.tolist(), classids):
+			if sname in d:
+				logger.warn("Source %s is already present in data dict, overwriting it ..." % (sname))
+			d[sname]= OrderedDict()
+			d[sname][colnames[0]]= sname
+			for varname, var in zip(varnames, featvars):
+				d[sname][varname]= var
+			d[sname][colnames[-1]]= classid
+
+		return d
+
+	#===========================
+	#==   BINARY TABLES
+	#===========================
+	@classmethod
+	def is_binary_table_file(cls, filename):
+		""" Check if given file has a binary columnar table format (from file extension) """
+		return os.path.splitext(filename)[1].lower() in g_binary_table_exts
+
+	@classmethod
+	def write_binary_table(cls, filename, columns, colnames):
+		""" Write binary columnar table (.npz) to file.
+				columns is a list of column arrays of shape (N,) or (N,ncols), colnames the list of all column names.
+		"""
+
+		# - Check columns
+		if not columns:
+			logger.warn("Empty column list given, no file will be written!")
+			return -1
+
+		blocks= []
+		for col in columns:
+			block= np.asarray(col)
+			if block.dtype==object: # NB: store object columns as strings, not pickled
+				block= block.astype(str)
+			blocks.append(block)
+
+		nrows= blocks[0].shape[0]
+		ncols_block= [1 if block.ndim==1 else block.shape[1] for block in blocks]
+		if any([block.shape[0]!=nrows for block in blocks]):
+			logger.error("Given columns have different number of rows!")
+			return -1
+		if sum(ncols_block)!=len(colnames):
+			logger.error("Number of column names (%d) differs from number of columns (%d)!" % (len(colnames), sum(ncols_block)))
+			return -1
+
+		# - Write table
+		arrays= {"colnames": np.array(colnames, dtype=str), "ncols": np.array(ncols_block, dtype=np.int64)}
+		for i, block in enumerate(blocks):
+			arrays["block" + str(i)]= block
+
+		try:
+			np.savez(filename, **arrays)
+		except Exception as e:
+			logger.error("Failed to write binary table %s (err=%s)!" % (filename, str(e)))
+			return -1
+
+		return 0
+
+	@classmethod
+	def read_binary_table(cls, filename):
+		""" Read binary columnar table (.npz) from file. Returns list of column names and list of column blocks """
+
+		try:
+			with np.load(filename, allow_pickle=False) as f:
+				colnames= f["colnames"].tolist()
+				ncols_block= f["ncols"].tolist()
+				blocks= [f["block" + str(i)] for i in range(len(ncols_block))]
+		except Exception as e:
+			logger.error("Failed to read binary table %s (err=%s)!" % (filename, str(e)))
+			return ()
+
+		return (colnames, blocks)
+
+	@classmethod
+	def read_binary_feature_data(cls, filename):
+		""" Read binary feature table. Format: sname data classid. Returns data, snames, classids and column names.
+				NB: data are returned as float32 (whatever the stored dtype), as done for ascii tables in read_feature_data
+		"""
+
+		ret= cls.read_binary_table(filename)
+		if not ret:
+			return ()
+		colnames, blocks= ret
+
+		ndim= len(colnames)
+		nvars= ndim-2
+		if nvars<0:
+			logger.error("Too few cols present in file (ndim=%d)!" % (ndim))
+			return ()
+
+		# - Get data columns as 2D array (no copy if stored in a single block)
+		nrows= blocks[0].shape[0]
+		blocks_2d= [block.reshape(nrows,-1) for block in blocks]
+		if len(blocks_2d)==3 and blocks_2d[1].shape[1]==nvars:
+			data= blocks_2d[1]
+		elif nvars>0:
+			data= np.concatenate(blocks_2d, axis=1)[:,1:1+nvars]
+		else:
+			data= np.zeros((nrows,0))
+
+		snames= blocks_2d[0][:,0].tolist()
+		classids= blocks_2d[-1][:,-1].tolist()
+
+		return (data.astype(np.float32, copy=False), snames, classids, colnames)
+
+	@classmethod
+	def write_table(cls, filename, columns, colnames):
+		""" Write table to file. Binary columnar format if file has a binary table extension (e.g. .npz), ascii otherwise.
+				columns is a list of column arrays of shape (N,) or (N,ncols), colnames the list of all column names.
+		"""
+
+		if cls.is_binary_table_file(filename):
+			return cls.write_binary_table(filename, columns, colnames)
+
+		nrows= np.asarray(columns[0]).shape[0]
+		data= np.concatenate([np.asarray(col).reshape(nrows,-1) for col in columns], axis=1)
+		head= "# " + " ".join(colnames)
+		cls.write_ascii(data, filename, head)
+
+		return 0
+
+	@classmethod
+	def write_feature_data(cls, filename, data, snames, classids, colnames=[]):
+		""" Write feature table to file. Format: sname data classid. Default colnames are: sname z1 ... zN id """
+
+		nvars= data.shape[1]
+		if not colnames:
+			colnames= ["sname"] + ["z" + str(i+1) for i in range(nvars)] + ["id"]
+
+		return cls.write_table(filename, [np.array(snames), data, np.array(classids)], colnames)
+
 	@classmethod
 	def read_json_datalist(cls, filename, datakey="data"):
 		""" Read json datalist """
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+##################################################
+###          MODULE IMPORT
+##################################################
+## STANDARD MODULES
+import os
+import sys
+import subprocess
+import logging
+import json
+import glob
+
+## COMMAND-LINE ARG MODULES
+import argparse
+
+## MODULES
+from sclassifier import logger
+
+##############################
+##     GLOBAL VARS
+##############################
+# - Heavy backends monitored at import
+g_heavy_modules= ["tensorflow", "imgaug", "cv2", "skimage", "astropy", "matplotlib", "lightgbm", "sklearn", "optuna", "hdbscan", "umap", "faiss", "pandas", "scutout", "regions", "fitsio"]
+
+# - Table-only tools: they must not load these backends at import
+g_table_tools= ["merge_features.py", "run_classifier.py", "select_features.py"]
+g_table_forbidden_modules= ["tensorflow", "imgaug", "cv2", "skimage", "scutout"]
+
+# - Code run in a fresh interpreter: import entry point module (main is not run) and report time & loaded backends
+g_import_code= """
+import sys, time, json, importlib.util
+t0= time.perf_counter()
+spec= importlib.util.spec_from_file_location("sclassifier_entry_point", sys.argv[1])
+module= importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+t1= time.perf_counter()
+heavy= json.loads(sys.argv[2])
+loaded= [name for name in heavy if name in sys.modules]
+print(json.dumps({"time": t1-t0, "loaded": loaded}))
+"""
+
+###########################
+##     ARGS
+###########################
+def get_args():
+	"""This function parses and return arguments passed in"""
+	parser = argparse.ArgumentParser(description="Measure import time of sclassifier entry points.")
+
+	parser.add_argument('-scripts','--scripts', dest='scripts', required=False, type=str, default='', help='Entry point scripts to be benchmarked, separated by commas (default=all scripts in scripts dir)')
+	parser.add_argument('-nrepeats', '--nrepeats', dest='nrepeats', required=False, type=int, default=3, action='store',help='Number of imports (fresh interpreters) per entry point, min time is reported (default=3)')
+	parser.add_argument('--check_table_tools', dest='check_table_tools', action='store_true',help='Fail if table-only tools load TF/imgaug/OpenCV/skimage at import (default=false)')
+	parser.set_defaults(check_table_tools=False)
+	parser.add_argument('-outfile','--outfile', dest='outfile', required=False, type=str, default='', help='Output filename (.json) with benchmark results')
+
+	args = parser.parse_args()
+
+	return args
+
+##############################
+##   BENCHMARK
+##############################
+def benchmark_import(script, nrepeats=3):
+	""" Return min import time and loaded heavy backends of an entry point script, or None on failure """
+
+	times= []
+	loaded= []
+	for i in range(nrepeats):
+		try:
+			out= subprocess.run(
+				[sys.executable, "-c", g_import_code, script, json.dumps(g_heavy_modules)],
+				stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True
+			)
+			res= json.loads(out.stdout.decode("utf-8").strip().split("\n")[-1])
+		except Exception as e:
+			stderr= getattr(e, "stderr", b"") or b""
+			logger.warn("Failed to import entry point %s (err=%s)!" % (script, stderr.decode("utf-8").strip().split("\n")[-1] if stderr else str(e)))
+			return None
+		times.append(res["time"])
+		loaded= res["loaded"]
+
+	return {"script": os.path.basename(script), "time": min(times), "loaded": loaded}
+
+
+##############
+##   MAIN   ##
+##############
+def main():
+	"""Main function"""
+
+	#===========================
+	#==   PARSE ARGS
+	#===========================
+	try:
+		args= get_args()
+	except Exception as ex:
+		logger.error("Failed to get and parse options (err=%s)",str(ex))
+		return 1
+
+	if args.scripts!="":
+		scripts= [x.strip() for x in args.scripts.split(',')]
+	else:
+		scriptdir= os.path.dirname(os.path.abspath(__file__))
+		scripts= sorted([item for item in glob.glob(os.path.join(scriptdir, "*.py")) if os.path.basename(item)!=os.path.basename(__file__)])
+
+	#===========================
+	#==   RUN BENCHMARK
+	#===========================
+	results= []
+	nfailed_checks= 0
+	print("%-40s %10s  %s" % ("ENTRY POINT", "TIME(s)", "HEAVY MODULES LOADED"))
+
+	for script in scripts:
+		res= benchmark_import(script, args.nrepeats)
+		if res is None:
+			print("%-40s %10s  %s" % (os.path.basename(script), "FAILED", ""))
+			continue
+		results.append(res)
+		print("%-40s %10.3f  %s" % (res["script"], res["time"], ",".join(res["loaded"])))
+
+		if args.check_table_tools and res["script"] in g_table_tools:
+			forbidden= [name for name in res["loaded"] if name in g_table_forbidden_modules]
+			if forbidden:
+				logger.error("Table-only tool %s loads %s at import!" % (res["script"], ",".join(forbidden)))
+				nfailed_checks+= 1
+
+	#===========================
+	#==   SAVE
+	#===========================
+	if args.outfile!="":
+		logger.info("Write benchmark results to file %s ..." % (args.outfile))
+		with open(args.outfile, 'w') as fp:
+			json.dump({"python": sys.version, "results": results}, fp, indent=2)
+
+	if nfailed_checks>0:
+		return 1
+
+	return 0
+
+###################
+##   MAIN EXEC   ##
+###################
+if __name__ == "__main__":
+	sys.exit(main())
@@ -106,6 +106,9 @@ def get_args():
 	parser.add_argument('-surveys','--surveys', dest='surveys', required=False, type=str, help='List of surveys to be used for cutouts, separated by comma. First survey is radio.') 
 	
 	
+	# - Feature extraction options
+	parser.add_argument('-nworkers_feat', '--nworkers_feat', dest='nworkers_feat', required=False, type=int, default=1, action='store',help='Number of worker processes used to extract moment features (default=1, serial)')
+
 	# - Autoencoder model options
 	parser.add_argument('--check_aereco', dest='check_aereco', action='store_true',help='Check AE reconstruction metrics (default=false)')	
 	parser.set_defaults(check_aereco=False)
@@ -668,6 +671,9 @@ def main():
 
 	# - Data pre-processing
 	normalize= args.normalize
+
+	# - Feature extraction options
+	nworkers_feat= args.nworkers_feat
 	
 
 	# - Autoencoder options
@@ -1041,6 +1047,7 @@ def main():
 		mc.ssim_winsize= 3
 		mc.save_ssim_pars= True
 		mc.outfile= featfile_mom
+		mc.nworkers= nworkers_feat
 
 		logger.info("[PROC %d] Extracting moment features from cutout data ..." % (procId))
 		if mc.run()<0:
@@ -36,15 +36,12 @@ from astropy.stats import sigma_clip
 from astropy.visualization import ZScaleInterval
 from sklearn.preprocessing import StandardScaler, MinMaxScaler, RobustScaler
 
-## ADDON MODULES
-import faiss
-import networkx as nx
-
 ## MODULES
 from sclassifier import __version__, __date__
 from sclassifier import logger
 from sclassifier.data_loader import DataLoader
 from sclassifier.utils import Utils
+from sclassifier.deduplicator import Deduplicator
 
 import matplotlib.pyplot as plt
 
@@ -76,16 +73,27 @@ def get_args():
 	parser.add_argument('-scalerfile', '--scalerfile', dest='scalerfile', required=False, type=str, default='', action='store',help='Load and use data transform stored in this file (.sav)')
 	
 	# - Similarity search options
-	parser.add_argument('-metric', '--metric', dest='metric', required=False, type=str, default='cossim', action='store',help='Similarity metric (default=cossim)')
+	parser.add_argument('-metric', '--metric', dest='metric', required=False, type=str, default='cossim', action='store',help='Similarity metric {cossim,l2} (default=cossim)')
 	parser.add_argument('-k', '--k', dest='k', required=False, type=int, default=64, action='store',help='Number of neighbors in similarity search (default=64)')
-	parser.add_argument('-score_thr', '--score_thr', dest='score_thr', required=False, type=float, default=0.6, action='store',help='Similarity threshold below which neighbors are not include in graph (default=0.6)')
+	parser.add_argument('-score_thr', '--score_thr', dest='score_thr', required=False, type=float, default=0.6, action='store',help='Similarity threshold below which neighbors are not include in graph (max squared distance with l2 metric) (default=0.6)')
+	parser.add_argument('-index_type', '--index_type', dest='index_type', required=False, type=str, default='flat', action='store',help='Index type used in similarity search {flat,ivfflat,ivfpq,opq_ivfpq,hnsw}, only flat with l2 metric (default=flat)')
+	parser.add_argument('-nlist', '--nlist', dest='nlist', required=False, type=int, default=256, action='store',help='The number of clusters (inverted lists) for IVF indexes (default=256)')
+	parser.add_argument('-M', '--M', dest='M', required=False, type=int, default=8, action='store',help='The number of sub-quantizers in Product Quantization (default=8)')
+	parser.add_argument('-nprobe', '--nprobe', dest='nprobe', required=False, type=int, default=10, action='store',help='The number of clusters to visit during search (default=10)')
+	parser.add_argument('-chunk_size', '--chunk_size', dest='chunk_size', required=False, type=int, default=65536, action='store',help='Number of query rows searched per block (default=65536)')
+	parser.add_argument('-nthreads', '--nthreads', dest='nthreads', required=False, type=int, default=1, action='store',help='Number of query blocks searched in parallel threads (default=1)')
+	
+	# - Deduplication options
+	parser.add_argument('-rep_rule', '--rep_rule', dest='rep_rule', required=False, type=str, default='medoid', action='store',help='Rule to select the image retained in each group of duplicates {first,medoid,quality} (default=medoid)')
+	parser.add_argument('-quality_key', '--quality_key', dest='quality_key', required=False, type=str, default='', action='store',help='Datalist key with image quality value (higher=better) used by quality rule')
 	
 	# - Output options
 	parser.add_argument('-outfile_embeddings','--outfile_embeddings', dest='outfile_embeddings', required=False, type=str, default='featdata_dedupl.dat', help='Output filename (.dat) of feature data with duplicated images removed') 
 	parser.add_argument('-outfile_datalist','--outfile_datalist', dest='outfile_datalist', required=False, type=str, default='filelist_dedupl.json', help='Output datalist filename (.json) with duplicated image entries removed') 
+	parser.add_argument('-outfile_groups','--outfile_groups', dest='outfile_groups', required=False, type=str, default='dedupl_groups.dat', help='Output filename (.dat) with group assignment of each image') 
 	
 	# - Draw options
-	parser.add_argument('--draw', dest='draw', action='store_true',help='Draw similar images in connected component graph (default=false)')	
+	parser.add_argument('--draw', dest='draw', action='store_true',help='Draw similar images in groups of duplicates (default=false)')	
 	parser.set_defaults(draw=False)
 	parser.add_argument('-nimgs_draw', '--nimgs_draw', dest='nimgs_draw', required=False, type=int, default=3, action='store',help='Number of similar images nxn to draw (default=3)')
 	
@@ -246,12 +254,15 @@ def main():
 	
 	# - Similarity search options
 	metric= args.metric
-	k= args.k + 1  # adding +1 to search for exactly k neibhbors in addition to the self similarity
+	k= args.k  # NB: self-matches are excluded in search
 	score_thr= args.score_thr
+	rep_rule= args.rep_rule
+	quality_key= args.quality_key
 	
 	# - Output options
 	outfile_embeddings= args.outfile_embeddings
 	outfile_datalist= args.outfile_datalist
+	outfile_groups= args.outfile_groups
 	
 	# - Draw options
 	draw= args.draw
@@ -297,90 +308,55 @@ def main():
 			return 1
 		data= data_norm
 
+	# - Read image quality?
+	quality= None
+	if rep_rule=="quality":
+		if quality_key=="":
+			logger.error("A datalist quality key is required by quality rule!")
+			return 1
+		quality= np.array([item.get(quality_key, np.nan) for item in datalist], dtype=np.float64)
+		nmissing= np.count_nonzero(~np.isfinite(quality))
+		if nmissing>0:
+			logger.warn("#%d entries with missing/invalid quality value %s, they are retained only in groups without valid values ..." % (nmissing, quality_key))
+
 	#===========================
 	#==   DEDUPLICATE FEATURES
 	#===========================
-	# - L2 normalize feature data
-	logger.info("L2 normalize feature data ...")
-	nrows= data.shape[0]
+	# - Find groups of duplicates as connected components of the kNN similarity graph
+	logger.info("Finding groups of duplicated images (metric=%s, index=%s, rep_rule=%s) ..." % (metric, args.index_type, rep_rule))
 	nfeats= data.shape[1]
 	
-	# - Build index for cosine similarity
-	logger.info("Building index for cosine similarity search ...")
-	if metric=="cossim":
-		logger.info("Using cosine similarity metric ...")
-		faiss.normalize_L2(data)
-		#index= faiss.index_factory(nfeats, "Flat", faiss.METRIC_INNER_PRODUCT)
-		index= faiss.IndexFlatIP(nfeats)
-	elif metric=="l2":
-		logger.info("Using L2 metric ...")
-		index= faiss.IndexFlatL2(nfeats)	
+	dedup= Deduplicator(
+		k=k, 
+		score_thr=score_thr, 
+		metric=metric, 
+		rep_rule=rep_rule,
+		index_type=args.index_type,
+		nlist=args.nlist, M=args.M, nprobe=args.nprobe,
+		chunk_size=args.chunk_size,
+		nthreads=args.nthreads
+	)
+	if dedup.run(data, quality)<0:
+		logger.error("Deduplication failed!")
+		return 1
 		
-	index.add(data)
-	logger.info("Created index (ntotal=%d) ..." % (index.ntotal))
+	indices_sel= dedup.representatives
 	
-	# - Run similarity search
-	logger.info("Running similarity search (k=%d) ..." % (k))
-	D, I = index.search(data, k)
-
-	# - Create graph of similarities
-	logger.info("Creating similarity graph ...")
-	G = nx.Graph()
-	n, d = I.shape
-
-	for i in range(n):
-		if debug:
-			print("Img no. %d: nneigh=%s, scores=%s" % (i, str(I[i,:]), str(D[i,:])))
-			
-		for j in range(d):
-			nn_index= I[i,j]
-			score= D[i,j]
-			if nn_index!=-1 and score>score_thr:
-				G.add_edge(i, nn_index, weight=score)
-
-	n_nodes= G.number_of_nodes()
-	n_edges= G.number_of_edges()
-	n_cc= nx.number_connected_components(G)
-	logger.info("#nodes=%d, #edges=%d, #connected_components=%d" % (n_nodes, n_edges, n_cc))
-
-	# - Loop through connected graph components and retain only the centroid of subgraphs
-	logger.info("Finding connected components and subgraphs ...")
-	cc= nx.connected_components(G)
-	subgraphs = [G.subgraph(c).copy() for c in cc]
-	
-	logger.info("Looping through %d connected graph components and retain only the centroid of subgraphs ..." % (n_cc))
-	indices_sel= []
-	counter= 0
-	for subgraph in subgraphs:
-		# - Add connected component barycenter to selected list
-		ids= [node for node in subgraph]
-		nneighbors= len(ids)
-		logger.info("subgraph no. %d/%d has %d nodes ..." % (counter, len(subgraphs), nneighbors))
+	if debug:
+		for group in dedup.get_groups(min_size=2):
+			print("Group of %d imgs: rep=%s, duplicates=%s" % (len(group), snames[group[0]], str([snames[index] for index in group[1:]])))
 		
-		#logger.info("Finding barycenter of subgraph no. %d/%d ..." % (counter, len(subgraphs)))
-		#barycenter_node= nx.barycenter(subgraph, weight="weight")
-		#barycenter_first_node= barycenter_node[0]
-		barycenter_first_node= ids[0]
-		indices_sel.append(barycenter_first_node)
-		counter+= 1
-		
-		# - Draw images inside the connected group for testing
-		if draw and nneighbors>1:
-			nn_indices= [node for node in subgraph if node!=barycenter_first_node]
-			
+	# - Draw images inside the groups for testing (representative first)
+	if draw:
+		for group in dedup.get_groups(min_size=2):
 			fig, axs = plt.subplots(nimgs_draw, nimgs_draw, figsize=(15, 15))
 			
 			for i in range(nimgs_draw):
 				for j in range(nimgs_draw):
 					gindex= i*nimgs_draw + j
-					if i==0 and j==0:
-						filename_img= datalist[barycenter_first_node]["filepaths"][0]
-					else:
-						if gindex<len(nn_indices):
-							nn_index= nn_indices[gindex]
-							filename_img= datalist[nn_index]["filepaths"][0]
-						else:
-							filename_img= ""
+					filename_img= ""
+					if gindex<len(group):
+						filename_img= datalist[group[gindex]]["filepaths"][0]
 							
 					# - Read image
 					if filename_img!="":
@@ -392,7 +368,7 @@ def main():
 							
 	# - Sort selected indices
 	logger.info("#%d/%d feature rows selected, sorting them ..." % (len(indices_sel), nrows))
-	indices_sel_sorted= sorted(indices_sel) 
+	indices_sel_sorted= dedup.get_selected_indices()
 	
 	# - Extract selected feature data
 	logger.info("Extract selected feature data ...")
@@ -422,6 +398,18 @@ def main():
 	with open(outfile_datalist, 'w') as fp:
 		json.dump(outdata_datalist, fp)	
 	
+	# - Write group assignments
+	logger.info("Writing group assignments to file %s ..." % (outfile_groups))
+	labels= dedup.labels
+	reps= dedup.representatives[labels]
+	snames_arr= np.array(snames)
+	outdata_groups= np.column_stack(
+		(snames_arr, labels, dedup.group_sizes[labels], (reps==np.arange(nrows)).astype(int), snames_arr[reps])
+	)
+	head= "# sname group_id group_size is_rep rep_sname"
+	
+	Utils.write_ascii(outdata_groups, outfile_groups, head)
+	
 	return 0
 
 ###################
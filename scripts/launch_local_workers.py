@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+##################################################
+###          MODULE IMPORT
+##################################################
+## STANDARD MODULES
+import os
+import sys
+import time
+import json
+import socket
+import subprocess
+import logging
+
+## COMMAND-LINE ARG MODULES
+import argparse
+
+## MODULES
+from sclassifier import logger
+
+###########################
+##     ARGS
+###########################
+def get_args():
+	"""This function parses and return arguments passed in"""
+	parser = argparse.ArgumentParser(
+		description="Launch a multi-worker training on the local host, spawning N worker processes with a generated TF_CONFIG.",
+		epilog="Example: launch_local_workers.py -nworkers 2 -- run_simclr.py --distribute -datalist=train.json [...]"
+	)
+
+	parser.add_argument('-nworkers', '--nworkers', dest='nworkers', required=False, type=int, default=2, action='store',help='Number of worker processes (default=2)')
+	parser.add_argument('-base_port', '--base_port', dest='base_port', required=False, type=int, default=0, action='store',help='Port of first worker, following workers use consecutive ports. If 0, free ports are chosen (default=0)')
+	parser.add_argument('-logdir', '--logdir', dest='logdir', required=False, type=str, default='', action='store',help='Directory where worker logs (worker_<index>.log) are written. If empty, worker outputs are not redirected (default=empty)')
+	parser.add_argument('-threads_per_worker', '--threads_per_worker', dest='threads_per_worker', required=False, type=int, default=0, action='store',help='Number of TF intra-op threads per worker (OMP_NUM_THREADS), 0=not set (default=0)')
+	parser.add_argument('cmd', nargs=argparse.REMAINDER, help='Training command run by each worker (after --). It must enable distributed training (e.g. --distribute) and take the cluster from TF_CONFIG')
+
+	args = parser.parse_args()
+
+	return args
+
+###########################
+##     CLUSTER
+###########################
+def get_free_ports(n):
+	""" Return n free TCP ports on localhost """
+
+	sockets= []
+	ports= []
+	for i in range(n):
+		s= socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		s.bind(("localhost", 0))
+		sockets.append(s)
+		ports.append(s.getsockname()[1])
+
+	for s in sockets:
+		s.close()
+
+	return ports
+
+def get_tf_config(worker_hosts, worker_index):
+	""" Return TF_CONFIG json string for given worker hosts (host:port list) and worker index """
+
+	tf_config= {
+		"cluster": {"worker": list(worker_hosts)},
+		"task": {"type": "worker", "index": int(worker_index)}
+	}
+
+	return json.dumps(tf_config)
+
+
+##############
+##   MAIN   ##
+##############
+def main():
+	"""Main function"""
+
+	#===========================
+	#==   PARSE ARGS
+	#===========================
+	logger.info("Get script args ...")
+	try:
+		args= get_args()
+	except Exception as ex:
+		logger.error("Failed to get and parse options (err=%s)",str(ex))
+		return 1
+
+	cmd= args.cmd
+	if cmd and cmd[0]=="--":
+		cmd= cmd[1:]
+	if not cmd:
+		logger.error("No worker command given (pass it after --)!")
+		return 1
+
+	if args.nworkers<=0:
+		logger.error("Invalid number of workers (%d) given (must be >0)!" % (args.nworkers))
+		return 1
+
+	# - Run python scripts with the current interpreter
+	if cmd[0].endswith(".py"):
+		cmd= [sys.executable] + cmd
+
+	#===========================
+	#==   SET CLUSTER
+	#===========================
+	if args.base_port>0:
+		ports= [args.base_port + i for i in range(args.nworkers)]
+	else:
+		ports= get_free_ports(args.nworkers)
+	worker_hosts= ["localhost:%d" % (port) for port in ports]
+	logger.info("Launching #%d workers on hosts %s ..." % (args.nworkers, ",".join(worker_hosts)))
+
+	if args.logdir!="" and not os.path.exists(args.logdir):
+		os.makedirs(args.logdir)
+
+	#===========================
+	#==   LAUNCH WORKERS
+	#===========================
+	procs= []
+	logfiles= []
+	for i in range(args.nworkers):
+		env= dict(os.environ)
+		env["TF_CONFIG"]= get_tf_config(worker_hosts, i)
+		if args.threads_per_worker>0:
+			env["OMP_NUM_THREADS"]= str(args.threads_per_worker)
+			env["TF_NUM_INTRAOP_THREADS"]= str(args.threads_per_worker)
+
+		stdout= None
+		if args.logdir!="":
+			logfile= os.path.join(args.logdir, "worker_%d.log" % (i))
+			stdout= open(logfile, "w")
+			logfiles.append(stdout)
+			logger.info("Worker %d output written to %s ..." % (i, logfile))
+
+		procs.append(subprocess.Popen(cmd, env=env, stdout=stdout, stderr=subprocess.STDOUT if stdout is not None else None))
+
+	#===========================
+	#==   WAIT WORKERS
+	#===========================
+	# - Wait for all workers, terminating the others if one fails (they would hang in collective ops)
+	t0= time.time()
+	status= 0
+	try:
+		running= list(range(args.nworkers))
+		while running:
+			for i in list(running):
+				retcode= procs[i].poll()
+				if retcode is None:
+					continue
+				running.remove(i)
+				logger.info("Worker %d exited with code %d ..." % (i, retcode))
+				if retcode!=0 and status==0:
+					logger.error("Worker %d failed, terminating other workers ..." % (i))
+					status= 1
+					for j in running:
+						procs[j].terminate()
+			time.sleep(1)
+	except KeyboardInterrupt:
+		logger.warn("Interrupted, terminating workers ...")
+		for p in procs:
+			p.terminate()
+		status= 1
+
+	for p in procs:
+		p.wait()
+	for f in logfiles:
+		f.close()
+
+	logger.info("All workers completed in %.1f s (status=%d) ..." % (time.time()-t0, status))
+
+	return status
+
+###################
+##   MAIN EXEC   ##
+###################
+if __name__ == "__main__":
+	sys.exit(main())
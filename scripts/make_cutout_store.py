@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+##################################################
+###          MODULE IMPORT
+##################################################
+## STANDARD MODULES
+import os
+import sys
+import time
+import datetime
+import numpy as np
+import logging
+
+## COMMAND-LINE ARG MODULES
+import getopt
+import argparse
+
+## MODULES
+from sclassifier import __version__, __date__
+from sclassifier import logger
+from sclassifier.cutout_store import CutoutStore
+
+###########################
+##     ARGS
+###########################
+def get_args():
+	"""This function parses and return arguments passed in"""
+	parser = argparse.ArgumentParser(description="Parse args.")
+
+	# - Input options
+	parser.add_argument('-datalist','--datalist', dest='datalist', required=True, type=str, help='Input data json filelist')
+
+	# - Store options
+	parser.add_argument('-nx', '--nx', dest='nx', required=False, type=int, default=64, action='store',help='Image resize width in pixels (default=64)')
+	parser.add_argument('-ny', '--ny', dest='ny', required=False, type=int, default=64, action='store',help='Image resize height in pixels (default=64)')
+	parser.add_argument('-badpix_fract_thr', '--badpix_fract_thr', dest='badpix_fract_thr', required=False, type=float, default=0.3, action='store',help='Max fraction of bad pixels allowed in each cutout channel (default=0.3)')
+
+	# - Output options
+	parser.add_argument('-outdir','--outdir', dest='outdir', required=True, type=str, help='Output cutout store directory')
+	parser.add_argument('--overwrite', dest='overwrite', action='store_true',help='Overwrite existing store (default=false)')
+	parser.set_defaults(overwrite=False)
+
+	args = parser.parse_args()
+
+	return args
+
+
+##############
+##   MAIN   ##
+##############
+def main():
+	"""Main function"""
+
+	#===========================
+	#==   PARSE ARGS
+	#===========================
+	logger.info("Get script args ...")
+	try:
+		args= get_args()
+	except Exception as ex:
+		logger.error("Failed to get and parse options (err=%s)",str(ex))
+		return 1
+
+	#===========================
+	#==   CREATE STORE
+	#===========================
+	logger.info("Packing cutouts in datalist %s into store %s ..." % (args.datalist, args.outdir))
+	t0= time.time()
+	store= CutoutStore.create_from_datalist(
+		args.datalist, args.outdir,
+		nx=args.nx, ny=args.ny,
+		badpix_fract_thr=args.badpix_fract_thr,
+		overwrite=args.overwrite
+	)
+	if store is None:
+		logger.error("Failed to create cutout store from datalist %s!" % (args.datalist))
+		return 1
+
+	logger.info("Cutout store %s created in %.1f s (#%d cutouts) ..." % (args.outdir, time.time()-t0, store.datasize))
+
+	return 0
+
+###################
+##   MAIN EXEC   ##
+###################
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+##################################################
+###          MODULE IMPORT
+##################################################
+## STANDARD MODULES
+import os
+import sys
+import time
+import numpy as np
+import logging
+
+## COMMAND-LINE ARG MODULES
+import argparse
+
+## MODULES
+from sclassifier import __version__, __date__
+from sclassifier import logger
+from sclassifier.index_store import IndexStore
+from sclassifier.index_tuner import IndexTuner
+
+###########################
+##     ARGS
+###########################
+def get_args():
+	"""This function parses and return arguments passed in"""
+	parser = argparse.ArgumentParser(description="Parse args.")
+
+	# - Command options
+	parser.add_argument('-cmd','--cmd', dest='cmd', required=False, type=str, default='create', help='Store command {create,add,remove} (default=create)')
+	parser.add_argument('-store','--store', dest='store', required=True, type=str, help='Index store directory')
+
+	# - Input options
+	parser.add_argument('-datafile','--datafile', dest='datafile', required=False, type=str, default='', help='Feature data file (.json) with entries to be indexed (create/add) or removed (remove, entries matched by sname)')
+	parser.add_argument('-datalist_key','--datalist_key', dest='datalist_key', required=False, type=str, default="data", help='Dictionary key name to be read in feature data file (default=data)')
+	parser.add_argument('-selcols','--selcols', dest='selcols', required=False, type=str, default='', help='Data column ids to be selected from feature data, separated by commas')
+	parser.add_argument('-snames','--snames', dest='snames', required=False, type=str, default='', help='Source names of entries to be removed, separated by commas')
+
+	# - Index options
+	parser.add_argument('-index_type','--index_type', dest='index_type', required=False, type=str, default='auto', help='Index type {auto,flat,ivfflat,ivfpq,opq_ivfpq,hnsw,tune}. With tune the index is selected by benchmarking candidates on held-out data (default=auto)')
+	parser.add_argument('-large_data_thr', '--large_data_thr', dest='large_data_thr', required=False, type=int, default=1000000, action='store',help='Number of entries above which an IVFPQ index is used with index_type=auto (default=1000000)')
+	parser.add_argument('-nlist', '--nlist', dest='nlist', required=False, type=int, default=256, action='store',help='The number of clusters (inverted lists) for the IVFPQ index (default=256)')
+	parser.add_argument('-M', '--M', dest='M', required=False, type=int, default=8, action='store',help='The number of sub-quantizers in Product Quantization (default=8)')
+	parser.add_argument('-nprobe', '--nprobe', dest='nprobe', required=False, type=int, default=10, action='store',help='The number of clusters to visit during search (default=10)')
+	parser.add_argument('-hnsw_m', '--hnsw_m', dest='hnsw_m', required=False, type=int, default=32, action='store',help='The number of neighbors per node in HNSW graph (default=32)')
+	parser.add_argument('-efsearch', '--efsearch', dest='efsearch', required=False, type=int, default=64, action='store',help='The HNSW search queue size. Larger efsearch = better recall but slower (default=64)')
+	parser.add_argument('-ntrain_max', '--ntrain_max', dest='ntrain_max', required=False, type=int, default=100000, action='store',help='Max number of samples used to train IVFPQ index (default=100000)')
+
+	# - Index tuning options
+	parser.add_argument('-target_recall', '--target_recall', dest='target_recall', required=False, type=float, default=0.95, action='store',help='Target recall@k of tuned index with respect to exact search (default=0.95)')
+	parser.add_argument('-tune_k', '--tune_k', dest='tune_k', required=False, type=int, default=10, action='store',help='Number of neighbors k used to measure recall@k in index tuning (default=10)')
+	parser.add_argument('-tune_nqueries', '--tune_nqueries', dest='tune_nqueries', required=False, type=int, default=1000, action='store',help='Number of held-out queries used in index tuning (default=1000)')
+	parser.add_argument('-tune_nbase_max', '--tune_nbase_max', dest='tune_nbase_max', required=False, type=int, default=0, action='store',help='Max number of data indexed in tuning benchmarks (0=all) (default=0)')
+	parser.add_argument('-tune_index_types', '--tune_index_types', dest='tune_index_types', required=False, type=str, default='flat,ivfflat,ivfpq,hnsw', help='Candidate index types benchmarked in index tuning, separated by commas (default=flat,ivfflat,ivfpq,hnsw)')
+	parser.add_argument('--tune_opq', dest='tune_opq', action='store_true',help='Include OPQ+IVFPQ index among tuning candidates (default=false)')
+	parser.set_defaults(tune_opq=False)
+
+	parser.add_argument('--overwrite', dest='overwrite', action='store_true',help='Overwrite existing store with create command (default=false)')
+	parser.set_defaults(overwrite=False)
+
+	args = parser.parse_args()
+
+	return args
+
+
+##############
+##   MAIN   ##
+##############
+def main():
+	"""Main function"""
+
+	#===========================
+	#==   PARSE ARGS
+	#===========================
+	logger.info("Get script args ...")
+	try:
+		args= get_args()
+	except Exception as ex:
+		logger.error("Failed to get and parse options (err=%s)",str(ex))
+		return 1
+
+	if args.cmd not in ["create","add","remove"]:
+		logger.error("Invalid/unknown command %s given!" % (args.cmd))
+		return 1
+
+	selcols= []
+	if args.selcols!="":
+		selcols= [int(x.strip()) for x in args.selcols.split(',')]
+
+	#===========================
+	#==   READ FEATURE DATA
+	#===========================
+	data= None
+	entries= []
+	if args.datafile!="":
+		logger.info("Read feature data file %s ..." % (args.datafile))
+		data, entries= IndexStore.read_feature_data(args.datafile, args.datalist_key, selcols)
+		if data is None:
+			logger.error("Failed to read feature data file %s!" % (args.datafile))
+			return 1
+	elif args.cmd!="remove":
+		logger.error("A feature data file is required by %s command!" % (args.cmd))
+		return 1
+
+	#===========================
+	#==   RUN COMMAND
+	#===========================
+	t0= time.time()
+	store= IndexStore(args.store)
+
+	if args.cmd=="create":
+		if IndexStore.is_store(args.store) and not args.overwrite:
+			logger.error("Store %s already exists (enable overwrite to replace it)!" % (args.store))
+			return 1
+
+		tuner= None
+		if args.index_type=="tune":
+			tuner= IndexTuner(
+				k=args.tune_k,
+				target_recall=args.target_recall,
+				nqueries=args.tune_nqueries,
+				nbase_max=args.tune_nbase_max,
+				ntrain_max=args.ntrain_max,
+				index_types=[x.strip() for x in args.tune_index_types.split(',')],
+				use_opq=args.tune_opq,
+				hnsw_m=args.hnsw_m
+			)
+
+		if store.create(
+			data, entries,
+			index_type=args.index_type,
+			large_data_thr=args.large_data_thr,
+			nlist=args.nlist, M=args.M, nprobe=args.nprobe,
+			ntrain_max=args.ntrain_max,
+			hnsw_m=args.hnsw_m, efsearch=args.efsearch,
+			tuner=tuner
+		)<0:
+			logger.error("Failed to create index store!")
+			return 1
+
+	else:
+		if store.open()<0:
+			logger.error("Failed to open index store %s!" % (args.store))
+			return 1
+
+		if args.cmd=="add":
+			if store.add(data, entries) is None:
+				logger.error("Failed to add entries to index store!")
+				return 1
+
+		elif args.cmd=="remove":
+			snames= []
+			if args.snames!="":
+				snames.extend([x.strip() for x in args.snames.split(',')])
+			snames.extend([item["sname"] for item in entries if "sname" in item])
+			if not snames:
+				logger.error("No source names given for removal!")
+				return 1
+			if store.remove(store.get_ids(snames))<0:
+				logger.error("Failed to remove entries from index store!")
+				return 1
+
+	if store.save()<0:
+		logger.error("Failed to save index store %s!" % (args.store))
+		return 1
+
+	logger.info("Index store %s updated in %.1f s (cmd=%s, #%d entries) ..." % (args.store, time.time()-t0, args.cmd, store.size))
+
+	return 0
+
+###################
+##   MAIN EXEC   ##
+###################
+if __name__ == "__main__":
+	sys.exit(main())
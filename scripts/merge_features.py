@@ -26,18 +26,17 @@ import argparse
 import collections
 import csv
 
-## ASTRO MODULES
-from astropy.io import ascii 
-
 ## MODULES
 from sclassifier import __version__, __date__
 from sclassifier import logger
 from sclassifier.data_loader import DataLoader
 from sclassifier.utils import Utils
 from sclassifier.feature_selector import FeatSelector
+from sclassifier.lazy_import import lazy_import
 
-
-import matplotlib.pyplot as plt
+## HEAVY MODULES (imported at first use)
+ascii= lazy_import("astropy.io.ascii")
+plt= lazy_import("matplotlib.pyplot")
 
 #### GET SCRIPT ARGS ####
 def str2bool(v):
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+##################################################
+###          MODULE IMPORT
+##################################################
+## STANDARD MODULES
+import os
+import sys
+import time
+import numpy as np
+import logging
+import json
+
+## COMMAND-LINE ARG MODULES
+import argparse
+
+## MODULES
+from sclassifier import __version__, __date__
+from sclassifier import logger
+from sclassifier.utils import Utils
+from sclassifier.img_hasher import ImgHasher
+
+###########################
+##     ARGS
+###########################
+def get_args():
+	"""This function parses and return arguments passed in"""
+	parser = argparse.ArgumentParser(description="Parse args.")
+
+	# - Input options
+	parser.add_argument('-inputfile_datalist','--inputfile_datalist', dest='inputfile_datalist', required=True, type=str, help='Path to file with image datalist (.json)')
+
+	# - Hash options
+	parser.add_argument('-hash_method', '--hash_method', dest='hash_method', required=False, type=str, default='dct', choices=['dct','mean'], action='store',help='Perceptual hash method {dct,mean} (default=dct)')
+	parser.add_argument('-hash_size', '--hash_size', dest='hash_size', required=False, type=int, default=8, action='store',help='Hash grid size, hashes have hash_size^2 bits (default=8)')
+	parser.add_argument('--no_zscale', dest='zscale', action='store_false',help='Do not apply zscale transform to images before hashing (default=false)')
+	parser.set_defaults(zscale=True)
+	parser.add_argument('-zscale_contrast', '--zscale_contrast', dest='zscale_contrast', required=False, type=float, default=0.25, action='store',help='ZScale transform contrast (default=0.25)')
+
+	# - Duplicate search options
+	parser.add_argument('-max_dist', '--max_dist', dest='max_dist', required=False, type=int, default=4, action='store',help='Max number of different hash bits (Hamming distance) between near-duplicated images, 0=only exact duplicates (default=4)')
+	parser.add_argument('-large_data_thr', '--large_data_thr', dest='large_data_thr', required=False, type=int, default=1000000, action='store',help='Number of unique hashes above which a multi-hash binary index is used (default=1000000)')
+
+	# - Parallel options
+	parser.add_argument('-nworkers', '--nworkers', dest='nworkers', required=False, type=int, default=1, action='store',help='Number of worker processes used to hash images (default=1, serial)')
+	parser.add_argument('-chunk_size', '--chunk_size', dest='chunk_size', required=False, type=int, default=0, action='store',help='Number of images hashed per worker task (0=auto) (default=0)')
+
+	# - Output options
+	parser.add_argument('-outfile_datalist','--outfile_datalist', dest='outfile_datalist', required=False, type=str, default='filelist_prefilt.json', help='Output datalist filename (.json) with duplicated image entries removed')
+	parser.add_argument('-outfile_groups','--outfile_groups', dest='outfile_groups', required=False, type=str, default='prefilt_groups.dat', help='Output filename (.dat) with hash and group assignment of each image')
+
+	args = parser.parse_args()
+
+	return args
+
+
+##############
+##   MAIN   ##
+##############
+def main():
+	"""Main function"""
+
+	#===========================
+	#==   PARSE ARGS
+	#===========================
+	logger.info("Get script args ...")
+	try:
+		args= get_args()
+	except Exception as ex:
+		logger.error("Failed to get and parse options (err=%s)",str(ex))
+		return 1
+
+	if args.hash_size<=1:
+		logger.error("Invalid hash size (%d) given (must be >1)!" % (args.hash_size))
+		return 1
+
+	#===========================
+	#==   READ DATALIST
+	#===========================
+	logger.info("Read image dataset filelist %s ..." % (args.inputfile_datalist))
+	try:
+		with open(args.inputfile_datalist, "r") as fp:
+			datalist= json.load(fp)["data"]
+	except Exception as e:
+		logger.error("Failed to read datalist %s (err=%s)!" % (args.inputfile_datalist, str(e)))
+		return 1
+
+	nfiles= len(datalist)
+	if nfiles<=0:
+		logger.error("Read datalist is empty!")
+		return 1
+
+	filenames= [item["filepaths"][0] for item in datalist]
+	snames= [item.get("sname", "S%d" % (i+1)) for i, item in enumerate(datalist)]
+
+	#===========================
+	#==   FIND DUPLICATES
+	#===========================
+	logger.info("Hashing #%d images and finding duplicates (method=%s, nbits=%d, max_dist=%d) ..." % (nfiles, args.hash_method, args.hash_size*args.hash_size, args.max_dist))
+	t0= time.time()
+
+	hasher= ImgHasher(
+		hash_method=args.hash_method,
+		hash_size=args.hash_size,
+		max_dist=args.max_dist,
+		apply_zscale=args.zscale,
+		contrast=args.zscale_contrast,
+		nworkers=args.nworkers,
+		chunk_size=args.chunk_size,
+		large_data_thr=args.large_data_thr
+	)
+	if hasher.run(filenames)<0:
+		logger.error("Failed to find duplicated images!")
+		return 1
+
+	indices_sel= hasher.get_selected_indices()
+	logger.info("#%d/%d images retained (#%d removed) in %.1f s ..." % (len(indices_sel), nfiles, nfiles-len(indices_sel), time.time()-t0))
+
+	#===========================
+	#==   SAVE OUTPUTS
+	#===========================
+	# - Write selected datalist
+	logger.info("Write selected datalist to file %s ..." % (args.outfile_datalist))
+	datalist_sel= [datalist[index] for index in indices_sel]
+	with open(args.outfile_datalist, 'w') as fp:
+		json.dump({"data": datalist_sel}, fp)
+
+	# - Write hashes & group assignments
+	logger.info("Writing hashes & group assignments to file %s ..." % (args.outfile_groups))
+	labels= hasher.labels
+	reps= hasher.representatives[labels]
+	snames_arr= np.array(snames)
+	hashes_hex= np.array([item if item!="" else "-" for item in hasher.get_hex_hashes()])
+	outdata= np.column_stack(
+		(snames_arr, hashes_hex, labels, hasher.group_sizes[labels], (reps==np.arange(nfiles)).astype(int), snames_arr[reps])
+	)
+	head= "# sname hash group_id group_size is_rep rep_sname"
+
+	Utils.write_ascii(outdata, args.outfile_groups, head)
+
+	return 0
+
+###################
+##   MAIN EXEC   ##
+###################
+if __name__ == "__main__":
+	sys.exit(main())
@@ -38,6 +38,10 @@ from sclassifier import __version__, __date__
 from sclassifier import logger
 from sclassifier.feature_extractor_byol import FeatExtractorByol
 from sclassifier.data_generator import DataGenerator
+from sclassifier.tf_utils import set_performance_mode
+from sclassifier.tf_distribute import create_strategy, shard_data_generator, get_strategy_scope
+from sclassifier.embedding_writer import add_stream_embeddings_args
+from sclassifier.preprocessing_cache import PreprocessingCache
 from sclassifier.preprocessing import DataPreprocessor
 from sclassifier.preprocessing import BkgSubtractor, SigmaClipper, SigmaClipShifter, Scaler, LogStretcher, Augmenter
 from sclassifier.preprocessing import Resizer, MinMaxNormalizer, AbsMinMaxNormalizer, MaxScaler, AbsMaxScaler, ChanMaxScaler
@@ -156,6 +160,20 @@ def get_args():
 	parser.add_argument('-optimizer', '--optimizer', dest='optimizer', required=False, type=str, default='rmsprop', action='store',help='Optimizer used (default=rmsprop)')
 	parser.add_argument('-learning_rate', '--learning_rate', dest='learning_rate', required=False, type=float, default=None, action='store',help='Learning rate. If None, use default for the selected optimizer (default=None)')
 	parser.add_argument('-batch_size', '--batch_size', dest='batch_size', required=False, type=int, default=32, action='store',help='Batch size used in training (default=32)')
+	parser.add_argument('-grad_accum_steps', '--grad_accum_steps', dest='grad_accum_steps', required=False, type=int, default=1, action='store',help='Number of batches over which gradients are accumulated before each optimizer update. Effective batch size is grad_accum_steps*batch_size (default=1)')
+	parser.add_argument('--mixed_precision', dest='mixed_precision', action='store_true',help='Use bfloat16 mixed precision (enabled only if CPU supports bfloat16) (default=false)')	
+	parser.set_defaults(mixed_precision=False)
+	parser.add_argument('-target_decay', '--target_decay', dest='target_decay', required=False, type=float, default=0.99, action='store',help='Momentum used to update target networks as exponential moving average of online networks (default=0.99)')
+	parser.add_argument('--use_xla', dest='use_xla', action='store_true',help='Compile train step with XLA (default=false)')	
+	parser.set_defaults(use_xla=False)
+	parser.add_argument('--distribute', dest='distribute', action='store_true',help='Run data-parallel training over multiple worker processes with MultiWorkerMirroredStrategy (default=false)')	
+	parser.set_defaults(distribute=False)
+	parser.add_argument('-worker_hosts', '--worker_hosts', dest='worker_hosts', required=False, type=str, default='', action='store',help='Comma-separated list of worker addresses host:port (e.g. localhost:12345,localhost:12346). If empty, workers are taken from MPI ranks (--use_mpi) or from TF_CONFIG env variable (default=empty)')
+	parser.add_argument('-worker_index', '--worker_index', dest='worker_index', required=False, type=int, default=-1, action='store',help='Index of this worker in worker_hosts list (default=-1)')
+	parser.add_argument('--use_mpi', dest='use_mpi', action='store_true',help='Set workers from MPI ranks as hostname:worker_base_port+rank, e.g. when run with mpirun (default=false)')	
+	parser.set_defaults(use_mpi=False)
+	parser.add_argument('-worker_base_port', '--worker_base_port', dest='worker_base_port', required=False, type=int, default=12345, action='store',help='Base port of workers set from MPI ranks (default=12345)')
+	parser.add_argument('-collective_impl', '--collective_impl', dest='collective_impl', required=False, type=str, default='ring', action='store',help='Collective communication implementation {ring,auto} (default=ring)')
 	parser.add_argument('-weight_seed', '--weight_seed', dest='weight_seed', required=False, type=int, default=None, action='store',help='Weight seed to set reproducible training (default=None)')
 	parser.add_argument('--reproducible', dest='reproducible', action='store_true',help='Fix seed and make model reproducible from run to run')	
 	parser.set_defaults(reproducible=False)
@@ -164,12 +182,29 @@ def get_args():
 	parser.add_argument('--no-multiprocessing', dest='multiprocessing', action='store_false',help='Disable multiprocessing in TF fit method (default=enabled)')	
 	parser.set_defaults(multiprocessing=True)
 
+	parser.add_argument('-nreaders', '--nreaders', dest='nreaders', required=False, type=int, default=0, action='store',help='Number of workers reading and pre-processing data in data generators (0=read in generator thread) (default=0)')
+	parser.add_argument('-reader_type', '--reader_type', dest='reader_type', required=False, type=str, default='process', action='store',help='Data reader worker type {process,thread} (default=process)')
+	parser.add_argument('-prefetch_size', '--prefetch_size', dest='prefetch_size', required=False, type=int, default=4, action='store',help='Number of batches prefetched by data generators when nreaders>0 (default=4)')
+	parser.add_argument('-reader_seed', '--reader_seed', dest='reader_seed', required=False, type=int, default=None, action='store',help='Seed used to make augmentations in data reader processes reproducible (default=None)')
+	parser.add_argument('-preproc_cache_dir', '--preproc_cache_dir', dest='preproc_cache_dir', required=False, type=str, default='', action='store',help='Directory used to cache the output of deterministic pre-processing stages. If empty, cache is disabled (default=empty)')
+	parser.add_argument('-preproc_cache_size', '--preproc_cache_size', dest='preproc_cache_size', required=False, type=float, default=10, action='store',help='Max size in GB of pre-processing cache, least recently used entries are evicted above it (default=10)')
+	parser.add_argument('-preproc_batch_size', '--preproc_batch_size', dest='preproc_batch_size', required=False, type=int, default=0, action='store',help='If >1, read data in chunks of this size and apply pre-processing stages to whole batches (vectorised). Not used with pre-processing cache (default=0)')
+
+	parser.add_argument('--use_tf_data', dest='use_tf_data', action='store_true',help='Feed training with tf.data datasets built on top of data generators (default=false)')	
+	parser.set_defaults(use_tf_data=False)
+	parser.add_argument('--tf_data_cache', dest='tf_data_cache', action='store_true',help='Cache raw input data in tf.data datasets (default=false)')	
+	parser.set_defaults(tf_data_cache=False)
+	parser.add_argument('-tf_data_cachefile', '--tf_data_cachefile', dest='tf_data_cachefile', required=False, type=str, default='', action='store',help='File used to cache raw input data in tf.data datasets. If empty, cache in memory (default=empty)')
+	parser.add_argument('-predict_batch_size', '--predict_batch_size', dest='predict_batch_size', required=False, type=int, default=32, action='store',help='Batch size used when running model inference on input data (default=32)')
+	add_stream_embeddings_args(parser)
+
 	parser.add_argument('--load_cv_data_in_batches', dest='load_cv_data_in_batches', action='store_true',help='Load validation data in batches using train batch size (default=load all data in a single step)')	
 	parser.set_defaults(load_cv_data_in_batches=False)
 
 	parser.add_argument('--balance_classes_in_batch', dest='balance_classes_in_batch', action='store_true',help='Balance classes in batch generation')	
 	parser.set_defaults(balance_classes_in_batch=False)
 	parser.add_argument('--class_probs', dest='class_probs', required=False, type=str, default='{"PN":1,"HII":1,"PULSAR":1,"YSO":1,"STAR":1,"GALAXY":1,"QSO":1}', help='Class weights used in batch rebalance') 
+	parser.add_argument('-sampling', '--sampling', dest='sampling', required=False, type=str, default='weighted', action='store',help='Index sampling mode used in class rebalancing {weighted,stratified}. Indexes are drawn before reading data (default=weighted)')
 	
 
 	# - Network architecture options
@@ -249,6 +284,16 @@ def main():
 		logger.error("Failed to get and parse options (err=%s)",str(ex))
 		return 1
 
+	# - Create multi-worker strategy?
+	#   NB: must be created before any other TF operation
+	strategy= None
+	if args.distribute:
+		worker_hosts= [item.strip() for item in args.worker_hosts.split(',') if item.strip()!=""]
+		strategy= create_strategy(worker_hosts, args.worker_index, args.use_mpi, args.worker_base_port, args.collective_impl)
+		if strategy is None:
+			logger.error("Failed to create multi-worker strategy!")
+			return 1
+
 	# - Input filelist
 	datalist= args.datalist
 	datalist_cv= args.datalist_cv
@@ -343,13 +388,32 @@ def main():
 	optimizer= args.optimizer
 	learning_rate= args.learning_rate
 	batch_size= args.batch_size
+	grad_accum_steps= args.grad_accum_steps
 	nepochs= args.nepochs
+	target_decay= args.target_decay
+	use_xla= args.use_xla
+	mixed_precision= args.mixed_precision
 	weight_seed= args.weight_seed
 	reproducible= args.reproducible
 	validation_steps= args.validation_steps
 
 	load_cv_data_in_batches= args.load_cv_data_in_batches
 	multiprocessing= args.multiprocessing
+	nreaders= args.nreaders
+	reader_type= args.reader_type
+	prefetch_size= args.prefetch_size
+	reader_seed= args.reader_seed
+	preproc_cache_dir= args.preproc_cache_dir
+	preproc_cache_size= args.preproc_cache_size
+	preproc_batch_size= args.preproc_batch_size
+	sampling= args.sampling
+	use_tf_data= args.use_tf_data
+	tf_data_cache= args.tf_data_cache
+	tf_data_cachefile= args.tf_data_cachefile
+	predict_batch_size= args.predict_batch_size
+	stream_embeddings= args.stream_embeddings
+	embeddings_chunk_size= args.embeddings_chunk_size
+	resume_embeddings= args.resume_embeddings
 
 	balance_classes_in_batch= args.balance_classes_in_batch
 
@@ -474,8 +538,23 @@ def main():
 	#===============================
 	#==  DATA GENERATOR
 	#===============================
+	# - Create pre-processing cache
+	preproc_cache= None
+	if preproc_cache_dir!="":
+		preproc_cache= PreprocessingCache(preproc_cache_dir, max_size=int(preproc_cache_size*1024**3))
+		if preproc_cache.open()<0:
+			logger.error("Failed to open pre-processing cache %s!" % (preproc_cache_dir))
+			return 1
+
 	# - Create train data generator
 	dg= DataGenerator(filename=datalist, preprocessor=dp)
+	dg.nworkers= nreaders
+	dg.worker_type= reader_type
+	dg.prefetch_size= prefetch_size
+	dg.seed= reader_seed
+	dg.preproc_cache= preproc_cache
+	dg.preproc_batch_size= preproc_batch_size
+	dg.sampling= sampling
 
 	logger.info("Reading datalist %s ..." % datalist)
 	if dg.read_datalist()<0:
@@ -486,6 +565,13 @@ def main():
 	dg_cv= None
 	if datalist_cv!="":
 		dg_cv= DataGenerator(filename=datalist_cv, preprocessor=dp_val)
+		dg_cv.nworkers= nreaders
+		dg_cv.worker_type= reader_type
+		dg_cv.prefetch_size= prefetch_size
+		dg_cv.seed= reader_seed
+		dg_cv.preproc_cache= preproc_cache
+		dg_cv.preproc_batch_size= preproc_batch_size
+		dg_cv.sampling= sampling
 		
 		logger.info("Reading datalist_cv %s ..." % (datalist_cv))
 		if dg_cv.read_datalist()<0:
@@ -495,6 +581,13 @@ def main():
 	#===========================
 	#==   BUILD MODEL
 	#===========================
+	# - Shard data over workers (if distributed)
+	shard_data_generator(dg, strategy)
+	shard_data_generator(dg_cv, strategy)
+
+	# - Set performance mode (before building models)
+	set_performance_mode(mixed_precision=mixed_precision)
+
 	byol= FeatExtractorByol(dg)
 	byol.nchannels= nchannels
 	byol.modelfile_encoder= modelfile_encoder
@@ -507,9 +600,14 @@ def main():
 	byol.latent_dim= latentdim
 
 	byol.batch_size= batch_size
+	byol.grad_accum_steps= grad_accum_steps
 	byol.nepochs= nepochs
+	byol.target_decay= target_decay
+	byol.use_xla= use_xla
+	byol.strategy= strategy
 	byol.validation_steps= validation_steps
-	byol.set_optimizer(optimizer, learning_rate)
+	with get_strategy_scope(strategy):
+		byol.set_optimizer(optimizer, learning_rate)
 	if reproducible:
 		byol.set_reproducible_model()
 	
@@ -528,6 +626,13 @@ def main():
 	byol.conv_dropout_rate= conv_dropout_rate
 
 	byol.use_multiprocessing= multiprocessing
+	byol.use_tf_data= use_tf_data
+	byol.tf_data_cache= tf_data_cache
+	byol.tf_data_cachefile= tf_data_cachefile
+	byol.predict_batch_size= predict_batch_size
+	byol.stream_embeddings= stream_embeddings
+	byol.embeddings_chunk_size= embeddings_chunk_size
+	byol.resume_embeddings= resume_embeddings
 	byol.dg_cv= dg_cv
 	byol.load_cv_data_in_batches= load_cv_data_in_batches
 
@@ -548,11 +653,12 @@ def main():
 	if predict:
 		status= byol.run_predict(modelfile_encoder, weightfile_encoder)
 	else:
-		status= byol.run_train(
-			modelfile_encoder, weightfile_encoder, 
-			modelfile_projector, weightfile_projector,
-			modelfile_predictor, weightfile_predictor
-		)
+		with get_strategy_scope(strategy):
+			status= byol.run_train(
+				modelfile_encoder, weightfile_encoder, 
+				modelfile_projector, weightfile_projector,
+				modelfile_predictor, weightfile_predictor
+			)
 	
 	if status<0:
 		logger.error("BYOL run failed!")
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+##################################################
+###          MODULE IMPORT
+##################################################
+## STANDARD MODULES
+import os
+import sys
+import logging
+import json
+
+## COMMAND-LINE ARG MODULES
+import argparse
+
+## MODULES
+from sclassifier import __version__, __date__
+from sclassifier import logger
+from sclassifier.inference_client import InferenceClient
+
+###########################
+##     ARGS
+###########################
+def get_args():
+	"""This function parses and return arguments passed in"""
+	parser = argparse.ArgumentParser(description="Parse args.")
+
+	# - Request options
+	parser.add_argument('-cmd','--cmd', dest='cmd', required=False, type=str, default='classify', help='Request command {features,classify,search,info} (default=classify)')
+	parser.add_argument('-img','--img', dest='img', required=False, type=str, default='', help='Image files (.fits) to be processed, separated by commas')
+	parser.add_argument('-datalist','--datalist', dest='datalist', required=False, type=str, default='', help='Input data json filelist with entries to be processed')
+	parser.add_argument('-datalist_key','--datalist_key', dest='datalist_key', required=False, type=str, default="data", help='Dictionary key name to be read in input datalist (default=data)')
+	parser.add_argument('-k', '--k', dest='k', required=False, type=int, default=None, action='store',help='Number of neighbors in similarity search (default=server default)')
+	parser.add_argument('-score_thr', '--score_thr', dest='score_thr', required=False, type=float, default=None, action='store',help='Similarity threshold in similarity search (default=server default)')
+
+	# - Server options
+	parser.add_argument('-socket','--socket', dest='socket', required=False, type=str, default='', help='Server Unix socket path. If empty HTTP url is used')
+	parser.add_argument('-url','--url', dest='url', required=False, type=str, default='http://127.0.0.1:8080', help='Server HTTP url (default=http://127.0.0.1:8080)')
+	parser.add_argument('-timeout', '--timeout', dest='timeout', required=False, type=float, default=600, action='store',help='Request timeout in seconds (default=600)')
+
+	# - Output options
+	parser.add_argument('-outfile','--outfile', dest='outfile', required=False, type=str, default='', help='Output filename (.json) with server response. If empty response is printed')
+
+	args = parser.parse_args()
+
+	return args
+
+
+##############
+##   MAIN   ##
+##############
+def main():
+	"""Main function"""
+
+	#===========================
+	#==   PARSE ARGS
+	#===========================
+	try:
+		args= get_args()
+	except Exception as ex:
+		logger.error("Failed to get and parse options (err=%s)",str(ex))
+		return 1
+
+	#===========================
+	#==   SET REQUEST DATA
+	#===========================
+	data= []
+	if args.img!="":
+		data.extend([x.strip() for x in args.img.split(',')])
+
+	if args.datalist!="":
+		try:
+			with open(args.datalist, 'r') as fp:
+				data.extend(json.load(fp)[args.datalist_key])
+		except Exception as e:
+			logger.error("Failed to read datalist %s (err=%s)!" % (args.datalist, str(e)))
+			return 1
+
+	if not data and args.cmd!="info":
+		logger.error("No images or datalist given!")
+		return 1
+
+	options= {}
+	if args.k is not None:
+		options["k"]= args.k
+	if args.score_thr is not None:
+		options["score_thr"]= args.score_thr
+
+	#===========================
+	#==   SEND REQUEST
+	#===========================
+	client= InferenceClient(socket_path=args.socket, url=args.url, timeout=args.timeout)
+	response= client.request(args.cmd, data, **options)
+	if response is None:
+		return 1
+
+	if response.get("status", -1)<0:
+		logger.error("Request failed on server (err=%s)!" % (response.get("error", "")))
+
+	#===========================
+	#==   SAVE RESPONSE
+	#===========================
+	if args.outfile!="":
+		logger.info("Write server response to file %s ..." % (args.outfile))
+		with open(args.outfile, 'w') as fp:
+			json.dump(response, fp, indent=2)
+	else:
+		print(json.dumps(response, indent=2))
+
+	return 0 if response.get("status", -1)==0 else 1
+
+###################
+##   MAIN EXEC   ##
+###################
+if __name__ == "__main__":
+	sys.exit(main())
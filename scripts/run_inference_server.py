@@ -0,0 +1,389 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+##################################################
+###          MODULE IMPORT
+##################################################
+## STANDARD MODULES
+import os
+import sys
+import numpy as np
+import logging
+import json
+
+## COMMAND-LINE ARG MODULES
+import getopt
+import argparse
+import collections
+
+## MODULES
+from sclassifier import __version__, __date__
+from sclassifier import logger
+from sclassifier.inference_server import InferenceService, create_server
+from sclassifier.preprocessing import DataPreprocessor
+from sclassifier.preprocessing import BkgSubtractor, SigmaClipper, SigmaClipShifter, Scaler, LogStretcher
+from sclassifier.preprocessing import Resizer, MinMaxNormalizer, AbsMinMaxNormalizer, MaxScaler, AbsMaxScaler, ChanMaxScaler
+from sclassifier.preprocessing import Shifter, Standardizer, MaskShrinker, BorderMasker
+from sclassifier.preprocessing import ChanResizer, ZScaleTransformer, Chan3Trasformer
+from sclassifier.preprocessing import PercentileThresholder, HistEqualizer
+from sclassifier.preprocessing import CenterCropper
+
+###########################
+##     ARGS
+###########################
+def get_args():
+	"""This function parses and return arguments passed in"""
+	parser = argparse.ArgumentParser(description="Parse args.")
+
+	# - Model options
+	parser.add_argument('-encoder','--encoder', dest='encoder', required=True, type=str, help='Encoder model exported with export_model.py (SavedModel directory or .tflite file)') 
+	parser.add_argument('-nthreads', '--nthreads', dest='nthreads', required=False, type=int, default=None, action='store',help='Number of threads used by TFLite interpreter (default=None, interpreter default)')
+	parser.add_argument('-modelfile', '--modelfile', dest='modelfile', required=False, type=str, default='', action='store',help='Classifier model filename (.sav) trained on encoder features. If empty classify requests are rejected')
+	parser.add_argument('-scalerfile', '--scalerfile', dest='scalerfile', required=False, type=str, default='', action='store',help='Classifier data scaler filename (.sav)')
+	parser.add_argument('--binary_class', dest='binary_class', action='store_true',help='Classifier performs a binary classification {0=EGAL,1=GAL} (default=multiclass)')	
+	parser.set_defaults(binary_class=False)
+	parser.add_argument('--normalize_feats', dest='normalize_feats', action='store_true',help='Transform encoder features with classifier data scaler (default=false)')	
+	parser.set_defaults(normalize_feats=False)
+
+	# - Similarity search options
+	parser.add_argument('-datafile','--datafile', dest='datafile', required=False, type=str, default='', help='Index store directory (see make_index_store.py) or feature data file (.json) to be indexed for similarity search. If empty search requests are rejected')
+	parser.add_argument('--mmap_index', dest='mmap_index', action='store_true',help='Memory-map stored index in read-only mode (default=false)')
+	parser.set_defaults(mmap_index=False)
+	parser.add_argument('-datalist_key','--datalist_key', dest='datalist_key', required=False, type=str, default="data", help='Dictionary key name to be read in feature data file (default=data)') 
+	parser.add_argument('-selcols','--selcols', dest='selcols', required=False, type=str, default='', help='Data column ids to be selected from feature data, separated by commas') 
+	parser.add_argument('-k', '--k', dest='k', required=False, type=int, default=10, action='store',help='Default number of neighbors in similarity search (default=10)')
+	parser.add_argument('-score_thr', '--score_thr', dest='score_thr', required=False, type=float, default=0.0, action='store',help='Default similarity threshold below which neighbors are not returned (default=0.0)')
+	parser.add_argument('-large_data_thr', '--large_data_thr', dest='large_data_thr', required=False, type=int, default=1000000, action='store',help='Number of entries in data above which an approximate search index is used (default=1000000)')
+	parser.add_argument('-nlist', '--nlist', dest='nlist', required=False, type=int, default=256, action='store',help='The number of clusters (inverted lists) for the IVFPQ index (default=256)')
+	parser.add_argument('-M', '--M', dest='M', required=False, type=int, default=8, action='store',help='The number of sub-quantizers in Product Quantization. (default=8)')
+	parser.add_argument('-nprobe', '--nprobe', dest='nprobe', required=False, type=int, default=10, action='store',help='The number of clusters to visit during search (default=10)')
+
+	# - Server options
+	parser.add_argument('-socket','--socket', dest='socket', required=False, type=str, default='', help='Unix socket path to listen on. If empty an HTTP server is started') 
+	parser.add_argument('-host','--host', dest='host', required=False, type=str, default='127.0.0.1', help='HTTP server host (default=127.0.0.1)') 
+	parser.add_argument('-port', '--port', dest='port', required=False, type=int, default=8080, action='store',help='HTTP server port (default=8080)')
+	parser.add_argument('-max_batch_size', '--max_batch_size', dest='max_batch_size', required=False, type=int, default=32, action='store',help='Max number of samples per encoder micro-batch (default=32)')
+	parser.add_argument('-max_latency', '--max_latency', dest='max_latency', required=False, type=float, default=0.01, action='store',help='Max time in seconds waiting for concurrent requests before running a micro-batch (default=0.01)')
+
+	# - Data pre-processing options
+	parser.add_argument('--no-resize', dest='resize', action='store_false',help='Resize images')	
+	parser.set_defaults(resize=True)
+	parser.add_argument('-resize_size', '--resize_size', dest='resize_size', required=False, type=int, default=64, action='store',help='Image resize in pixels (default=64)')	
+	parser.add_argument('--downscale_with_antialiasing', dest='downscale_with_antialiasing', action='store_true', help='Use anti-aliasing when downsampling the image (default=no)')	
+	parser.set_defaults(downscale_with_antialiasing=False)
+	parser.add_argument('--upscale', dest='upscale', action='store_true', help='Upscale images to resize size when source size is smaller (default=no)')	
+	parser.set_defaults(upscale=False)
+	parser.add_argument('--set_pad_val_to_min', dest='set_pad_val_to_min', action='store_true', help='Set masked value in resized image to min, otherwise leave to masked values (default=no)')	
+	parser.set_defaults(set_pad_val_to_min=False)
+
+
+	parser.add_argument('--normalize_minmax', dest='normalize_minmax', action='store_true',help='Normalize each channel in range [0,1]')	
+	parser.set_defaults(normalize_minmax=False)
+	parser.add_argument('-norm_min', '--norm_min', dest='norm_min', required=False, type=float, default=0., action='store',help='Normalization min value (default=0)')
+	parser.add_argument('-norm_max', '--norm_max', dest='norm_max', required=False, type=float, default=1., action='store',help='Normalization max value (default=1)')
+	parser.add_argument('--normalize_absminmax', dest='normalize_absminmax', action='store_true',help='Normalize each channel in range using absolute min/max computed over all channels [0,1]')	
+	parser.set_defaults(normalize_absminmax=False)
+
+	parser.add_argument('--scale_to_abs_max', dest='scale_to_abs_max', action='store_true',help='Scale to global max across all channels')	
+	parser.set_defaults(scale_to_abs_max=False)
+	parser.add_argument('--scale_to_max', dest='scale_to_max', action='store_true',help='Scale to max not to min-max range')	
+	parser.set_defaults(scale_to_max=False)
+	parser.add_argument('--scale_to_selch_max', dest='scale_to_selch_max', action='store_true',help='Scale to selected channel max not to min-max range')	
+	parser.set_defaults(scale_to_selch_max=False)
+	parser.add_argument('--use_box_mask_in_chan_max_scaler', dest='use_box_mask_in_chan_max_scaler', action='store_true',help='Find chan max for scaling inside box mask')	
+	parser.set_defaults(use_box_mask_in_chan_max_scaler=False)	
+	parser.add_argument('-chan_max_scaler_box_mask_fract', '--chan_max_scaler_box_mask_fract', dest='chan_max_scaler_box_mask_fract', required=False, type=float, default=0.5, action='store',help='Size of mask box dimensions with respect to image size used in chan max scaler (default=0.5)')
+	parser.add_argument('-chref', '--chref', dest='chref', required=False, type=int, default=0, action='store',help='Image channel reference to be used in scale to selch (default=0)')
+	
+	parser.add_argument('--log_transform', dest='log_transform', action='store_true',help='Apply log transform to images')	
+	parser.set_defaults(log_transform=False)
+	parser.add_argument('-log_transform_chid', '--log_transform_chid', dest='log_transform_chid', required=False, type=int, default=-1, action='store',help='Channel id to be excluded from log-transformed. -1=transform all (default=-1)')
+	parser.add_argument('--log_transform_minmaxnorm', dest='log_transform_minmaxnorm', action='store_true',help='Apply min/max normalization after log transform to images')	
+	parser.set_defaults(log_transform_minmaxnorm=False)
+	parser.add_argument('-log_transform_normmin', '--log_transform_normmin', dest='log_transform_normmin', required=False, type=float, default=-6, action='store',help='Min data normalization value to be applied if log_transform_minmaxnorm is enabled (default=-6)')
+	parser.add_argument('-log_transform_normmax', '--log_transform_normmax', dest='log_transform_normmax', required=False, type=float, default=6, action='store',help='Max data normalization value to be applied if log_transform_minmaxnorm is enabled (default=6)')
+	parser.add_argument('--log_transform_clipneg', dest='log_transform_clipneg', action='store_true',help='Clip negative values to 0 after min/max norm')	
+	parser.set_defaults(log_transform_clipneg=False)
+
+	parser.add_argument('--scale', dest='scale', action='store_true',help='Apply scale factors to images')	
+	parser.set_defaults(scale=False)
+	parser.add_argument('-scale_factors', '--scale_factors', dest='scale_factors', required=False, type=str, default='', action='store',help='Image scale factors separated by commas (default=empty)')
+
+	parser.add_argument('--standardize', dest='standardize', action='store_true',help='Apply standardization to images')	
+	parser.set_defaults(standardize=False)
+	parser.add_argument('--meanshift', dest='meanshift', action='store_true',help='Apply mean shift to images')	
+	parser.set_defaults(meanshift=False)
+	parser.add_argument('-img_means', '--img_means', dest='img_means', required=False, type=str, default='', action='store',help='Image means (separated by commas) to be used in standardization (default=empty)')
+	parser.add_argument('-img_sigmas', '--img_sigmas', dest='img_sigmas', required=False, type=str, default='', action='store',help='Image sigmas (separated by commas) to be used in standardization (default=empty)')
+
+	parser.add_argument('--erode', dest='erode', action='store_true',help='Apply erosion to image sourve mask')	
+	parser.set_defaults(erode=False)	
+	parser.add_argument('-erode_kernel', '--erode_kernel', dest='erode_kernel', required=False, type=int, default=5, action='store',help='Erosion kernel size in pixels (default=5)')	
+
+	parser.add_argument('--subtract_bkg', dest='subtract_bkg', action='store_true',help='Subtract bkg from ref channel image')	
+	parser.set_defaults(subtract_bkg=False)
+	parser.add_argument('-sigma_bkg', '--sigma_bkg', dest='sigma_bkg', required=False, type=float, default=3, action='store',help='Sigma clip to be used in bkg calculation (default=3)')
+	parser.add_argument('--use_box_mask_in_bkg', dest='use_box_mask_in_bkg', action='store_true',help='Compute bkg value in borders left from box mask')	
+	parser.set_defaults(use_box_mask_in_bkg=False)	
+	parser.add_argument('-bkg_box_mask_fract', '--bkg_box_mask_fract', dest='bkg_box_mask_fract', required=False, type=float, default=0.7, action='store',help='Size of mask box dimensions with respect to image size used in bkg calculation (default=0.7)')
+	parser.add_argument('-bkg_chid', '--bkg_chid', dest='bkg_chid', required=False, type=int, default=-1, action='store',help='Channel to subtract background (-1=all) (default=-1)')
+
+	parser.add_argument('--clip_shift_data', dest='clip_shift_data', action='store_true',help='Do sigma clipp shifting')	
+	parser.set_defaults(clip_shift_data=False)
+	parser.add_argument('-sigma_clip', '--sigma_clip', dest='sigma_clip', required=False, type=float, default=1, action='store',help='Sigma threshold to be used for clip & shifting pixels (default=1)')
+	parser.add_argument('--clip_data', dest='clip_data', action='store_true',help='Do sigma clipping')	
+	parser.set_defaults(clip_data=False)
+	parser.add_argument('-sigma_clip_low', '--sigma_clip_low', dest='sigma_clip_low', required=False, type=float, default=10, action='store',help='Lower sigma threshold to be used for clipping pixels below (mean-sigma_low*stddev) (default=10)')
+	parser.add_argument('-sigma_clip_up', '--sigma_clip_up', dest='sigma_clip_up', required=False, type=float, default=10, action='store',help='Upper sigma threshold to be used for clipping pixels above (mean+sigma_up*stddev) (default=10)')	
+	parser.add_argument('-clip_chid', '--clip_chid', dest='clip_chid', required=False, type=int, default=-1, action='store',help='Channel to clip data (-1=all) (default=-1)')
+
+	parser.add_argument('--mask_borders', dest='mask_borders', action='store_true',help='Mask image borders by desired width/height fraction')
+	parser.set_defaults(mask_borders=False)
+	parser.add_argument('-mask_border_fract', '--mask_border_fract', dest='mask_border_fract', required=False, type=float, default=0.7, action='store',help='Size of non-masked box dimensions with respect to image size (default=0.7)')
+
+	parser.add_argument('--resize_chans', dest='resize_chans', action='store_true',help='Resize channels to desired number specified in nchan_resize')	
+	parser.set_defaults(resize_chans=False)
+	parser.add_argument('-nchan_resize', '--nchan_resize', dest='nchan_resize', required=False, type=int, default=3, action='store',help='Desired number of channels for resizing (default=3)')
+
+	parser.add_argument('--zscale_stretch', dest='zscale_stretch', action='store_true',help='Do zscale transform')	
+	parser.set_defaults(zscale_stretch=False)
+	parser.add_argument('--zscale_contrasts', dest='zscale_contrasts', required=False, type=str, default='0.25,0.25,0.25',help='zscale contrasts applied to all channels') 
+	
+	parser.add_argument('--chan3_preproc', dest='chan3_preproc', action='store_true',help='Use the 3 channel pre-processor')	
+	parser.set_defaults(chan3_preproc=False)
+	parser.add_argument('-sigma_clip_baseline', '--sigma_clip_baseline', dest='sigma_clip_baseline', required=False, type=float, default=0, action='store',help='Lower sigma threshold to be used for clipping pixels below (mean-sigma_low*stddev) in first channel of 3-channel preprocessing (default=0)')
+
+	parser.add_argument('--apply_percentile_thr', dest='apply_percentile_thr', action='store_true',help='Apply percentile threshold to input image')	
+	parser.set_defaults(apply_percentile_thr=False)
+	parser.add_argument('-percentile_thr', '--percentile_thr', dest='percentile_thr', required=False, type=float, default=50, action='store',help='Percentile threshold (default=50)')
+
+	parser.add_argument('--apply_histeq', dest='apply_histeq', action='store_true',help='Apply histogram equalization to input image')	
+	parser.set_defaults(apply_histeq=False)
+	
+	parser.add_argument('--center_crop', dest='center_crop', action='store_true', help='Center crop image to fixed desired size in pixel, specified in crop_size option (default=no)')	
+	parser.set_defaults(center_crop=False)
+	parser.add_argument('-crop_size', '--crop_size', dest='crop_size', required=False, type=int, default=224, action='store',help='Crop size in pixels (default=224)')
+	parser.add_argument('--crop_resize_back', dest='crop_resize_back', action='store_true', help='Resize image after crop to its original size (default=no)')	
+	parser.set_defaults(crop_resize_back=False)
+
+	args = parser.parse_args()	
+
+	return args
+
+
+##############
+##   MAIN   ##
+##############
+def main():
+	"""Main function"""
+
+	#===========================
+	#==   PARSE ARGS
+	#===========================
+	logger.info("Get script args ...")
+	try:
+		args= get_args()
+	except Exception as ex:
+		logger.error("Failed to get and parse options (err=%s)",str(ex))
+		return 1
+
+	selcols= []
+	if args.selcols!="":
+		selcols= [int(x.strip()) for x in args.selcols.split(',')]
+
+	# - Data process options
+	resize= args.resize
+	resize_size= args.resize_size
+	downscale_with_antialiasing= args.downscale_with_antialiasing
+	upscale= args.upscale
+	set_pad_val_to_min= args.set_pad_val_to_min
+	scale= args.scale
+	scale_factors= []
+	if args.scale_factors!="":
+		scale_factors= [float(x.strip()) for x in args.scale_factors.split(',')]
+
+	normalize_minmax= args.normalize_minmax
+	norm_min= args.norm_min
+	norm_max= args.norm_max
+	normalize_absminmax= args.normalize_absminmax
+	scale_to_abs_max= args.scale_to_abs_max
+	scale_to_max= args.scale_to_max
+	scale_to_selch_max= args.scale_to_selch_max
+	use_box_mask_in_chan_max_scaler= args.use_box_mask_in_chan_max_scaler
+	chan_max_scaler_box_mask_fract= args.chan_max_scaler_box_mask_fract
+	chref= args.chref
+	log_transform= args.log_transform
+	log_transform_chid= args.log_transform_chid
+	log_transform_minmaxnorm= args.log_transform_minmaxnorm
+	log_transform_normmin= args.log_transform_normmin
+	log_transform_normmax= args.log_transform_normmax
+	log_transform_clipneg= args.log_transform_clipneg
+	standardize= args.standardize
+	meanshift= args.meanshift
+	img_means= []
+	img_sigmas= []
+	if args.img_means!="":
+		img_means= [float(x.strip()) for x in args.img_means.split(',')]
+	if args.img_sigmas!="":
+		img_sigmas= [float(x.strip()) for x in args.img_sigmas.split(',')]
+
+	erode= args.erode	
+	erode_kernel= args.erode_kernel
+
+	subtract_bkg= args.subtract_bkg
+	sigma_bkg= args.sigma_bkg
+	use_box_mask_in_bkg= args.use_box_mask_in_bkg
+	bkg_box_mask_fract= args.bkg_box_mask_fract
+	bkg_chid= args.bkg_chid
+	clip_shift_data= args.clip_shift_data
+	clip_data= args.clip_data
+	sigma_clip= args.sigma_clip
+	sigma_clip_low= args.sigma_clip_low
+	sigma_clip_up= args.sigma_clip_up
+	clip_chid= args.clip_chid
+	mask_borders= args.mask_borders
+	mask_border_fract= args.mask_border_fract
+
+	resize_chans= args.resize_chans
+	nchan_resize= args.nchan_resize
+
+	zscale_stretch= args.zscale_stretch
+	zscale_contrasts= [float(x) for x in args.zscale_contrasts.split(',')]
+
+	chan3_preproc= args.chan3_preproc
+	sigma_clip_baseline= args.sigma_clip_baseline
+
+	apply_percentile_thr= args.apply_percentile_thr
+	percentile_thr= args.percentile_thr
+	
+	apply_histeq= args.apply_histeq
+	
+	center_crop= args.center_crop
+	crop_size= args.crop_size
+	crop_resize_back= args.crop_resize_back
+	#===============================
+	#==  CREATE PRE-PROCESSOR
+	#===============================
+	# - NB: data are pre-processed as in training, without augmentation
+	logger.info("Create data pre-processor ...")
+	preprocess_stages= []
+
+	if center_crop:
+		preprocess_stages.append(CenterCropper(crop_size=crop_size, resize_back=crop_resize_back))
+
+	if resize_chans:
+		preprocess_stages.append(ChanResizer(nchans=nchan_resize))
+
+	if subtract_bkg:
+		preprocess_stages.append(BkgSubtractor(sigma=sigma_bkg, use_mask_box=use_box_mask_in_bkg, mask_fract=bkg_box_mask_fract, chid=bkg_chid))
+
+	if clip_shift_data:
+		preprocess_stages.append(SigmaClipShifter(sigma=sigma_clip, chid=clip_chid))
+
+	if clip_data:
+		preprocess_stages.append(SigmaClipper(sigma_low=sigma_clip_low, sigma_up=sigma_clip_up, chid=clip_chid))
+
+	if scale_to_abs_max:
+		preprocess_stages.append(AbsMaxScaler(use_mask_box=use_box_mask_in_chan_max_scaler, mask_fract=chan_max_scaler_box_mask_fract))
+
+	if scale_to_selch_max:
+		preprocess_stages.append(ChanMaxScaler(chref=chref, use_mask_box=use_box_mask_in_chan_max_scaler, mask_fract=chan_max_scaler_box_mask_fract))
+
+	if scale:
+		preprocess_stages.append(Scaler(scale_factors))
+
+	if log_transform:
+		preprocess_stages.append(LogStretcher(chid=log_transform_chid, minmaxnorm=log_transform_minmaxnorm, data_norm_min=log_transform_normmin, data_norm_max=log_transform_normmax, clip_neg=log_transform_clipneg))
+
+	if zscale_stretch:
+		preprocess_stages.append(ZScaleTransformer(contrasts=zscale_contrasts))
+	
+	if apply_histeq:
+		preprocess_stages.append(HistEqualizer(adaptive=False))
+
+	if erode:
+		preprocess_stages.append(MaskShrinker(kernel=erode_kernel))
+
+	if chan3_preproc:
+		preprocess_stages.append( Chan3Trasformer(sigma_clip_baseline=sigma_clip_baseline, sigma_clip_low=sigma_clip_low, sigma_clip_up=sigma_clip_up, zscale_contrast=zscale_contrasts[0]) )
+
+	if apply_percentile_thr:
+		preprocess_stages.append(PercentileThresholder(percthr=percentile_thr))
+
+	if mask_borders:
+		preprocess_stages.append(BorderMasker(mask_border_fract))
+
+	if resize:
+		preprocess_stages.append(Resizer(resize_size=resize_size, upscale=upscale, downscale_with_antialiasing=downscale_with_antialiasing, set_pad_val_to_min=set_pad_val_to_min))
+
+	if normalize_minmax:
+		preprocess_stages.append(MinMaxNormalizer(norm_min=norm_min, norm_max=norm_max))
+
+	if normalize_absminmax:
+		preprocess_stages.append(AbsMinMaxNormalizer(norm_min=norm_min, norm_max=norm_max))
+
+	if scale_to_max:
+		preprocess_stages.append(MaxScaler())
+
+	if meanshift:
+		preprocess_stages.append(Shifter(offsets=img_means))
+
+	if standardize:
+		preprocess_stages.append(Standardizer(means=img_means, sigmas=img_sigmas))
+
+	print("== PRE-PROCESSING STAGES ==")
+	print(preprocess_stages)
+
+	dp= DataPreprocessor(preprocess_stages)
+
+	#===============================
+	#==  LOAD MODELS
+	#===============================
+	service= InferenceService(preprocessor=dp)
+	service.max_batch_size= args.max_batch_size
+	service.max_latency= args.max_latency
+	service.k= args.k
+	service.score_thr= args.score_thr
+
+	if service.load_encoder(args.encoder, nthreads=args.nthreads)<0:
+		logger.error("Failed to load encoder!")
+		return 1
+
+	if args.modelfile!="":
+		if service.load_classifier(args.modelfile, args.scalerfile, multiclass=not args.binary_class, normalize=args.normalize_feats)<0:
+			logger.error("Failed to load classifier!")
+			return 1
+
+	if args.datafile!="":
+		if service.load_index(args.datafile, args.datalist_key, selcols, args.large_data_thr, args.nlist, args.M, args.nprobe, mmap=args.mmap_index)<0:
+			logger.error("Failed to create similarity index!")
+			return 1
+
+	#===============================
+	#==  RUN SERVER
+	#===============================
+	server= create_server(service, socket_path=args.socket, host=args.host, port=args.port)
+	if server is None:
+		logger.error("Failed to create server!")
+		return 1
+
+	service.start()
+
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		logger.info("Stopping server ...")
+	finally:
+		server.server_close()
+		service.stop()
+		if args.socket!="" and os.path.exists(args.socket):
+			os.remove(args.socket)
+
+	return 0
+
+###################
+##   MAIN EXEC   ##
+###################
+if __name__ == "__main__":
+	sys.exit(main())
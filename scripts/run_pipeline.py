@@ -149,6 +149,9 @@ def get_args():
 
 	# - Run options	
 	parser.add_argument('-jobdir','--jobdir', dest='jobdir', required=False, type=str, default='', help='Job directory. Set to PWD if empty') 
+	parser.add_argument('-scheduling','--scheduling', dest='scheduling', required=False, type=str, default='static', help='Source scheduling among MPI procs in feature extraction {static,dynamic} (default=static)') 
+	parser.add_argument('-chunk_size','--chunk_size', dest='chunk_size', required=False, type=int, default=0, help='Number of sources per chunk in dynamic scheduling or process pool. If <=0 it is set from number of sources and procs (default=0)') 
+	parser.add_argument('-nworkers','--nworkers', dest='nworkers', required=False, type=int, default=1, help='Number of worker processes used in feature extraction when MPI is not available (default=1)') 
 
 	# - Output options
 	parser.add_argument('-outfile','--outfile', dest='outfile', required=False, type=str, default='classified_data.dat', help='Output filename (.dat) with classified data') 
@@ -284,6 +287,14 @@ def main():
 	negative_pix_fract_thr= args.negative_pix_fract_thr
 	bad_pix_fract_thr= args.bad_pix_fract_thr
 
+	# - Scheduling options
+	scheduling= args.scheduling
+	if scheduling not in ["static", "dynamic"]:
+		logger.error("Invalid scheduling option %s given (valid values are {static,dynamic})!" % (scheduling))
+		return 1
+	chunk_size= args.chunk_size
+	nworkers= args.nworkers
+
 	#==================================
 	#==   RUN
 	#==================================
@@ -351,6 +362,10 @@ def main():
 	pipeline.negative_pix_fract_thr= negative_pix_fract_thr
 	pipeline.bad_pix_fract_thr= bad_pix_fract_thr
 
+	pipeline.scheduling= scheduling
+	pipeline.chunk_size= chunk_size
+	pipeline.nworkers= nworkers
+
 	print("pipeline.alpha_img_freqs")
 	print(pipeline.alpha_img_freqs)
 	print("pipeline.alpha_img_group_1")
@@ -34,6 +34,8 @@ from sclassifier import logger
 from sclassifier.utils import Utils
 from sclassifier.utils import NoIndent, MyEncoder
 from sclassifier.faiss_utils import get_top_k_similar_within_data, get_top_k_similar
+from sclassifier.index_store import IndexStore
+from sclassifier.index_tuner import IndexTuner
 from sclassifier.tf_utils import extract_tf_features_from_img
 
 import matplotlib.pyplot as plt
@@ -55,7 +57,7 @@ def get_args():
 	parser = argparse.ArgumentParser(description="Parse args.")
 
 	# - Input options
-	parser.add_argument('-datafile','--datafile', dest='datafile', required=True, type=str, help='Path to feature data file (.json)')
+	parser.add_argument('-datafile','--datafile', dest='datafile', required=False, type=str, default='', help='Path to feature data file (.json). Not needed when searching an image in an existing index store')
 	parser.add_argument('-datalist_key','--datalist_key', dest='datalist_key', required=False, type=str, default="data", help='Dictionary key name to be read in input datalist (default=data)') 
 	parser.add_argument('-selcols','--selcols', dest='selcols', required=False, type=str, default='', help='Data column ids to be selected from input data, separated by commas') 
 
@@ -76,6 +78,13 @@ def get_args():
 	parser.add_argument('-nlist', '--nlist', dest='nlist', required=False, type=int, default=100, action='store',help='The number of clusters (inverted lists) for the IVFPQ index (default=100)')
 	parser.add_argument('-M', '--M', dest='M', required=False, type=int, default=8, action='store',help='The number of sub-quantizers in Product Quantization. (default=8)')
 	parser.add_argument('-nprobe', '--nprobe', dest='nprobe', required=False, type=int, default=10, action='store',help='The number of clusters to visit during search. Larger nprobe = better recall but slower (default=10)')
+	parser.add_argument('-chunk_size', '--chunk_size', dest='chunk_size', required=False, type=int, default=65536, action='store',help='Number of query rows searched per block (default=65536)')
+	parser.add_argument('-nthreads', '--nthreads', dest='nthreads', required=False, type=int, default=1, action='store',help='Number of query blocks searched in parallel threads (default=1)')
+	parser.add_argument('-index_store','--index_store', dest='index_store', required=False, type=str, default='', help='Index store directory (see make_index_store.py). If existing the search is run on the stored index, otherwise the index is created from datafile and saved there') 
+	parser.add_argument('-index_type','--index_type', dest='index_type', required=False, type=str, default='auto', help='Type of index created in index store {auto,flat,ivfflat,ivfpq,opq_ivfpq,hnsw,tune}. With tune the index is selected by benchmarking candidates on held-out data (default=auto)') 
+	parser.add_argument('-target_recall', '--target_recall', dest='target_recall', required=False, type=float, default=0.95, action='store',help='Target recall@k of tuned index with respect to exact search (default=0.95)')
+	parser.add_argument('--mmap_index', dest='mmap_index', action='store_true',help='Memory-map stored index in read-only mode (default=false)')	
+	parser.set_defaults(mmap_index=False)
 	
 	# - Output options
 	parser.add_argument('-outfile','--outfile', dest='outfile', required=False, type=str, default='featdata_simsearch.json', help='Output filename (.json) of feature data with similarity search info') 
@@ -101,15 +110,20 @@ def main():
 		logger.error("Failed to get and parse options (err=%s)",str(ex))
 		return 1
 		
-	# - Input filelist
-	if args.datafile=="":
-		logger.error("Empty input data filename!")
-		return 1
-		
 	# - Check if image is given
 	run_simsearch_with_img= False
 	if args.img!="":
 		run_simsearch_with_img= True
+
+	# - Check if an existing index store is given
+	use_index_store= (args.index_store!="")
+	index_store_exists= IndexStore.is_store(args.index_store)
+
+	# - Input filelist
+	read_datafile= not (run_simsearch_with_img and index_store_exists)
+	if read_datafile and args.datafile=="":
+		logger.error("Empty input data filename!")
+		return 1
 		
 	selcols= []
 	if args.selcols!="":
@@ -118,55 +132,58 @@ def main():
 	#===========================
 	#==   READ FEATURE DATA
 	#===========================
-	# - Read file
-	logger.info("Read image dataset %s ..." % (args.datafile))
-	datadict= Utils.read_json_datadict(args.datafile)
-	if datadict is None:
-		logger.error("Failed to read data file %s!" % (args.datafile))
-		return 1
+	datalist= []
+	data= None
+	if read_datafile:
+		# - Read file
+		logger.info("Read image dataset %s ..." % (args.datafile))
+		datadict= Utils.read_json_datadict(args.datafile)
+		if datadict is None:
+			logger.error("Failed to read data file %s!" % (args.datafile))
+			return 1
 		
-	# - Check if datalist is empty and has feature data
-	if args.datalist_key not in datadict:
-		logger.error("No key %s found in read datadict!" % (args.datalist_key))
-		return 1
+		# - Check if datalist is empty and has feature data
+		if args.datalist_key not in datadict:
+			logger.error("No key %s found in read datadict!" % (args.datalist_key))
+			return 1
 		
-	datalist= datadict[args.datalist_key]
+		datalist= datadict[args.datalist_key]
 		
-	if not datalist:
-		logger.error("Read datalist is empty!")
-		return 1
+		if not datalist:
+			logger.error("Read datalist is empty!")
+			return 1
 			
-	# - Read feature data from datalist
-	featdata= []
-	snames= []
-	data_labels= []
-	data_classids= []
+		# - Read feature data from datalist
+		featdata= []
+		snames= []
+		data_labels= []
+		data_classids= []
 	
-	for idx, item in enumerate(datalist):
-		sname= item['sname']
-		classid= item['id']
-		label= item['label']
-		if 'feats' not in item:
-			logger.error("Missing feats data in entry %d, exit!" % (idx))
-			return 1
+		for idx, item in enumerate(datalist):
+			sname= item['sname']
+			classid= item['id']
+			label= item['label']
+			if 'feats' not in item:
+				logger.error("Missing feats data in entry %d, exit!" % (idx))
+				return 1
 			
-		feats= item['feats']
+			feats= item['feats']
 		
-		# - Add entries to list
-		snames.append(sname)
-		data_labels.append(label)
-		data_classids.append(classid)
-		featdata.append(feats)
+			# - Add entries to list
+			snames.append(sname)
+			data_labels.append(label)
+			data_classids.append(classid)
+			featdata.append(feats)
 
-	# - Select columns?
-	if selcols:
-		data= Utils.get_selected_data_cols(np.array(featdata), selcols)
-	else:
-		data= np.array(featdata)
+		# - Select columns?
+		if selcols:
+			data= Utils.get_selected_data_cols(np.array(featdata), selcols)
+		else:
+			data= np.array(featdata)
 	
-	N, Nfeat = data.shape
+		N, Nfeat = data.shape
 	
-	logger.info("%d data read ..." % (N))
+		logger.info("%d data read ..." % (N))
 
 	#=================================
 	#==   EXTRACT FEATURES FROM IMG?
@@ -185,11 +202,49 @@ def main():
 			logger.error("Failed to extract data representation from image %s!" % (args.img))
 			return 1
 
+	#===========================
+	#==   OPEN/CREATE INDEX STORE
+	#===========================
+	# - NB: neighbor indices are store ids (equal to datafile rows if the store was created from the same datafile)
+	store= None
+	if use_index_store:
+		store= IndexStore(args.index_store)
+		if index_store_exists:
+			logger.info("Opening index store %s ..." % (args.index_store))
+			if store.open(mmap=args.mmap_index)<0:
+				logger.error("Failed to open index store %s!" % (args.index_store))
+				return 1
+		else:
+			logger.info("Creating index store %s from data ..." % (args.index_store))
+			tuner= None
+			if args.index_type=="tune":
+				tuner= IndexTuner(k=args.k, target_recall=args.target_recall)
+			if store.create(data, datalist, index_type=args.index_type, large_data_thr=args.large_data_thr, nlist=args.nlist, M=args.M, nprobe=args.nprobe, tuner=tuner)<0 or store.save()<0:
+				logger.error("Failed to create index store %s!" % (args.index_store))
+				return 1
+
 	#===========================
 	#==   SIMILARITY SEARCH
 	#===========================
 	# - Compute indices & scores of top similar data
-	if run_simsearch_with_img:
+	if store is not None:
+		if run_simsearch_with_img:
+			logger.info("Compute indices & scores of top similar data between index store and image ...")
+			nn= store.search(data_vector, k=args.k, threshold=args.score_thr)
+		else:
+			logger.info("Compute indices & scores of top similar data within dataset using index store ...")
+			sname_id_map= {entry.get("sname", None): entry["index_id"] for entry in store.entries}
+			exclude_ids= [sname_id_map.get(item.get("sname", None), -1) for item in datalist]
+			nn= store.search(data, k=args.k, threshold=args.score_thr, exclude_ids=exclude_ids, chunk_size=args.chunk_size, nthreads=args.nthreads, return_graph=True)
+		if nn is None:
+			logger.error("Similarity search on index store failed!")
+			return 1
+		if run_simsearch_with_img:
+			nn_indices, nn_scores= nn[0][0], nn[1][0]
+		else:
+			nn_indptr, nn_indices, nn_scores= nn
+
+	elif run_simsearch_with_img:
 		logger.info("Compute indices & scores of top similar data between dataset and image ...")
 		nn_indices, nn_scores= get_top_k_similar(
 			data, 
@@ -203,14 +258,17 @@ def main():
 		)
 	else:
 		logger.info("Compute indices & scores of top similar data within dataset ...")
-		nn_indices, nn_scores= get_top_k_similar_within_data(
+		nn_indptr, nn_indices, nn_scores= get_top_k_similar_within_data(
 			data,
 			k= args.k,
 			threshold= args.score_thr,
 			large_data_thr= args.large_data_thr,
 			nlist= args.nlist,
 			M= args.M,
-			nprobe= args.nprobe
+			nprobe= args.nprobe,
+			chunk_size= args.chunk_size,
+			nthreads= args.nthreads,
+			return_graph= True
 		)
 	
 	#===========================
@@ -224,12 +282,16 @@ def main():
 		for i in range(len(nn_indices)):
 			index= nn_indices[i]
 			score= nn_scores[i]
-			feats= list(data[index])
-			feats= [float(item) for item in feats]
 			
 			# - Set output data
-			d= datalist[index]
-			d['feats']= NoIndent(feats)
+			#   NB: feats are not stored in index store entries
+			if store is not None and not read_datafile:
+				d= dict(store.get_entry(index))
+			else:
+				feats= list(data[index])
+				feats= [float(item) for item in feats]
+				d= datalist[index]
+				d['feats']= NoIndent(feats)
 			d['nn_index']= int(index)
 			d['nn_score']= float(score)
 			outdata[args.datalist_key].append(d)
@@ -238,10 +300,9 @@ def main():
 		for i in range(N):
 			feats= list(data[i])
 			feats= [float(item) for item in feats]
-			indices= list(nn_indices[i])
-			indices= [int(item) for item in indices]
-			scores= list(nn_scores[i])
-			scores= [float(item) for item in scores]
+			start, stop= nn_indptr[i], nn_indptr[i+1]
+			indices= nn_indices[start:stop].tolist()
+			scores= nn_scores[start:stop].tolist()
 		
 			# - Set output data
 			d= datalist[i]
@@ -30,9 +30,10 @@ from sclassifier import logger
 from sclassifier.data_loader import DataLoader
 from sclassifier.utils import Utils
 from sclassifier.feature_selector import FeatSelector
+from sclassifier.lazy_import import lazy_import
 
-
-import matplotlib.pyplot as plt
+## HEAVY MODULES (imported at first use)
+plt= lazy_import("matplotlib.pyplot")
 
 #### GET SCRIPT ARGS ####
 def str2bool(v):
@@ -80,7 +80,7 @@ setup(
 	download_url="https://github.com/SKA-INAF/sclassifier/archive/refs/tags/v1.0.7.tar.gz",
 	packages=['sclassifier'],
 	install_requires=reqs,
-	scripts=['scripts/check_data.py','scripts/run_ae.py','scripts/run_predict.py','scripts/run_clustering.py','scripts/reconstruct_data.py','scripts/extract_features.py','scripts/select_features.py','scripts/run_classifier.py','scripts/merge_features.py','scripts/run_classifier_nn.py','scripts/classify_source.py','scripts/find_outliers.py','scripts/run_pipeline.py','scripts/run_umap.py','scripts/run_umap_on_imgs.py','scripts/run_simclr.py','scripts/run_byol.py','scripts/run_pca.py','scripts/run_imgclassifier.py','scripts/gradcam.py','scripts/read_model_weights.py','scripts/set_encoder_weights_from_model.py','scripts/compute_latent_space_complexity.py','scripts/compute_img_complexity.py','scripts/deduplicate_imgs.py','scripts/run_similarity_search.py'],
+	scripts=['scripts/check_data.py','scripts/run_ae.py','scripts/run_predict.py','scripts/run_clustering.py','scripts/reconstruct_data.py','scripts/extract_features.py','scripts/select_features.py','scripts/run_classifier.py','scripts/merge_features.py','scripts/run_classifier_nn.py','scripts/classify_source.py','scripts/find_outliers.py','scripts/run_pipeline.py','scripts/run_umap.py','scripts/run_umap_on_imgs.py','scripts/run_simclr.py','scripts/run_byol.py','scripts/run_pca.py','scripts/run_imgclassifier.py','scripts/gradcam.py','scripts/read_model_weights.py','scripts/set_encoder_weights_from_model.py','scripts/compute_latent_space_complexity.py','scripts/compute_img_complexity.py','scripts/deduplicate_imgs.py','scripts/run_similarity_search.py','scripts/make_cutout_store.py','scripts/export_model.py','scripts/run_inference_server.py','scripts/run_inference_client.py','scripts/make_index_store.py','scripts/prefilter_duplicate_imgs.py','scripts/launch_local_workers.py'],
 	classifiers=[
 		'Development Status :: 5 - Production/Stable',
 		'Intended Audience :: Science/Research',